@@ -12,10 +12,13 @@ from lollms.utilities import PromptReshaper
 from lollms.client_session import Client, Session
 from lollms.databases.skills_database import SkillsLibrary
 from lollms.tasks import TasksLibrary
+from lollms.generation import GenerationScheduler, GenerationBatcher, StopSequenceMatcher
+from lollms.databases.vectorizers_registry import vector_databases_cache, open_vector_database
+from lollms.lazy_service import LazyService, warmup_services
 
-from lollmsvectordb.database_elements.chunk import Chunk
-from lollmsvectordb.vector_database import VectorDatabase
-from typing import Callable, Any
+from typing import Callable, Any, TYPE_CHECKING
+if TYPE_CHECKING:
+    from lollmsvectordb.database_elements.chunk import Chunk
 from pathlib import Path
 from datetime import datetime
 from functools import partial
@@ -30,6 +33,7 @@ import yaml
 import time
 from lollms.utilities import PackageManager
 import socket
+import threading
 import json
 class LollmsApplication(LoLLMsCom):
     def __init__(
@@ -72,6 +76,12 @@ class LollmsApplication(LoLLMsCom):
         self.model:LLMBinding           = None
         self.long_term_memory           = None
 
+        # Admission queue shared by every generation request
+        self.generation_scheduler       = GenerationScheduler(config.generation_max_concurrency, config.generation_queue_size)
+        self.generation_batcher         = GenerationBatcher(config.generation_batch_window)
+        # Vector databases are shared by all users of the same file
+        vector_databases_cache.max_open = config.rag_max_open_databases
+
         self.tts                        = None
 
         self.handle_generate_msg: Callable[[str, Dict], None]               = None
@@ -95,8 +105,17 @@ class LollmsApplication(LoLLMsCom):
         self.stt = None
         self.ttm = None
         self.ttv = None
+        # Services built by build_service, by name
+        self.services:Dict[str, LazyService] = {}
+        # Reload the services when the settings they use change
+        self.watch_services_config()
         
         self.rt_com = None
+
+        # Token counts of static prompt parts
+        self.tokens_count_cache:Dict[str, int] = {}
+        self.tokens_count_cache_model = None
+
         self.is_internet_available = self.check_internet_connection()
         
         if not free_mode:
@@ -223,6 +242,8 @@ class LollmsApplication(LoLLMsCom):
             for per in self.mounted_personalities:
                 if per is not None:
                     per.model = None
+            # Unused databases may still reference the previous model as tokenizer
+            vector_databases_cache.drop_unused()
             gc.collect()
             self.binding = BindingBuilder().build_binding(self.config, self.lollms_paths, InstallOption.INSTALL_IF_NECESSARY, lollmsCom=self)
             self.config["model_name"] = model_name
@@ -309,7 +330,10 @@ class LollmsApplication(LoLLMsCom):
 
     def _generate_text(self, prompt):
         max_tokens = min(self.config.ctx_size - self.model.get_nb_tokens(prompt),self.config.max_n_predict if self.config.max_n_predict else self.config.ctx_size- self.model.get_nb_tokens(prompt))
-        generated_text = self.model.generate(prompt, max_tokens)
+        with self.generation_scheduler.slot(binding=self.model) as ticket:
+            if ticket.cancelled:
+                return ""
+            generated_text = self.model.generate(prompt, max_tokens)
         return generated_text.strip()
     
     def _generate_code(self, prompt, template, language):
@@ -322,43 +346,24 @@ class LollmsApplication(LoLLMsCom):
     
     def load_rag_dbs(self):
         ASCIIColors.info("Loading RAG datalakes")
+        for datalake in getattr(self, "active_datalakes", []):
+            if datalake['type']=='lollmsvectordb':
+                vector_databases_cache.release(datalake["binding"])
         self.active_datalakes = []
         for rag_db in self.config.datalakes:
             if rag_db['mounted']:
                 if rag_db['type']=='lollmsvectordb':
                     try:                    
-                        from lollmsvectordb import VectorDatabase
-                        from lollmsvectordb.text_document_loader import TextDocumentsLoader
                         from lollmsvectordb.lollms_tokenizers.tiktoken_tokenizer import TikTokenTokenizer
 
-                        # Vectorizer selection
-                        if self.config.rag_vectorizer == "semantic":
-                            from lollmsvectordb.lollms_vectorizers.semantic_vectorizer import SemanticVectorizer
-                            vectorizer = SemanticVectorizer(self.config.rag_vectorizer_model)
-                        elif self.config.rag_vectorizer == "tfidf":
-                            from lollmsvectordb.lollms_vectorizers.tfidf_vectorizer import TFIDFVectorizer
-                            vectorizer = TFIDFVectorizer()
-                        elif self.config.rag_vectorizer == "openai":
-                            from lollmsvectordb.lollms_vectorizers.openai_vectorizer import OpenAIVectorizer
-                            vectorizer = OpenAIVectorizer(
-                                self.config.rag_vectorizer_model,
-                                self.config.rag_vectorizer_openai_key
-                            )
-                        elif self.config.rag_vectorizer == "ollama":
-                            from lollmsvectordb.lollms_vectorizers.ollama_vectorizer import OllamaVectorizer
-                            vectorizer = OllamaVectorizer(
-                                self.config.rag_vectorizer_model,
-                                self.config.rag_service_url
-                            )
-
-                        # Create database path and initialize VectorDatabase
+                        # Create database path and open the VectorDatabase (shared with the other users of this file)
                         db_path = Path(rag_db['path']) / f"{rag_db['alias']}.sqlite"
-                        vdb = VectorDatabase(
+                        vdb = open_vector_database(
+                            self.config,
                             db_path,
-                            vectorizer,
                             None if self.config.rag_vectorizer == "semantic" else self.model if self.model else TikTokenTokenizer(),
                             n_neighbors=self.config.rag_n_chunks
-                        )       
+                        )
 
                         # Add to active databases
                         self.active_datalakes.append(
@@ -374,260 +379,341 @@ class LollmsApplication(LoLLMsCom):
                     self.active_datalakes.append(
                             rag_db | {"binding": lr}
                     )
+    # ----------------------------------- Services -----------------------------------
+    # Configuration keys of the services that are selected by an active_xxx_service entry.
+    # A selected service is reloaded only when the selection or one of its own keys changes.
+    TTS_SERVICES_CONFIG_KEYS = {
+        "xtts":[],
+        "eleven_labs_tts":["elevenlabs_tts_model_id", "elevenlabs_tts_voice_id", "elevenlabs_tts_key", "elevenlabs_tts_voice_stability", "elevenlabs_tts_voice_boost"],
+        "openai_tts":["openai_tts_model", "openai_tts_voice", "openai_tts_key"],
+        "fish_tts":["fish_tts_voice", "fish_tts_key"],
+    }
+    STT_SERVICES_CONFIG_KEYS = {
+        "whisper":[],
+        "openai_whisper":["openai_whisper_model", "openai_whisper_key"],
+    }
+    TTI_SERVICES_CONFIG_KEYS = {
+        "diffusers":["diffusers_model"],
+        "diffusers_client":["diffusers_client_base_url"],
+        "autosd":[],
+        "dall-e":["dall_e_key"],
+        "midjourney":["midjourney_key", "midjourney_timeout", "midjourney_retries"],
+        "comfyui":[],
+    }
+    TTV_SERVICES_CONFIG_KEYS = {
+        "lumalabs":["lumalabs_key"],
+    }
+    # Attributes holding the services
+    SERVICES_ATTRIBUTES = ["ollama", "vllm", "whisper", "xtts", "sd", "comfyui", "tts", "stt", "tti", "ttv"]
+
+    def build_service(self, name:str, factory:Callable[[], Any], error_message:str=None):
+        """
+        Builds a service with factory, which imports and constructs it.
+        With services_lazy_loading the service is built the first time it is used and a LazyService is returned.
+        Returns None if the service couldn't be built.
+        """
+        service = LazyService(name, factory)
+        self.services[name] = service
+        if self.config.services_lazy_loading:
+            return service
+        try:
+            return service.lazy_load()
+        except Exception as ex:
+            trace_exception(ex)
+            self.warning(error_message or f"Couldn't load {name}")
+            return None
+
+    def load_ollama_service(self, reload=False):
+        if not self.config.enable_ollama_service:
+            self.ollama = None
+        elif self.ollama is None or reload:
+            def build():
+                from lollms.services.ttt.ollama.lollms_ollama import Service
+                return Service(self, base_url=self.config.ollama_base_url)
+            self.ollama = self.build_service("ollama", build, "Couldn't load Ollama")
+
+    def load_vllm_service(self, reload=False):
+        if not self.config.enable_vllm_service:
+            self.vllm = None
+        elif self.vllm is None or reload:
+            def build():
+                from lollms.services.ttt.vllm.lollms_vllm import Service
+                return Service(self, base_url=self.config.vllm_url)
+            self.vllm = self.build_service("vllm", build, "Couldn't load vllm")
+
+    def load_whisper_service(self, reload=False):
+        if not (self.config.whisper_activate or self.config.active_stt_service == "whisper"):
+            return
+        if self.whisper is None or reload:
+            def build():
+                from lollms.services.stt.whisper.lollms_whisper import LollmsWhisper
+                return LollmsWhisper(self, self.config.whisper_model, self.lollms_paths.personal_outputs_path)
+            self.whisper = self.build_service("whisper", build, "Couldn't load Whisper")
+
+    def load_xtts_service(self, reload=False):
+        if self.config.active_tts_service != "xtts":
+            return
+        if self.xtts is None or reload:
+            def build():
+                ASCIIColors.yellow("Loading XTTS")
+                from lollms.services.tts.xtts.lollms_xtts import LollmsXTTS
+                voice=self.config.xtts_current_voice
+                if voice!="main_voice":
+                    voices_folder = self.lollms_paths.custom_voices_path
+                else:
+                    voices_folder = Path(__file__).parent.parent.parent/"services/xtts/voices"
+
+                return LollmsXTTS(
+                                        self,
+                                        voices_folders=[voices_folder, self.lollms_paths.custom_voices_path], 
+                                        freq=self.config.xtts_freq
+                                    )
+            self.xtts = self.build_service("xtts", build, "Couldn't load XTTS")
+
+    def load_sd_service(self, reload=False):
+        if not self.config.enable_sd_service:
+            return
+        if self.sd is None or reload:
+            def build():
+                from lollms.services.tti.sd.lollms_sd import LollmsSD
+                return LollmsSD(self, auto_sd_base_url=self.config.sd_base_url)
+            self.sd = self.build_service("sd", build, "Couldn't load SD")
+
+    def load_comfyui_service(self, reload=False):
+        if not self.config.enable_comfyui_service:
+            return
+        if self.comfyui is None or reload:
+            def build():
+                from lollms.services.tti.comfyui.lollms_comfyui import LollmsComfyUI
+                return LollmsComfyUI(self, comfyui_base_url=self.config.comfyui_base_url)
+            self.comfyui = self.build_service("comfyui", build, "Couldn't load Comfyui")
+
+    def load_tts_service(self, reload=False):
+        if self.tts is not None and not reload:
+            return
+        service = self.config.active_tts_service
+        if service == "eleven_labs_tts":
+            def build():
+                from lollms.services.tts.eleven_labs_tts.lollms_eleven_labs_tts import LollmsElevenLabsTTS
+                return LollmsElevenLabsTTS(self, self.config.elevenlabs_tts_model_id, self.config.elevenlabs_tts_voice_id,  self.config.elevenlabs_tts_key, stability=self.config.elevenlabs_tts_voice_stability, similarity_boost=self.config.elevenlabs_tts_voice_boost)
+            self.tts = self.build_service(service, build)
+        elif service == "openai_tts":
+            def build():
+                from lollms.services.tts.open_ai_tts.lollms_openai_tts import LollmsOpenAITTS
+                return LollmsOpenAITTS(self, self.config.openai_tts_model, self.config.openai_tts_voice,  self.config.openai_tts_key)
+            self.tts = self.build_service(service, build)
+        elif service == "fish_tts":
+            def build():
+                from lollms.services.tts.fish.lollms_fish_tts import LollmsFishAudioTTS
+                return LollmsFishAudioTTS(self, self.config.fish_tts_voice,  self.config.fish_tts_key)
+            self.tts = self.build_service(service, build)
+        elif service == "xtts":
+            self.tts = self.xtts
+        else:
+            self.tts = None
+
+    def load_stt_service(self, reload=False):
+        if self.stt is not None and not reload:
+            return
+        service = self.config.active_stt_service
+        if service == "openai_whisper":
+            def build():
+                from lollms.services.stt.openai_whisper.lollms_openai_whisper import LollmsOpenAIWhisper
+                return LollmsOpenAIWhisper(self, self.config.openai_whisper_model, self.config.openai_whisper_key)
+            self.stt = self.build_service(service, build)
+        elif service == "whisper":
+            # Shares the model loaded by the whisper service
+            self.stt = self.whisper
+        else:
+            self.stt = None
+
+    def load_tti_service(self, reload=False):
+        if self.tti is not None and not reload:
+            return
+        service = self.config.active_tti_service
+        if service == "diffusers":
+            def build():
+                from lollms.services.tti.diffusers.lollms_diffusers import LollmsDiffusers
+                return LollmsDiffusers(self)
+            self.tti = self.build_service(service, build)
+        elif service == "diffusers_client":
+            def build():
+                from lollms.services.tti.diffusers_client.lollms_diffusers_client import LollmsDiffusersClient
+                return LollmsDiffusersClient(self, base_url=self.config.diffusers_client_base_url)
+            self.tti = self.build_service(service, build)
+        elif service == "autosd":
+            if self.sd:
+                self.tti = self.sd
+            else:
+                def build():
+                    from lollms.services.tti.sd.lollms_sd import LollmsSD
+                    return LollmsSD(self, auto_sd_base_url=self.config.sd_base_url)
+                self.tti = self.build_service(service, build)
+        elif service == "dall-e":
+            def build():
+                from lollms.services.tti.dalle.lollms_dalle import LollmsDalle
+                return LollmsDalle(self, self.config.dall_e_key)
+            self.tti = self.build_service(service, build)
+        elif service == "midjourney":
+            def build():
+                from lollms.services.tti.midjourney.lollms_midjourney import LollmsMidjourney
+                return LollmsMidjourney(self, self.config.midjourney_key, self.config.midjourney_timeout, self.config.midjourney_retries)
+            self.tti = self.build_service(service, build)
+        elif service == "comfyui":
+            if self.comfyui:
+                self.tti = self.comfyui
+            else:
+                def build():
+                    from lollms.services.tti.comfyui.lollms_comfyui import LollmsComfyUI
+                    return LollmsComfyUI(self, comfyui_base_url=self.config.comfyui_base_url)
+                self.tti = self.build_service(service, build)
+        else:
+            self.tti = None
+
+    def load_ttv_service(self, reload=False):
+        if self.ttv is not None and not reload:
+            return
+        if self.config.active_ttv_service == "lumalabs":
+            def build():
+                from lollms.services.ttv.lumalabs.lollms_lumalabs import LollmsLumaLabs
+                return LollmsLumaLabs(self.config.lumalabs_key)
+            self.ttv = self.build_service("lumalabs", build, "Couldn't load lumalabs")
+        else:
+            self.ttv = None
+
+    def warmup_services(self)->Dict[str, dict]:
+        """
+        Builds the services that are not built yet concurrently (services_warmup_workers threads).
+
+        Returns:
+            Dict[str, dict]: the services startup report, see services_startup_report.
+        """
+        warmup_services([getattr(self, attribute) for attribute in LollmsApplication.SERVICES_ATTRIBUTES], self.config.services_warmup_workers)
+        report = self.services_startup_report()
+        for name, status in report.items():
+            if status["error"] is not None:
+                ASCIIColors.red(f"{name}: failed after {status['startup_time']:.2f}s ({status['error']})")
+            elif status["loaded"]:
+                ASCIIColors.green(f"{name}: started in {status['startup_time']:.2f}s")
+            else:
+                ASCIIColors.yellow(f"{name}: not loaded")
+        return report
+
+    def services_startup_report(self)->Dict[str, dict]:
+        """
+        Startup status of the last built service of each name: whether it is loaded, the time its construction
+        took in seconds and the error that prevented it from starting.
+        """
+        return {name:service.lazy_status() for name, service in self.services.items()}
+
+    def watch_services_config(self):
+        """
+        Subscribes each service to the configuration keys it depends on: changing a setting reloads only the
+        services that use it, the other ones (and their models) are kept.
+        """
+        def reload_on_change(loader):
+            return lambda changes: loader(reload=True)
+
+        def reload_selected(selection_key, services_keys, loader):
+            def on_change(changes):
+                selected = self.config[selection_key]
+                if selection_key in changes or any(key in changes for key in services_keys.get(selected, [])):
+                    loader(reload=True)
+            return on_change
+
+        # Order matters: the selected services reuse the instances of the local services (xtts, whisper, sd, comfyui)
+        self.config.watch(["enable_ollama_service", "ollama_base_url"], reload_on_change(self.load_ollama_service), "ollama")
+        self.config.watch(["enable_vllm_service", "vllm_url"], reload_on_change(self.load_vllm_service), "vllm")
+        self.config.watch(["whisper_activate", "whisper_model", "active_stt_service"], lambda changes: self.load_whisper_service(reload=self.whisper is None or "whisper_model" in changes), "whisper")
+        self.config.watch(["active_tts_service", "xtts_current_voice", "xtts_freq"], lambda changes: self.load_xtts_service(reload=self.xtts is None or "active_tts_service" not in changes or len(changes)>1), "xtts")
+        self.config.watch(["enable_sd_service", "sd_base_url"], reload_on_change(self.load_sd_service), "sd")
+        self.config.watch(["enable_comfyui_service", "comfyui_base_url"], reload_on_change(self.load_comfyui_service), "comfyui")
+
+        for selection_key, services_keys, loader, extra_keys in [
+            ("active_tts_service", LollmsApplication.TTS_SERVICES_CONFIG_KEYS, self.load_tts_service, {"xtts":["xtts_current_voice", "xtts_freq"]}),
+            ("active_stt_service", LollmsApplication.STT_SERVICES_CONFIG_KEYS, self.load_stt_service, {"whisper":["whisper_model"]}),
+            ("active_tti_service", LollmsApplication.TTI_SERVICES_CONFIG_KEYS, self.load_tti_service, {"autosd":["enable_sd_service", "sd_base_url"], "comfyui":["enable_comfyui_service", "comfyui_base_url"]}),
+            ("active_ttv_service", LollmsApplication.TTV_SERVICES_CONFIG_KEYS, self.load_ttv_service, {}),
+        ]:
+            # The services that reuse a local service instance follow its reloads
+            services_keys = {service:keys+extra_keys.get(service, []) for service, keys in services_keys.items()}
+            keys = [selection_key]+[key for service_keys in services_keys.values() for key in service_keys]
+            self.config.watch(keys, reload_selected(selection_key, services_keys, loader), selection_key)
+
     def start_servers(self):
 
         ASCIIColors.yellow("* - * - * - Starting services - * - * - *")
-        tts_services = []
-        stt_services = []
         def start_ttt(*args, **kwargs):
-            if self.config.enable_ollama_service:
-                try:
-                    from lollms.services.ttt.ollama.lollms_ollama import Service
-                    self.ollama = Service(self, base_url=self.config.ollama_base_url)
-                    tts_services.append("ollama")
-
-                except Exception as ex:
-                    trace_exception(ex)
-                    self.warning(f"Couldn't load Ollama")
-
-            if self.config.enable_vllm_service:
-                try:
-                    from lollms.services.ttt.vllm.lollms_vllm import Service
-                    self.vllm = Service(self, base_url=self.config.vllm_url)
-                    tts_services.append("vllm")
-                except Exception as ex:
-                    trace_exception(ex)
-                    self.warning(f"Couldn't load vllm")
+            self.load_ollama_service(reload=True)
+            self.load_vllm_service(reload=True)
         ASCIIColors.execute_with_animation("Loading TTT services", start_ttt,ASCIIColors.color_blue)
         print("OK")
         def start_stt(*args, **kwargs):
-            if self.config.whisper_activate or self.config.active_stt_service == "whisper":
-                try:
-                    from lollms.services.stt.whisper.lollms_whisper import LollmsWhisper
-                    self.whisper = LollmsWhisper(self, self.config.whisper_model, self.lollms_paths.personal_outputs_path)
-                    stt_services.append("whisper")
-                except Exception as ex:
-                    trace_exception(ex)
-            if self.config.active_stt_service == "openai_whisper":
-                from lollms.services.stt.openai_whisper.lollms_openai_whisper import LollmsOpenAIWhisper
-                self.stt = LollmsOpenAIWhisper(self, self.config.openai_whisper_model, self.config.openai_whisper_key)
-            elif self.config.active_stt_service == "whisper":
-                from lollms.services.stt.whisper.lollms_whisper import LollmsWhisper
-                self.stt = LollmsWhisper(self, self.config.whisper_model)
+            self.load_whisper_service(reload=True)
+            self.load_stt_service(reload=True)
 
         ASCIIColors.execute_with_animation("Loading STT services", start_stt, ASCIIColors.color_blue)
         print("OK")
 
         def start_tts(*args, **kwargs):
-            if self.config.active_tts_service == "xtts":
-                ASCIIColors.yellow("Loading XTTS")
-                try:
-                    from lollms.services.tts.xtts.lollms_xtts import LollmsXTTS
-                    voice=self.config.xtts_current_voice
-                    if voice!="main_voice":
-                        voices_folder = self.lollms_paths.custom_voices_path
-                    else:
-                        voices_folder = Path(__file__).parent.parent.parent/"services/xtts/voices"
-
-                    self.xtts = LollmsXTTS(
-                                            self,
-                                            voices_folders=[voices_folder, self.lollms_paths.custom_voices_path], 
-                                            freq=self.config.xtts_freq
-                                        )
-                except Exception as ex:
-                    trace_exception(ex)
-                    self.warning(f"Couldn't load XTTS")
-            if self.config.active_tts_service == "eleven_labs_tts":
-                from lollms.services.tts.eleven_labs_tts.lollms_eleven_labs_tts import LollmsElevenLabsTTS
-                self.tts = LollmsElevenLabsTTS(self, self.config.elevenlabs_tts_model_id, self.config.elevenlabs_tts_voice_id,  self.config.elevenlabs_tts_key, stability=self.config.elevenlabs_tts_voice_stability, similarity_boost=self.config.elevenlabs_tts_voice_boost)
-            elif self.config.active_tts_service == "openai_tts":
-                from lollms.services.tts.open_ai_tts.lollms_openai_tts import LollmsOpenAITTS
-                self.tts = LollmsOpenAITTS(self, self.config.openai_tts_model, self.config.openai_tts_voice,  self.config.openai_tts_key)
-            elif self.config.active_tts_service == "fish_tts":
-                from lollms.services.tts.fish.lollms_fish_tts import LollmsFishAudioTTS
-                self.tts = LollmsFishAudioTTS(self, self.config.fish_tts_voice,  self.config.fish_tts_key)
-            elif self.config.active_tts_service == "xtts" and self.xtts:
-                self.tts = self.xtts
+            self.load_xtts_service(reload=True)
+            self.load_tts_service(reload=True)
 
         ASCIIColors.execute_with_animation("Loading TTS services", start_tts, ASCIIColors.color_blue)
         print("OK")
 
         def start_tti(*args, **kwargs):
-            if self.config.enable_sd_service:
-                try:
-                    from lollms.services.tti.sd.lollms_sd import LollmsSD
-                    self.sd = LollmsSD(self, auto_sd_base_url=self.config.sd_base_url)
-                except:
-                    self.warning(f"Couldn't load SD")
-
-            if self.config.enable_comfyui_service:
-                try:
-                    from lollms.services.tti.comfyui.lollms_comfyui import LollmsComfyUI
-                    self.comfyui = LollmsComfyUI(self, comfyui_base_url=self.config.comfyui_base_url)
-                except:
-                    self.warning(f"Couldn't load SD")
-
-            if self.config.active_tti_service == "diffusers":
-                from lollms.services.tti.diffusers.lollms_diffusers import LollmsDiffusers
-                self.tti = LollmsDiffusers(self)
-            elif self.config.active_tti_service == "diffusers_client":
-                from lollms.services.tti.diffusers_client.lollms_diffusers_client import LollmsDiffusersClient
-                self.tti = LollmsDiffusersClient(self)
-            elif self.config.active_tti_service == "autosd":
-                if self.sd:
-                    self.tti = self.sd
-                else:
-                    from lollms.services.tti.sd.lollms_sd import LollmsSD
-                    self.tti = LollmsSD(self, auto_sd_base_url = self.config.sd_base_url)
-            elif self.config.active_tti_service == "dall-e":
-                from lollms.services.tti.dalle.lollms_dalle import LollmsDalle
-                self.tti = LollmsDalle(self, self.config.dall_e_key)
-            elif self.config.active_tti_service == "midjourney":
-                from lollms.services.tti.midjourney.lollms_midjourney import LollmsMidjourney
-                self.tti = LollmsMidjourney(self, self.config.midjourney_key, self.config.midjourney_timeout, self.config.midjourney_retries)
-            elif self.config.active_tti_service == "comfyui" and (self.tti is None or self.tti.name!="comfyui"):
-                if self.comfyui:
-                    self.tti = self.comfyui
-                else:
-                    from lollms.services.tti.comfyui.lollms_comfyui import LollmsComfyUI
-                    self.tti = LollmsComfyUI(self, comfyui_base_url=self.config.comfyui_base_url)
+            self.load_sd_service(reload=True)
+            self.load_comfyui_service(reload=True)
+            self.load_tti_service(reload=True)
 
         ASCIIColors.execute_with_animation("Loading loacal TTI services", start_tti, ASCIIColors.color_blue)
         print("OK")
         def start_ttv(*args, **kwargs):
-            if self.config.active_ttv_service == "lumalabs" and (self.ttv is None or self.tti.name!="lumalabs"):
-                try:
-                    from lollms.services.ttv.lumalabs.lollms_lumalabs import LollmsLumaLabs
-                    self.sd = LollmsLumaLabs(self.config.lumalabs_key)
-                except:
-                    self.warning(f"Couldn't load SD")
+            self.load_ttv_service(reload=True)
 
 
         ASCIIColors.execute_with_animation("Loading loacal TTV services", start_ttv, ASCIIColors.color_blue)
         print("OK")
 
+        if self.config.services_lazy_loading and self.config.services_parallel_warmup:
+            # The services start in the background, the first request that uses one waits only for it
+            threading.Thread(target=self.warmup_services, name="lollms_services_warmup", daemon=True).start()
+
 
 
     def verify_servers(self, reload_all=False):
+        """
+        Loads the enabled services that are not loaded yet (all of them if reload_all is True).
+        The settings changes don't need it: the services watch the configuration keys they depend on.
+        """
         ASCIIColors.yellow("* - * - * - Verifying services - * - * - *")
 
         try:
             ASCIIColors.blue("Loading active local TTT services")
-            
-            if self.config.enable_ollama_service and self.ollama is None:
-                try:
-                    from lollms.services.ttt.ollama.lollms_ollama import Service
-                    self.ollama = Service(self, base_url=self.config.ollama_base_url)
-                except Exception as ex:
-                    trace_exception(ex)
-                    self.warning(f"Couldn't load Ollama")
-
-            if self.config.enable_vllm_service and self.vllm is None:
-                try:
-                    from lollms.services.ttt.vllm.lollms_vllm import Service
-                    self.vllm = Service(self, base_url=self.config.vllm_url)
-                except Exception as ex:
-                    trace_exception(ex)
-                    self.warning(f"Couldn't load vllm")
+            self.load_ollama_service(reload_all)
+            self.load_vllm_service(reload_all)
 
             ASCIIColors.blue("Loading local STT services")
-
-            if self.config.whisper_activate and self.whisper is None:
-                try:
-                    from lollms.services.stt.whisper.lollms_whisper import LollmsWhisper
-                    self.whisper = LollmsWhisper(self, self.config.whisper_model, self.lollms_paths.personal_outputs_path)
-                except Exception as ex:
-                    trace_exception(ex)
+            self.load_whisper_service(reload_all)
                     
             ASCIIColors.blue("Loading loacal TTS services")
-            if self.config.active_tts_service == "xtts" and self.xtts is None:
-                ASCIIColors.yellow("Loading XTTS")
-                try:
-                    from lollms.services.tts.xtts.lollms_xtts import LollmsXTTS
-                    voice=self.config.xtts_current_voice
-                    if voice!="main_voice":
-                        voices_folder = self.lollms_paths.custom_voices_path
-                    else:
-                        voices_folder = Path(__file__).parent.parent.parent/"services/xtts/voices"
-
-                    self.xtts = LollmsXTTS(
-                                            self,
-                                            voices_folders=[voices_folder, self.lollms_paths.custom_voices_path], 
-                                            freq=self.config.xtts_freq
-                                        )
-                except Exception as ex:
-                    trace_exception(ex)
-                    self.warning(f"Couldn't load XTTS")
+            self.load_xtts_service(reload_all)
 
             ASCIIColors.blue("Loading local TTI services")
-            if self.config.enable_sd_service and self.sd is None:
-                try:
-                    from lollms.services.tti.sd.lollms_sd import LollmsSD
-                    self.sd = LollmsSD(self, auto_sd_base_url=self.config.sd_base_url)
-                except:
-                    self.warning(f"Couldn't load SD")
-
-            if self.config.enable_comfyui_service and self.comfyui is None:
-                try:
-                    from lollms.services.tti.comfyui.lollms_comfyui import LollmsComfyUI
-                    self.comfyui = LollmsComfyUI(self, comfyui_base_url=self.config.comfyui_base_url)
-                except:
-                    self.warning(f"Couldn't load Comfyui")
+            self.load_sd_service(reload_all)
+            self.load_comfyui_service(reload_all)
 
             ASCIIColors.blue("Activating TTI service")
-            if self.config.active_tti_service == "diffusers" and (self.tti is None or self.tti.name!="diffusers" or self.tti.model!=self.config.diffusers_model):
-                from lollms.services.tti.diffusers.lollms_diffusers import LollmsDiffusers
-                self.tti = LollmsDiffusers(self)
-            elif self.config.active_tti_service == "diffusers_client" and (self.tti.base_url!=self.config.diffusers_client_base_url or self.tti.name!="diffusers_client"):
-                from lollms.services.tti.diffusers_client.lollms_diffusers_client import LollmsDiffusersClient
-                self.tti = LollmsDiffusersClient(self, base_url=self.config.diffusers_client_base_url)
-            elif self.config.active_tti_service == "autosd" and (self.tti is None or self.tti.name!="stable_diffusion"):
-                if self.sd:
-                    self.tti = self.sd
-                else:
-                    from lollms.services.tti.sd.lollms_sd import LollmsSD
-                    self.tti = LollmsSD(self, auto_sd_base_url=self.config.sd_base_url)
-            elif self.config.active_tti_service == "dall-e" and (self.tti is None or self.tti.name!="dall-e-2" or type(self.tti.name)!="dall-e-3"):
-                from lollms.services.tti.dalle.lollms_dalle import LollmsDalle
-                self.tti = LollmsDalle(self, self.config.dall_e_key)
-            elif self.config.active_tti_service == "midjourney" and (self.tti is None or self.tti.name!="midjourney"):
-                from lollms.services.tti.midjourney.lollms_midjourney import LollmsMidjourney
-                self.tti = LollmsMidjourney(self, self.config.midjourney_key, self.config.midjourney_timeout, self.config.midjourney_retries)
-            elif self.config.active_tti_service == "comfyui" and (self.tti is None or self.tti.name!="comfyui"):
-                if self.comfyui:
-                    self.tti = self.comfyui
-                else:
-                    from lollms.services.tti.comfyui.lollms_comfyui import LollmsComfyUI
-                    self.tti = LollmsComfyUI(self, comfyui_base_url=self.config.comfyui_base_url)
+            self.load_tti_service(reload_all)
 
             ASCIIColors.blue("Activating TTS service")
-            if self.config.active_tts_service == "eleven_labs_tts":
-                from lollms.services.tts.eleven_labs_tts.lollms_eleven_labs_tts import LollmsElevenLabsTTS
-                self.tts = LollmsElevenLabsTTS(self, self.config.elevenlabs_tts_model_id, self.config.elevenlabs_tts_voice_id,  self.config.elevenlabs_tts_key, stability=self.config.elevenlabs_tts_voice_stability, similarity_boost=self.config.elevenlabs_tts_voice_boost)
-            elif self.config.active_tts_service == "openai_tts" and (self.tts is None or self.tts.name!="openai_tts"):
-                from lollms.services.tts.open_ai_tts.lollms_openai_tts import LollmsOpenAITTS
-                self.tts = LollmsOpenAITTS(self, self.config.openai_tts_model, self.config.openai_tts_voice,  self.config.openai_tts_key)
-            elif self.config.active_tts_service == "fish_tts":
-                from lollms.services.tts.fish.lollms_fish_tts import LollmsFishAudioTTS
-                self.tts = LollmsFishAudioTTS(self, self.config.fish_tts_voice,  self.config.fish_tts_key)
-            elif self.config.active_tts_service == "xtts" and self.xtts:
-                self.tts = self.xtts
+            self.load_tts_service(reload_all)
 
             ASCIIColors.blue("Activating STT service")
-            if self.config.active_stt_service == "openai_whisper" and (self.tts is None or self.tts.name!="openai_whisper"):
-                from lollms.services.stt.openai_whisper.lollms_openai_whisper import LollmsOpenAIWhisper
-                self.stt = LollmsOpenAIWhisper(self, self.config.openai_whisper_model, self.config.openai_whisper_key)
-            elif self.config.active_stt_service == "whisper" and (self.tts is None or  self.tts.name!="whisper") :
-                from lollms.services.stt.whisper.lollms_whisper import LollmsWhisper
-                self.stt = LollmsWhisper(self, self.config.whisper_model)
+            self.load_stt_service(reload_all)
 
-
-            if self.config.active_ttv_service == "lumalabs" and (self.ttv is None or self.tti.name!="lumalabs"):
-                try:
-                    from lollms.services.ttv.lumalabs.lollms_lumalabs import LollmsLumaLabs
-                    self.sd = LollmsLumaLabs(self.config.lumalabs_key)
-                except:
-                    self.warning(f"Couldn't load SD")
+            self.load_ttv_service(reload_all)
 
         except Exception as ex:
             trace_exception(ex)
@@ -655,12 +741,18 @@ class LollmsApplication(LoLLMsCom):
         ASCIIColors.green(f"Received {generation_infos['nb_received_tokens']} tokens (speed: {spd:.2f}t/s)              ",end="\r",flush=True) 
         sys.stdout = sys.__stdout__
         sys.stdout.flush()
+        # The stop sequences are searched incrementally, only in the new chunk and the end of the previous text
+        matcher = generation_infos.get("stop_sequence_matcher")
+        if matcher is None:
+            matcher = StopSequenceMatcher(self.personality.get_anti_prompts(), generation_infos["generated_text"])
+            generation_infos["stop_sequence_matcher"] = matcher
         if chunk:
             generation_infos["generated_text"] += chunk
-        antiprompt = self.personality.detect_antiprompt(generation_infos["generated_text"])
+            matcher.feed(chunk)
+        antiprompt = matcher.match
         if antiprompt:
             ASCIIColors.warning(f"\n{antiprompt} detected. Stopping generation")
-            generation_infos["generated_text"] = self.remove_text_from_string(generation_infos["generated_text"],antiprompt)
+            generation_infos["generated_text"] = generation_infos["generated_text"][:len(matcher)]
             return False
         else:
             generation_infos["nb_received_tokens"] += 1
@@ -907,6 +999,49 @@ class LollmsApplication(LoLLMsCom):
                 self.config.save_config()
         return True
 
+    def count_tokens(self, text:str)->int:
+        """
+        Returns the number of tokens of a text using the current model.
+        The counts are cached so that static prompt parts (conditionning, boosts, user description...) are only tokenized once.
+
+        Args:
+            text (str): The text to measure.
+
+        Returns:
+            int: The number of tokens of the text.
+        """
+        if text=="":
+            return 0
+        if self.tokens_count_cache_model is not self.model:
+            self.tokens_count_cache.clear()
+            self.tokens_count_cache_model = self.model
+        n_tokens = self.tokens_count_cache.get(text)
+        if n_tokens is None:
+            if len(self.tokens_count_cache)>=256:
+                self.tokens_count_cache.clear()
+            n_tokens = len(self.model.tokenize(text))
+            self.tokens_count_cache[text] = n_tokens
+        return n_tokens
+
+    def format_message_for_context(self, message:Message)->str:
+        """
+        Formats a discussion message with its header the way it is put in the context.
+
+        Args:
+            message (Message): The message to format.
+
+        Returns:
+            str: The formatted message.
+        """
+        is_ai = message.sender_type == SENDER_TYPES.SENDER_TYPES_AI
+        start_header = self.config.start_ai_header_id_template if is_ai else self.start_user_header_id_template
+        end_header = self.config.end_ai_header_id_template if is_ai else self.end_user_header_id_template
+        if self.config.use_model_name_in_discussions and message.model:
+            sender = f"{message.sender}({message.model})"
+        else:
+            sender = message.sender
+        return f"{self.separator_template}{start_header}{sender}{end_header}" + message.content.strip()
+
     def recover_discussion(self,client_id, message_index=-1):
         messages = self.session.get_client(client_id).discussion.get_messages()
         discussion=""
@@ -932,8 +1067,6 @@ class LollmsApplication(LoLLMsCom):
         skills_detials=[]
         skills = []
         documentation_entries = []
-        start_ai_header_id_template     = self.config.start_ai_header_id_template
-        end_ai_header_id_template       = self.config.end_ai_header_id_template
 
 
         if self.personality.callback is None:
@@ -941,17 +1074,14 @@ class LollmsApplication(LoLLMsCom):
         # Get the list of messages
         client = self.session.get_client(client_id)
         discussion = client.discussion
-        messages = discussion.get_messages()
+        # Only the last messages of the discussion are loaded, the older ones are read if the context needs them
+        last_message = discussion.get_last_message()
+        discussion.current_message = last_message
 
-        # Find the index of the message with the specified message_id
-        message_index = -1
-        for i, message in enumerate(messages):
-            if message.id == message_id:
-                message_index = i
-                break
-        
-        # Define current message
-        current_message = messages[message_index]
+        # Find the message with the specified message_id (the last message by default)
+        current_message = discussion.find_message(message_id) if message_id!=-1 else None
+        if current_message is None:
+            current_message = last_message
 
         # Build the conditionning text block
         default_language = self.personality.language.lower().strip().split()[0]
@@ -988,21 +1118,21 @@ class LollmsApplication(LoLLMsCom):
         # boosting information
         if self.config.positive_boost:
             positive_boost=f"{self.system_custom_header('important information')}"+self.config.positive_boost+"\n"
-            n_positive_boost = len(self.model.tokenize(positive_boost))
+            n_positive_boost = self.count_tokens(positive_boost)
         else:
             positive_boost=""
             n_positive_boost = 0
 
         if self.config.negative_boost:
             negative_boost=f"{self.system_custom_header('important information')}"+self.config.negative_boost+"\n"
-            n_negative_boost = len(self.model.tokenize(negative_boost))
+            n_negative_boost = self.count_tokens(negative_boost)
         else:
             negative_boost=""
             n_negative_boost = 0
 
         if self.config.fun_mode:
             fun_mode=f"{self.system_custom_header('important information')} Fun mode activated. In this mode you must answer in a funny playful way. Do not be serious in your answers. Each answer needs to make the user laugh.\n"
-            n_fun_mode = len(self.model.tokenize(positive_boost))
+            n_fun_mode = self.count_tokens(fun_mode)
         else:
             fun_mode=""
             n_fun_mode = 0
@@ -1190,8 +1320,7 @@ Answer directly with the reformulation of the last prompt.
 
 
         # Tokenize the conditionning text and calculate its number of tokens
-        tokens_conditionning = self.model.tokenize(conditionning)
-        n_cond_tk = len(tokens_conditionning)
+        n_cond_tk = self.count_tokens(conditionning)
 
 
         # Tokenize the internet search results text and calculate its number of tokens
@@ -1225,10 +1354,8 @@ Answer directly with the reformulation of the last prompt.
 
         # Tokenize user description
         if len(user_description)>0:
-            tokens_user_description = self.model.tokenize(user_description)
-            n_user_description_tk = len(tokens_user_description)
+            n_user_description_tk = self.count_tokens(user_description)
         else:
-            tokens_user_description = []
             n_user_description_tk = 0
 
 
@@ -1257,81 +1384,62 @@ Answer directly with the reformulation of the last prompt.
         tokens_accumulated = 0
 
 
-        # Initialize a list to store the full messages
+        # Initialize a list to store the full messages as (text, number of tokens) pairs
         full_message_list = []
         # If this is not a continue request, we add the AI prompt
         if not is_continue:
-            message_tokenized = self.model.tokenize(
-                self.personality.ai_message_prefix.strip()
-            )
-            full_message_list.append(message_tokenized)
+            ai_message_prefix = self.personality.ai_message_prefix.strip()
+            n_ai_message_prefix_tk = self.count_tokens(ai_message_prefix)
+            full_message_list.append((ai_message_prefix, n_ai_message_prefix_tk))
             # Update the cumulative number of tokens
-            tokens_accumulated += len(message_tokenized)
+            tokens_accumulated += n_ai_message_prefix_tk
 
 
         if generation_type != "simple_question":
-            # Accumulate messages starting from message_index
-            for i in range(message_index, -1, -1):
-                message = messages[i]
+            # Accumulate messages starting from the current message
+            for message in discussion.iter_messages_backward(current_message.id):
 
                 # Check if the message content is not empty and visible to the AI
                 if message.content != '' and (
                         message.message_type <= MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_SET_CONTENT_INVISIBLE_TO_USER.value and message.message_type != MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_SET_CONTENT_INVISIBLE_TO_AI.value):
 
-                    # Tokenize the message content
-                    if self.config.use_model_name_in_discussions:
-                        if message.model:
-                            msg =  f"{self.separator_template}" + f"{start_ai_header_id_template if message.sender_type == SENDER_TYPES.SENDER_TYPES_AI else self.start_user_header_id_template}{message.sender}({message.model}){end_ai_header_id_template  if message.sender_type == SENDER_TYPES.SENDER_TYPES_AI else self.end_user_header_id_template}" + message.content.strip()
-                        else:
-                            msg = f"{self.separator_template}" + f"{start_ai_header_id_template if message.sender_type == SENDER_TYPES.SENDER_TYPES_AI else self.start_user_header_id_template}{message.sender}{end_ai_header_id_template  if message.sender_type == SENDER_TYPES.SENDER_TYPES_AI else self.end_user_header_id_template}" + message.content.strip()
-                        message_tokenized = self.model.tokenize(msg)
-                    else:
-                        msg_value= f"{self.separator_template}" + f"{start_ai_header_id_template if message.sender_type == SENDER_TYPES.SENDER_TYPES_AI else self.start_user_header_id_template}{message.sender}{end_ai_header_id_template  if message.sender_type == SENDER_TYPES.SENDER_TYPES_AI else self.end_user_header_id_template}" + message.content.strip()
-                        message_tokenized = self.model.tokenize(
-                            msg_value
-                        )
+                    # Tokenize the message content (only new or changed messages are actually tokenized)
+                    msg_value = self.format_message_for_context(message)
+                    message_tokenized = client.discussion.get_message_tokens(message, msg_value, self.model)
+
                     # Check if adding the message will exceed the available space
                     if tokens_accumulated + len(message_tokenized) > available_space:
                         # Update the cumulative number of tokens
                         msg = message_tokenized[-(available_space-tokens_accumulated):]
                         tokens_accumulated += available_space-tokens_accumulated
-                        full_message_list.insert(0, msg)
+                        full_message_list.insert(0, (self.model.detokenize(msg), len(msg)))
                         break
 
-                    # Add the tokenized message to the full_message_list
-                    full_message_list.insert(0, message_tokenized)
+                    # Add the message to the full_message_list
+                    full_message_list.insert(0, (msg_value, len(message_tokenized)))
 
                     # Update the cumulative number of tokens
                     tokens_accumulated += len(message_tokenized)
         else:
-            message = messages[message_index]
+            message = current_message
 
             # Check if the message content is not empty and visible to the AI
             if message.content != '' and (
                     message.message_type <= MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_SET_CONTENT_INVISIBLE_TO_USER.value and message.message_type != MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_SET_CONTENT_INVISIBLE_TO_AI.value):
 
-                if self.config.use_model_name_in_discussions:
-                    if message.model:
-                        msg = f"{self.separator_template}{start_ai_header_id_template if message.sender_type == SENDER_TYPES.SENDER_TYPES_AI else self.start_user_header_id_template}{message.sender}({message.model}){end_ai_header_id_template  if message.sender_type == SENDER_TYPES.SENDER_TYPES_AI else self.end_user_header_id_template}" + message.content.strip()
-                    else:
-                        msg = f"{self.separator_template}{start_ai_header_id_template if message.sender_type == SENDER_TYPES.SENDER_TYPES_AI else self.start_user_header_id_template}{message.sender}{end_ai_header_id_template  if message.sender_type == SENDER_TYPES.SENDER_TYPES_AI else self.end_user_header_id_template}" + message.content.strip()
-                    message_tokenized = self.model.tokenize(msg)
-                else:
-                    message_tokenized = self.model.tokenize(
-                        f"{self.separator_template}{start_ai_header_id_template if message.sender_type == SENDER_TYPES.SENDER_TYPES_AI else self.start_user_header_id_template}{message.sender}{end_ai_header_id_template  if message.sender_type == SENDER_TYPES.SENDER_TYPES_AI else self.end_user_header_id_template}" + message.content.strip()
-                    )
+                msg_value = self.format_message_for_context(message)
+                message_tokenized = client.discussion.get_message_tokens(message, msg_value, self.model)
 
-                # Add the tokenized message to the full_message_list
-                full_message_list.insert(0, message_tokenized)
+                # Add the message to the full_message_list
+                full_message_list.insert(0, (msg_value, len(message_tokenized)))
 
                 # Update the cumulative number of tokens
                 tokens_accumulated += len(message_tokenized)
 
-        # Build the final discussion messages by detokenizing the full_message_list
-        discussion_messages = ""
-        for i in range(len(full_message_list)-1 if not is_continue else len(full_message_list)):
-            message_tokens = full_message_list[i]
-            discussion_messages += self.model.detokenize(message_tokens)
+        # Build the final discussion messages from the already formatted texts
+        discussion_messages = "".join([
+            message_text for message_text, _ in full_message_list[:len(full_message_list)-1 if not is_continue else len(full_message_list)]
+        ])
         
         if len(full_message_list)>0:
             ai_prefix = self.personality.ai_message_prefix
@@ -1342,6 +1450,7 @@ Answer directly with the reformulation of the last prompt.
         # Details
         context_details = {
             "client_id":client_id,
+            "discussion_id":discussion.discussion_id if discussion else None,
             "conditionning":conditionning,
             "internet_search_infos":internet_search_infos,
             "internet_search_results":internet_search_results,
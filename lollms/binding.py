@@ -6,8 +6,7 @@
 # Description   : 
 # This is an interface class for lollms bindings.
 ######
-from fastapi import Request
-from typing import Dict, Any
+from typing import Dict, Any, List
 from pathlib import Path
 from typing import Callable, Any
 from lollms.paths import LollmsPaths
@@ -33,8 +32,8 @@ from datetime import datetime
 from enum import Enum
 from lollms.utilities import trace_exception
 
-from tqdm import tqdm
 from lollms.databases.models_database import ModelsDB
+from lollms.download import RangeDownloader
 import sys
 
 __author__ = "parisneo"
@@ -44,6 +43,13 @@ __license__ = "Apache 2.0"
 
 
 class LLMBinding:
+    # Bindings able to process several prompts at once override generate_batch and set this to True
+    supports_batch_generation:bool = False
+    # Maximum number of prompts sent to generate_batch at once
+    max_batch_size:int = 8
+    # Bindings keeping a KV cache set this to True to receive the stable_prefix_tokens generation parameter:
+    # the number of leading prompt tokens that are identical to the previous prompt of the same discussion
+    supports_prefix_reuse:bool = False
     
     def __init__(
                     self,
@@ -155,23 +161,16 @@ class LLMBinding:
             # Create folder if it doesn't exist
             folder_path.mkdir(parents=True, exist_ok=True)
             if not callback:
+                from tqdm import tqdm
                 progress_bar = tqdm(total=100, unit="%", unit_scale=True, desc=f"Downloading {url.split('/')[-1]}")
-            # Define callback function for urlretrieve
-            downloaded_size = [0]
-            def report_progress(block_num, block_size, total_size):
+            def report_progress(downloaded_size, total_size):
                 if callback:
-                    downloaded_size[0] += block_size
-                    callback(downloaded_size[0], total_size)
-                else:
-                    progress_bar.update(block_size/total_size)
-            # Download file from URL to folder
-            try:
-                Path(model_full_path).parent.mkdir(parents=True, exist_ok=True)
-                request.urlretrieve(url, model_full_path, reporthook=report_progress)
-                print("File downloaded successfully!")
-            except Exception as e:
-                ASCIIColors.error("Error downloading file:", e)
-                sys.exit(1)
+                    callback(downloaded_size, total_size)
+                elif total_size:
+                    progress_bar.update(100*downloaded_size/total_size-progress_bar.n)
+            # Download file from URL to folder. Errors are raised to the caller (an interrupted download is resumed by the next call)
+            RangeDownloader(url, model_full_path, n_connections=self.config.model_download_connections, callback=report_progress).download()
+            print("File downloaded successfully!")
 
     def reference_model(self, path):
         path = Path(str(path).replace("\\","/"))
@@ -201,36 +200,32 @@ class LLMBinding:
     def download_file(self, url, installation_path, callback=None):
         """
         Downloads a file from a URL, reports the download progress using a callback function, and displays a progress bar.
+        The file is fetched over several connections and an interrupted download is resumed by the next call.
 
         Args:
             url (str): The URL of the file to download.
             installation_path (str): The path where the file should be saved.
             callback (function, optional): A callback function to be called during the download
-                with the progress percentage as an argument. Defaults to None.
+                with the downloaded size and the total size as arguments. Defaults to None.
+
+        Returns:
+            bool: True if the file was downloaded.
         """
         try:
-            response = requests.get(url, stream=True)
-
-            # Get the file size from the response headers
-            total_size = int(response.headers.get('content-length', 0))
-
-            with open(installation_path, 'wb') as file:
-                downloaded_size = 0
-                with tqdm(total=total_size, unit='B', unit_scale=True, ncols=80) as progress_bar:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            file.write(chunk)
-                            downloaded_size += len(chunk)
-                            if callback is not None:
-                                callback(downloaded_size, total_size)
-                            progress_bar.update(len(chunk))
-
-            if callback is not None:
-                callback(total_size, total_size)
+            from tqdm import tqdm
+            with tqdm(unit='B', unit_scale=True, ncols=80) as progress_bar:
+                def report_progress(downloaded_size, total_size):
+                    progress_bar.total = total_size
+                    progress_bar.update(downloaded_size-progress_bar.n)
+                    if callback is not None:
+                        callback(downloaded_size, total_size)
+                RangeDownloader(url, installation_path, n_connections=self.config.model_download_connections, callback=report_progress).download()
 
             print("File downloaded successfully")
+            return True
         except Exception as e:
             print("Couldn't download file:", str(e))
+            return False
 
     def install_model(self, model_type:str, model_path:str, variant_name:str, client_id:int=None):
         print("Install model triggered")
@@ -315,10 +310,14 @@ class LLMBinding:
 
             
             def callback(downloaded_size, total_size):
-                progress = (downloaded_size / total_size) * 100
+                # The size is unknown when the server sends no Content-Length, then the progress can't be computed
+                total_size = total_size or self.download_infos[signature]['total_size']
+                progress = (downloaded_size / total_size) * 100 if total_size else self.download_infos[signature]['progress']
                 now = datetime.now()
                 dt = (now - self.download_infos[signature]['start_time']).total_seconds()
-                speed = downloaded_size/dt
+                # A resumed download starts with the bytes of the previous session already on disk
+                resumed_size = self.download_infos[signature].setdefault("resumed_size", downloaded_size)
+                speed = (downloaded_size-resumed_size)/dt if dt>0 else 0
                 self.download_infos[signature]['downloaded_size'] = downloaded_size
                 self.download_infos[signature]['speed'] = speed
 
@@ -732,6 +731,30 @@ class LLMBinding:
         """
         pass
     
+    def generate_batch(self, 
+                 prompts:List[str],
+                 n_predicts:List[int],
+                 callbacks:List[Callable[[str, int, dict], bool]] = None,
+                 verbose: bool = False,
+                 **gpt_params )->List[str]:
+        """Generates text out of a batch of prompts
+        Bindings that can batch (vllm, tgi, ollama ...) override this and set supports_batch_generation to True.
+        The default implementation generates the prompts one after the other.
+
+        Args:
+            prompts (List[str]): The prompts to use for generation
+            n_predicts (List[int]): Number of tokens to predict for each prompt.
+            callbacks (List[Callable[[str, int, dict], bool]], optional): One callback per prompt receiving the chunks of that prompt. When a callback returns False, only the generation of its prompt stops. Defaults to None.
+            verbose (bool, optional): If true, the code will spit many informations about the generation process. Defaults to False.
+
+        Returns:
+            List[str]: The generated text of each prompt
+        """
+        return [
+                    self.generate(prompt, n_predict, callback=callbacks[i] if callbacks else None, verbose=verbose, **gpt_params)
+                    for i, (prompt, n_predict) in enumerate(zip(prompts, n_predicts))
+                ]
+
     def tokenize(self, prompt:str):
         """
         Tokenizes the given prompt using the model's tokenizer.
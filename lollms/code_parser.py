@@ -1,8 +1,8 @@
 import re
+from typing import List
 from lollms.utilities import PackageManager
 import pipmaster as pm
 
-from bs4 import BeautifulSoup
 def compress_js(js_code):
     # Patterns to match function, class, and variable declarations
     function_pattern = r"function\s+(\w+)\s*\(([^)]*)\)"
@@ -82,6 +82,7 @@ def compress_python(py_code):
     return '\n'.join(compressed)
 
 def compress_html(html_doc):
+    from bs4 import BeautifulSoup
 
     # Initialize BeautifulSoup with the provided HTML document
     soup = BeautifulSoup(html_doc, 'html.parser')
@@ -122,6 +123,202 @@ def compress_html(html_doc):
     
     return '\n'.join(compressed_output)
 
+class CodeBlocksParser:
+    """
+    Single pass and resumable parser of the markdown code blocks (```type ... ```) of a text.
+
+    The text can be fed by chunks while it is generated: each call to feed only scans the new chunk and returns
+    the blocks whose closing fence arrived. finish() closes the text: an unclosed block is returned with
+    is_complete set to False.
+
+    Each block is a dictionary with:
+        - 'index' (int): The index of the code block in the text
+        - 'file_name' (str): The file name given on the line before the block (<file_name>...</file_name> or ## filename: ...)
+        - 'section' (str): The section given on the line before the block (<section>...</section>)
+        - 'content' (str): The content of the code block
+        - 'type' (str): The language of the block, 'language-specific' when the fence is followed by a space
+        - 'is_complete' (bool): True if the block has a closing fence
+
+    Usage:
+        parser = CodeBlocksParser()
+        for chunk in chunks:
+            for block in parser.feed(chunk):
+                print(block["file_name"], block["content"])
+        parser.finish()
+        parser.blocks, parser.remaining_text
+    """
+    FENCE = "```"
+
+    def __init__(self) -> None:
+        self.blocks:List[dict] = []
+        self.finished = False
+        # Text that was not scanned yet (at most the beginning of a fence or a block header)
+        self.pending = ""
+        self.in_block = False
+        self.current:dict = None
+        self.content_parts:List[str] = []
+        # Text outside of the blocks and the last lines of the current outside segment
+        self.text_parts:List[str] = []
+        self.segment_parts:List[str] = []
+        self.line = ""
+        self.last_line = ""
+
+    # ----------------------------------- Outside of the blocks -----------------------------------
+    def _add_text(self, text:str):
+        if not text:
+            return
+        self.segment_parts.append(text)
+        lines = text.split("\n")
+        if len(lines)>1:
+            for line in reversed([self.line+lines[0]]+lines[1:-1]):
+                if line.strip():
+                    self.last_line = line.strip()
+                    break
+            self.line = lines[-1]
+        else:
+            self.line += text
+
+    def _close_segment(self):
+        segment = "".join(self.segment_parts).strip()
+        if segment:
+            self.text_parts.append(segment)
+        self.segment_parts = []
+        self.line = ""
+        self.last_line = ""
+
+    def _open_block(self):
+        block = {
+            'index': len(self.blocks),
+            'file_name': "",
+            'section': "",
+            'content': "",
+            'type': "",
+            'is_complete': False
+        }
+        preceding_line = self.line.strip() or self.last_line
+        if preceding_line.startswith("<file_name>") and preceding_line.endswith("</file_name>"):
+            block['file_name'] = preceding_line[len("<file_name>"):-len("</file_name>")].strip()
+        elif preceding_line.startswith("## filename:"):
+            block['file_name'] = preceding_line[len("## filename:"):].strip()
+        if preceding_line.startswith("<section>") and preceding_line.endswith("</section>"):
+            block['section'] = preceding_line[len("<section>"):-len("</section>")].strip()
+        self._close_segment()
+        return block
+
+    # ----------------------------------- Parsing -----------------------------------
+    def feed(self, chunk:str)->List[dict]:
+        """
+        Adds a chunk of text.
+
+        Returns:
+            List[dict]: the blocks completed by this chunk.
+        """
+        if self.finished:
+            raise ValueError("The parser is finished")
+        completed = []
+        text = self.pending+chunk
+        # Scan position in text, the text is never sliced except for the parts that are kept
+        pos = 0
+        while pos<len(text):
+            if not self.in_block:
+                position = text.find(CodeBlocksParser.FENCE, pos)
+                if position<0:
+                    # Keep what may be the beginning of a fence
+                    end = len(text.rstrip("`"))
+                    self._add_text(text[pos:max(pos, end)])
+                    pos = max(pos, end)
+                    break
+                self._add_text(text[pos:position])
+                self.current = self._open_block()
+                self.in_block = True
+                self.current["type"] = None
+                pos = position+3
+            if self.current["type"] is None:
+                # The header of the block goes up to the first space or new line
+                if pos>=len(text):
+                    break
+                if text[pos] in ["\n", " ", "\t"]:
+                    self.current["type"] = 'language-specific'
+                else:
+                    ends = [p for p in (text.find(" ", pos), text.find("\n", pos), text.find(CodeBlocksParser.FENCE, pos)) if p>=0]
+                    if len(ends)==0:
+                        break
+                    header = text[pos:min(ends)]
+                    if '{' in header:
+                        self.current["type"] = ""
+                    else:
+                        self.current["type"] = header
+                        pos += len(header)
+            position = text.find(CodeBlocksParser.FENCE, pos)
+            if position<0:
+                end = len(text.rstrip("`"))
+                self.content_parts.append(text[pos:max(pos, end)])
+                pos = max(pos, end)
+                break
+            self.content_parts.append(text[pos:position])
+            pos = position+3
+            completed.append(self._close_block(True))
+        self.pending = text[pos:]
+        return completed
+
+    def _close_block(self, is_complete:bool)->dict:
+        block = self.current
+        block["content"] = "".join(self.content_parts).strip()
+        block["is_complete"] = is_complete
+        self.blocks.append(block)
+        self.current = None
+        self.content_parts = []
+        self.in_block = False
+        return block
+
+    def finish(self)->List[dict]:
+        """
+        Ends the text.
+
+        Returns:
+            List[dict]: the unclosed block if any.
+        """
+        completed = []
+        if not self.finished:
+            self.finished = True
+            if self.in_block:
+                if self.current["type"] is None:
+                    # The text ended on the header of the block
+                    if not self.pending:
+                        self.current = None
+                        self.in_block = False
+                    else:
+                        if '{' in self.pending:
+                            self.current["type"] = ""
+                            self.content_parts.append(self.pending)
+                        else:
+                            self.current["type"] = self.pending
+                        self.pending = ""
+                        completed.append(self._close_block(False))
+                else:
+                    self.content_parts.append(self.pending)
+                    self.pending = ""
+                    completed.append(self._close_block(False))
+            else:
+                self._add_text(self.pending)
+                self.pending = ""
+            self._close_segment()
+        return completed
+
+    @property
+    def remaining_text(self)->str:
+        """The text outside of the blocks (each part stripped and joined by new lines)."""
+        return '\n'.join(self.text_parts)
+
+    @staticmethod
+    def parse(text:str)->"CodeBlocksParser":
+        """Parses a whole text."""
+        parser = CodeBlocksParser()
+        parser.feed(text)
+        parser.finish()
+        return parser
+
+
 if __name__=="__main__":
     # Example JavaScript code with class members
     js_code = """
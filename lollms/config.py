@@ -1,5 +1,7 @@
 from pathlib import Path
-from ascii_colors import ASCIIColors
+from ascii_colors import ASCIIColors, trace_exception
+from contextlib import contextmanager
+from typing import Callable, Dict, List
 
 
 import yaml
@@ -42,6 +44,9 @@ class ConfigTemplate:
             Checks if a configuration entry with the specified name exists in the template.
     """
 
+    # Real attributes of the object, every other attribute is a configuration entry
+    ATTRIBUTES = frozenset(["template", "exceptional_keys", "_index"])
+
     def __init__(self, template: list = None) -> None:
         """
         Initializes a new instance of the `ConfigTemplate` class.
@@ -66,6 +71,17 @@ class ConfigTemplate:
                     raise ValueError(f"Missing fields {', '.join(missing_fields)} in template entry.")
         self.template = template
 
+    def entries_index(self) -> dict:
+        """
+        Returns a dictionary of the entries by name. It is rebuilt only when the template list changes.
+        """
+        index = self.__dict__.get("_index")
+        template = self.template
+        if index is None or index[0] is not template or index[1]!=len(template):
+            index = (template, len(template), {entry["name"]:entry for entry in template})
+            super().__setattr__("_index", index)
+        return index[2]
+
     def add_entry(self, entry_name, entry_value, entry_type, entry_min=None, entry_max=None, entry_help=""):
         """
         Adds a new entry to the configuration template.
@@ -102,10 +118,7 @@ class ConfigTemplate:
         """
         if self.template is None:
             raise ValueError("No configuration loaded.")
-        for entry in self.template:
-            if entry["name"] == key:
-                return entry
-        return None
+        return self.entries_index().get(key)
 
     def __getattr__(self, key):
         """
@@ -120,17 +133,12 @@ class ConfigTemplate:
         Raises:
             ValueError: If no configuration is loaded.
         """
-        if key == "exceptional_keys":
-            return super().__getattribute__(key)
-        if key in  ["template"] or key.startswith("__"):
+        if key in ConfigTemplate.ATTRIBUTES or key.startswith("__"):
             return super().__getattribute__(key)
         else:
             if self.template is None:
                 raise ValueError("No configuration loaded.")
-            for entry in self.template:
-                if entry["name"] == key:
-                    return entry
-            return None
+            return self.entries_index().get(key)
 
     def __setattr__(self, key, value):
         """
@@ -143,18 +151,10 @@ class ConfigTemplate:
         Raises:
             ValueError: If no configuration is loaded or if the specified key is not found.
         """
-        if key == "exceptional_keys":
-            return super().__setattr__(key, value)
-        if key in ["template"] or key.startswith("__"):
+        if key in ConfigTemplate.ATTRIBUTES or key.startswith("__"):
             super().__setattr__(key, value)
         else:
-            if self.template is None:
-                raise ValueError("No configuration loaded.")
-            for entry in self.template:
-                if entry["name"] == key:
-                    entry["value"] = value
-                    return
-            raise ValueError(f"Configuration entry '{key}' not found.")
+            self[key] = value
 
     def __setitem__(self, key, value):
         """
@@ -169,11 +169,10 @@ class ConfigTemplate:
         """
         if self.template is None:
             raise ValueError("No configuration loaded.")
-        for entry in self.template:
-            if entry["name"] == key:
-                entry["value"] = value
-                return
-        raise ValueError(f"Configuration entry '{key}' not found.")
+        entry = self.entries_index().get(key)
+        if entry is None:
+            raise ValueError(f"Configuration entry '{key}' not found.")
+        entry["value"] = value
 
     def __contains__(self, item):
         """
@@ -190,11 +189,66 @@ class ConfigTemplate:
         """
         if self.template is None:
             raise ValueError("No configuration loaded.")
-        for entry in self.template:
-            if entry["name"] == item:
-                return True
-        return False
+        return item in self.entries_index()
+
+
+
+class ConfigChange:
+    """A configuration key whose value changed."""
+    __slots__ = ("key", "old_value", "new_value")
+
+    def __init__(self, key:str, old_value, new_value) -> None:
+        self.key = key
+        self.old_value = old_value
+        self.new_value = new_value
+
+    def __repr__(self) -> str:
+        return f"ConfigChange({self.key}: {self.old_value!r} -> {self.new_value!r})"
+
+
+class ConfigWatcher:
+    """
+    A subscription to the changes of some configuration keys.
 
+    The callback receives a dictionary key -> ConfigChange holding only the watched keys that changed.
+    """
+    def __init__(self, keys:List[str], callback:Callable[[Dict[str, ConfigChange]], None], name:str=None) -> None:
+        self.keys = frozenset(keys)
+        self.callback = callback
+        self.name = name or getattr(callback, "__name__", "watcher")
+
+
+_MISSING = object()
+
+
+class ConfigKeyAccessor:
+    """
+    Resolves a configuration key read as an attribute (config.ctx_size).
+
+    Python calls __getattr__ only after the normal attribute lookup failed, which is slow. The first time a key is
+    read as an attribute, an accessor is installed on the configuration class so that the next reads of this key
+    find it directly. It is a non data descriptor: the real attributes of the object (stored in its __dict__) keep
+    precedence over it.
+    """
+    __slots__ = ("key",)
+
+    def __init__(self, key:str) -> None:
+        self.key = key
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        # Inlined BaseConfig.get_key, this is the hot path
+        attributes = instance.__dict__
+        config = attributes.get("config")
+        if config is None or self.key in attributes.get("_attributes", BaseConfig.ATTRIBUTES):
+            return instance.get_key(self.key)
+        return config[self.key]
+
+    @classmethod
+    def install(accessor_class, cls, key:str):
+        if isinstance(key, str) and not key.startswith("_") and key not in cls.__dict__:
+            setattr(cls, key, accessor_class(key))
 
 
 class BaseConfig:
@@ -226,6 +280,9 @@ class BaseConfig:
             Saves the configuration to a YAML file.
     """
 
+    # Real attributes of the object, every other attribute is a configuration key
+    ATTRIBUTES = frozenset(["config", "file_path", "copy"])
+
     def __init__(self, exceptional_keys: list = [], config: dict = None, file_path:Path|str=None):
         """
         Initializes a new instance of the `BaseConfig` class.
@@ -292,14 +349,24 @@ class BaseConfig:
             ValueError: If no configuration is loaded.
             AttributeError: If the specified key is not found in the configuration.
         """
-        if key == "exceptional_keys":
+        if key == "exceptional_keys" or key.startswith("__"):
             return super().__getattribute__(key)
-        if key in self.exceptional_keys + ["config","file_path","copy"] or key.startswith("__"):
-            return super().__getattribute__(key)
-        else:
-            if self.config is None:
-                raise ValueError("No configuration loaded.")
-            return self.config[key]
+        value = self.get_key(key)
+        ConfigKeyAccessor.install(BaseConfig, key)
+        return value
+
+    def get_key(self, key):
+        """
+        Retrieves the configuration value of a key read as an attribute.
+        """
+        attributes = self.__dict__
+        if key in attributes.get("_attributes", BaseConfig.ATTRIBUTES):
+            # A real attribute that was not set yet
+            raise AttributeError(key)
+        config = attributes.get("config")
+        if config is None:
+            raise ValueError("No configuration loaded.")
+        return config[key]
 
     def __setattr__(self, key, value):
         """
@@ -313,13 +380,12 @@ class BaseConfig:
             ValueError: If no configuration is loaded.
         """
         if key == "exceptional_keys":
+            super().__setattr__("_attributes", BaseConfig.ATTRIBUTES.union(value))
             return super().__setattr__(key, value)
-        if key in self.exceptional_keys + ["config","file_path","copy"] or key.startswith("__"):
+        if key in self.__dict__.get("_attributes", BaseConfig.ATTRIBUTES) or key.startswith("__"):
             super().__setattr__(key, value)
         else:
-            if self.config is None:
-                raise ValueError("No configuration loaded.")
-            self.config[key] = value
+            self[key] = value
 
     def __setitem__(self, key, value):
         """
@@ -332,9 +398,95 @@ class BaseConfig:
         Raises:
             ValueError: If no configuration is loaded.
         """
-        if self.config is None:
+        config = self.__dict__.get("config")
+        if config is None:
             raise ValueError("No configuration loaded.")
-        self.config[key] = value
+        if self.__dict__.get("_watchers"):
+            old_value = config.get(key, _MISSING)
+            config[key] = value
+            self.changed(key, old_value, value)
+        else:
+            config[key] = value
+
+    # ----------------------------------- Change notifications -----------------------------------
+    def watch(self, keys:List[str], callback:Callable[[Dict[str, ConfigChange]], None], name:str=None)->ConfigWatcher:
+        """
+        Calls callback each time one of the keys is set to a new value.
+
+        Args:
+            keys (List[str]): The watched keys.
+            callback (Callable): Receives a dictionary key -> ConfigChange with the watched keys that changed.
+            name (str, optional): Name of the watcher, used in the error messages.
+
+        Returns:
+            ConfigWatcher: the subscription, to give to unwatch.
+        """
+        watcher = ConfigWatcher(keys, callback, name)
+        watchers = self.__dict__.get("_watchers")
+        if watchers is None:
+            watchers = []
+            object.__setattr__(self, "_watchers", watchers)
+            object.__setattr__(self, "_pending_changes", None)
+        watchers.append(watcher)
+        return watcher
+
+    def unwatch(self, watcher:ConfigWatcher):
+        watchers = self.__dict__.get("_watchers")
+        if watchers and watcher in watchers:
+            watchers.remove(watcher)
+
+    @contextmanager
+    def batch_changes(self):
+        """
+        Groups the changes made inside the block: each watcher is called once at the end with all its changed keys.
+
+        Usage:
+            with config.batch_changes():
+                config["a"] = 1
+                config["b"] = 2
+        """
+        if self.__dict__.get("_pending_changes") is not None:
+            # Nested batch, the outermost one notifies
+            yield
+            return
+        object.__setattr__(self, "_pending_changes", {})
+        try:
+            yield
+        finally:
+            changes = self.__dict__.get("_pending_changes")
+            object.__setattr__(self, "_pending_changes", None)
+            self.notify([change for change in changes.values() if not BaseConfig.same_value(change.old_value, change.new_value)])
+
+    @staticmethod
+    def same_value(a, b)->bool:
+        try:
+            return type(a)==type(b) and bool(a==b)
+        except Exception:
+            return False
+
+    def changed(self, key:str, old_value, new_value):
+        """Records that key was set, the watchers are notified now or at the end of the current batch."""
+        pending = self.__dict__.get("_pending_changes")
+        if pending is not None:
+            if key in pending:
+                pending[key].new_value = new_value
+            else:
+                pending[key] = ConfigChange(key, old_value, new_value)
+        elif not BaseConfig.same_value(old_value, new_value):
+            self.notify([ConfigChange(key, old_value, new_value)])
+
+    def notify(self, changes:List[ConfigChange]):
+        """Calls the watchers of the changed keys."""
+        if not changes:
+            return
+        for watcher in list(self.__dict__.get("_watchers") or []):
+            watched_changes = {change.key:change for change in changes if change.key in watcher.keys}
+            if watched_changes:
+                try:
+                    watcher.callback(watched_changes)
+                except Exception as ex:
+                    ASCIIColors.error(f"Config watcher {watcher.name} failed")
+                    trace_exception(ex)
 
     def __contains__(self, item):
         """
@@ -406,11 +558,29 @@ class BaseConfig:
 
 
 
+class TypedConfigKeyAccessor(ConfigKeyAccessor):
+    """ConfigKeyAccessor of TypedConfig: the values are read from its base configuration."""
+    __slots__ = ()
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        config = instance.__dict__.get("config")
+        if config is None:
+            raise ValueError("No configuration loaded.")
+        return config[self.key]
+
+
 class TypedConfig:
     """
     This type of configuration contains a template of descriptions for the fields of the configuration.
     Field types: int, float, str.
+
+    Setting a value only marks it as modified, the template values are converted and updated (sync) the next
+    time the template is used (config_template, to_dict(use_template=True), save) or when sync is called.
     """
+    # Real attributes of the object, every other attribute is a configuration entry
+    ATTRIBUTES = frozenset(["config", "config_template", "_config_template", "_dirty_keys"])
 
     def __init__(self, config_template: ConfigTemplate, config: BaseConfig):
         """
@@ -420,19 +590,33 @@ class TypedConfig:
             config_template (ConfigTemplate): The template of descriptions for the fields of the configuration.
             config (BaseConfig): The base configuration object containing the configuration values.
         """
+        self._dirty_keys = set()
         self.config = config
-        self.config_template = config_template
+        self._config_template = config_template
 
         # Fill the template values from the config values
         self.sync()
-        
+
+    @property
+    def config_template(self) -> ConfigTemplate:
+        """The template, with the values modified since the last sync applied."""
+        if self._dirty_keys:
+            self.sync_modified()
+        return self._config_template
+
+    @config_template.setter
+    def config_template(self, config_template: ConfigTemplate):
+        self._config_template = config_template
+        self.sync()
+
     def addConfigs(self, cfg_template:list):
-        self.config_template.template += cfg_template
+        self._config_template.template += cfg_template
         self.sync()
 
     def update_template(self, new_template):
-        self.config_template.template = new_template
-        self.config = BaseConfig.from_template(self.config_template,self.config.exceptional_keys, self.config.file_path)
+        self._config_template.template = new_template
+        self._dirty_keys.clear()
+        self.config = BaseConfig.from_template(self._config_template,self.config.exceptional_keys, self.config.file_path)
 
     def get(self, key, default_value=None):
         if self.config is None:
@@ -456,12 +640,14 @@ class TypedConfig:
         Raises:
             ValueError: If no configuration is loaded.
         """
-        if key in  ["config","config_template"] or key.startswith("__"):
+        if key in TypedConfig.ATTRIBUTES or key.startswith("__"):
             return super().__getattribute__(key)
         else:
             if self.config is None:
                 raise ValueError("No configuration loaded.")
-            return self.config[key]
+            value = self.config[key]
+            TypedConfigKeyAccessor.install(TypedConfig, key)
+            return value
         
     def __setattr__(self, key, value):
         """
@@ -476,13 +662,10 @@ class TypedConfig:
         Raises:
             ValueError: If no configuration is loaded.
         """
-        if key in ["config","config_template"] or key.startswith("__"):
+        if key in TypedConfig.ATTRIBUTES or key.startswith("__"):
             super().__setattr__(key, value)
         else:
-            if self.config is None:
-                raise ValueError("No configuration loaded.")
-            self.config[key] = value
-            self.sync()
+            self[key] = value
             
 
     def __getitem__(self, key):
@@ -518,62 +701,91 @@ class TypedConfig:
         if self.config is None:
             raise ValueError("No configuration loaded.")
         self.config[key] = value   
-        self.sync()
+        self._dirty_keys.add(key)
+
+    @staticmethod
+    def convert_entry(entry:dict, entry_value):
+        """
+        Converts a value to the type of a template entry and clamps it to the entry min and max.
+        """
+        entry_name = entry["name"]
+        entry_type = entry["type"]
+
+        # Validate and convert the entry value based on its type
+        if entry_type == "int":
+            entry_value = int(entry_value)
+        elif entry_type == "float":
+            entry_value = float(entry_value)
+        elif entry_type == "str" or entry_type == "text" or entry_type == "string" or entry_type == "btn" or entry_type == "file" or entry_type == "folder":
+            entry_value = str(entry_value)                   
+        elif entry_type == "bool":
+            entry_value = bool(entry_value)
+        elif entry_type == "list":
+            entry_value = list(entry_value)
+        elif entry_type == "dict":
+            entry_value = eval(entry_value)
+        else:
+            raise ValueError(f"Invalid field type '{entry_type}' for entry '{entry_name}'.")
+
+        # Skip checking min and max if the entry type is not numeric
+        if entry_type == "int" or entry_type == "float":
+            entry_min = entry.get("min")
+            entry_max = entry.get("max")
+
+            # Check if the value is within the allowed range (if specified)
+            if entry_min is not None and entry_max is not None:
+                if entry_value < entry_min:
+                    entry_value = entry_min
+                elif entry_value > entry_max:
+                    entry_value = entry_max
+            elif entry_min is not None:
+                if entry_value < entry_min:
+                    entry_value = entry_min
+            elif entry_max is not None:
+                if entry_value > entry_max:
+                    entry_value = entry_max
+        return entry_value
 
     def sync(self):
         """
         Fills the template values from the config values.
         """
-        if self.config_template is None:
+        if self._config_template is None:
             raise ValueError("No configuration template loaded.")
         if self.config is None:
             raise ValueError("No configuration loaded.")
 
-        for entry in self.config_template.template:
+        self._dirty_keys.clear()
+        for entry in self._config_template.template:
             entry_name = entry["name"]
             if entry_name in self.config:
-                entry_value = self.config[entry_name]
-                entry_type = entry["type"]
-
-                # Validate and convert the entry value based on its type
-                if entry_type == "int":
-                    entry_value = int(entry_value)
-                elif entry_type == "float":
-                    entry_value = float(entry_value)
-                elif entry_type == "str" or entry_type == "text" or entry_type == "string" or entry_type == "btn" or entry_type == "file" or entry_type == "folder":
-                    entry_value = str(entry_value)                   
-                elif entry_type == "bool":
-                    entry_value = bool(entry_value)
-                elif entry_type == "list":
-                    entry_value = list(entry_value)
-                elif entry_type == "dict":
-                    entry_value = eval(entry_value)
-                else:
-                    raise ValueError(f"Invalid field type '{entry_type}' for entry '{entry_name}'.")
-
-                # Skip checking min and max if the entry type is not numeric
-                if entry_type == "int" or entry_type == "float":
-                    entry_min = entry.get("min")
-                    entry_max = entry.get("max")
-
-                    # Check if the value is within the allowed range (if specified)
-                    if entry_min is not None and entry_max is not None:
-                        if entry_value < entry_min:
-                            entry_value = entry_min
-                        elif entry_value > entry_max:
-                            entry_value = entry_max
-                    elif entry_min is not None:
-                        if entry_value < entry_min:
-                            entry_value = entry_min
-                    elif entry_max is not None:
-                        if entry_value > entry_max:
-                            entry_value = entry_max
-
                 # Update the template entry with the converted value
-                entry["value"] = entry_value
+                entry["value"] = TypedConfig.convert_entry(entry, self.config[entry_name])
             else:
                 self.config[entry_name] = entry["value"]
 
+    def sync_modified(self):
+        """
+        Fills the template values from the config values that were set since the last sync.
+        """
+        if self._config_template is None:
+            raise ValueError("No configuration template loaded.")
+        if self.config is None:
+            raise ValueError("No configuration loaded.")
+
+        dirty_keys = list(self._dirty_keys)
+        self._dirty_keys = set()
+        entries = self._config_template.entries_index()
+        for i, key in enumerate(dirty_keys):
+            entry = entries.get(key)
+            if entry is not None and key in self.config:
+                try:
+                    entry["value"] = TypedConfig.convert_entry(entry, self.config[key])
+                except Exception:
+                    # The invalid value and the keys not synced yet stay modified, the next sync reports it again
+                    self._dirty_keys.update(dirty_keys[i:])
+                    raise
+
     def set_config(self, config: BaseConfig):
         """
         Sets the configuration and updates the values of the template.
@@ -585,6 +797,8 @@ class TypedConfig:
         self.sync()
 
     def save(self, file_path:str|Path|None=None):
+        if self._dirty_keys:
+            self.sync_modified()
         self.config.save_config(file_path=file_path)
     def to_dict(self, use_template=False):
         if not use_template:
@@ -9,14 +9,18 @@ from lollms.utilities import PackageManager, discussion_path_to_url
 from lollms.paths import LollmsPaths
 from lollms.com import LoLLMsCom
 
-from lollmsvectordb.vector_database import VectorDatabase
-from lollmsvectordb.text_document_loader import TextDocumentsLoader
+from lollms.databases.vectorizers_registry import vectorizers_registry
+import bisect
 import gc
 import json
 import shutil
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
 from lollms.tasks import TasksLibrary
 import json
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 
 __author__ = "parisneo"
 __github__ = "https://github.com/ParisNeo/lollms-webui"
@@ -25,6 +29,41 @@ __license__ = "Apache 2.0"
 
 
 # =================================== Database ==================================================================
+# Full text index of the messages content, kept up to date by triggers on the message table
+MESSAGES_FTS_STATEMENTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(content, content='message', content_rowid='id')",
+    """CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message BEGIN
+        INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS message_fts_delete AFTER DELETE ON message BEGIN
+        INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS message_fts_update AFTER UPDATE OF content ON message BEGIN
+        INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+# Number of messages indexed per transaction when an existing database is indexed
+MESSAGES_FTS_BACKFILL_BATCH_SIZE = 10000
+
+def create_messages_fts_index(conn:sqlite3.Connection):
+    """
+    Creates the full text index of the messages. The new messages are indexed by the triggers, the existing ones
+    are indexed after the migration by DiscussionsDB.backfill_messages_fts, which records its progress in the
+    message_fts_backfill table.
+    If the sqlite library has no fts5 support, the index is not created and the search falls back to a scan.
+    """
+    try:
+        for statement in MESSAGES_FTS_STATEMENTS:
+            conn.execute(statement)
+    except sqlite3.OperationalError as ex:
+        ASCIIColors.warning(f"Couldn't create the messages search index, the search will be slow ({ex})")
+        return
+    # The messages up to end_id existed before the index, last_id is the last of them already indexed
+    conn.execute("CREATE TABLE IF NOT EXISTS message_fts_backfill (last_id INTEGER NOT NULL, end_id INTEGER NOT NULL)")
+    conn.execute("INSERT INTO message_fts_backfill (last_id, end_id) SELECT 0, COALESCE(MAX(id), 0) FROM message")
+
+
 class DiscussionsDB:
     
     def __init__(self, lollms:LoLLMsCom, lollms_paths:LollmsPaths, discussion_db_name="default"):
@@ -37,9 +76,215 @@ class DiscussionsDB:
         self.discussion_db_path.mkdir(exist_ok=True, parents= True)
         self.discussion_db_file_path = self.discussion_db_path/"database.db"
 
+        # One long lived connection per thread
+        self._local = threading.local()
+        self._connections:Dict[int, sqlite3.Connection] = {}
+        self._connections_lock = threading.Lock()
+
+        # Write behind buffer of the messages being generated: message id -> message,
+        # and content size at the last write of these messages: message id -> size (kept across flushes until the message is finished)
+        config = getattr(lollms, "config", None)
+        if config is not None and "discussion_messages_flush_interval" in config:
+            self.messages_flush_interval = float(config.discussion_messages_flush_interval)
+        else:
+            self.messages_flush_interval = 0.5
+        self._pending_messages:Dict[int, 'Message'] = {}
+        self._written_sizes:Dict[int, int] = {}
+        self._pending_lock = threading.Lock()
+        self._pending_condition = threading.Condition(self._pending_lock)
+        self._flush_lock = threading.Lock()
+        # Single thread writing the buffer, so that it reuses its connection
+        self._writer_thread:threading.Thread = None
+
+    # -------------------------------------- Write behind buffer
+    # Once the content of a message grew by this many characters since its last write, it is written right away
+    MESSAGES_FLUSH_SIZE = 65536
+
+    def buffer_message_content(self, message:'Message'):
+        """
+        Registers a message whose content changed.
+        The content is written at most every messages_flush_interval seconds (or sooner if it grew a lot),
+        so streaming an answer doesn't rewrite the whole text for every chunk.
+
+        Args:
+            message (Message): The updated message.
+        """
+        if self.messages_flush_interval<=0 or message.id is None:
+            self.write_message_content(message)
+            return
+        with self._pending_lock:
+            self._pending_messages[message.id] = message
+            size_due = len(message.content) - self._written_sizes.get(message.id, 0) >= DiscussionsDB.MESSAGES_FLUSH_SIZE
+            if not size_due:
+                if self._writer_thread is None:
+                    self._writer_thread = threading.Thread(target=self.messages_writer, name="lollms_messages_writer", daemon=True)
+                    self._writer_thread.start()
+                self._pending_condition.notify()
+        if size_due:
+            self.flush_messages()
+
+    def messages_writer(self):
+        """
+        Loop of the writer thread: writes the buffered messages every messages_flush_interval seconds while there are some.
+        The generations flush their messages when they end, so nothing is lost when the process exits.
+        """
+        writer = threading.current_thread()
+        while True:
+            with self._pending_condition:
+                while not self._pending_messages and self._writer_thread is writer:
+                    self._pending_condition.wait()
+                if self._writer_thread is not writer:
+                    return
+            time.sleep(self.messages_flush_interval)
+            try:
+                self.flush_messages()
+            except Exception as ex:
+                trace_exception(ex)
+
+    def flush_messages(self, finished:bool=False):
+        """
+        Writes all the buffered messages contents to the database.
+        Called by the writer thread, before any read, when a message is fully updated, when a generation ends
+        and when the database is closed.
+
+        Args:
+            finished (bool): True when the generations are over, the sizes at last write of the messages
+                that are not buffered anymore are dropped.
+        """
+        if self._pending_messages:
+            with self._flush_lock:
+                with self._pending_lock:
+                    pending = [(message, len(message.content)) for message in self._pending_messages.values()]
+                    self._pending_messages.clear()
+                if len(pending)>0:
+                    with self.transaction():
+                        for message, _ in pending:
+                            self.write_message_content(message)
+                    with self._pending_lock:
+                        for message, size in pending:
+                            self._written_sizes[message.id] = size
+        if finished:
+            with self._pending_lock:
+                for message_id in [message_id for message_id in self._written_sizes if message_id not in self._pending_messages]:
+                    del self._written_sizes[message_id]
+
+    def forget_message(self, message_id:int):
+        """Flushes the buffered messages and drops the size at last write of a message that is finished"""
+        self.flush_messages()
+        with self._pending_lock:
+            self._written_sizes.pop(message_id, None)
+
+    def write_message_content(self, message:'Message'):
+        """Writes the content and generation information of a message to the database"""
+        self.update(
+            "UPDATE message SET content = ?, started_generating_at = COALESCE(?, started_generating_at), nb_tokens = COALESCE(?, nb_tokens), finished_generating_at = ? WHERE id = ?",
+            (message.content, message.started_generating_at, message.nb_tokens, message.finished_generating_at, message.id)
+        )
+
+    # -------------------------------------- Connections
+    def get_connection(self)->sqlite3.Connection:
+        """
+        Returns the connection of the calling thread, opening it on first use.
+        Connections use WAL journaling so that readers don't block the writer.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.discussion_db_file_path, timeout=30, check_same_thread=False, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.transaction_depth = 0
+            with self._connections_lock:
+                # Close the connections of threads that are gone
+                alive = {t.ident for t in threading.enumerate()}
+                for ident in [ident for ident in self._connections if ident not in alive]:
+                    try:
+                        self._connections.pop(ident).close()
+                    except Exception as ex:
+                        trace_exception(ex)
+                # A thread id can be reused by a new thread, the connection of the previous one is closed
+                previous = self._connections.get(threading.get_ident())
+                if previous is not None and previous is not conn:
+                    try:
+                        previous.close()
+                    except Exception as ex:
+                        trace_exception(ex)
+                self._connections[threading.get_ident()] = conn
+        return conn
+
+    def _commit(self, conn:sqlite3.Connection):
+        """Commits unless the calling thread is inside a transaction block"""
+        if self._local.transaction_depth==0:
+            conn.commit()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups all the statements executed by the calling thread in a single transaction.
+        The transaction is committed when the outermost block exits and rolled back if it raises.
+
+        Example:
+            with discussions_db.transaction():
+                for message in messages:
+                    message.update_content(message.content)
+        """
+        conn = self.get_connection()
+        self._local.transaction_depth += 1
+        try:
+            yield conn
+        except Exception:
+            self._local.transaction_depth -= 1
+            if self._local.transaction_depth==0:
+                conn.rollback()
+            raise
+        else:
+            self._local.transaction_depth -= 1
+            if self._local.transaction_depth==0:
+                conn.commit()
+
+    def executemany(self, query, params_list):
+        """
+        Execute the specified SQL query once per parameters tuple of params_list.
+        """
+        conn = self.get_connection()
+        conn.executemany(query, params_list)
+        self._commit(conn)
+
+    def close(self):
+        """
+        Closes the connection of the calling thread and those of the threads that are gone.
+        The connections other threads may still be using are only forgotten: sqlite closes them once they are released.
+        """
+        self.flush_messages(finished=True)
+        # Stops the writer thread, a new one is started if messages are buffered again
+        with self._pending_condition:
+            self._writer_thread = None
+            self._pending_condition.notify_all()
+        alive = {t.ident for t in threading.enumerate()}
+        with self._connections_lock:
+            for ident, conn in self._connections.items():
+                if ident==threading.get_ident() or ident not in alive:
+                    try:
+                        conn.close()
+                    except Exception as ex:
+                        trace_exception(ex)
+            self._connections.clear()
+        self._local = threading.local()
+
+    # Statements to apply when upgrading the database to each schema version
+    migrations = {
+        15: [
+            "CREATE INDEX IF NOT EXISTS idx_message_discussion_id ON message(discussion_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_message_parent_message_id ON message(parent_message_id)",
+        ],
+        16: [
+            create_messages_fts_index,
+        ],
+    }
+
     def create_tables(self):
-        db_version = 14
-        with sqlite3.connect(self.discussion_db_file_path) as conn:
+        db_version = max(DiscussionsDB.migrations.keys())
+        with self.transaction() as conn:
             cursor = conn.cursor()
 
             cursor.execute("""
@@ -83,18 +328,97 @@ class DiscussionsDB:
                 )
             """)
 
-            cursor.execute("SELECT * FROM schema_version")
+            cursor.execute("SELECT version FROM schema_version")
             row = cursor.fetchone()
+            current_version = row[0] if row is not None else 0
+
+            if current_version<db_version:
+                # Migrations may rely on columns that older databases don't have yet
+                self.add_missing_columns()
+                self.migrate(current_version)
 
             if row is None:
                 cursor.execute("INSERT INTO schema_version (version) VALUES (?)", (db_version,))
             else:
                 cursor.execute("UPDATE schema_version SET version = ?", (db_version,))            
 
-            conn.commit()
+        self.backfill_messages_fts()
+        try:
+            self.check_query_plans()
+        except Exception as ex:
+            trace_exception(ex)
+
+    def backfill_messages_fts(self, batch_size:int=None):
+        """
+        Indexes the messages that existed when the search index was created, one transaction per batch so that
+        the database is not locked for the whole indexing. An interrupted indexing resumes where it stopped.
+        """
+        batch_size = batch_size or MESSAGES_FTS_BACKFILL_BATCH_SIZE
+        if self.select("SELECT 1 FROM sqlite_master WHERE type='table' AND name='message_fts_backfill'", fetch_all=False) is None:
+            return
+        nb_messages = self.select("SELECT COUNT(*) FROM message WHERE id <= (SELECT end_id FROM message_fts_backfill)", fetch_all=False)[0]
+        nb_indexed = self.select("SELECT COUNT(*) FROM message WHERE id <= (SELECT last_id FROM message_fts_backfill)", fetch_all=False)[0]
+        while True:
+            with self.transaction() as conn:
+                last_id, end_id = conn.execute("SELECT last_id, end_id FROM message_fts_backfill").fetchone()
+                row = conn.execute(
+                    "SELECT MAX(id), COUNT(*) FROM (SELECT id FROM message WHERE id > ? AND id <= ? ORDER BY id LIMIT ?)",
+                    (last_id, end_id, batch_size)
+                ).fetchone()
+                if row[1]==0:
+                    conn.execute("DROP TABLE message_fts_backfill")
+                    return
+                conn.execute("INSERT INTO message_fts(rowid, content) SELECT id, content FROM message WHERE id > ? AND id <= ?", (last_id, row[0]))
+                conn.execute("UPDATE message_fts_backfill SET last_id = ?", (row[0],))
+            nb_indexed += row[1]
+            ASCIIColors.info(f"Indexed {nb_indexed}/{nb_messages} messages")
+
+    def migrate(self, current_version:int):
+        """
+        Applies the migrations of all the schema versions newer than current_version.
+
+        Args:
+            current_version (int): The schema version the database is currently at.
+        """
+        with self.transaction() as conn:
+            for version in sorted(DiscussionsDB.migrations.keys()):
+                if version>current_version:
+                    ASCIIColors.yellow(f"Upgrading discussions database to version {version}")
+                    for statement in DiscussionsDB.migrations[version]:
+                        if callable(statement):
+                            statement(conn)
+                        else:
+                            conn.execute(statement)
+
+    def check_query_plans(self):
+        """
+        Runs EXPLAIN QUERY PLAN on the message lookups used to open and manage discussions
+        and reports those that still need a full table scan.
+
+        Returns:
+            list: The (query, plan detail) pairs that scan the whole message table.
+        """
+        queries = [
+            ("SELECT * FROM message WHERE discussion_id=? ORDER BY id", (0,)),
+            ("SELECT id FROM message WHERE discussion_id=? ORDER BY id DESC LIMIT 1", (0,)),
+            ("SELECT * FROM message WHERE parent_message_id=?", (0,)),
+            ("DELETE FROM message WHERE discussion_id=?", (0,)),
+            ("SELECT * FROM message WHERE id=?", (0,)),
+        ]
+        full_scans = []
+        conn = self.get_connection()
+        for query, params in queries:
+            for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall():
+                detail = row[-1]
+                if detail.startswith("SCAN") and "INDEX" not in detail:
+                    full_scans.append((query, detail))
+        for query, detail in full_scans:
+            ASCIIColors.warning(f"Discussions database full scan ({detail}): {query}")
+        return full_scans
+
 
     def add_missing_columns(self):
-        with sqlite3.connect(self.discussion_db_file_path) as conn:
+        with self.transaction() as conn:
             cursor = conn.cursor()
 
             table_columns = {
@@ -149,7 +473,6 @@ class DiscussionsDB:
                         else:
                             cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT")
                         ASCIIColors.yellow(f"Added column :{column}")
-            conn.commit()
 
 
     def select(self, query, params=None, fetch_all=True):
@@ -158,16 +481,36 @@ class DiscussionsDB:
         with optional parameters.
         Returns the cursor object for further processing.
         """
-        with sqlite3.connect(self.discussion_db_file_path) as conn:
-            if params is None:
-                cursor = conn.execute(query)
-            else:
-                cursor = conn.execute(query, params)
-            if fetch_all:
-                return cursor.fetchall()
-            else:
-                return cursor.fetchone()
-            
+        if self._pending_messages:
+            self.flush_messages()
+        conn = self.get_connection()
+        if params is None:
+            cursor = conn.execute(query)
+        else:
+            cursor = conn.execute(query, params)
+        if fetch_all:
+            return cursor.fetchall()
+        else:
+            return cursor.fetchone()
+
+    def select_messages(self, where:str, params=(), heavy_fields:bool=True)->list:
+        """
+        Selects messages, built directly from the rows by the sqlite row factory.
+
+        Args:
+            where (str): The end of the query after FROM message (conditions, order, limit).
+            params (tuple): The query parameters.
+            heavy_fields (bool): Reads the metadata, steps and ui of the messages, else they are read on first access.
+
+        Returns:
+            list: The messages.
+        """
+        if self._pending_messages:
+            self.flush_messages()
+        columns = Message.get_fields() if heavy_fields else Message.get_light_fields()
+        cursor = self.get_connection().cursor()
+        cursor.row_factory = Message.row_factory(self, heavy_fields)
+        return cursor.execute(f"SELECT {','.join(columns)} FROM message {where}", params).fetchall()
 
     def delete(self, query, params=None):
         """
@@ -175,13 +518,13 @@ class DiscussionsDB:
         with optional parameters.
         Returns the cursor object for further processing.
         """
-        with sqlite3.connect(self.discussion_db_file_path) as conn:
-            cursor = conn.cursor()
-            if params is None:
-                cursor.execute(query)
-            else:
-                cursor.execute(query, params)
-            conn.commit()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        if params is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(query, params)
+        self._commit(conn)
    
     def insert(self, query, params=None):
         """
@@ -189,12 +532,10 @@ class DiscussionsDB:
         with optional parameters.
         Returns the ID of the newly inserted row.
         """
-        
-        with sqlite3.connect(self.discussion_db_file_path) as conn:
-            cursor = conn.execute(query, params)
-            rowid = cursor.lastrowid
-            conn.commit()
-        self.conn = None
+        conn = self.get_connection()
+        cursor = conn.execute(query, params)
+        rowid = cursor.lastrowid
+        self._commit(conn)
         return rowid
 
     def update(self, query, params:tuple=None):
@@ -203,10 +544,9 @@ class DiscussionsDB:
         with optional parameters.
         Returns the ID of the newly inserted row.
         """
-        
-        with sqlite3.connect(self.discussion_db_file_path) as conn:
-            conn.execute(query, params)
-            conn.commit()
+        conn = self.get_connection()
+        conn.execute(query, params)
+        self._commit(conn)
     
     def load_last_discussion(self):
         last_discussion_id = self.select("SELECT id FROM discussion ORDER BY id DESC LIMIT 1", fetch_all=False)
@@ -247,6 +587,57 @@ class DiscussionsDB:
         rows = self.select("SELECT * FROM discussion")         
         return [{"id": row[0], "title": row[1]} for row in rows]
 
+    @staticmethod
+    def fts_query(text:str)->str:
+        """Turns user text into an fts5 query matching the messages that contain all its words (the fts5 operators are not interpreted)."""
+        terms = ['"'+term.replace('"', '""')+'"' for term in text.split()]
+        return " ".join(terms)
+
+    def has_messages_fts_index(self)->bool:
+        return self.select("SELECT 1 FROM sqlite_master WHERE type='table' AND name='message_fts'", fetch_all=False) is not None
+
+    def search_messages(self, text:str, limit:int=20, offset:int=0, discussion_id:int=None, highlight:tuple=("**", "**"))->dict:
+        """
+        Searches the messages containing all the words of text, best matches first.
+
+        Args:
+            text (str): The searched words.
+            limit (int): Number of results per page.
+            offset (int): Number of results to skip (page*limit).
+            discussion_id (int, optional): Searches only the messages of this discussion.
+            highlight (tuple): Markers put around the matched words in the snippets.
+
+        Returns:
+            dict: The results (message id, discussion id and title, sender, creation date, snippet and score),
+                  and whether there are more results after this page.
+        """
+        query = DiscussionsDB.fts_query(text)
+        if query=="":
+            return {"results":[], "limit":limit, "offset":offset, "has_more":False}
+        discussion_filter = "" if discussion_id is None else " AND m.discussion_id = ?"
+        discussion_params = () if discussion_id is None else (discussion_id,)
+        if self.has_messages_fts_index():
+            rows = self.select(
+                "SELECT m.id, m.discussion_id, d.title, m.sender, m.created_at, snippet(message_fts, 0, ?, ?, '...', 24), bm25(message_fts) "
+                "FROM message_fts JOIN message m ON m.id = message_fts.rowid JOIN discussion d ON d.id = m.discussion_id "
+                f"WHERE message_fts MATCH ?{discussion_filter} ORDER BY bm25(message_fts) LIMIT ? OFFSET ?",
+                (highlight[0], highlight[1], query)+discussion_params+(limit+1, offset)
+            )
+        else:
+            # No fts5 support: scan the messages
+            words = text.split()
+            rows = self.select(
+                "SELECT m.id, m.discussion_id, d.title, m.sender, m.created_at, substr(m.content, 1, 200), 0 "
+                "FROM message m JOIN discussion d ON d.id = m.discussion_id "
+                f"WHERE {' AND '.join(['m.content LIKE ?']*len(words))}{discussion_filter} ORDER BY m.id DESC LIMIT ? OFFSET ?",
+                tuple(f"%{word}%" for word in words)+discussion_params+(limit+1, offset)
+            )
+        results = [
+            {"message_id":row[0], "discussion_id":row[1], "discussion_title":row[2], "sender":row[3], "created_at":row[4], "snippet":row[5], "score":-row[6]}
+            for row in rows[:limit]
+        ]
+        return {"results":results, "limit":limit, "offset":offset, "has_more":len(rows)>limit}
+
     def does_last_discussion_have_messages(self):
         last_discussion_id = self.select("SELECT id FROM discussion ORDER BY id DESC LIMIT 1", fetch_all=False)
         if last_discussion_id is None:
@@ -262,6 +653,117 @@ class DiscussionsDB:
         self.delete("DELETE FROM discussion")
 
 
+    # -------------------------------------- Export
+    # Message columns written by the exports
+    EXPORTED_MESSAGE_COLUMNS = ["id", "sender", "content", "message_type", "rank", "parent_message_id", "binding", "model", "personality", "created_at", "started_generating_at", "finished_generating_at", "nb_tokens"]
+    # Size of the pieces of text yielded by stream_export
+    EXPORT_CHUNK_SIZE = 65536
+
+    def iter_discussions_messages(self, discussions_ids:list=None):
+        """
+        Walks the discussions (all of them or only discussions_ids) and their messages with a single query,
+        ordered by discussion then message. The rows are read from the cursor one at a time.
+
+        Yields:
+            tuple: (discussion id, discussion title, message dict). The message is None for a discussion without messages.
+        """
+        columns = DiscussionsDB.EXPORTED_MESSAGE_COLUMNS
+        query = f"SELECT d.id, d.title, {', '.join('m.'+column for column in columns)} FROM discussion d LEFT JOIN message m ON m.discussion_id = d.id"
+        params = ()
+        if discussions_ids is not None:
+            params = tuple(discussions_ids)
+            if len(params)==0:
+                return
+            query += f" WHERE d.id IN ({','.join(['?'] * len(params))})"
+        query += " ORDER BY d.id, m.id"
+        if self._pending_messages:
+            self.flush_messages()
+        # A dedicated connection: the export may be consumed by several threads and outlive the request thread
+        conn = sqlite3.connect(self.discussion_db_file_path, timeout=30, check_same_thread=False)
+        try:
+            cursor = conn.execute(query, params)
+            cursor.arraysize = 256
+            while True:
+                rows = cursor.fetchmany()
+                if not rows:
+                    break
+                for row in rows:
+                    yield row[0], row[1], dict(zip(columns, row[2:])) if row[2] is not None else None
+        finally:
+            conn.close()
+
+    def iter_export(self, export_format:str="json", discussions_ids:list=None, title:str=""):
+        """
+        Exports discussions as pieces of text, without holding more than one message in memory.
+
+        Args:
+            export_format (str): json (a list of discussions with their messages, like export_to_json),
+                ndjson (a line per discussion followed by a line per message, each message giving its discussion_id)
+                or markdown.
+            discussions_ids (list, optional): The discussions to export, all of them if None.
+            title (str, optional): The title of the markdown document.
+        """
+        rows = self.iter_discussions_messages(discussions_ids)
+        current_id = None
+        if export_format=="json":
+            # The messages are encoded by batches, encoding them one by one is much slower
+            batch = []
+            first_message = True
+            def encode_batch():
+                text = ("" if first_message else ",")+json.dumps(batch)[1:-1]
+                batch.clear()
+                return text
+            yield "["
+            for discussion_id, discussion_title, message in rows:
+                if discussion_id!=current_id:
+                    if batch:
+                        yield encode_batch()
+                    yield ("]}," if current_id is not None else "")+json.dumps({"id":discussion_id, "title":discussion_title})[:-1]+', "messages": ['
+                    current_id = discussion_id
+                    first_message = True
+                if message is not None:
+                    batch.append(message)
+                    if len(batch)>=256:
+                        yield encode_batch()
+                        first_message = False
+            if batch:
+                yield encode_batch()
+            yield ("]}" if current_id is not None else "")+"]"
+        elif export_format=="ndjson":
+            for discussion_id, discussion_title, message in rows:
+                if discussion_id!=current_id:
+                    yield json.dumps({"type":"discussion", "id":discussion_id, "title":discussion_title})+"\n"
+                    current_id = discussion_id
+                if message is not None:
+                    yield json.dumps({"type":"message", "discussion_id":discussion_id, **message})+"\n"
+        elif export_format=="markdown":
+            if title!="":
+                yield f"# {title}\n"
+            for discussion_id, discussion_title, message in rows:
+                if discussion_id!=current_id:
+                    yield ("\n" if current_id is not None else "")+f"## {discussion_title}\n"
+                    current_id = discussion_id
+                if message is not None:
+                    yield f"### {message['sender']}:\n{message['content']}\n"
+            if current_id is not None:
+                yield "\n"
+        else:
+            raise ValueError(f"Unknown export format {export_format}")
+
+    def stream_export(self, export_format:str="json", discussions_ids:list=None, title:str=""):
+        """Same as iter_export, with the small pieces grouped in chunks of about EXPORT_CHUNK_SIZE characters."""
+        chunk = []
+        size = 0
+        for piece in self.iter_export(export_format, discussions_ids, title):
+            chunk.append(piece)
+            size += len(piece)
+            if size>=DiscussionsDB.EXPORT_CHUNK_SIZE:
+                yield "".join(chunk)
+                chunk = []
+                size = 0
+        if chunk:
+            yield "".join(chunk)
+
     def export_to_json(self):
         """
         Export all discussions and their messages from the database to a JSON format.
@@ -272,35 +774,8 @@ class DiscussionsDB:
                 Each message dictionary contains the sender, content, message type, rank,
                 parent message ID, binding, model, personality, created at, and finished
                 generating at fields.
-        """        
-        db_discussions = self.select("SELECT * FROM discussion")
-        discussions = []
-        for row in db_discussions:
-            discussion_id = row[0]
-            discussion_title = row[1]
-            discussion = {"id": discussion_id, "title":discussion_title, "messages": []}
-
-            rows = self.select(f"SELECT sender, content, message_type, rank, parent_message_id, binding, model, personality, created_at, started_generating_at, finished_generating_at, nb_tokens FROM message WHERE discussion_id=?",(discussion_id,))
-            for message_row in rows:
-                sender = message_row[0]
-                content = message_row[1]
-                content_type = message_row[2]
-                rank = message_row[3]
-                parent_message_id = message_row[4]
-                binding = message_row[5]
-                model = message_row[6]
-                personality = message_row[7]
-                created_at = message_row[8]
-                started_generating_at = message_row[9]
-                finished_generating_at = message_row[10]
-                nb_tokens =  message_row[11]
-
-                discussion["messages"].append(
-                    {"sender": sender, "content": content, "message_type": content_type, "rank": rank, "parent_message_id": parent_message_id, "binding": binding, "model":model, "personality":personality, "created_at":created_at, "started_generating_at":started_generating_at, "finished_generating_at":finished_generating_at, "nb_tokens":nb_tokens}
-                )
-            discussions.append(discussion)
-
-        return discussions
+        """
+        return self.export_discussions_to_json(None)
 
     def export_all_as_markdown_list_for_vectorization(self):
         """
@@ -310,24 +785,17 @@ class DiscussionsDB:
             list: A list of lists representing discussions and their messages in a Markdown format.
                 Each inner list contains the discussion title and a string representing all
                 messages in the discussion in a Markdown format.
-        """        
-        data = self.export_all_discussions_to_json()
-        # Initialize an empty result string
+        """
         discussions = []
-        # Iterate through discussions in the JSON data
-        for discussion in data:
-            # Extract the title
-            title = discussion['title']
-            messages = ""
-            # Iterate through messages in the discussion
-            for message in discussion['messages']:
-                sender = message['sender']
-                content = message['content']
-                # Append the sender and content in a Markdown format
-                messages += f'{sender}: {content}\n'
-            discussions.append([title, messages])
-        return discussions
-        
+        current_id = None
+        for discussion_id, discussion_title, message in self.iter_discussions_messages():
+            if discussion_id!=current_id:
+                discussions.append([discussion_title, []])
+                current_id = discussion_id
+            if message is not None:
+                discussions[-1][1].append(f"{message['sender']}: {message['content']}\n")
+        return [[title, "".join(messages)] for title, messages in discussions]
+
     def export_all_as_markdown(self):
         """
         Export all discussions and their messages from the database to a Markdown format.
@@ -336,166 +804,246 @@ class DiscussionsDB:
             str: A string representing all discussions and their messages in a Markdown format.
                 Each discussion is represented as a Markdown heading, and each message is
                 represented with the sender and content in a Markdown format.
-        """        
-        data = self.export_all_discussions_to_json()
-
-        # Initialize an empty result string
-        result = ''
-
-        # Iterate through discussions in the JSON data
-        for discussion in data:
-            # Extract the title
-            title = discussion['title']
-            # Append the title with '#' as Markdown heading
-            result += f'#{title}\n'
-
-            # Iterate through messages in the discussion
-            for message in discussion['messages']:
-                sender = message['sender']
-                content = message['content']
-                # Append the sender and content in a Markdown format
-                result += f'{sender}: {content}\n'
-
-        return result
+        """
+        result = []
+        current_id = None
+        for discussion_id, discussion_title, message in self.iter_discussions_messages():
+            if discussion_id!=current_id:
+                result.append(f"#{discussion_title}\n")
+                current_id = discussion_id
+            if message is not None:
+                result.append(f"{message['sender']}: {message['content']}\n")
+        return "".join(result)
 
     def export_all_discussions_to_json(self):
-        # Convert the list of discussion IDs to a tuple
-        db_discussions = self.select(
-            f"SELECT * FROM discussion"
-        )
-        discussions = []
-        for row in db_discussions:
-            discussion_id = row[0]
-            discussion_title = row[1]
-            discussion = {"id": discussion_id, "title":discussion_title, "messages": []}
-
-            rows = self.select(f"SELECT sender, content, message_type, rank, parent_message_id, binding, model, personality, created_at, started_generating_at, finished_generating_at, nb_tokens FROM message WHERE discussion_id=?",(discussion_id,))
-            for message_row in rows:
-                sender = message_row[0]
-                content = message_row[1]
-                content_type = message_row[2]
-                rank = message_row[3]
-                parent_message_id = message_row[4]
-                binding = message_row[5]
-                model = message_row[6]
-                personality = message_row[7]
-                created_at = message_row[8]
-                started_generating_at = message_row[9]
-                finished_generating_at = message_row[10]
-                nb_tokens = message_row[11]
-                discussion["messages"].append(
-                    {"sender": sender, "content": content, "message_type": content_type, "rank": rank, "parent_message_id": parent_message_id, "binding": binding, "model":model, "personality":personality, "created_at":created_at, "started_generating_at":started_generating_at, "finished_generating_at": finished_generating_at,"nb_tokens":nb_tokens}
-                )
-            discussions.append(discussion)
-        return discussions
+        return self.export_discussions_to_json(None)
 
     def export_discussions_to_json(self, discussions_ids:list):
-        # Convert the list of discussion IDs to a tuple
-        discussions_ids_tuple = tuple(discussions_ids)
-        txt = ','.join(['?'] * len(discussions_ids_tuple))
-        db_discussions = self.select(
-            f"SELECT * FROM discussion WHERE id IN ({txt})",
-            discussions_ids_tuple
-        )
         discussions = []
-        for row in db_discussions:
-            discussion_id = row[0]
-            discussion_title = row[1]
-            discussion = {"id": discussion_id, "title":discussion_title, "messages": []}
-            rows = self.select(f"SELECT sender, content, message_type, rank, parent_message_id, binding, model, personality, created_at, started_generating_at, finished_generating_at, nb_tokens FROM message WHERE discussion_id=?",(discussion_id,))
-            for message_row in rows:
-                sender = message_row[0]
-                content = message_row[1]
-                content_type = message_row[2]
-                rank = message_row[3]
-                parent_message_id = message_row[4]
-                binding = message_row[5]
-                model = message_row[6]
-                personality = message_row[7]
-                created_at = message_row[8]
-                started_generating_at = message_row[9]
-                finished_generating_at = message_row[9]
-                nb_tokens = message_row[9]
-                
-                discussion["messages"].append(
-                    {"sender": sender, "content": content, "message_type": content_type, "rank": rank, "parent_message_id": parent_message_id, "binding": binding, "model":model, "personality":personality, "created_at":created_at, "started_generating_at":started_generating_at, "finished_generating_at": finished_generating_at, "nb_tokens":nb_tokens}
-                )
-            discussions.append(discussion)
+        current_id = None
+        for discussion_id, discussion_title, message in self.iter_discussions_messages(discussions_ids):
+            if discussion_id!=current_id:
+                discussions.append({"id": discussion_id, "title":discussion_title, "messages": []})
+                current_id = discussion_id
+            if message is not None:
+                discussions[-1]["messages"].append(message)
         return discussions
     
-    def import_from_json(self, json_data):
-        discussions = []
-        data = json_data
-        for discussion_data in data:
-            discussion_id = discussion_data.id
-            discussion_title = discussion_data.title
-            messages_data = discussion_data.messages
-            discussion = {"id": discussion_id, "title": discussion_title, "messages": []}
-
-            # Insert discussion into the database
-            discussion_id = self.insert("INSERT INTO discussion (title) VALUES (?)", (discussion_title,))
-
-            for message_data in messages_data:
-                sender = message_data.get("sender")
-                content = message_data.get("content")
-                content_type = message_data.get("message_type",message_data.get("type"))
-                rank = message_data.get("rank")
-                parent_message_id = message_data.get("parent_message_id")
-                binding = message_data.get("binding","")
-                model = message_data.get("model","")
-                personality = message_data.get("personality","")
-                created_at = message_data.get("created_at",datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-
-                started_generating_at = message_data.get("started_generating_at",datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-                finished_generating_at = message_data.get("finished_generating_at",datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-                nb_tokens = message_data.get("nb_tokens",datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-                discussion["messages"].append(
-                    {"sender": sender, "content": content, "message_type": content_type, "rank": rank, "binding": binding, "model": model, "personality": personality, "created_at": created_at, "started_generating_at":started_generating_at, "finished_generating_at": finished_generating_at, "nb_tokens":nb_tokens}
-                )
+    # -------------------------------------- Import
+    # Number of rows inserted by each executemany of the bulk import
+    IMPORT_BATCH_SIZE = 1000
+    # Once an import inserted this many messages, the message indexes are dropped and rebuilt at the end
+    IMPORT_DEFER_INDEXES_THRESHOLD = 50000
+
+    @staticmethod
+    def _get_field(data, key, default=None):
+        """Reads a field of a dict or of an object (the pydantic models of the import endpoint)."""
+        if isinstance(data, dict):
+            return data.get(key, default)
+        return getattr(data, key, default)
 
-                # Insert message into the database
-                self.insert("INSERT INTO message (sender, content, message_type, rank, parent_message_id, binding, model, personality, created_at, started_generating_at, finished_generating_at, nb_tokens, discussion_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                            (sender, content, content_type, rank, parent_message_id, binding, model, personality, created_at, started_generating_at, finished_generating_at, nb_tokens, discussion_id))
+    @staticmethod
+    def _to_text(value):
+        """JSON columns may be given already encoded or as python objects."""
+        return value if value is None or isinstance(value, str) else json.dumps(value)
 
-            discussions.append(discussion)
+    @staticmethod
+    def iter_json_records(discussions):
+        """Flattens discussions with their messages (export_to_json format) into ("discussion"|"message", data) records."""
+        for discussion in discussions:
+            yield "discussion", discussion
+            for message in DiscussionsDB._get_field(discussion, "messages", None) or []:
+                yield "message", message
 
-        return discussions
+    @staticmethod
+    def iter_ndjson_records(lines):
+        """Parses the records of an ndjson export (see iter_export), line by line."""
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            record_type = record.pop("type", None)
+            if record_type not in ["discussion", "message"]:
+                raise ValueError(f"Unknown ndjson record type {record_type}")
+            yield record_type, record
+
+    def import_records(self, records, batch_size:int=None)->dict:
+        """
+        Imports discussions and messages in a single transaction: either everything is imported or nothing is.
+
+        The rows are inserted by batches with executemany. The new ids are allocated by the import, so the
+        parent_message_id of the imported messages are remapped to the new ids of their parents. Parents that are
+        not found among the imported messages of the same discussion are set to 0 (no parent).
+        When an import is large, the message indexes are dropped while inserting and rebuilt once at the end.
+
+        Args:
+            records: ("discussion", data) and ("message", data) records, the messages following their discussion.
+            batch_size (int, optional): Number of rows per executemany. Defaults to IMPORT_BATCH_SIZE.
+
+        Returns:
+            dict: The number of imported discussions and messages, the duration and the throughput.
+        """
+        batch_size = batch_size or DiscussionsDB.IMPORT_BATCH_SIZE
+        get = DiscussionsDB._get_field
+        to_text = DiscussionsDB._to_text
+        start = time.perf_counter()
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        nb_discussions = 0
+        nb_messages = 0
+        indexes_deferred = []
+        discussions_batch = []
+        messages_batch = []
+        # old message id -> new message id, for the messages of the current discussion (ids of exported discussions may overlap)
+        messages_ids:Dict[Any, int] = {}
+        discussion_id = None
+
+        if self._pending_messages:
+            self.flush_messages()
+        with self.transaction() as conn:
+            if not conn.in_transaction:
+                # Reserve the database now: the ids are allocated from its current content
+                conn.execute("BEGIN IMMEDIATE")
+            next_discussion_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM discussion").fetchone()[0]+1
+            next_message_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM message").fetchone()[0]+1
+            sequences = {row[0]:row[1] for row in conn.execute("SELECT name, seq FROM sqlite_sequence WHERE name IN ('discussion', 'message')")}
+            next_discussion_id = max(next_discussion_id, sequences.get("discussion", 0)+1)
+            next_message_id = max(next_message_id, sequences.get("message", 0)+1)
+            # The imported messages are added to the search index at once at the end, which is several times
+            # faster than indexing them one by one with the trigger
+            fts_trigger = conn.execute("SELECT sql FROM sqlite_master WHERE type='trigger' AND name='message_fts_insert'").fetchone()
+            if fts_trigger is not None:
+                conn.execute("DROP TRIGGER message_fts_insert")
+            first_message_id = next_message_id
+
+            def write_batches():
+                if discussions_batch:
+                    conn.executemany("INSERT INTO discussion (id, title, metadata) VALUES (?, ?, ?)", discussions_batch)
+                    discussions_batch.clear()
+                if messages_batch:
+                    conn.executemany(
+                        "INSERT INTO message (id, sender, content, message_type, sender_type, rank, parent_message_id, binding, model, personality, created_at, started_generating_at, finished_generating_at, nb_tokens, discussion_id, steps, metadata, ui) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        messages_batch
+                    )
+                    messages_batch.clear()
+
+            for record_type, data in records:
+                if record_type=="discussion":
+                    discussion_id = next_discussion_id
+                    next_discussion_id += 1
+                    messages_ids.clear()
+                    discussions_batch.append((discussion_id, get(data, "title", "untitled"), to_text(get(data, "metadata"))))
+                    nb_discussions += 1
+                else:
+                    if discussion_id is None:
+                        raise ValueError("The imported messages must follow their discussion")
+                    message_id = next_message_id
+                    next_message_id += 1
+                    old_id = get(data, "id")
+                    if old_id is not None:
+                        messages_ids[old_id] = message_id
+                    # A parent that is not part of the import (exports without message ids) would point to an
+                    # unrelated message of this database, the message becomes a root message
+                    parent_message_id = messages_ids.get(get(data, "parent_message_id"), 0)
+                    messages_batch.append((
+                        message_id,
+                        get(data, "sender", ""),
+                        get(data, "content", ""),
+                        get(data, "message_type", get(data, "type", 0)),
+                        get(data, "sender_type", 0),
+                        get(data, "rank", 0) or 0,
+                        parent_message_id,
+                        get(data, "binding", ""),
+                        get(data, "model", ""),
+                        get(data, "personality", ""),
+                        get(data, "created_at", now),
+                        get(data, "started_generating_at", now),
+                        get(data, "finished_generating_at", now),
+                        get(data, "nb_tokens"),
+                        discussion_id,
+                        to_text(get(data, "steps")),
+                        to_text(get(data, "metadata")),
+                        to_text(get(data, "ui")),
+                    ))
+                    nb_messages += 1
+                if len(discussions_batch)+len(messages_batch)>=batch_size:
+                    write_batches()
+                    if not indexes_deferred and nb_messages>=DiscussionsDB.IMPORT_DEFER_INDEXES_THRESHOLD:
+                        indexes_deferred = [
+                            (name, sql) for name, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name='message' AND sql IS NOT NULL").fetchall()
+                        ]
+                        for name, sql in indexes_deferred:
+                            conn.execute(f"DROP INDEX {name}")
+            write_batches()
+            for name, sql in indexes_deferred:
+                conn.execute(sql)
+            if fts_trigger is not None:
+                conn.execute("INSERT INTO message_fts(rowid, content) SELECT id, content FROM message WHERE id >= ?", (first_message_id,))
+                conn.execute(fts_trigger[0])
+
+        duration = time.perf_counter()-start
+        report = {
+            "discussions": nb_discussions,
+            "messages": nb_messages,
+            "seconds": duration,
+            "messages_per_second": nb_messages/duration if duration>0 else 0
+        }
+        ASCIIColors.success(f"Imported {nb_discussions} discussions and {nb_messages} messages in {duration:.2f}s ({report['messages_per_second']:.0f} messages/s)")
+        return report
+
+    def import_from_json(self, json_data)->dict:
+        """
+        Imports discussions in the export_to_json format (dicts or objects with id, title and messages).
+
+        Returns:
+            dict: The import report, see import_records.
+        """
+        return self.import_records(DiscussionsDB.iter_json_records(json_data))
+
+    def import_from_ndjson(self, lines)->dict:
+        """
+        Imports an ndjson export, reading it line by line (lines can be an opened file).
+
+        Returns:
+            dict: The import report, see import_records.
+        """
+        return self.import_records(DiscussionsDB.iter_ndjson_records(lines))
 
     def export_discussions_to_markdown(self, discussions_ids:list, title = ""):
-        # Convert the list of discussion IDs to a tuple
-        discussions_ids_tuple = tuple(discussions_ids)
-        txt = ','.join(['?'] * len(discussions_ids_tuple))
-        db_discussions = self.select(
-            f"SELECT * FROM discussion WHERE id IN ({txt})",
-            discussions_ids_tuple
-        )
-        discussions = f"# {title}" if title!="" else ""
-        for row in db_discussions:
-            discussion_id = row[0]
-            discussion_title = row[1]
-            discussions += f"## {discussion_title}\n"
-
-            rows = self.select(f"SELECT sender, content, message_type, rank, parent_message_id, binding, model, personality, created_at, started_generating_at, finished_generating_at, nb_tokens FROM message WHERE discussion_id=?",(discussion_id,))
-            for message_row in rows:
-                sender = message_row[0]
-                content = message_row[1]
-                content_type = message_row[2]
-                rank = message_row[3]
-                parent_message_id = message_row[4]
-                binding = message_row[5]
-                model = message_row[6]
-                personality = message_row[7]
-                created_at = message_row[8]
-                started_generating_at = message_row[9]
-                finished_generating_at = message_row[10]
-                nb_tokens = message_row[11]
-
-                discussions +=f"### {sender}:\n{content}\n"
-            discussions +=f"\n"
-        return discussions
+        return "".join(self.iter_export("markdown", discussions_ids, title))
+
 
+# Value of the heavy fields of a message that were not read from the database yet
+NOT_LOADED = object()
 
 class Message:
+    # Columns that can be large (the ui of a message can hold a whole html page), read on first access
+    HEAVY_FIELDS = ["metadata", "steps", "ui"]
+
+    # No per instance __dict__: a discussion can hold thousands of messages
+    __slots__ = (
+        "id",
+        "message_id",
+        "discussion_id",
+        "discussions_db",
+        "message_type",
+        "sender_type",
+        "sender",
+        "content",
+        "_metadata",
+        "_steps",
+        "_ui",
+        "rank",
+        "parent_message_id",
+        "binding",
+        "model",
+        "personality",
+        "created_at",
+        "started_generating_at",
+        "finished_generating_at",
+        "nb_tokens",
+    )
+
     def __init__(
                     self,
                     discussion_id,
@@ -522,21 +1070,17 @@ class Message:
         
         self.discussion_id      = discussion_id
         self.discussions_db     = discussions_db
-        self.self               = self
         self.sender             = sender
         self.sender_type        = sender_type
         self.content            = content
-        try:
-            self.steps          = steps if type(steps)==list else json.loads(steps)
-        except:
-            self.steps          = []
+        self._steps             = Message.parse_steps(steps)
         self.message_type       = message_type
         self.rank               = rank
         self.parent_message_id  = parent_message_id
         self.binding            = binding
         self.model              = model
-        self.metadata           = json.dumps(metadata, indent=4) if metadata is not None and type(metadata)== dict else metadata
-        self.ui                 = ui
+        self._metadata          = json.dumps(metadata, indent=4) if metadata is not None and type(metadata)== dict else metadata
+        self._ui                = ui
         self.personality        = personality
         self.created_at         = created_at
         self.started_generating_at  = started_generating_at
@@ -550,7 +1094,111 @@ class Message:
             )
         else:
             self.id = id
+        self.message_id = self.id
+
+    @property
+    def self(self):
+        return self
+
+    @staticmethod
+    def parse_steps(steps):
+        if steps is NOT_LOADED or type(steps)==list:
+            return steps
+        if not steps or steps=="[]":
+            return []
+        try:
+            return json.loads(steps)
+        except:
+            return []
+
+    @property
+    def steps(self):
+        if self._steps is NOT_LOADED:
+            self.load_heavy_fields()
+        return self._steps
+
+    @steps.setter
+    def steps(self, value):
+        self._steps = value
+
+    @property
+    def metadata(self):
+        if self._metadata is NOT_LOADED:
+            self.load_heavy_fields()
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, value):
+        self._metadata = value
+
+    @property
+    def ui(self):
+        if self._ui is NOT_LOADED:
+            self.load_heavy_fields()
+        return self._ui
+
+    @ui.setter
+    def ui(self, value):
+        self._ui = value
+
+    @property
+    def heavy_fields_loaded(self)->bool:
+        return self._metadata is not NOT_LOADED and self._steps is not NOT_LOADED and self._ui is not NOT_LOADED
+
+    def set_heavy_fields(self, metadata, steps, ui):
+        """Sets the heavy fields read from the database, keeping the ones that were changed since the message was loaded."""
+        if self._metadata is NOT_LOADED:
+            self._metadata = metadata
+        if self._steps is NOT_LOADED:
+            self._steps = Message.parse_steps(steps)
+        if self._ui is NOT_LOADED:
+            self._ui = ui
+
+    def load_heavy_fields(self):
+        """Reads the metadata, steps and ui of a message that was loaded without them."""
+        row = self.discussions_db.select("SELECT metadata, steps, ui FROM message WHERE id=?", (self.id,), fetch_all=False) if self.id is not None else None
+        self.set_heavy_fields(*(row if row is not None else (None, [], None)))
 
+    @staticmethod
+    def get_light_fields():
+        return [field for field in Message.get_fields() if field not in Message.HEAVY_FIELDS]
+
+    @staticmethod
+    def row_factory(discussions_db, heavy_fields:bool=True):
+        """
+        Returns a sqlite row factory building the messages directly from the rows of the columns
+        Message.get_fields() (Message.get_light_fields() without heavy_fields), see DiscussionsDB.select_messages.
+        """
+        new_message = object.__new__
+        parse_steps = Message.parse_steps
+        if heavy_fields:
+            def build(cursor, row):
+                message = new_message(Message)
+                (
+                    message.id, message.message_type, message.sender_type, message.sender, message.content,
+                    message._metadata, steps, message._ui, message.rank, message.parent_message_id,
+                    message.binding, message.model, message.personality, message.created_at, message.started_generating_at,
+                    message.finished_generating_at, message.nb_tokens, message.discussion_id
+                ) = row
+                message._steps = parse_steps(steps)
+                message.discussions_db = discussions_db
+                message.message_id = message.id
+                return message
+        else:
+            def build(cursor, row):
+                message = new_message(Message)
+                (
+                    message.id, message.message_type, message.sender_type, message.sender, message.content,
+                    message.rank, message.parent_message_id,
+                    message.binding, message.model, message.personality, message.created_at, message.started_generating_at,
+                    message.finished_generating_at, message.nb_tokens, message.discussion_id
+                ) = row
+                # Read on first access
+                message._metadata = message._steps = message._ui = NOT_LOADED
+                message.discussions_db = discussions_db
+                message.message_id = message.id
+                return message
+        return build
 
     @staticmethod
     def get_fields():
@@ -577,18 +1225,7 @@ class Message:
 
     @staticmethod
     def from_db(discussions_db, message_id):
-        columns = Message.get_fields()
-        rows = discussions_db.select(
-            f"SELECT {','.join(columns)} FROM message WHERE id=?", (message_id,)
-        )
-        data_dict={
-            col:rows[0][i]
-            for i,col in enumerate(columns)
-        }
-        data_dict["discussions_db"]=discussions_db
-        return Message(
-            **data_dict
-        )
+        return discussions_db.select_messages("WHERE id=?", (message_id,))[0]
 
     @staticmethod
     def from_dict(discussions_db,data_dict):
@@ -610,7 +1247,9 @@ class Message:
         )
 
     def update(self, new_content, new_metadata=None, new_ui=None, started_generating_at=None, nb_tokens=None, commit=True):
+        self.discussions_db.forget_message(self.id)
         self.finished_generating_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.content = new_content
         text = f"UPDATE message SET content = ?"
         params = [new_content]
         if new_metadata is not None:
@@ -641,27 +1280,23 @@ class Message:
         )        
 
     def update_content(self, new_content, started_generating_at=None, nb_tokens=None, commit=True):
+        """Updates the content of the message.
+        The database write is buffered by the discussions database (see DiscussionsDB.buffer_message_content)
+        """
         self.finished_generating_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        text = f"UPDATE message SET content = ?"
-        params = [new_content]
+        self.content = new_content
 
         if started_generating_at is not None:
-            text+=", started_generating_at = ?"
-            params.append(started_generating_at)
             self.started_generating_at=started_generating_at
 
         if nb_tokens is not None:
-            text+=", nb_tokens = ?"
-            params.append(nb_tokens)
             self.nb_tokens=nb_tokens
 
+        self.discussions_db.buffer_message_content(self)
 
-        text +=", finished_generating_at = ? WHERE id = ?"
-        params.append(self.finished_generating_at)
-        params.append(self.id)
-        self.discussions_db.update(
-            text, tuple(params)
-        )  
+    def flush(self):
+        """Writes the buffered content of the message to the database"""
+        self.discussions_db.flush_messages()
 
     def update_steps(self, steps:list, step_type:str, status:bool):
         self.finished_generating_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -746,6 +1381,11 @@ class Message:
         return msgJson
 
 class Discussion:
+    # Number of messages read at once when the discussion is opened and when older messages are needed
+    MESSAGES_WINDOW = 50
+    # Number of messages whose heavy fields are read per query (sqlite limits the number of parameters)
+    HEAVY_FIELDS_BATCH_SIZE = 500
+
     def __init__(self, lollms:LoLLMsCom, discussion_id:int, discussions_db:DiscussionsDB):
         self.lollms = lollms
         self.current_message = None
@@ -765,7 +1405,14 @@ class Discussion:
         self.discussion_skills_folder.mkdir(exist_ok=True)
         self.discussion_rag_folder.mkdir(exist_ok=True)
         self.discussion_view_images_folder.mkdir(exist_ok=True)
-        self.messages = self.get_messages()
+        # message id -> (formatted text hash, tokenizer, tokens)
+        self.messages_tokens_cache:Dict[int, tuple] = {}
+        # The loaded messages: self.messages are the last messages of the discussion ordered by id, the older ones
+        # are read window by window when needed. messages_index holds every loaded message by id.
+        self.messages:List[Message] = []
+        self.messages_index:Dict[int, Message] = {}
+        self.all_messages_loaded = False
+        self.load_older_messages()
         
         if len(self.messages)>0:
             self.current_message = self.messages[-1]
@@ -774,19 +1421,9 @@ class Discussion:
         self.update_file_lists()
 
         if len(self.text_files)>0:
-            if self.lollms.config.rag_vectorizer=="semantic":
-                from lollmsvectordb.lollms_vectorizers.semantic_vectorizer import SemanticVectorizer
-                vectorizer = SemanticVectorizer(self.lollms.config.rag_vectorizer_model, self.lollms.config.rag_vectorizer_execute_remote_code)
-            elif self.lollms.config.rag_vectorizer=="tfidf":
-                from lollmsvectordb.lollms_vectorizers.tfidf_vectorizer import TFIDFVectorizer
-                vectorizer = TFIDFVectorizer()
-            elif self.lollms.config.rag_vectorizer=="openai":
-                from lollmsvectordb.lollms_vectorizers.openai_vectorizer import OpenAIVectorizer
-                vectorizer = OpenAIVectorizer(self.lollms.config.rag_vectorizer_model, self.lollms.config.rag_vectorizer_openai_key)
-            elif self.lollms.config.rag_vectorizer == "ollama":
-                from lollmsvectordb.lollms_vectorizers.ollama_vectorizer import OllamaVectorizer
-                vectorizer = OllamaVectorizer(self.lollms.config.rag_vectorizer_model, self.lollms.config.rag_service_url)
-
+            from lollmsvectordb.vector_database import VectorDatabase
+            from lollmsvectordb.text_document_loader import TextDocumentsLoader
+            vectorizer = vectorizers_registry.get_vectorizer(self.lollms.config)
             self.vectorizer = VectorDatabase(
                                         self.discussion_rag_folder/"db.sqli",
                                         vectorizer,
@@ -825,6 +1462,7 @@ class Discussion:
             if any(file_name == entry.name for entry in self.text_files):
                 fn = [entry for entry in self.text_files if entry.name == file_name][0]
                 self.text_files = [entry for entry in self.text_files if entry.name != file_name]
+                from lollmsvectordb.text_document_loader import TextDocumentsLoader
                 try:
                     text = TextDocumentsLoader.read_file(fn)
                     hash = self.vectorizer._hash_document(text)
@@ -859,6 +1497,7 @@ class Discussion:
 
     def remove_all_files(self):
         # Iterate over each directory and remove all files
+        from lollmsvectordb.text_document_loader import TextDocumentsLoader
         for path in [self.discussion_images_folder, self.discussion_rag_folder, self.discussion_audio_folder, self.discussion_text_folder]:
             
             for file in path.glob('*'):
@@ -941,6 +1580,8 @@ class Discussion:
             if callback is not None:
                 callback("Image file added successfully", MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_INFO)
         else:
+            from lollmsvectordb.vector_database import VectorDatabase
+            from lollmsvectordb.text_document_loader import TextDocumentsLoader
             try:
                 # self.ShowBlockingMessage("Adding file to vector store.\nPlease stand by")
                 self.text_files.append(path)
@@ -948,19 +1589,7 @@ class Discussion:
                 self.lollms.ShowBlockingMessage("Processing file\nPlease wait ...")
                 if process:
                     if self.vectorizer is None:
-                        if self.lollms.config.rag_vectorizer == "semantic":
-                            from lollmsvectordb.lollms_vectorizers.semantic_vectorizer import SemanticVectorizer
-                            v = SemanticVectorizer(self.lollms.config.rag_vectorizer_model, self.lollms.config.rag_vectorizer_execute_remote_code)
-                        elif self.lollms.config.rag_vectorizer == "tfidf":
-                            from lollmsvectordb.lollms_vectorizers.tfidf_vectorizer import TFIDFVectorizer
-                            v = TFIDFVectorizer()
-                        elif self.lollms.config.rag_vectorizer == "openai":
-                            from lollmsvectordb.lollms_vectorizers.openai_vectorizer import OpenAIVectorizer
-                            v = OpenAIVectorizer(self.lollms.config.rag_vectorizer_openai_key)
-                        elif self.lollms.config.rag_vectorizer == "ollama":
-                            from lollmsvectordb.lollms_vectorizers.ollama_vectorizer import OllamaVectorizer
-                            v = OllamaVectorizer(self.lollms.config.rag_vectorizer_model, self.lollms.config.rag_service_url)
-
+                        v = vectorizers_registry.get_vectorizer(self.lollms.config)
                         self.vectorizer = VectorDatabase(
                                     self.discussion_rag_folder/"db.sqli",
                                     v,
@@ -984,7 +1613,7 @@ class Discussion:
         Returns:
             list: List of entries in the format {"id":message id, "sender":sender name, "content":message content, "message_type":message type, "rank": message rank}
         """
-        self.current_message = Message.from_db(self.discussions_db, id)
+        self.current_message = self.messages_index.get(id) or Message.from_db(self.discussions_db, id)
         return self.current_message
     
     def add_message(
@@ -1050,6 +1679,7 @@ class Discussion:
         )
 
         self.messages.append(self.current_message)
+        self.messages_index[self.current_message.id] = self.current_message
         return self.current_message
 
     def rename(self, new_title):
@@ -1144,33 +1774,125 @@ class Discussion:
             f"DELETE FROM discussion WHERE id={self.discussion_id}"
         )
 
+    def load_older_messages(self, count:int=None)->List[Message]:
+        """
+        Loads the messages preceding the loaded ones (the last messages of the discussion if none is loaded yet).
+        The heavy fields (metadata, steps, ui) are read on first access.
+
+        Args:
+            count (int, optional): Number of messages to load, all the remaining ones if 0. Defaults to MESSAGES_WINDOW.
+
+        Returns:
+            List[Message]: The loaded messages ordered by id.
+        """
+        if self.all_messages_loaded:
+            return []
+        count = Discussion.MESSAGES_WINDOW if count is None else count
+        where = "WHERE discussion_id=?"
+        params = [self.discussion_id]
+        if len(self.messages)>0:
+            where += " AND id<?"
+            params.append(self.messages[0].id)
+        where += " ORDER BY id DESC"
+        if count>0:
+            where += " LIMIT ?"
+            params.append(count)
+        loaded = self.discussions_db.select_messages(where, tuple(params), heavy_fields=False)
+        if count<=0 or len(loaded)<count:
+            self.all_messages_loaded = True
+        loaded.reverse()
+        # Messages loaded on their own are reused
+        messages = [self.messages_index.setdefault(message.id, message) for message in loaded]
+        self.messages[:0] = messages
+        return messages
+
     def get_messages(self)->List[Message]:
         """Gets a list of messages information
+        All the messages are loaded with their heavy fields (read by batches), as the callers serialize them.
 
         Returns:
             list: List of entries in the format {"id":message id, "sender":sender name, "content":message content, "message_type":message type, "rank": message rank}
         """
-        columns = Message.get_fields()
-
-        rows = self.discussions_db.select(
-            f"SELECT {','.join(columns)} FROM message WHERE discussion_id=?", (self.discussion_id,)
-        )
-        msg_dict = [{ c:row[i] for i,c in enumerate(columns)} for row in rows]
-        self.messages=[]
-        for msg in msg_dict:
-            self.messages.append(Message.from_dict(self.discussions_db, msg))
+        self.load_older_messages(0)
+        self.load_heavy_fields(self.messages)
 
         if len(self.messages)>0:
             self.current_message = self.messages[-1]
 
         return self.messages
 
+    def get_last_message(self)->Message:
+        return self.messages[-1] if len(self.messages)>0 else None
+
+    def iter_messages_backward(self, from_message_id:int=None):
+        """
+        Yields the messages from from_message_id (included, the last message by default) back to the first message
+        of the discussion. Older windows of messages are loaded only when the iteration reaches them, so building
+        the context of a long discussion only reads the messages that fit in it.
+        """
+        if from_message_id is None:
+            position = len(self.messages)
+        else:
+            while not self.all_messages_loaded and (len(self.messages)==0 or from_message_id<self.messages[0].id):
+                self.load_older_messages()
+            position = bisect.bisect_right(self.messages, from_message_id, key=lambda message: message.id)
+        while True:
+            while position>0:
+                position -= 1
+                yield self.messages[position]
+            # The older messages are inserted before the ones already yielded
+            position = len(self.load_older_messages())
+            if position==0:
+                break
+
+    def get_messages_page(self, before_id:int=None, limit:int=50, heavy_fields:bool=True)->Tuple[List[Message], int]:
+        """
+        Gets a page of messages for the ui, starting from the end of the discussion.
+
+        Args:
+            before_id (int, optional): Cursor returned with the previous page, None for the last messages.
+            limit (int): Number of messages per page.
+            heavy_fields (bool): Reads the metadata, steps and ui of the messages of the page (in a single query).
+
+        Returns:
+            Tuple[List[Message], int]: The messages ordered by id and the cursor of the previous page (None if this is the first one).
+        """
+        end = len(self.messages) if before_id is None else bisect.bisect_left(self.messages, before_id, key=lambda message: message.id)
+        while end<=limit and not self.all_messages_loaded:
+            end += len(self.load_older_messages(max(Discussion.MESSAGES_WINDOW, limit+1-end)))
+        page = self.messages[max(0, end-limit):end]
+        if heavy_fields:
+            self.load_heavy_fields(page)
+        next_cursor = page[0].id if end>limit else None
+        return page, next_cursor
+
+    def load_heavy_fields(self, messages:List[Message]):
+        """Reads the heavy fields of the messages that were loaded without them, one query per HEAVY_FIELDS_BATCH_SIZE messages."""
+        messages_index = {message.id:message for message in messages if not message.heavy_fields_loaded}
+        ids = list(messages_index.keys())
+        for start in range(0, len(ids), Discussion.HEAVY_FIELDS_BATCH_SIZE):
+            batch = ids[start:start+Discussion.HEAVY_FIELDS_BATCH_SIZE]
+            rows = self.discussions_db.select(f"SELECT id, metadata, steps, ui FROM message WHERE id IN ({','.join('?'*len(batch))})", tuple(batch))
+            for row in rows:
+                messages_index[row[0]].set_heavy_fields(row[1], row[2], row[3])
+
+    def find_message(self, message_id)->Message:
+        """Gets a message of the discussion by id, reading it from the database if it is not loaded. Returns None if it doesn't exist."""
+        message_id = int(message_id)
+        message = self.messages_index.get(message_id)
+        if message is None:
+            messages = self.discussions_db.select_messages("WHERE id=? AND discussion_id=?", (message_id, self.discussion_id), heavy_fields=False)
+            if len(messages)==0:
+                return None
+            message = messages[0]
+            self.messages_index[message_id] = message
+        return message
+
     def get_message(self, message_id):
-        for message in self.messages:
-            if message.id == int(message_id):
-                self.current_message = message
-                return message
-        return None
+        message = self.find_message(message_id)
+        if message is not None:
+            self.current_message = message
+        return message
 
     def select_message(self, message_id):
         msg = self.get_message(message_id)
@@ -1188,6 +1910,7 @@ class Discussion:
             new_content (str): The nex message content
         """
         self.current_message.update(new_content, new_metadata, new_ui, started_generating_at, nb_tokens)
+        self.invalidate_message_tokens(self.current_message.id)
 
     def update_message_content(self, new_content, started_generating_at=None, nb_tokens=None):
         """Updates the content of a message
@@ -1197,6 +1920,7 @@ class Discussion:
             new_content (str): The nex message content
         """
         self.current_message.update_content(new_content, started_generating_at, nb_tokens)
+        self.invalidate_message_tokens(self.current_message.id)
 
     def update_message_steps(self, steps):
         """Updates the content of a message
@@ -1237,6 +1961,7 @@ class Discussion:
         msg = self.get_message(message_id)
         if msg:
             msg.update(new_content, new_metadata, new_ui)
+            self.invalidate_message_tokens(msg.id)
             return True
         else:
             return False
@@ -1256,6 +1981,7 @@ class Discussion:
         self.discussions_db.update(
             f"UPDATE message SET rank = ? WHERE id = ?",(new_rank,message_id)
         )
+        self.set_loaded_message_rank(message_id, new_rank)
         return new_rank
 
     def message_rank_down(self, message_id):
@@ -1272,7 +1998,13 @@ class Discussion:
         self.discussions_db.update(
             f"UPDATE message SET rank = ? WHERE id = ?",(new_rank,message_id)
         )
+        self.set_loaded_message_rank(message_id, new_rank)
         return new_rank
+
+    def set_loaded_message_rank(self, message_id, rank):
+        message = self.messages_index.get(int(message_id))
+        if message is not None:
+            message.rank = rank
     
     def delete_message(self, message_id):
         """Delete the message
@@ -1282,6 +2014,46 @@ class Discussion:
         """
         # Retrieve current rank value for message_id
         self.discussions_db.delete("DELETE FROM message WHERE id=?", (message_id,))
+        self.invalidate_message_tokens(message_id)
+        message = self.messages_index.pop(int(message_id), None)
+        if message is not None:
+            self.messages = [m for m in self.messages if m is not message]
+            if self.current_message is message:
+                self.current_message = self.get_last_message()
+
+    def get_message_tokens(self, message:Message, formatted_message:str, model)->list:
+        """Returns the tokens of a header formatted message.
+        The tokens are cached per message id and only recomputed when the formatted text or the model changes.
+
+        Args:
+            message (Message): The message being formatted
+            formatted_message (str): The message text including its header
+            model (LLMBinding): The model used to tokenize the text
+
+        Returns:
+            list: The tokens of the formatted message
+        """
+        text_hash = hashlib.md5(formatted_message.encode("utf-8", errors="ignore")).hexdigest()
+        entry = self.messages_tokens_cache.get(message.id)
+        if entry is not None and entry[0]==text_hash and entry[1] is model:
+            return entry[2]
+        tokens = model.tokenize(formatted_message)
+        self.messages_tokens_cache[message.id] = (text_hash, model, tokens)
+        return tokens
+
+    def invalidate_message_tokens(self, message_id=None):
+        """Removes a message from the tokens cache
+
+        Args:
+            message_id (int, optional): The id of the message to forget. If None, the whole cache is cleared.
+        """
+        if message_id is None:
+            self.messages_tokens_cache.clear()
+        else:
+            try:
+                self.messages_tokens_cache.pop(int(message_id), None)
+            except (TypeError, ValueError):
+                pass
 
     def export_for_vectorization(self):
         """
@@ -1294,20 +2066,17 @@ class Discussion:
         """        
         # Extract the title
         title = self.title()
-        messages = ""
-        # Iterate through messages in the discussion
-        for message in self.messages:
-            sender = message.sender
-            content = message.content
-            # Append the sender and content in a Markdown format
-            messages += f'{sender}: {content}\n'
+        # Iterate through messages in the discussion, without loading them
+        rows = self.discussions_db.select("SELECT sender, content FROM message WHERE discussion_id=? ORDER BY id", (self.discussion_id,))
+        # Append the sender and content in a Markdown format
+        messages = "".join(f'{sender}: {content}\n' for sender, content in rows)
         return title, messages
  
     def format_discussion(self, max_allowed_tokens, splitter_text=None):
         if not splitter_text:
             splitter_text = self.lollms.config.discussion_prompt_separator
         formatted_text = ""
-        for message in reversed(self.messages):  # Start from the newest message
+        for message in self.iter_messages_backward():  # Start from the newest message
             formatted_message = f"{splitter_text}{message.sender.replace(':','').replace(splitter_text,'')}:\n{message.content}\n"
             tokenized_message = self.lollms.model.tokenize(formatted_message)
             if len(tokenized_message) + len(self.lollms.model.tokenize(formatted_text)) <= max_allowed_tokens:
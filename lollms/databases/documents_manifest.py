@@ -0,0 +1,142 @@
+"""
+project: lollms
+file: documents_manifest.py
+author: ParisNeo
+description:
+    Manifest of the files indexed in a vector database. For each file it stores its size, modification time and
+    content hash along with the hash of the document it produced in the database, so that a folder can be
+    indexed again by reading only the files that were added or changed and removing the deleted ones.
+
+"""
+from ascii_colors import ASCIIColors
+from pathlib import Path
+from typing import Dict, List, Tuple
+import hashlib
+import json
+import os
+
+
+def file_hash(path:Path, block_size:int=1024*1024)->str:
+    """sha256 of the content of a file."""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def document_hash(text:str)->str:
+    """Hash given by lollmsvectordb to a document (sha256 of its text), used to remove it from the database."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class DocumentsManifest:
+    """
+    Files indexed in a vector database.
+
+    The signature describes how the database was built (vectorizer, chunking...). When it differs from the one
+    stored in the manifest, the database content can't be reused: reset_required is set and every file is
+    considered new.
+    """
+    VERSION = 1
+
+    def __init__(self, manifest_path:Path, signature=None) -> None:
+        self.manifest_path = Path(manifest_path)
+        self.signature = json.loads(json.dumps(signature)) if signature is not None else None
+        self.entries:Dict[str, dict] = {}
+        self.reset_required = False
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        if not self.manifest_path.exists():
+            return
+        try:
+            with open(self.manifest_path, "r", encoding="utf8") as f:
+                data = json.load(f)
+            if data.get("version")!=DocumentsManifest.VERSION or data.get("signature")!=self.signature:
+                ASCIIColors.warning(f"The database of {self.manifest_path.parent} was built with other settings, it will be rebuilt")
+                self.reset_required = True
+                self.dirty = True
+                return
+            self.entries = data.get("entries", {})
+        except Exception as ex:
+            ASCIIColors.warning(f"Couldn't load the documents manifest {self.manifest_path}, the documents will be indexed again ({ex})")
+            self.reset_required = True
+            self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            tmp_path = self.manifest_path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf8") as f:
+                json.dump({"version":DocumentsManifest.VERSION, "signature":self.signature, "entries":self.entries}, f)
+            os.replace(tmp_path, self.manifest_path)
+            self.dirty = False
+        except Exception as ex:
+            ASCIIColors.warning(f"Couldn't save the documents manifest {self.manifest_path} ({ex})")
+
+    def clear(self):
+        """Forgets all the files, for example when the database was deleted."""
+        if len(self.entries)>0:
+            self.entries = {}
+            self.dirty = True
+
+    def scan(self, files:List[Path])->Tuple[List[Path], List[str]]:
+        """
+        Compares the files with the manifest. The content is hashed only for the files whose size or
+        modification time changed, a file that was only touched is not indexed again.
+
+        Returns:
+            Tuple[List[Path], List[str]]: the new or changed files and the keys of the files that disappeared.
+        """
+        changed = []
+        seen = set()
+        for path in files:
+            key = str(path)
+            seen.add(key)
+            entry = self.entries.get(key)
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            if entry is not None and entry["size"]==st.st_size and entry["mtime"]==st.st_mtime_ns:
+                continue
+            if entry is not None and entry["size"]==st.st_size and entry["hash"]==file_hash(path):
+                entry["mtime"] = st.st_mtime_ns
+                self.dirty = True
+                continue
+            changed.append(path)
+        removed = [key for key in self.entries if key not in seen]
+        return changed, removed
+
+    def update(self, path:Path, doc_hash:str, content_hash:str=None):
+        """Records that path is indexed as the document doc_hash."""
+        st = path.stat()
+        self.entries[str(path)] = {
+            "size":st.st_size,
+            "mtime":st.st_mtime_ns,
+            "hash":content_hash or file_hash(path),
+            "doc_hash":doc_hash
+        }
+        self.dirty = True
+
+    def remove(self, key:str)->str:
+        """
+        Forgets a file.
+
+        Returns:
+            str: the hash of its document if no other file produced the same document, else None.
+        """
+        entry = self.entries.pop(str(key), None)
+        self.dirty = True
+        if entry is None:
+            return None
+        doc_hash = entry.get("doc_hash")
+        if any(e.get("doc_hash")==doc_hash for e in self.entries.values()):
+            return None
+        return doc_hash
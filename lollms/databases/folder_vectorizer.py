@@ -0,0 +1,275 @@
+"""
+project: lollms
+file: folder_vectorizer.py
+author: ParisNeo
+description:
+    Pipeline that indexes a folder into a vector database:
+        - discovery: lists the supported files and compares them with the manifest of the database
+        - parsing: the new or changed files are read in a pool of processes
+        - embedding: the documents are chunked and their chunks vectorized by batches in a pool of threads
+        - writing: a single writer commits each document and its chunks to the database. It inserts the
+          precomputed vectors directly, which is only done on a database of the schema version checked by
+          supports_direct_write, otherwise the documents are added through VectorDatabase.add_document
+    The manifest is saved regularly while the documents are written, an interrupted run restarts from the
+    documents that were not committed yet.
+
+"""
+from ascii_colors import ASCIIColors, trace_exception
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from pathlib import Path
+from typing import Callable, List
+import multiprocessing
+import numpy as np
+import sqlite3
+import time
+import os
+
+from lollms.databases.documents_manifest import DocumentsManifest, document_hash, file_hash
+
+# lollmsvectordb schema the writer inserts into
+SUPPORTED_SCHEMA_VERSION = 4
+DOCUMENTS_COLUMNS = {"id", "hash", "title", "path", "category_id", "subcategory_id"}
+CHUNKS_COLUMNS = {"id", "document_id", "vector", "text", "nb_tokens", "chunk_id"}
+
+
+def read_document(path:Path):
+    """Reads a file and hashes its content. Runs in the parsing processes."""
+    from lollmsvectordb.text_document_loader import TextDocumentsLoader
+    try:
+        return TextDocumentsLoader.read_file(path), file_hash(path), None
+    except Exception as ex:
+        return None, None, str(ex)
+
+
+def supports_direct_write(vdb)->bool:
+    """
+    Checks that the database and the installed lollmsvectordb use the schema the writer inserts into.
+    The documents and chunks tables are private to lollmsvectordb, a new version may change them.
+    """
+    from lollmsvectordb import vector_database
+    try:
+        if not vdb.db_path or getattr(vector_database, "__version__", None)!=SUPPORTED_SCHEMA_VERSION or vdb.get_version()!=SUPPORTED_SCHEMA_VERSION:
+            return False
+        with sqlite3.connect(vdb.db_path) as conn:
+            documents_columns = {row[1] for row in conn.execute("PRAGMA table_info(documents)")}
+            chunks_columns = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+        return documents_columns==DOCUMENTS_COLUMNS and chunks_columns==CHUNKS_COLUMNS
+    except Exception as ex:
+        trace_exception(ex)
+        return False
+
+
+class _ImmediateFuture:
+    def __init__(self, fn, *args) -> None:
+        self.value = fn(*args)
+
+    def result(self):
+        return self.value
+
+
+class FolderVectorizer:
+    """
+    Indexes the supported files of a folder into a vector database.
+
+    Usage:
+        FolderVectorizer(folder, vdb, manifest).run()
+
+    The progress callback receives a dictionary with the number of processed documents and chunks, the number
+    of documents to process and the throughput (docs_per_second, chunks_per_second).
+    """
+    def __init__(
+                    self,
+                    folder:Path,
+                    vdb,
+                    manifest:DocumentsManifest,
+                    follow_subfolders:bool=True,
+                    parse_workers:int=0,
+                    embed_workers:int=2,
+                    batch_size:int=32,
+                    checkpoint_interval:float=10,
+                    callback:Callable[[dict], None]=None,
+                    progress_interval:float=1
+                ) -> None:
+        self.folder = Path(folder)
+        self.vdb = vdb
+        self.manifest = manifest
+        self.follow_subfolders = follow_subfolders
+        self.parse_workers = parse_workers if parse_workers>0 else max(1, (os.cpu_count() or 2)-1)
+        self.embed_workers = max(1, embed_workers)
+        self.batch_size = max(1, batch_size)
+        self.checkpoint_interval = checkpoint_interval
+        self.callback = callback
+        self.progress_interval = progress_interval
+
+        self.nb_documents = 0
+        self.nb_chunks = 0
+        self.nb_failed = 0
+        self.nb_todo = 0
+        self.direct_write = True
+        self.start_time = None
+        self._last_progress = 0
+
+    # ----------------------------------- Discovery -----------------------------------
+    def discover(self)->List[Path]:
+        from lollmsvectordb.text_document_loader import TextDocumentsLoader
+        file_types = [f"**/*{f}" if self.follow_subfolders else f"*{f}" for f in TextDocumentsLoader.get_supported_file_types()]
+        files = set()
+        for file_type in file_types:
+            files.update(f for f in self.folder.glob(file_type) if f.is_file())
+        db_path = Path(self.vdb.db_path).resolve()
+        return sorted(f for f in files if f.resolve()!=db_path)
+
+    # ----------------------------------- Embedding -----------------------------------
+    def embed(self, path:Path, parsed):
+        """
+        Chunks and vectorizes a parsed document. Runs in the embedding threads.
+        Without direct writes, only the text is returned and the database chunks and vectorizes it when it is added.
+        """
+        from lollmsvectordb.database_elements.document import Document
+        text, content_hash, error = parsed.result()
+        if error is not None or text is None:
+            return path, None, None, None, None, error
+        doc_hash = document_hash(text)
+        doc = Document(doc_hash, path.stem, str(path))
+        if not self.direct_write:
+            return path, doc, text, None, None, content_hash
+        chunks = self.vdb.textChunker.get_text_chunks(text, doc, self.vdb.clean_chunks)
+        vectorizer = self.vdb.vectorizer
+        vectors = [None]*len(chunks)
+        if not vectorizer.requires_fitting or vectorizer.model is not None:
+            for i in range(0, len(chunks), self.batch_size):
+                batch = chunks[i:i+self.batch_size]
+                for j, vector in enumerate(vectorizer.vectorize([c.text for c in batch])):
+                    vectors[i+j] = np.array(vector).astype("float32").tobytes()
+        return path, doc, None, chunks, vectors, content_hash
+
+    # ----------------------------------- Writing -----------------------------------
+    def write(self, conn:sqlite3.Connection, path:Path, doc, text, chunks, vectors, content_hash):
+        if chunks is None:
+            self.vdb.add_document(doc.title, text, path)
+            self.manifest.update(path, doc.hash, content_hash)
+            self.nb_documents += 1
+            return
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM documents WHERE hash = ?", (doc.hash,))
+        if cursor.fetchone() is None:
+            cursor.execute(
+                "INSERT INTO documents (hash, title, path, category_id, subcategory_id) VALUES (?, ?, ?, ?, ?)",
+                (doc.hash, doc.title, str(path), 1, 1)
+            )
+            document_id = cursor.lastrowid
+            cursor.executemany(
+                "INSERT INTO chunks (document_id, vector, text, nb_tokens, chunk_id) VALUES (?, ?, ?, ?, ?)",
+                [(document_id, vector, chunk.text, chunk.nb_tokens, chunk.chunk_id) for chunk, vector in zip(chunks, vectors)]
+            )
+        conn.commit()
+        self.manifest.update(path, doc.hash, content_hash)
+        self.nb_documents += 1
+        self.nb_chunks += len(chunks)
+
+    # ----------------------------------- Progress -----------------------------------
+    def progress(self, force:bool=False)->dict:
+        elapsed = max(time.perf_counter()-self.start_time, 1e-6)
+        infos = {
+            "documents":self.nb_documents,
+            "chunks":self.nb_chunks,
+            "failed":self.nb_failed,
+            "total":self.nb_todo,
+            "docs_per_second":self.nb_documents/elapsed,
+            "chunks_per_second":self.nb_chunks/elapsed
+        }
+        now = time.perf_counter()
+        if self.callback is not None and (force or now-self._last_progress>=self.progress_interval):
+            self._last_progress = now
+            try:
+                self.callback(infos)
+            except Exception as ex:
+                trace_exception(ex)
+        return infos
+
+    # ----------------------------------- Pipeline -----------------------------------
+    def run(self)->dict:
+        """
+        Indexes the folder.
+
+        Returns:
+            dict: the final progress infos, with the number of removed documents and whether the index was rebuilt.
+        """
+        self.start_time = time.perf_counter()
+        files = self.discover()
+        changed, removed = self.manifest.scan(files)
+        self.nb_todo = len(changed)
+        ASCIIColors.info(f"Vectorizing {self.folder}: {len(files)} files, {len(changed)} new or changed, {len(removed)} removed")
+
+        for key in removed+[str(f) for f in changed]:
+            doc_hash = self.manifest.remove(key)
+            if doc_hash is not None:
+                self.vdb.remove_document(doc_hash)
+        self.manifest.save()
+
+        if len(changed)>0:
+            self.run_pipeline(changed)
+
+        rebuilt = len(changed)>0 or len(removed)>0
+        if rebuilt:
+            self.vdb.build_index()
+        self.manifest.save()
+        infos = self.progress(force=True)
+        infos["removed"] = len(removed)
+        infos["rebuilt"] = rebuilt
+        ASCIIColors.success(f"Vectorized {self.nb_documents} documents ({infos['docs_per_second']:.2f} docs/s, {infos['chunks_per_second']:.2f} chunks/s)")
+        return infos
+
+    def run_pipeline(self, files:List[Path]):
+        self.direct_write = supports_direct_write(self.vdb)
+        if not self.direct_write:
+            ASCIIColors.warning(f"The vector database doesn't have the supported schema (version {SUPPORTED_SCHEMA_VERSION}), the documents are added one by one by the database")
+        try:
+            # spawn: forking a server that runs threads and holds models is not safe
+            parsers = ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=multiprocessing.get_context("spawn")) if len(files)>1 and self.parse_workers>1 else None
+        except Exception as ex:
+            ASCIIColors.warning(f"Couldn't start the parsing processes, parsing in the embedding threads ({ex})")
+            parsers = None
+        embedders = ThreadPoolExecutor(max_workers=self.embed_workers)
+        # Bounded number of documents in flight so that memory doesn't grow with the folder size
+        max_in_flight = 2*(self.parse_workers+self.embed_workers)
+        pending = deque()
+        files_iter = iter(files)
+        last_checkpoint = time.perf_counter()
+        conn = sqlite3.connect(self.vdb.db_path)
+        try:
+            def fill():
+                for path in files_iter:
+                    parsed = parsers.submit(read_document, path) if parsers is not None else None
+                    if parsed is None:
+                        pending.append(embedders.submit(lambda p: self.embed(p, _ImmediateFuture(read_document, p)), path))
+                    else:
+                        pending.append(embedders.submit(self.embed, path, parsed))
+                    if len(pending)>=max_in_flight:
+                        return
+
+            fill()
+            while pending:
+                future = pending.popleft()
+                try:
+                    path, doc, text, chunks, vectors, extra = future.result()
+                    if doc is None:
+                        self.nb_failed += 1
+                        ASCIIColors.error(f"Failed to add document {path}: {extra}")
+                    else:
+                        self.write(conn, path, doc, text, chunks, vectors, extra)
+                except Exception as ex:
+                    self.nb_failed += 1
+                    trace_exception(ex)
+                fill()
+                self.progress()
+                if time.perf_counter()-last_checkpoint>=self.checkpoint_interval:
+                    self.manifest.save()
+                    last_checkpoint = time.perf_counter()
+        finally:
+            conn.close()
+            embedders.shutdown(wait=True, cancel_futures=True)
+            if parsers is not None:
+                parsers.shutdown(wait=True, cancel_futures=True)
+            self.manifest.save()
@@ -0,0 +1,277 @@
+"""
+project: lollms
+file: personalities_catalog.py
+author: ParisNeo
+description:
+    Persistent index of the personalities zoo. Reading every personality (config.yaml, README.md, languages and logos)
+    is slow on big zoos, so the extracted information is stored in a json file with a fingerprint of each personality
+    folder. Listings are served from that file: a category whose folder changed is listed again, and a personality is
+    read again only when its fingerprint (a few stat calls) changed.
+
+"""
+from ascii_colors import ASCIIColors, trace_exception
+from pathlib import Path
+from typing import Dict, List, Tuple
+import threading
+import json
+import yaml
+import os
+
+# Logo files by order of preference
+LOGO_EXTENSIONS = [".gif", ".webp", ".png", ".jpg", ".jpeg", ".svg", ".bmp"]
+
+
+def _stat_signature(path:Path):
+    try:
+        st = path.stat()
+        return [st.st_mtime_ns, st.st_size]
+    except OSError:
+        return None
+
+
+def personality_fingerprint(personality_folder:Path)->list:
+    """
+    Signature of the files the catalog reads from a personality folder.
+    A folder mtime changes when an entry is added or removed, files edited in place are covered by their own signature.
+    """
+    return [
+        _stat_signature(personality_folder),
+        _stat_signature(personality_folder / "config.yaml"),
+        _stat_signature(personality_folder / "README.md"),
+        _stat_signature(personality_folder / "languages"),
+        _stat_signature(personality_folder / "assets"),
+    ]
+
+
+def read_personality_infos(personality_folder:Path, category:str)->dict:
+    """
+    Reads the listing information of a personality from its folder.
+    The installed flag depends on the user configuration and is not part of these infos.
+    """
+    personality_info = {"folder":personality_folder.stem}
+    config_path = personality_folder / 'config.yaml'
+    scripts_path = personality_folder / 'scripts'
+    personality_info['has_scripts'] = scripts_path.exists()
+    with open(config_path, "r", encoding="utf8") as config_file:
+        config_data = yaml.load(config_file, Loader=yaml.FullLoader)
+        personality_info['name'] = config_data.get('name',"No Name")
+        personality_info['description'] = config_data.get('personality_description',"")
+        personality_info['disclaimer'] = config_data.get('disclaimer',"")
+        personality_info['author'] = config_data.get('author', 'ParisNeo')
+        personality_info['language'] = config_data.get('language', 'english')
+        personality_info['version'] = config_data.get('version', '1.0.0')
+        personality_info['creation_date'] = config_data.get("creation_date",None)
+        personality_info['last_update_date'] = config_data.get("last_update_date",None)
+        personality_info['help'] = config_data.get('help', '')
+        personality_info['commands'] = config_data.get('commands', '')
+        personality_info['prompts_list'] = config_data.get('prompts_list', [])
+
+    try:
+        help_path = personality_folder / 'README.md'
+        if help_path.exists():
+            personality_info['help']=help_path.read_text()
+    except:
+        pass
+
+    languages_path = personality_folder/ 'languages'
+    if languages_path.exists():
+        personality_info['languages']= [""]+[f.stem for f in languages_path.iterdir() if f.suffix==".yaml"]
+    else:
+        personality_info['languages']=None
+
+    avatar, has_logo = find_avatar(personality_folder/ 'assets', Path("personalities") / category / personality_folder.stem / 'assets')
+    personality_info['has_logo'] = has_logo
+    personality_info['avatar'] = avatar
+    return personality_info
+
+
+def find_avatar(real_assets_path:Path, assets_path:Path)->Tuple[str, bool]:
+    """
+    Finds the logo of a personality with a single listing of its assets folder.
+
+    Returns:
+        Tuple[str, bool]: the url of the avatar (empty if there is none) and whether there is a png or gif logo.
+    """
+    try:
+        logos = {f.suffix.lower():f.name for f in real_assets_path.iterdir() if f.stem=="logo"}
+    except OSError:
+        logos = {}
+    has_logo = ".png" in logos or ".gif" in logos
+    for ext in LOGO_EXTENSIONS:
+        if ext in logos:
+            return str(assets_path / logos[ext]).replace("\\","/"), has_logo
+    return "", has_logo
+
+
+class PersonalitiesCatalog:
+    """
+    Index of the personalities stored in a json file.
+    Listings are served from the index. A category is listed again only when its folder mtime changes (a personality
+    was added or removed), when the catalog is invalidated (mount, install...) or when a refresh is requested.
+    Each entry keeps the fingerprint of the personality folder it was read from and is read again when it changes,
+    which also catches the files edited in place (by a git pull of the zoo for example).
+    """
+    VERSION = 2
+
+    def __init__(self, index_path:Path) -> None:
+        self.index_path = Path(index_path)
+        self.lock = threading.Lock()
+        self.entries:Dict[str, dict] = {}
+        # mtime of each listed folder (the zoo and the category folders) when its content was last checked
+        self.folders:Dict[str, int] = {}
+        self.categories:List[str] = []
+        self.stale = True
+        self.installed_folder_mtime = None
+        self.installed:set = set()
+        self.load()
+
+    def load(self):
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf8") as f:
+                data = json.load(f)
+            if data.get("version")==PersonalitiesCatalog.VERSION:
+                self.entries = data.get("entries", {})
+                self.folders = data.get("folders", {})
+                self.categories = data.get("categories", [])
+                self.stale = False
+        except Exception as ex:
+            ASCIIColors.warning(f"Couldn't load the personalities catalog, it will be rebuilt ({ex})")
+            self.entries = {}
+            self.folders = {}
+            self.categories = []
+
+    def save(self):
+        try:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.index_path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf8") as f:
+                json.dump({"version":PersonalitiesCatalog.VERSION, "entries":self.entries, "folders":self.folders, "categories":self.categories}, f)
+            os.replace(tmp_path, self.index_path)
+        except Exception as ex:
+            ASCIIColors.warning(f"Couldn't save the personalities catalog ({ex})")
+
+    def invalidate(self):
+        """Makes the next listing check every personality folder again, to be called after a mount or an install"""
+        with self.lock:
+            self.stale = True
+            self.installed_folder_mtime = None
+
+    @staticmethod
+    def _folder_mtime(folder:Path):
+        try:
+            return folder.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def list_zoo(self, zoo_path:Path, custom_path:Path, refresh:bool=False)->Dict[str, List[dict]]:
+        """
+        Lists the personalities of the zoo and of the custom personalities folder.
+        The categories of the zoo are listed again only if the zoo folder mtime changed.
+
+        Args:
+            zoo_path (Path): The personalities zoo folder, each sub folder is a category.
+            custom_path (Path): The custom personalities folder.
+            refresh (bool): Check every category and personality folder even if their folder didn't change.
+
+        Returns:
+            Dict[str, List[dict]]: The personalities infos of each category.
+        """
+        with self.lock:
+            key = str(zoo_path)
+            mtime = self._folder_mtime(zoo_path)
+            if refresh or self.stale or mtime is None or self.folders.get(key)!=mtime:
+                try:
+                    self.categories = [f.stem for f in zoo_path.iterdir() if f.is_dir() and not f.stem.startswith('.')]
+                except OSError:
+                    self.categories = []
+                self.folders[key] = mtime
+            categories = [("custom_personalities", Path(custom_path))]+[(category, zoo_path/category) for category in self.categories]
+        return self.list_personalities(categories, refresh)
+
+    def list_personalities(self, categories:List[Tuple[str, Path]], refresh:bool=False)->Dict[str, List[dict]]:
+        """
+        Lists the personalities of each category.
+        The categories whose folder didn't change since the last listing are served from the index, after checking
+        the fingerprint of each of their personalities.
+
+        Args:
+            categories (List[Tuple[str, Path]]): The category names and their folders.
+            refresh (bool): Check every personality folder even if its category folder didn't change.
+
+        Returns:
+            Dict[str, List[dict]]: The personalities infos of each category.
+        """
+        with self.lock:
+            changed = False
+            unchanged = set()
+            for category, category_folder in categories:
+                folder_key = str(category_folder)
+                mtime = self._folder_mtime(category_folder)
+                if refresh or self.stale or mtime is None or self.folders.get(folder_key)!=mtime:
+                    self._scan_category(category, category_folder)
+                    self.folders[folder_key] = mtime
+                    changed = True
+                else:
+                    unchanged.add(folder_key)
+            for key, entry in list(self.entries.items()):
+                if entry["parent"] in unchanged and entry["fingerprint"]!=personality_fingerprint(Path(key)):
+                    self._read_entry(Path(key), entry["category"], entry["parent"])
+                    changed = True
+            self.stale = False
+            by_folder = {}
+            for entry in self.entries.values():
+                if entry["infos"] is not None:
+                    by_folder.setdefault((entry["parent"], entry["category"]), []).append(dict(entry["infos"]))
+            personalities = {category:by_folder.get((str(category_folder), category), []) for category, category_folder in categories}
+            if changed:
+                self.save()
+            return personalities
+
+    def _scan_category(self, category:str, category_folder:Path):
+        """Reads again the personalities of a category whose folder changed"""
+        folder_key = str(category_folder)
+        seen = set()
+        try:
+            personality_folders = sorted(category_folder.iterdir())
+        except OSError:
+            personality_folders = []
+        for personality_folder in personality_folders:
+            if not personality_folder.is_dir() or personality_folder.stem.startswith('.'):
+                continue
+            key = str(personality_folder)
+            seen.add(key)
+            entry = self.entries.get(key)
+            if entry is None or entry["fingerprint"]!=personality_fingerprint(personality_folder) or entry["category"]!=category or entry["parent"]!=folder_key:
+                self._read_entry(personality_folder, category, folder_key)
+        for key in [key for key, entry in self.entries.items() if entry["parent"]==folder_key and key not in seen]:
+            del self.entries[key]
+
+    def _read_entry(self, personality_folder:Path, category:str, folder_key:str):
+        """Reads a personality folder and stores its entry"""
+        fingerprint = personality_fingerprint(personality_folder)
+        entry = {"fingerprint":fingerprint, "category":category, "parent":folder_key, "infos":None}
+        # Without config.yaml, this is not a personality
+        if fingerprint[1] is not None:
+            try:
+                entry["infos"] = read_personality_infos(personality_folder, category)
+            except Exception as ex:
+                ASCIIColors.warning(f"Couldn't load personality from {personality_folder} [{ex}]")
+                trace_exception(ex)
+        self.entries[str(personality_folder)] = entry
+
+    def installed_personalities(self, configuration_path:Path)->set:
+        """
+        Folder names of the personalities having a configuration file in the user configuration folder.
+        The folder is listed again only when its mtime changes.
+        """
+        with self.lock:
+            mtime = self._folder_mtime(configuration_path)
+            if mtime is None or mtime!=self.installed_folder_mtime:
+                try:
+                    self.installed = {f.name[len("personality_"):-len(".yaml")] for f in configuration_path.iterdir() if f.name.startswith("personality_") and f.name.endswith(".yaml")}
+                except OSError:
+                    self.installed = set()
+                self.installed_folder_mtime = mtime
+            return self.installed
@@ -1,33 +1,19 @@
 import sqlite3
-from lollmsvectordb import VectorDatabase, TFIDFVectorizer
-from lollmsvectordb.lollms_tokenizers.tiktoken_tokenizer import TikTokenTokenizer
-import numpy as np
 from ascii_colors import ASCIIColors, trace_exception
+from lollms.databases.vectorizers_registry import vectorizers_registry
 class SkillsLibrary:
         
     def __init__(self, db_path, chunk_size:int=512, overlap:int=0, n_neighbors:int=5, config=None):
         self.db_path =db_path
         self.config = config
         self._initialize_db()
+        from lollmsvectordb import VectorDatabase
         from lollmsvectordb.lollms_tokenizers.tiktoken_tokenizer import TikTokenTokenizer
         if config is not None:
-            vectorizer = self.config.rag_vectorizer
-            if vectorizer == "semantic":
-                from lollmsvectordb.lollms_vectorizers.semantic_vectorizer import SemanticVectorizer
-                v = SemanticVectorizer(self.config.rag_vectorizer_model, self.config.rag_vectorizer_execute_remote_code)
-            elif vectorizer == "tfidf":
-                from lollmsvectordb.lollms_vectorizers.tfidf_vectorizer import TFIDFVectorizer
-                v = TFIDFVectorizer()
-            elif vectorizer == "openai":
-                from lollmsvectordb.lollms_vectorizers.openai_vectorizer import OpenAIVectorizer
-                v = OpenAIVectorizer()
-            elif self.config.rag_vectorizer == "ollama":
-                from lollmsvectordb.lollms_vectorizers.ollama_vectorizer import OllamaVectorizer
-                v = OllamaVectorizer(self.config.rag_vectorizer_model, self.config.rag_service_url)
-
+            v = vectorizers_registry.get_vectorizer(self.config)
         else:
             from lollmsvectordb.lollms_vectorizers.semantic_vectorizer import SemanticVectorizer
-            v = SemanticVectorizer(self.config.rag_vectorizer_model, self.config.rag_vectorizer_execute_remote_code)
+            v = SemanticVectorizer()
 
         self.vectorizer = VectorDatabase("", v, TikTokenTokenizer(),chunk_size, overlap, n_neighbors)
         ASCIIColors.green("Vecorizer ready")
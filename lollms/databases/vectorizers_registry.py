@@ -0,0 +1,218 @@
+"""
+project: lollms
+file: vectorizers_registry.py
+author: ParisNeo
+description:
+    Process wide registry of the rag vectorizers and cache of the opened vector databases.
+    Building a semantic vectorizer loads an embedding model and opening a vector database loads all its vectors in
+    memory, so both are shared instead of being rebuilt by each discussion, personality, datalake or request.
+
+"""
+from ascii_colors import ASCIIColors
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict
+import threading
+
+
+def vectorizer_key(config, vectorizer_type:str=None, model_name:str=None)->tuple:
+    """Identifies a vectorizer by its type and everything its constructor depends on."""
+    vectorizer_type = vectorizer_type or config.rag_vectorizer
+    model_name = model_name or config.rag_vectorizer_model
+    if vectorizer_type == "semantic":
+        return (vectorizer_type, model_name, config.rag_vectorizer_execute_remote_code)
+    elif vectorizer_type == "openai":
+        return (vectorizer_type, model_name, config.rag_vectorizer_openai_key)
+    elif vectorizer_type == "ollama":
+        return (vectorizer_type, model_name, config.rag_service_url)
+    return (vectorizer_type,)
+
+
+def build_vectorizer(config, vectorizer_type:str=None, model_name:str=None):
+    """Builds a new vectorizer as configured by the rag_vectorizer* entries of the configuration."""
+    vectorizer_type = vectorizer_type or config.rag_vectorizer
+    model_name = model_name or config.rag_vectorizer_model
+    if vectorizer_type == "semantic":
+        from lollmsvectordb.lollms_vectorizers.semantic_vectorizer import SemanticVectorizer
+        return SemanticVectorizer(model_name, config.rag_vectorizer_execute_remote_code)
+    elif vectorizer_type == "tfidf":
+        from lollmsvectordb.lollms_vectorizers.tfidf_vectorizer import TFIDFVectorizer
+        return TFIDFVectorizer()
+    elif vectorizer_type == "openai":
+        from lollmsvectordb.lollms_vectorizers.openai_vectorizer import OpenAIVectorizer
+        return OpenAIVectorizer(model_name, config.rag_vectorizer_openai_key)
+    elif vectorizer_type == "ollama":
+        from lollmsvectordb.lollms_vectorizers.ollama_vectorizer import OllamaVectorizer
+        return OllamaVectorizer(model_name, config.rag_service_url)
+    raise ValueError(f"Unknown vectorizer {vectorizer_type}")
+
+
+class VectorizersRegistry:
+    """
+    Owns one vectorizer per (type, model) and hands the same instance to every caller.
+
+    The tfidf vectorizer is fitted on the content of the database that uses it, so it is stateful and each
+    call gets a new one. The other vectorizers only embed text and are safe to share.
+    """
+    STATEFUL_VECTORIZERS = ["tfidf"]
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.vectorizers:Dict[tuple, Any] = {}
+
+    def get_vectorizer(self, config, vectorizer_type:str=None, model_name:str=None):
+        """
+        Gets the vectorizer configured by config, building it on first use.
+
+        Args:
+            config: The lollms configuration.
+            vectorizer_type (str, optional): Overrides config.rag_vectorizer.
+            model_name (str, optional): Overrides config.rag_vectorizer_model.
+        """
+        key = vectorizer_key(config, vectorizer_type, model_name)
+        if key[0] in VectorizersRegistry.STATEFUL_VECTORIZERS:
+            return build_vectorizer(config, vectorizer_type, model_name)
+        with self.lock:
+            vectorizer = self.vectorizers.get(key)
+            if vectorizer is None:
+                ASCIIColors.info(f"Building {key[0]} vectorizer {key[1]}")
+                vectorizer = build_vectorizer(config, vectorizer_type, model_name)
+                self.vectorizers[key] = vectorizer
+            return vectorizer
+
+    def clear(self):
+        """Forgets the built vectorizers, they are freed once their last user releases them."""
+        with self.lock:
+            self.vectorizers.clear()
+
+    def status(self)->dict:
+        with self.lock:
+            return {"vectorizers":[list(key[:2]) for key in self.vectorizers]}
+
+
+class _OpenDatabase:
+    def __init__(self, database) -> None:
+        self.database = database
+        self.references = 0
+
+
+class VectorDatabasesCache:
+    """
+    Keeps the opened vector databases so that the same file is not loaded again by each user.
+
+    A database is acquired with acquire() and given back with release(). While it is referenced it stays open,
+    once released it is kept in a least recently used list and closed when more than max_open databases are
+    unused.
+    """
+    def __init__(self, max_open:int=8) -> None:
+        self.max_open = max_open
+        self.lock = threading.Lock()
+        self.databases:"OrderedDict[tuple, _OpenDatabase]" = OrderedDict()
+
+    @staticmethod
+    def database_key(db_path, key:tuple=())->tuple:
+        return (str(Path(db_path).resolve()),)+tuple(key)
+
+    def acquire(self, db_path, factory:Callable[[], Any], key:tuple=()):
+        """
+        Gets the database opened at db_path, opening it with factory if it is not in the cache.
+
+        Args:
+            db_path: Path of the database file.
+            factory (Callable): Opens the database, called only on a cache miss.
+            key (tuple, optional): What the opened database depends on beside its path (vectorizer, tokenizer...).
+        """
+        database_key = VectorDatabasesCache.database_key(db_path, key)
+        with self.lock:
+            entry = self.databases.get(database_key)
+            if entry is not None:
+                entry.references += 1
+                self.databases.move_to_end(database_key)
+                return entry.database
+        # Opening loads all the vectors, don't keep the other users waiting
+        database = factory()
+        with self.lock:
+            entry = self.databases.get(database_key)
+            if entry is None:
+                entry = _OpenDatabase(database)
+                self.databases[database_key] = entry
+            entry.references += 1
+            self.databases.move_to_end(database_key)
+            self.evict()
+            return entry.database
+
+    def release(self, database):
+        """Gives back a database obtained with acquire()."""
+        with self.lock:
+            for entry in self.databases.values():
+                if entry.database is database:
+                    entry.references = max(0, entry.references-1)
+                    break
+            self.evict()
+
+    @contextmanager
+    def open(self, db_path, factory:Callable[[], Any], key:tuple=()):
+        database = self.acquire(db_path, factory, key)
+        try:
+            yield database
+        finally:
+            self.release(database)
+
+    def evict(self):
+        unused = [key for key, entry in self.databases.items() if entry.references==0]
+        for key in unused[:max(0, len(unused)-self.max_open)]:
+            del self.databases[key]
+
+    def invalidate(self, db_path):
+        """Forgets every database opened at db_path, for example before it is rebuilt."""
+        path = str(Path(db_path).resolve())
+        with self.lock:
+            for key in [key for key in self.databases if key[0]==path]:
+                del self.databases[key]
+
+    def drop_unused(self):
+        """Closes all the databases that nobody uses (for example after the model that tokenizes them changed)."""
+        with self.lock:
+            for key in [key for key, entry in self.databases.items() if entry.references==0]:
+                del self.databases[key]
+
+    def status(self)->dict:
+        with self.lock:
+            return {
+                "open_databases":len(self.databases),
+                "used_databases":sum(1 for entry in self.databases.values() if entry.references>0),
+                "max_open":self.max_open
+            }
+
+
+vectorizers_registry = VectorizersRegistry()
+vector_databases_cache = VectorDatabasesCache()
+
+
+def tokenizer_key(tokenizer)->tuple:
+    """Tiktoken tokenizers are interchangeable, any other tokenizer (a binding) is identified by its instance."""
+    if tokenizer is None:
+        return (None,)
+    if type(tokenizer).__name__=="TikTokenTokenizer":
+        return ("tiktoken",)
+    return (type(tokenizer).__name__, id(tokenizer))
+
+
+def open_vector_database(config, db_path, tokenizer=None, vectorizer_type:str=None, model_name:str=None, **kwargs):
+    """
+    Acquires the vector database stored at db_path using the configured vectorizer.
+    The database must be given back with vector_databases_cache.release() when it is not used anymore.
+
+    Args:
+        config: The lollms configuration.
+        db_path: Path of the database file.
+        tokenizer: Tokenizer used to split the documents.
+        kwargs: Other parameters of VectorDatabase (chunk_size, overlap, n_neighbors...).
+    """
+    from lollmsvectordb import VectorDatabase
+    key = vectorizer_key(config, vectorizer_type, model_name) + tokenizer_key(tokenizer) + tuple(sorted((k, id(v) if k=="model" else v) for k, v in kwargs.items()))
+    def factory():
+        vectorizer = vectorizers_registry.get_vectorizer(config, vectorizer_type, model_name)
+        return VectorDatabase(db_path, vectorizer, tokenizer, **kwargs)
+    return vector_databases_cache.acquire(db_path, factory, key)
@@ -0,0 +1,297 @@
+"""
+project: lollms
+file: download.py
+author: ParisNeo
+description:
+    Download engine for big files (models). The file is split in parts that are fetched in parallel over several
+    connections using http range requests and written in place in a preallocated partial file. The list of finished
+    parts is kept in a manifest next to the partial file so that an interrupted download resumes where it stopped.
+    When the server gives the size or the sha256 of the file (huggingface does), the result is verified before
+    being moved to its final path.
+
+"""
+from ascii_colors import ASCIIColors
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, List, Tuple
+import hashlib
+import threading
+import requests
+import json
+import time
+import os
+
+
+class DownloadError(Exception):
+    """Raised when a download fails or its verification doesn't match."""
+
+
+class RangeDownloader:
+    """
+    Parallel and resumable file downloader.
+
+    Usage:
+        RangeDownloader(url, destination, callback=lambda downloaded, total: print(downloaded, total)).download()
+
+    The callback receives the number of bytes on disk and the total size. It is called at most every
+    progress_interval seconds from the download threads. If it raises an exception the download stops,
+    the partial file and its manifest are kept so that the next call resumes it.
+    """
+    def __init__(
+                    self,
+                    url:str,
+                    destination:Path,
+                    n_connections:int=4,
+                    part_size:int=16*1024*1024,
+                    buffer_size:int=1024*1024,
+                    expected_size:int=None,
+                    expected_sha256:str=None,
+                    callback:Callable[[int, int], None]=None,
+                    headers:dict=None,
+                    timeout:float=30,
+                    max_retries:int=5,
+                    progress_interval:float=0.5
+                ) -> None:
+        self.url = url
+        self.destination = Path(destination)
+        self.part_path = self.destination.with_name(self.destination.name+".part")
+        self.manifest_path = self.destination.with_name(self.destination.name+".part.json")
+        self.n_connections = max(1, n_connections)
+        self.part_size = part_size
+        self.buffer_size = buffer_size
+        self.expected_size = expected_size
+        self.expected_sha256 = expected_sha256.lower() if expected_sha256 else None
+        self.callback = callback
+        self.headers = headers or {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+
+        self.total_size = None
+        self.downloaded_size = 0
+        self.start_time = None
+        self.stopped = False
+        self._lock = threading.Lock()
+        self._last_progress = 0
+
+    # ----------------------------------- Remote file infos -----------------------------------
+    def probe(self)->Tuple[int, bool, str, str]:
+        """
+        Gets the size of the remote file, whether the server accepts range requests, a validator (etag or
+        last modification date) and the sha256 advertised by the server if any.
+        """
+        response = requests.head(self.url, headers=self.headers, allow_redirects=True, timeout=self.timeout)
+        response.raise_for_status()
+        size = response.headers.get("Content-Length")
+        size = int(size) if size and response.headers.get("Content-Encoding") is None else None
+        accept_ranges = response.headers.get("Accept-Ranges","").lower()=="bytes"
+        validator = response.headers.get("ETag") or response.headers.get("Last-Modified") or ""
+        sha256 = None
+        # Huggingface gives the sha256 of lfs files on the response before the redirection to the storage
+        for r in response.history+[response]:
+            linked_etag = r.headers.get("X-Linked-Etag","").strip('"').lower()
+            if len(linked_etag)==64 and all(c in "0123456789abcdef" for c in linked_etag):
+                sha256 = linked_etag
+            if size is None and r.headers.get("X-Linked-Size"):
+                size = int(r.headers.get("X-Linked-Size"))
+        return size, accept_ranges, validator, sha256
+
+    # ----------------------------------- Manifest -----------------------------------
+    def load_manifest(self, size:int, validator:str)->List[int]:
+        """Returns the finished parts of a previous download of the same remote file."""
+        if not self.manifest_path.exists() or not self.part_path.exists():
+            return None
+        try:
+            with open(self.manifest_path, "r", encoding="utf8") as f:
+                manifest = json.load(f)
+            if manifest.get("url")==self.url and manifest.get("size")==size and manifest.get("validator")==validator and manifest.get("part_size")==self.part_size and self.part_path.stat().st_size==size:
+                return manifest.get("done", [])
+        except Exception as ex:
+            ASCIIColors.warning(f"Couldn't read download manifest {self.manifest_path} ({ex})")
+        return None
+
+    def save_manifest(self, size:int, validator:str, done:List[int]):
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump({"url":self.url, "size":size, "validator":validator, "part_size":self.part_size, "done":sorted(done)}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def clear_partial_files(self):
+        for path in [self.part_path, self.manifest_path]:
+            if path.exists():
+                path.unlink()
+
+    # ----------------------------------- Progress -----------------------------------
+    def add_progress(self, nb_bytes:int, force:bool=False):
+        with self._lock:
+            self.downloaded_size += nb_bytes
+            now = time.perf_counter()
+            if self.callback is None or (not force and now-self._last_progress<self.progress_interval):
+                return
+            self._last_progress = now
+            downloaded_size = self.downloaded_size
+        self.callback(downloaded_size, self.total_size)
+
+    @property
+    def speed(self)->float:
+        """Aggregate throughput of all connections since the start of this session, in bytes per second."""
+        if self.start_time is None:
+            return 0
+        return self.downloaded_size/max(time.perf_counter()-self.start_time, 1e-6)
+
+    # ----------------------------------- Download -----------------------------------
+    def download(self)->Path:
+        """
+        Downloads the file to its destination.
+
+        Returns:
+            Path: the destination path.
+
+        Raises:
+            DownloadError: if the download fails or the downloaded file doesn't match the expected size or hash.
+        """
+        self.destination.parent.mkdir(parents=True, exist_ok=True)
+        self.start_time = time.perf_counter()
+        try:
+            size, accept_ranges, validator, sha256 = self.probe()
+        except Exception as ex:
+            ASCIIColors.warning(f"Couldn't get the file informations, downloading on a single connection ({ex})")
+            size, accept_ranges, validator, sha256 = None, False, "", None
+        if self.expected_size is None:
+            self.expected_size = size
+        if self.expected_sha256 is None:
+            self.expected_sha256 = sha256
+        self.total_size = size
+
+        if size and accept_ranges:
+            self.download_ranges(size, validator)
+        else:
+            self.download_stream()
+        self.add_progress(0, force=True)
+        self.verify()
+        os.replace(self.part_path, self.destination)
+        if self.manifest_path.exists():
+            self.manifest_path.unlink()
+        ASCIIColors.success(f"Downloaded {self.destination.name} ({self.speed/1e6:.2f} MB/s)")
+        return self.destination
+
+    def download_ranges(self, size:int, validator:str):
+        parts = [(i, start, min(start+self.part_size, size)-1) for i, start in enumerate(range(0, size, self.part_size))]
+        done = self.load_manifest(size, validator)
+        if done is None:
+            done = []
+            # Preallocate the whole file so that the parts can be written in place
+            with open(self.part_path, "wb") as f:
+                f.truncate(size)
+            self.save_manifest(size, validator, done)
+        else:
+            ASCIIColors.info(f"Resuming download of {self.destination.name} ({len(done)}/{len(parts)} parts already downloaded)")
+        done = set(done)
+        # Bytes of the finished parts are already on disk
+        self.downloaded_size = sum(end-start+1 for i, start, end in parts if i in done)
+        todo = [p for p in parts if p[0] not in done]
+        self.add_progress(0, force=True)
+
+        local = threading.local()
+        def get_session()->requests.Session:
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            return local.session
+
+        def fetch(part):
+            index, start, end = part
+            for attempt in range(self.max_retries):
+                if self.stopped:
+                    return
+                written = 0
+                try:
+                    headers = dict(self.headers)
+                    headers["Range"] = f"bytes={start}-{end}"
+                    with get_session().get(self.url, headers=headers, stream=True, timeout=self.timeout) as response:
+                        if response.status_code!=206:
+                            raise DownloadError(f"Server didn't honour the range request (status {response.status_code})")
+                        with open(self.part_path, "r+b", buffering=0) as f:
+                            f.seek(start)
+                            buffer = bytearray()
+                            for chunk in response.iter_content(chunk_size=256*1024):
+                                if self.stopped:
+                                    return
+                                buffer += chunk
+                                if len(buffer)>=self.buffer_size:
+                                    f.write(buffer)
+                                    written += len(buffer)
+                                    self.add_progress(len(buffer))
+                                    buffer = bytearray()
+                            if buffer:
+                                f.write(buffer)
+                                written += len(buffer)
+                                self.add_progress(len(buffer))
+                    if written!=end-start+1:
+                        raise DownloadError(f"Part {index} is incomplete ({written}/{end-start+1} bytes)")
+                    with self._lock:
+                        done.add(index)
+                        self.save_manifest(size, validator, list(done))
+                    return
+                except DownloadError:
+                    if attempt==self.max_retries-1:
+                        raise
+                except requests.RequestException as ex:
+                    if attempt==self.max_retries-1:
+                        raise DownloadError(f"Couldn't download part {index}: {ex}")
+                finally:
+                    if index not in done and written:
+                        # The part will be downloaded again from its start
+                        self.add_progress(-written)
+                if self.stopped:
+                    return
+                time.sleep(min(2**attempt, 10))
+
+        with ThreadPoolExecutor(max_workers=self.n_connections) as executor:
+            futures = [executor.submit(fetch, part) for part in todo]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                self.stopped = True
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def download_stream(self):
+        """Single connection download for servers that don't support ranges. It resumes only if the server accepts ranges."""
+        start = self.part_path.stat().st_size if self.part_path.exists() else 0
+        headers = dict(self.headers)
+        if start>0:
+            headers["Range"] = f"bytes={start}-"
+        with requests.get(self.url, headers=headers, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            if response.status_code==206:
+                mode = "ab"
+                self.downloaded_size = start
+            else:
+                mode = "wb"
+                self.downloaded_size = 0
+            if self.total_size is None and response.headers.get("Content-Length") and response.headers.get("Content-Encoding") is None:
+                self.total_size = int(response.headers.get("Content-Length")) + self.downloaded_size
+            with open(self.part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=self.buffer_size):
+                    if chunk:
+                        f.write(chunk)
+                        self.add_progress(len(chunk))
+
+    def verify(self):
+        size = self.part_path.stat().st_size
+        if self.expected_size is not None and size!=self.expected_size:
+            self.clear_partial_files()
+            raise DownloadError(f"Downloaded file size mismatch: got {size} bytes, expected {self.expected_size}")
+        if self.expected_sha256:
+            sha256 = hashlib.sha256()
+            with open(self.part_path, "rb") as f:
+                while True:
+                    block = f.read(8*1024*1024)
+                    if not block:
+                        break
+                    sha256.update(block)
+            if sha256.hexdigest()!=self.expected_sha256:
+                self.clear_partial_files()
+                raise DownloadError(f"Downloaded file hash mismatch: got {sha256.hexdigest()}, expected {self.expected_sha256}")
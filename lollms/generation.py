@@ -1,5 +1,11 @@
 from enum import Enum
-from ascii_colors import ASCIIColors
+from ascii_colors import ASCIIColors, trace_exception
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List
+import asyncio
+import itertools
+import threading
+import time
 class ROLE_CHANGE_DECISION(Enum):
     """Roles change detection."""
     
@@ -22,29 +28,555 @@ class ROLE_CHANGE_OURTPUT:
         self.status = status
         self.value = value
 
+def _lower(text:str)->str:
+    """Lower case keeping one character per character so that positions in the lowered text match the original text."""
+    lowered = text.lower()
+    if len(lowered)==len(text):
+        return lowered
+    return "".join(c.lower()[0] for c in text)
+
+
+class StopSequenceMatcher:
+    """
+    Incremental and case insensitive detection of stop sequences (antiprompts) in a streamed text.
+
+    The received chunks are kept in a list and only the new chunk and the last characters of the previous ones
+    (the length of the longest stop sequence) are searched, so each chunk costs the same whatever the length of
+    the text already received.
+
+    Usage:
+        matcher = StopSequenceMatcher(["!@>"])
+        for chunk in chunks:
+            if matcher.feed(chunk):
+                break
+        text = matcher.text # the received text up to the stop sequence
+    """
+    def __init__(self, stop_sequences:List[str], text:str="") -> None:
+        self.stop_sequences = list(dict.fromkeys(_lower(s) for s in stop_sequences if s))
+        self.max_length = max([len(s) for s in self.stop_sequences], default=0)
+        # Beginnings of stop sequences that may be completed by the next chunks
+        self.prefixes = {s[:i] for s in self.stop_sequences for i in range(1, len(s))}
+        self.chunks:List[str] = []
+        self.length = 0
+        self.tail = ""
+        self.held = 0
+        self.match:str = None
+        self.match_position:int = None
+        # Text received but not emitted yet (see emit)
+        self.emitted = 0
+        self.pending:List[str] = []
+        if text:
+            self.feed(text)
+
+    def feed(self, chunk:str)->str:
+        """
+        Adds a chunk to the text.
+
+        Returns:
+            str: the (lower case) stop sequence if the text contains one, else None. Once a stop sequence is found,
+            the next chunks are ignored.
+        """
+        if self.match is not None or not chunk:
+            return self.match
+        offset = self.length-len(self.tail)
+        window = self.tail+_lower(chunk)
+        self.chunks.append(chunk)
+        self.pending.append(chunk)
+        self.length += len(chunk)
+        best = None
+        for stop_sequence in self.stop_sequences:
+            index = window.find(stop_sequence)
+            if index>=0 and (best is None or index<best[0]):
+                best = (index, stop_sequence)
+        if best is not None:
+            self.match_position = offset+best[0]
+            self.match = best[1]
+            self.held = 0
+            return self.match
+        if self.max_length>1:
+            self.tail = window[-(self.max_length-1):]
+        self.held = 0
+        for i in range(min(len(self.tail), self.max_length-1), 0, -1):
+            if self.tail[-i:] in self.prefixes:
+                self.held = i
+                break
+        return None
+
+    @property
+    def text(self)->str:
+        """The received text without the stop sequence and what follows it."""
+        if len(self.chunks)>1:
+            self.chunks = ["".join(self.chunks)]
+        text = self.chunks[0] if self.chunks else ""
+        return text[:self.match_position] if self.match_position is not None else text
+
+    def __len__(self)->int:
+        return self.length if self.match_position is None else self.match_position
+
+    @property
+    def safe_length(self)->int:
+        """Length of the text that can't be part of a stop sequence anymore."""
+        return len(self)-self.held
+
+    def emit(self, end:int=None)->str:
+        """
+        Gets the text received since the last call that is safe to show: the end of the text that may be the
+        beginning of a stop sequence is held until the next chunks tell whether it is one, and the stop
+        sequence itself is never returned.
+        """
+        end = self.safe_length if end is None else end
+        if end<=self.emitted:
+            return ""
+        pending = "".join(self.pending)
+        text = pending[:end-self.emitted]
+        rest = pending[end-self.emitted:]
+        self.pending = [rest] if rest else []
+        self.emitted = end
+        return text
+
+    def flush(self)->str:
+        """Gets all the text not emitted yet, once the stream is finished (the held text was not a stop sequence)."""
+        return self.emit(len(self))
+
+
 class RECEPTION_MANAGER:
-    done:bool=False
-    chunk:str=""
-    new_role:str=""
-    reception_buffer:str=""
-    def new_chunk(self, chunk):
-        self.chunk = chunk
-        if chunk=="!" and self.new_role == "":
-            self.new_role+=chunk
-            return ROLE_CHANGE_OURTPUT(ROLE_CHANGE_DECISION.PROGRESSING)
-        elif self.new_role != "":
-            if self.new_role=="!" and chunk=="@":
-                self.new_role+=chunk
-                return ROLE_CHANGE_OURTPUT(ROLE_CHANGE_DECISION.PROGRESSING)
-            elif self.new_role=="!@" and chunk==">":
-                self.new_role=""
-                self.done=True
-                ASCIIColors.yellow("Delected end of sentence")
-                return ROLE_CHANGE_OURTPUT(ROLE_CHANGE_DECISION.ROLE_CHANGED, self.reception_buffer)
+    """
+    Filters the chunks of a streaming generation so that the headers of a new message (stop sequences) are
+    never sent to the client, even when the model writes them over several chunks.
+
+    After each call to new_chunk, chunk holds the slice of text that is safe to send (possibly empty when
+    the end of the text may be the beginning of a header). Once the stream is finished, flush gives the
+    text that was held back.
+
+    Usage:
+        reception_manager = RECEPTION_MANAGER(personality.get_anti_prompts())
+        rx = reception_manager.new_chunk(chunk)
+        send(reception_manager.chunk)
+        if rx.status == ROLE_CHANGE_DECISION.ROLE_CHANGED:
+            stop()
+    """
+    def __init__(self, stop_sequences:List[str]=None) -> None:
+        self.matcher = StopSequenceMatcher(stop_sequences if stop_sequences else ["!@>"])
+        self.done = False
+        self.chunk = ""
+
+    @property
+    def reception_buffer(self)->str:
+        """The received text up to the new role header."""
+        return self.matcher.text
+
+    @property
+    def new_role(self)->str:
+        """The beginning of a header being received."""
+        return self.matcher.tail[len(self.matcher.tail)-self.matcher.held:]
+
+    def new_chunk(self, chunk:str)->ROLE_CHANGE_OURTPUT:
+        was_holding = self.matcher.held>0
+        self.matcher.feed(chunk)
+        self.chunk = self.matcher.emit()
+        if self.matcher.match is not None:
+            if not self.done:
+                ASCIIColors.yellow("Detected end of sentence")
+            self.done = True
+            return ROLE_CHANGE_OURTPUT(ROLE_CHANGE_DECISION.ROLE_CHANGED, self.chunk)
+        if self.matcher.held>0:
+            return ROLE_CHANGE_OURTPUT(ROLE_CHANGE_DECISION.PROGRESSING, self.chunk)
+        if was_holding:
+            return ROLE_CHANGE_OURTPUT(ROLE_CHANGE_DECISION.FALSE_ALERT, self.chunk)
+        return ROLE_CHANGE_OURTPUT(ROLE_CHANGE_DECISION.MOVE_ON, self.chunk)
+
+    def flush(self)->str:
+        """Releases the held text at the end of the stream."""
+        self.chunk = self.matcher.flush()
+        return self.chunk
+
+
+
+class StreamingBridge:
+    """
+    Moves the chunks produced by a generation thread to an async consumer (a streaming endpoint).
+
+    The generation thread pushes chunks from its callback. Chunks are handed to the event loop through
+    loop.call_soon_threadsafe so the consumer awaits an asyncio.Queue and costs nothing while idle.
+    At most max_pending chunks can wait in the queue: when the consumer is slower than the model,
+    the generation thread blocks (backpressure). Once the consumer stops (end of stream or client
+    disconnection), push returns False so that the binding stops generating.
+
+    Usage (inside an async generator):
+        bridge = StreamingBridge()
+        bridge.start(lambda: binding.generate(prompt, n_predict, callback=lambda chunk, chunk_type: bridge.push(chunk)))
+        async for chunk in bridge:
+            yield chunk
+    """
+    _END = object()
+
+    def __init__(self, max_pending:int=256) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.cancelled = False
+        self._slots = threading.Semaphore(max_pending)
+        self.thread:threading.Thread = None
+
+    def push(self, chunk)->bool:
+        """
+        Sends a chunk to the consumer. Called from the generation thread.
+
+        Returns:
+            bool: False if the consumer is gone and the generation should stop.
+        """
+        while not self._slots.acquire(timeout=0.1):
+            if self.cancelled:
+                return False
+        if self.cancelled:
+            return False
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, chunk)
+        except RuntimeError:
+            # The event loop is closed
+            self.cancelled = True
+            return False
+        return True
+
+    def close(self):
+        """Tells the consumer that no more chunks will come. Called from the generation thread."""
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, StreamingBridge._END)
+        except RuntimeError:
+            pass
+
+    def cancel(self):
+        """Stops the producer: next calls to push return False."""
+        self.cancelled = True
+
+    def start(self, target, *args, **kwargs)->threading.Thread:
+        """
+        Runs target in a new thread and closes the bridge when it returns.
+        """
+        def run():
+            try:
+                target(*args, **kwargs)
+            except Exception as ex:
+                trace_exception(ex)
+            finally:
+                self.close()
+        self.thread = threading.Thread(target=run)
+        self.thread.start()
+        return self.thread
+
+    async def __aiter__(self):
+        try:
+            while True:
+                chunk = await self.queue.get()
+                if chunk is StreamingBridge._END:
+                    break
+                self._slots.release()
+                yield chunk
+        finally:
+            self.cancel()
+
+
+
+class GenerationQueueFull(Exception):
+    """Raised when the generation scheduler can't accept more waiting requests."""
+
+
+class GenerationTicket:
+    """
+    A generation request handled by the GenerationScheduler.
+
+    The ticket is also the cancellation token of the request: cancelling it removes it from the queue
+    if it is still waiting or makes its callback return False if it is already generating.
+    """
+    def __init__(self, ticket_id:int, client_id:str, priority:int, binding_key:str) -> None:
+        self.ticket_id = ticket_id
+        self.client_id = client_id
+        self.priority = priority
+        self.binding_key = binding_key
+        self.enqueued_at = time.perf_counter()
+        self.started_at = None
+        self.cancelled = False
+
+    @property
+    def wait_time(self)->float:
+        """Time spent in the queue (up to now if the request is still waiting)."""
+        return (self.started_at or time.perf_counter()) - self.enqueued_at
+
+    def cancel(self):
+        self.cancelled = True
+
+    def wrap_callback(self, callback:Callable)->Callable:
+        """Returns a callback that stops the generation once the ticket is cancelled."""
+        if callback is None:
+            return None
+        def wrapped(*args, **kwargs):
+            if self.cancelled:
+                return False
+            return callback(*args, **kwargs)
+        return wrapped
+
+
+class GenerationScheduler:
+    """
+    Admission queue in front of the bindings generate methods.
+
+    Requests wait in a bounded queue until their binding has a free generation slot. The next request
+    is chosen by priority (lower first), then by fairness (the client that was served least recently
+    goes first) and finally in arrival order. Each binding runs at most max_concurrency generations at
+    a time; bindings that can serve parallel requests may raise it with a max_concurrent_generations
+    attribute.
+
+    Usage:
+        with scheduler.slot(client_id, binding=binding) as ticket:
+            if not ticket.cancelled:
+                binding.generate(prompt, n_predict, callback=ticket.wrap_callback(callback))
+    """
+    def __init__(self, max_concurrency:int=1, max_queue_size:int=64) -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue_size = max_queue_size
+        self._condition = threading.Condition()
+        self._waiting:List[GenerationTicket] = []
+        self._running:Dict[int, GenerationTicket] = {}
+        self._last_served:Dict[str, int] = {}
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+        # Statistics
+        self.nb_served = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @staticmethod
+    def binding_key(binding)->str:
+        if binding is None:
+            return "default"
+        return getattr(binding, "binding_folder_name", None) or binding.__class__.__name__
+
+    def concurrency_limit(self, binding)->int:
+        limit = max(1, getattr(binding, "max_concurrent_generations", None) or self.max_concurrency)
+        if getattr(binding, "supports_batch_generation", False):
+            # Let enough requests in for the GenerationBatcher to fill its batches
+            limit = max(limit, getattr(binding, "max_batch_size", 1))
+        return limit
+
+    def bind_client(self, client_id:str, target:Callable)->Callable:
+        """
+        Returns a function running target on behalf of client_id: generations started by target
+        without an explicit client (personalities, tasks) are then queued and cancelled as this client's.
+        """
+        def run(*args, **kwargs):
+            self._local.client_id = client_id
+            try:
+                return target(*args, **kwargs)
+            finally:
+                self._local.client_id = None
+        return run
+
+    def _next_ticket(self, binding_key:str)->GenerationTicket:
+        candidates = [t for t in self._waiting if t.binding_key==binding_key]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda t:(t.priority, self._last_served.get(t.client_id, -1), t.ticket_id))
+
+    def acquire(self, client_id:str=None, priority:int=0, binding=None, abandoned:Callable[[], bool]=None)->GenerationTicket:
+        """
+        Waits for a generation slot. The returned ticket is cancelled if the request was cancelled
+        while waiting, in which case no slot is held and release must not be called.
+        abandoned is polled while waiting: when it returns True (the client disconnected) the request is cancelled.
+
+        Raises:
+            GenerationQueueFull: if max_queue_size requests are already waiting.
+        """
+        if client_id is None:
+            client_id = getattr(self._local, "client_id", None) or "local"
+        binding_key = GenerationScheduler.binding_key(binding)
+        limit = self.concurrency_limit(binding)
+        with self._condition:
+            if len(self._waiting)>=self.max_queue_size:
+                raise GenerationQueueFull(f"Generation queue is full ({self.max_queue_size} waiting requests)")
+            ticket = GenerationTicket(next(self._ids), client_id, priority, binding_key)
+            self._waiting.append(ticket)
+            while True:
+                if not ticket.cancelled and abandoned is not None and abandoned():
+                    ticket.cancel()
+                if ticket.cancelled:
+                    self._waiting.remove(ticket)
+                    self._condition.notify_all()
+                    return ticket
+                running = sum(1 for t in self._running.values() if t.binding_key==binding_key)
+                if running<limit and self._next_ticket(binding_key) is ticket:
+                    break
+                self._condition.wait(0.5)
+            self._waiting.remove(ticket)
+            ticket.started_at = time.perf_counter()
+            self._running[ticket.ticket_id] = ticket
+            self._last_served[client_id] = ticket.ticket_id
+            if len(self._last_served)>1024:
+                active = {t.client_id for t in self._waiting} | {t.client_id for t in self._running.values()}
+                self._last_served = {k:v for k,v in self._last_served.items() if k in active}
+            wait_time = ticket.wait_time
+            self.nb_served += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+        if wait_time>1:
+            ASCIIColors.info(f"Generation request of {client_id} waited {wait_time:.2f}s in the queue")
+        return ticket
+
+    def release(self, ticket:GenerationTicket):
+        with self._condition:
+            self._running.pop(ticket.ticket_id, None)
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, client_id:str=None, priority:int=0, binding=None, abandoned:Callable[[], bool]=None):
+        """
+        Context manager holding a generation slot. It is reentrant: a generation started while the
+        current thread already holds a slot (a personality workflow for example) reuses it.
+        """
+        current = getattr(self._local, "ticket", None)
+        if current is not None:
+            yield current
+            return
+        ticket = self.acquire(client_id, priority, binding, abandoned)
+        if ticket.cancelled and ticket.ticket_id not in self._running:
+            yield ticket
+            return
+        self._local.ticket = ticket
+        try:
+            yield ticket
+        finally:
+            self._local.ticket = None
+            self.release(ticket)
+
+    def cancel(self, client_id:str=None)->int:
+        """
+        Cancels the waiting and running requests of a client (all requests if client_id is None).
+
+        Returns:
+            int: the number of cancelled requests.
+        """
+        with self._condition:
+            tickets = self._waiting + list(self._running.values())
+            if client_id is not None:
+                tickets = [t for t in tickets if t.client_id==client_id]
+            for ticket in tickets:
+                ticket.cancel()
+            self._condition.notify_all()
+        return len(tickets)
+
+    def status(self)->dict:
+        with self._condition:
+            now = time.perf_counter()
+            return {
+                "queue_depth": len(self._waiting),
+                "running": len(self._running),
+                "max_concurrency": self.max_concurrency,
+                "max_queue_size": self.max_queue_size,
+                "oldest_wait_time": max((now-t.enqueued_at for t in self._waiting), default=0.0),
+                "served": self.nb_served,
+                "mean_wait_time": self.total_wait_time/self.nb_served if self.nb_served else 0.0,
+                "max_wait_time": self.max_wait_time,
+            }
+
+
+class _BatchEntry:
+    def __init__(self, prompt:str, n_predict:int, callback:Callable) -> None:
+        self.prompt = prompt
+        self.n_predict = n_predict
+        self.callback = callback
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class _Batch:
+    def __init__(self) -> None:
+        self.entries:List[_BatchEntry] = []
+        self.full = threading.Event()
+
+
+class GenerationBatcher:
+    """
+    Groups the generation requests sent to a binding within a small time window and sends them
+    together to its generate_batch method.
+
+    The first request of a batch waits up to window seconds (or until max_batch_size requests
+    joined) then dispatches the whole batch from its own thread. Only requests with the same
+    generation parameters are batched together. Each request keeps its own callback: the binding
+    receives one callback per prompt, so streamed chunks go back to the request that owns them.
+    Bindings that don't advertise supports_batch_generation are called directly.
+    """
+    def __init__(self, window:float=0.01) -> None:
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending:Dict[tuple, _Batch] = {}
+        # Statistics
+        self.nb_batches = 0
+        self.nb_batched_requests = 0
+
+    def generate(self, binding, prompt:str, n_predict:int=128, callback:Callable=None, **gpt_params)->str:
+        if not getattr(binding, "supports_batch_generation", False) or self.window<=0:
+            return binding.generate(prompt, n_predict, callback=callback, **gpt_params)
+
+        key = (id(binding), tuple(sorted((k, repr(v)) for k,v in gpt_params.items())))
+        max_batch_size = max(1, getattr(binding, "max_batch_size", 1))
+        entry = _BatchEntry(prompt, n_predict, callback)
+        with self._lock:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = _Batch()
+                self._pending[key] = batch
+            batch.entries.append(entry)
+            if len(batch.entries)>=max_batch_size:
+                del self._pending[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._pending.get(key) is batch:
+                    del self._pending[key]
+            self._dispatch(binding, batch.entries, gpt_params)
+        else:
+            entry.done.wait()
+
+        if entry.error is not None:
+            raise entry.error
+        return entry.result
+
+    def _dispatch(self, binding, entries:List[_BatchEntry], gpt_params:dict):
+        self.nb_batches += 1
+        self.nb_batched_requests += len(entries)
+        try:
+            if len(entries)==1:
+                results = [binding.generate(entries[0].prompt, entries[0].n_predict, callback=entries[0].callback, **gpt_params)]
             else:
-                rc = ROLE_CHANGE_OURTPUT(ROLE_CHANGE_DECISION.FALSE_ALERT, self.reception_buffer)
-                self.reception_buffer += self.new_role      
-                return rc
-        self.reception_buffer += chunk
-        return ROLE_CHANGE_OURTPUT(ROLE_CHANGE_DECISION.MOVE_ON)
+                results = binding.generate_batch(
+                                                    [e.prompt for e in entries],
+                                                    [e.n_predict for e in entries],
+                                                    [e.callback for e in entries],
+                                                    **gpt_params
+                                                )
+            for entry, result in zip(entries, results):
+                entry.result = result
+        except Exception as ex:
+            trace_exception(ex)
+            for entry in entries:
+                entry.error = ex
+        finally:
+            for entry in entries:
+                entry.done.set()
+
+    def status(self)->dict:
+        return {
+            "window": self.window,
+            "batches": self.nb_batches,
+            "mean_batch_size": self.nb_batched_requests/self.nb_batches if self.nb_batches else 0.0,
+        }
+
 
+def generation_slot(app, binding=None, client_id:str=None):
+    """Holds a slot of the app's generation scheduler (does nothing for apps without a scheduler)."""
+    scheduler:GenerationScheduler = getattr(app, "generation_scheduler", None)
+    if scheduler is None:
+        return nullcontext(GenerationTicket(0, client_id, 0, GenerationScheduler.binding_key(binding)))
+    return scheduler.slot(client_id, binding=binding)
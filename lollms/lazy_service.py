@@ -0,0 +1,115 @@
+"""
+project: lollms
+file: lazy_service.py
+author: ParisNeo
+description:
+    Lazy loading of the services (tts, stt, tti, local servers...). A LazyService stands for a service that is
+    imported and built the first time it is used, so that the application starts without waiting for every
+    enabled service. The services can also be warmed up concurrently with warmup_services.
+
+"""
+from ascii_colors import ASCIIColors, trace_exception
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List
+import threading
+import time
+
+
+class LazyService:
+    """
+    Proxy of a service built on first use.
+
+    Any attribute read, write or call on the proxy builds the service (once, thread safe) and is forwarded to it.
+    The proxy's own members are prefixed with lazy_ so that they don't hide the members of the service.
+    If the service fails to build, the error is recorded and raised to the caller, then raised again on every use
+    without running the factory: the proxy is falsy and the service is built again only when it is reloaded
+    (the application builds a new proxy).
+
+    Usage:
+        tts = LazyService("openai_tts", lambda: LollmsOpenAITTS(app, model, voice, key))
+        tts.tts_audio(text) # imports and builds the service, then calls it
+    """
+    def __init__(self, name:str, factory:Callable[[], Any]) -> None:
+        object.__setattr__(self, "lazy_name", name)
+        object.__setattr__(self, "lazy_factory", factory)
+        object.__setattr__(self, "lazy_instance", None)
+        object.__setattr__(self, "lazy_error", None)
+        object.__setattr__(self, "lazy_exception", None)
+        object.__setattr__(self, "lazy_startup_time", None)
+        object.__setattr__(self, "lazy_lock", threading.Lock())
+
+    @property
+    def lazy_loaded(self)->bool:
+        return self.lazy_instance is not None
+
+    def lazy_load(self):
+        """Builds the service if needed and returns it. Raises the build error if the service failed to build."""
+        instance = self.lazy_instance
+        if instance is not None:
+            return instance
+        with self.lazy_lock:
+            if self.lazy_exception is not None:
+                raise self.lazy_exception
+            if self.lazy_instance is None:
+                ASCIIColors.info(f"Loading service {self.lazy_name}")
+                start = time.perf_counter()
+                try:
+                    instance = self.lazy_factory()
+                except Exception as ex:
+                    object.__setattr__(self, "lazy_error", str(ex))
+                    object.__setattr__(self, "lazy_exception", ex)
+                    object.__setattr__(self, "lazy_startup_time", time.perf_counter()-start)
+                    raise
+                object.__setattr__(self, "lazy_startup_time", time.perf_counter()-start)
+                object.__setattr__(self, "lazy_error", None)
+                object.__setattr__(self, "lazy_instance", instance)
+            return self.lazy_instance
+
+    def lazy_status(self)->dict:
+        return {
+            "loaded":self.lazy_loaded,
+            "startup_time":self.lazy_startup_time,
+            "error":self.lazy_error
+        }
+
+    def __getattr__(self, key):
+        if key.startswith("__"):
+            raise AttributeError(key)
+        return getattr(self.lazy_load(), key)
+
+    def __setattr__(self, key, value):
+        setattr(self.lazy_load(), key, value)
+
+    def __call__(self, *args, **kwargs):
+        return self.lazy_load()(*args, **kwargs)
+
+    def __bool__(self):
+        # The service is configured, whether it is built yet or not, unless it failed to build
+        return self.lazy_exception is None
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.lazy_loaded else "failed" if self.lazy_exception is not None else "not loaded"
+        return f"<LazyService {self.lazy_name} ({state})>"
+
+
+def warmup_services(services:List[LazyService], max_workers:int=4)->Dict[str, dict]:
+    """
+    Builds the services concurrently (they must not depend on each other).
+
+    Returns:
+        Dict[str, dict]: the startup report of each service (loaded, startup_time in seconds, error).
+    """
+    services = list({id(service):service for service in services if isinstance(service, LazyService)}.values())
+    todo = [service for service in services if not service.lazy_loaded and service.lazy_exception is None]
+    if len(todo)>0:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="lollms_warmup") as executor:
+            futures = {executor.submit(service.lazy_load):service for service in todo}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as ex:
+                    ASCIIColors.warning(f"Couldn't load service {futures[future].lazy_name}")
+                    trace_exception(ex)
+        ASCIIColors.success(f"Warmed up {len(todo)} services in {time.perf_counter()-start:.2f}s")
+    return {service.lazy_name:service.lazy_status() for service in services}
@@ -9,7 +9,6 @@ from lollms.config      import BaseConfig
 #from lollms.binding import  LLMBinding
 import shutil
 import urllib.request as rq
-from tqdm               import tqdm
 from pathlib            import Path
 
 
@@ -8,7 +8,7 @@ License: Apache 2.0
 """
 from lollms.utilities import PackageManager
 from lollms.com import LoLLMsCom
-from lollms.utilities import trace_exception, run_async
+from lollms.utilities import trace_exception, run_async, import_sounddevice
 from lollms.types import MSG_OPERATION_TYPE, SENDER_TYPES
 from lollms.client_session import Session
 from ascii_colors import ASCIIColors
@@ -16,67 +16,18 @@ import platform
 from functools import partial
 import subprocess
 from collections import deque
-from scipy.signal import butter, lfilter
 import pipmaster as pm
 
 import os
 import threading
 import re
 
-if not PackageManager.check_package_installed("cv2"):
-    if platform.system() == "Darwin":
-        os.system('brew install opencv')
-    elif platform.system() == "Windows":
-        os.system('pip install opencv-python')
-    else:
-        os.system('pip install opencv-python')
-        # os.system('sudo apt-get update')
-        # os.system('sudo apt-get install libgl1-mesa-glx python3-opencv -y')
-        # os.system('pip install opencv-python')
-try:
-    import cv2
-except:
-    ASCIIColors.error("Couldn't install opencv!")
-
-
-if not PackageManager.check_package_installed("scipy"):
-    PackageManager.install_package("scipy")
-    from scipy import signal
-from scipy import signal
-
-if not PackageManager.check_package_installed("matplotlib"):
-    PackageManager.install_package("matplotlib")
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')
-
-
-
 import socketio
 from lollms.com import LoLLMsCom
-try:
-    if not PackageManager.check_package_installed("sounddevice"):
-        # os.system("sudo apt-get install portaudio19-dev")
-        PackageManager.install_package("sounddevice")
-        PackageManager.install_package("wave")
-except:
-    # os.system("sudo apt-get install portaudio19-dev -y")
-    PackageManager.install_package("sounddevice")
-    PackageManager.install_package("wave")
-try:
-    import sounddevice as sd
-    import wave
-except:
-    ASCIIColors.error("Couldn't load sound tools")
-
 import time
 import base64
 import io
 import socketio
-from scipy.io.wavfile import write
-from matplotlib import pyplot as plt
-import numpy as np
-from scipy.signal import spectrogram
 from pathlib import Path
 
 from lollms.app import LollmsApplication
@@ -89,6 +40,48 @@ from datetime import datetime
 
 import sys
 
+# opencv, scipy, matplotlib, numpy and the sound tools are installed and imported when the first object that
+# needs them is built, importing this module doesn't load them
+cv2 = None
+sd = wave = np = signal = butter = lfilter = plt = None
+
+def load_video_tools():
+    global cv2
+    if cv2 is not None:
+        return
+    if not PackageManager.check_package_installed("cv2"):
+        if platform.system() == "Darwin":
+            os.system('brew install opencv')
+        else:
+            os.system('pip install opencv-python')
+    try:
+        import cv2 as _cv2
+        cv2 = _cv2
+    except:
+        ASCIIColors.error("Couldn't install opencv!")
+
+def load_audio_tools():
+    global sd, wave, np, signal, butter, lfilter, plt
+    if np is not None:
+        return
+    if not PackageManager.check_package_installed("scipy"):
+        PackageManager.install_package("scipy")
+    if not PackageManager.check_package_installed("matplotlib"):
+        PackageManager.install_package("matplotlib")
+    import numpy as _np
+    from scipy import signal as _signal
+    from scipy.signal import butter as _butter, lfilter as _lfilter
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as _plt
+    signal, butter, lfilter, plt = _signal, _butter, _lfilter, _plt
+    try:
+        import wave as _wave
+        sd, wave = import_sounddevice(), _wave
+    except:
+        ASCIIColors.error("Couldn't load sound tools")
+    np = _np
+
 def update_progress_bar(silence_counter, max_silence):
     bar_length = 40  # Length of the progress bar
     progress = silence_counter / max_silence
@@ -108,6 +101,7 @@ def update_progress_bar(silence_counter, max_silence):
 
 # Step 1: Define your high-pass and low-pass filters (they’re like the bouncers for your audio club)
 def butter_bandpass(lowcut, highcut, fs, order=5):
+    load_audio_tools()
     nyquist = 0.5 * fs
     low = lowcut / nyquist
     high = highcut / nyquist
@@ -115,6 +109,7 @@ def butter_bandpass(lowcut, highcut, fs, order=5):
     return b, a
 
 def bandpass_filter(data, lowcut, highcut, fs, order=5):
+    load_audio_tools()
     b, a = butter_bandpass(lowcut, highcut, fs, order=order)
     y = lfilter(b, a, data)
     return y
@@ -140,6 +135,7 @@ class RTCom:
                         use_keyword_audio=False,
                         keyword_audio_path=None
                     ):
+        load_audio_tools()
         self.sio = sio
         self.lc = lc
         self.client = client
@@ -474,11 +470,8 @@ class RTCom:
             return voices
         return []
 from pathlib import Path
-import sounddevice as sd
 import threading
 import datetime
-import wave
-import numpy as np
 
 class AudioNinja:
     def __init__(self, lc, logs_folder='logs', device=None):
@@ -491,6 +484,7 @@ class AudioNinja:
             logs_folder (str): The folder to save recordings. Default is 'logs'.
             device (int or str): The recording device index or name. Default is None.
         """
+        load_audio_tools()
         self.lc = lc
         self.logs_folder = Path(logs_folder)
         self.device = device
@@ -578,6 +572,7 @@ class WebcamImageSender:
         Args:
             socketio (socketio.Client): The SocketIO client object.
         """
+        load_video_tools()
         self.sio = sio
         self.last_image = None
         self.last_change_time = None
@@ -702,6 +697,7 @@ class RealTimeTranscription:
     def __init__(self, callback):
 
         # Set up PyAudio
+        load_audio_tools()
         self.p = pyaudio.PyAudio()
         self.stream = self.p.open(format=pyaudio.paInt16, channels=1, rate=16000, input=True, frames_per_buffer=1024)
 
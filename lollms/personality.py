@@ -12,20 +12,20 @@ from lollms.config import InstallOption, TypedConfig, BaseConfig
 from lollms.main_config import LOLLMSConfig
 from lollms.paths import LollmsPaths
 from lollms.binding import LLMBinding, BindingType
-from lollms.utilities import PromptReshaper, PackageManager, discussion_path_to_url, process_ai_output, remove_text_from_string
+from lollms.utilities import PromptReshaper, PackageManager, discussion_path_to_url, process_ai_output, remove_text_from_string, import_pyqt5
 from lollms.com import NotificationType, NotificationDisplayType
 from lollms.client_session import Session, Client
-from lollmsvectordb.vector_database import VectorDatabase
-from lollmsvectordb.text_document_loader import TextDocumentsLoader
-from lollmsvectordb.database_elements.document import Document
-import pkg_resources
+from lollms.generation import generation_slot, StopSequenceMatcher
+from lollms.databases.vectorizers_registry import vectorizers_registry, vectorizer_key
+from lollms.databases.documents_manifest import DocumentsManifest, document_hash
 from pathlib import Path
-from PIL import Image
 import re
 import shutil
+import os
 
 from datetime import datetime
 import importlib
+import importlib.metadata
 import subprocess
 import yaml
 from ascii_colors import ASCIIColors
@@ -33,9 +33,6 @@ import time
 from lollms.types import MSG_OPERATION_TYPE, SUMMARY_MODE
 import json
 from typing import Any, List, Optional, Type, Callable, Dict, Any, Union, Tuple
-from lollmsvectordb.vector_database import VectorDatabase
-from lollmsvectordb.text_document_loader import TextDocumentsLoader
-from lollmsvectordb.text_chunker import TextChunker
 
 from functools import partial
 import sys
@@ -45,18 +42,17 @@ from lollms.utilities import PackageManager
 
 import inspect
 
-from lollms.code_parser import compress_js, compress_python, compress_html
+from lollms.code_parser import compress_js, compress_python, compress_html, CodeBlocksParser
 
 import requests
-from bs4 import BeautifulSoup
 import pipmaster as pm
-if not pm.is_installed("PyQt5"):
-    pm.install("PyQt5")
-    
-import sys
-from PyQt5.QtWidgets import QApplication, QLineEdit, QButtonGroup, QRadioButton, QVBoxLayout, QWidget, QMessageBox
+# PyQt5, Pillow, BeautifulSoup, pkg_resources and lollmsvectordb are imported by the methods that use them
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from PIL import Image
 
 def get_element_id(url, text):
+    from bs4 import BeautifulSoup
     response = requests.get(url)
     soup = BeautifulSoup(response.content, 'html.parser')
     element = soup.find('span', text=text)
@@ -76,6 +72,7 @@ def craft_a_tag_to_specific_text(url, text, caption):
     return anchor_url
 
 def is_package_installed(package_name):
+    import pkg_resources
     try:
         dist = pkg_resources.get_distribution(package_name)
         return True
@@ -133,19 +130,24 @@ class AIPersonality:
         """
         self.config = config
 
-        self.bot_says = ""
-
         self.lollms_paths = lollms_paths
         self.model = model
         self.callback = callback
         self.app = app
 
+        self.bot_says = ""
+
         self.text_files = []
         self.image_files = []
         self.audio_files = []
         self.images_descriptions = []
         self.vectorizer = None
 
+        # Tokens of the last prompt sent to the model for each (client, discussion) to compute the stable prefix of the next one
+        self.context_tokens_cache:Dict[tuple, list] = {}
+        # Last built context: (text, tokens, (client, discussion))
+        self.last_context:Tuple[str, list, tuple] = None
+
         self.installation_option = installation_option
 
         # Whisper to transcribe audio
@@ -153,7 +155,7 @@ class AIPersonality:
 
         # First setup a default personality
         # Version
-        self._version = pkg_resources.get_distribution('lollms').version
+        self._version = importlib.metadata.version('lollms')
 
         self.run_scripts = run_scripts
 
@@ -214,7 +216,7 @@ class AIPersonality:
 
         self._processor_cfg: dict = {}
 
-        self._logo: Optional[Image.Image] = None
+        self._logo: Optional["Image.Image"] = None
         self._processor = None
         self._data = None
 
@@ -271,11 +273,46 @@ class AIPersonality:
         ]
         )
         tokens = self.model.tokenize(prompt_data)
+        context_details["stable_prefix_tokens"] = self.update_stable_prefix(context_details, prompt_data, tokens)
         if return_tokens:
             return prompt_data, tokens
         else:
             return prompt_data
 
+    def update_stable_prefix(self, context_details, prompt_data:str, tokens:list)->int:
+        """
+        Records the context built for a client and discussion and returns the number of its leading tokens that are
+        unchanged since the last prompt sent to the model for the same client and discussion.
+        """
+        key = (context_details.get("client_id"), context_details.get("discussion_id"))
+        previous = self.context_tokens_cache.get(key)
+        self.last_context = (prompt_data, tokens, key)
+        return len(os.path.commonprefix([previous, tokens])) if previous else 0
+
+    def get_generation_hints(self, prompt:str)->dict:
+        """
+        Returns the optional generation parameters to send to the binding with this prompt.
+
+        For bindings that support prefix reuse, stable_prefix_tokens is the number of leading tokens of the prompt that
+        are identical to the previous prompt sent for the same client and discussion, so that they can skip the
+        prefill of that part. It is computed on the tokens of the prompt itself: text appended after the context can
+        change how its end is tokenized.
+        """
+        if self.last_context is None or not getattr(self.model, "supports_prefix_reuse", False):
+            return {}
+        context, tokens, key = self.last_context
+        if not prompt.startswith(context):
+            return {}
+        if len(prompt)>len(context):
+            tokens = self.model.tokenize(prompt)
+        previous = self.context_tokens_cache.pop(key, None)
+        stable_prefix = len(os.path.commonprefix([previous, tokens])) if previous else 0
+        self.context_tokens_cache[key] = tokens
+        if len(self.context_tokens_cache)>64:
+            # Forget the least recently used discussion
+            del self.context_tokens_cache[next(iter(self.context_tokens_cache))]
+        return {"stable_prefix_tokens":stable_prefix}
+
 
     def InfoMessage(self, content, duration:int=4, client_id=None, verbose:bool=True):
         if self.app:
@@ -1153,115 +1190,10 @@ Don't forget encapsulate the code inside a html code tag. This is mandatory.
             - 'type' (str): The type of the code block
             - 'is_complete' (bool): True if the block has a closing tag, False otherwise
         """        
-        remaining = text
-        bloc_index = 0
-        first_index = 0
-        indices = []
-        text_without_blocks = text
-        
-        # Find all code block delimiters
-        while len(remaining) > 0:
-            try:
-                index = remaining.index("```")
-                indices.append(index + first_index)
-                remaining = remaining[index + 3:]
-                first_index += index + 3
-                bloc_index += 1
-            except Exception as ex:
-                if bloc_index % 2 == 1:
-                    index = len(remaining)
-                    indices.append(index)
-                remaining = ""
-
-        code_blocks = []
-        is_start = True
-        
-        # Process code blocks and build text without blocks if requested
+        parser = CodeBlocksParser.parse(text)
         if return_remaining_text:
-            text_parts = []
-            last_end = 0
-            
-        for index, code_delimiter_position in enumerate(indices):
-            if is_start:
-                block_infos = {
-                    'index': len(code_blocks),
-                    'file_name': "",
-                    'section': "",
-                    'content': "",
-                    'type': "",
-                    'is_complete': False
-                }
-                
-                # Store text before code block if returning remaining text
-                if return_remaining_text:
-                    text_parts.append(text[last_end:code_delimiter_position].strip())
-                
-                # Check the preceding line for file name
-                preceding_text = text[:code_delimiter_position].strip().splitlines()
-                if preceding_text:
-                    last_line = preceding_text[-1].strip()
-                    if last_line.startswith("<file_name>") and last_line.endswith("</file_name>"):
-                        file_name = last_line[len("<file_name>"):-len("</file_name>")].strip()
-                        block_infos['file_name'] = file_name
-                    elif last_line.startswith("## filename:"):
-                        file_name = last_line[len("## filename:"):].strip()
-                        block_infos['file_name'] = file_name
-                    if last_line.startswith("<section>") and last_line.endswith("</section>"):
-                        section = last_line[len("<section>"):-len("</section>")].strip()
-                        block_infos['section'] = section
-
-                sub_text = text[code_delimiter_position + 3:]
-                if len(sub_text) > 0:
-                    try:
-                        find_space = sub_text.index(" ")
-                    except:
-                        find_space = int(1e10)
-                    try:
-                        find_return = sub_text.index("\n")
-                    except:
-                        find_return = int(1e10)
-                    next_index = min(find_return, find_space)
-                    if '{' in sub_text[:next_index]:
-                        next_index = 0
-                    start_pos = next_index
-                    
-                    if code_delimiter_position + 3 < len(text) and text[code_delimiter_position + 3] in ["\n", " ", "\t"]:
-                        block_infos["type"] = 'language-specific'
-                    else:
-                        block_infos["type"] = sub_text[:next_index]
-
-                    if index + 1 < len(indices):
-                        next_pos = indices[index + 1] - code_delimiter_position
-                        if next_pos - 3 < len(sub_text) and sub_text[next_pos - 3] == "`":
-                            block_infos["content"] = sub_text[start_pos:next_pos - 3].strip()
-                            block_infos["is_complete"] = True
-                        else:
-                            block_infos["content"] = sub_text[start_pos:next_pos].strip()
-                            block_infos["is_complete"] = False
-                        
-                        if return_remaining_text:
-                            last_end = indices[index + 1] + 3
-                    else:
-                        block_infos["content"] = sub_text[start_pos:].strip()
-                        block_infos["is_complete"] = False
-                        
-                        if return_remaining_text:
-                            last_end = len(text)
-                    
-                    code_blocks.append(block_infos)
-                is_start = False
-            else:
-                is_start = True
-                
-        if return_remaining_text:
-            # Add any remaining text after the last code block
-            if last_end < len(text):
-                text_parts.append(text[last_end:].strip())
-            # Join all non-code parts with newlines
-            text_without_blocks = '\n'.join(filter(None, text_parts))
-            return code_blocks, text_without_blocks
-            
-        return code_blocks
+            return parser.blocks, parser.remaining_text
+        return parser.blocks
 
 
 
@@ -1271,9 +1203,10 @@ Don't forget encapsulate the code inside a html code tag. This is mandatory.
         if text is None:
             return True
         if message_type==MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK:
-            bot_says = self.bot_says + text
+            antiprompt = self.bot_says_matcher.feed(text)
         elif  message_type==MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_SET_CONTENT:
-            bot_says = text
+            self.bot_says = text
+            antiprompt = self.bot_says_matcher.match
 
         if show_progress:
             if self.nb_received_tokens==0:
@@ -1288,17 +1221,23 @@ Don't forget encapsulate the code inside a html code tag. This is mandatory.
             self.nb_received_tokens+=1
 
 
-        antiprompt = self.detect_antiprompt(bot_says)
         if antiprompt:
-            self.bot_says = remove_text_from_string(bot_says,antiprompt)
             ASCIIColors.warning(f"\n{antiprompt} detected. Stopping generation")
             return False
         else:
             if callback:
                 callback(text,message_type)
-            self.bot_says = bot_says
             return True
 
+    @property
+    def bot_says(self) -> str:
+        """The text generated so far, without the antiprompt that stopped the generation."""
+        return self.bot_says_matcher.text
+
+    @bot_says.setter
+    def bot_says(self, text:str):
+        self.bot_says_matcher = StopSequenceMatcher(self.get_anti_prompts() if self.app is not None else [], text)
+
     def generate_with_images(self, prompt, images, max_size=None, temperature = None, top_k = None, top_p=None, repeat_penalty=None, repeat_last_n=None, callback=None, debug=False, show_progress=False ):
         ASCIIColors.info("Text generation started: Warming up")
         self.nb_received_tokens = 0
@@ -1309,17 +1248,20 @@ Don't forget encapsulate the code inside a html code tag. This is mandatory.
         if max_size is None:
             max_size = min(self.config.max_n_predict if self.config.max_n_predict else self.config.ctx_size-len(self.model.tokenize(prompt)), self.config.ctx_size-len(self.model.tokenize(prompt)))
 
-        self.model.generate_with_images(
-                                prompt,
-                                images,
-                                max_size,
-                                partial(self.process, callback=callback, show_progress=show_progress),
-                                temperature=self.model_temperature if temperature is None else temperature,
-                                top_k=self.model_top_k if top_k is None else top_k,
-                                top_p=self.model_top_p if top_p is None else top_p,
-                                repeat_penalty=self.model_repeat_penalty if repeat_penalty is None else repeat_penalty,
-                                repeat_last_n = self.model_repeat_last_n if repeat_last_n is None else repeat_last_n
-                                )
+        with generation_slot(self.app, self.model) as ticket:
+            if not ticket.cancelled:
+                self.model.generate_with_images(
+                                        prompt,
+                                        images,
+                                        max_size,
+                                        ticket.wrap_callback(partial(self.process, callback=callback, show_progress=show_progress)),
+                                        temperature=self.model_temperature if temperature is None else temperature,
+                                        top_k=self.model_top_k if top_k is None else top_k,
+                                        top_p=self.model_top_p if top_p is None else top_p,
+                                        repeat_penalty=self.model_repeat_penalty if repeat_penalty is None else repeat_penalty,
+                                        repeat_last_n = self.model_repeat_last_n if repeat_last_n is None else repeat_last_n,
+                                        **self.get_generation_hints(prompt)
+                                        )
         return self.bot_says
 
     def generate(self, prompt, max_size = None, temperature = None, top_k = None, top_p=None, repeat_penalty=None, repeat_last_n=None, callback=None, debug=False, show_progress=False ):
@@ -1330,16 +1272,19 @@ Don't forget encapsulate the code inside a html code tag. This is mandatory.
             self.print_prompt("gen",prompt)
         ntokens = len(self.model.tokenize(prompt))
         
-        self.model.generate(
-                                prompt,
-                                max_size if max_size else min(self.config.ctx_size-ntokens,self.config.max_n_predict if self.config.max_n_predict else self.config.ctx_size-ntokens),
-                                partial(self.process, callback=callback, show_progress=show_progress),
-                                temperature=self.model_temperature if temperature is None else temperature,
-                                top_k=self.model_top_k if top_k is None else top_k,
-                                top_p=self.model_top_p if top_p is None else top_p,
-                                repeat_penalty=self.model_repeat_penalty if repeat_penalty is None else repeat_penalty,
-                                repeat_last_n = self.model_repeat_last_n if repeat_last_n is None else repeat_last_n,
-                                )
+        with generation_slot(self.app, self.model) as ticket:
+            if not ticket.cancelled:
+                self.model.generate(
+                                        prompt,
+                                        max_size if max_size else min(self.config.ctx_size-ntokens,self.config.max_n_predict if self.config.max_n_predict else self.config.ctx_size-ntokens),
+                                        ticket.wrap_callback(partial(self.process, callback=callback, show_progress=show_progress)),
+                                        temperature=self.model_temperature if temperature is None else temperature,
+                                        top_k=self.model_top_k if top_k is None else top_k,
+                                        top_p=self.model_top_p if top_p is None else top_p,
+                                        repeat_penalty=self.model_repeat_penalty if repeat_penalty is None else repeat_penalty,
+                                        repeat_last_n = self.model_repeat_last_n if repeat_last_n is None else repeat_last_n,
+                                        **self.get_generation_hints(prompt)
+                                        )
         if debug:
             self.print_prompt("prompt", prompt+self.bot_says)
         
@@ -1574,6 +1519,7 @@ Don't forget encapsulate the code inside a html code tag. This is mandatory.
         # Check for a logo file
         self.logo_path = self.personality_package_path / "assets" / "logo.png"
         if self.logo_path.is_file():
+            from PIL import Image
             self._logo = Image.open(self.logo_path)
 
         # Get the assets folder path
@@ -1606,21 +1552,16 @@ Don't forget encapsulate the code inside a html code tag. This is mandatory.
         if self.data_path.exists():
             self.database_path = self.data_path / "db.sqlite"
             from lollmsvectordb.lollms_tokenizers.tiktoken_tokenizer import TikTokenTokenizer
+            from lollmsvectordb.vector_database import VectorDatabase
+            from lollmsvectordb.text_document_loader import TextDocumentsLoader
 
-            if self.config.rag_vectorizer == "semantic":
-                from lollmsvectordb.lollms_vectorizers.semantic_vectorizer import SemanticVectorizer
-                v = SemanticVectorizer()
-            elif self.config.rag_vectorizer == "tfidf":
-                from lollmsvectordb.lollms_vectorizers.tfidf_vectorizer import TFIDFVectorizer
-                v = TFIDFVectorizer()
-            elif self.config.rag_vectorizer == "openai":
-                from lollmsvectordb.lollms_vectorizers.openai_vectorizer import OpenAIVectorizer
-                v = OpenAIVectorizer(api_key=self.config.rag_vectorizer_openai_key)
-            elif self.config.rag_vectorizer == "ollama":
-                from lollmsvectordb.lollms_vectorizers.ollama_vectorizer import OllamaVectorizer
-                v = OllamaVectorizer(self.config.rag_vectorizer_model, self.config.rag_service_url)
-
-            self.persona_data_vectorizer = VectorDatabase(self.database_path, v, TikTokenTokenizer(), self.config.rag_chunk_size, self.config.rag_overlap)
+            v = vectorizers_registry.get_vectorizer(self.config)
+
+            # Only the files that changed since the last mount are vectorized
+            manifest = DocumentsManifest(self.data_path / "db.sqlite.manifest", [list(vectorizer_key(self.config)), self.config.rag_chunk_size, self.config.rag_overlap])
+            if not self.database_path.exists():
+                manifest.clear()
+            self.persona_data_vectorizer = VectorDatabase(self.database_path, v, TikTokenTokenizer(), self.config.rag_chunk_size, self.config.rag_overlap, reset=manifest.reset_required)
 
             files = [f for f in self.data_path.iterdir() if f.suffix.lower() in ['.asm', '.bat', '.c', '.cpp', '.cs', '.csproj', '.css',
                 '.csv', '.docx', '.h', '.hh', '.hpp', '.html', '.inc', '.ini', '.java', '.js', '.json', '.log',
@@ -1628,10 +1569,23 @@ Don't forget encapsulate the code inside a html code tag. This is mandatory.
                 '.snippet', '.snippets', '.sql', '.sym', '.ts', '.txt', '.xlsx', '.xml', '.yaml', '.yml', '.msg'] ]
             dl = TextDocumentsLoader()
 
-            for f in files:
-                text = dl.read_file(f)
-                self.persona_data_vectorizer.add_document(f.name, text, f)
-            self.persona_data_vectorizer.build_index()
+            changed, removed = manifest.scan(files)
+            for key in removed+[str(f) for f in changed]:
+                doc_hash = manifest.remove(key)
+                if doc_hash is not None:
+                    self.persona_data_vectorizer.remove_document(doc_hash)
+            for f in changed:
+                try:
+                    text = dl.read_file(f)
+                    self.persona_data_vectorizer.add_document(f.name, text, f)
+                    manifest.update(f, document_hash(text))
+                except Exception as ex:
+                    trace_exception(ex)
+                    ASCIIColors.error(f"Couldn't add {f} to the persona data")
+            if len(changed)>0 or len(removed)>0:
+                ASCIIColors.info(f"Persona data: {len(changed)} new or changed files, {len(removed)} removed files")
+                self.persona_data_vectorizer.build_index()
+            manifest.save()
 
         else:
             self.persona_data_vectorizer = None
@@ -1764,6 +1718,8 @@ Don't forget encapsulate the code inside a html code tag. This is mandatory.
             if callback is not None:
                 callback("Image file added successfully", MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_INFO)
         else:
+            from lollmsvectordb.vector_database import VectorDatabase
+            from lollmsvectordb.text_document_loader import TextDocumentsLoader
             try:
                 # self.ShowBlockingMessage("Adding file to vector store.\nPlease stand by")
                 self.text_files.append(path)
@@ -1771,22 +1727,8 @@ Don't forget encapsulate the code inside a html code tag. This is mandatory.
                 self.ShowBlockingMessage("Processing file\nPlease wait ...")
                 if process:
                     if self.vectorizer is None:
-                        if self.config.rag_vectorizer == "semantic":
-                            self.ShowBlockingMessage("Processing file\nPlease wait ...\nUsing semantic vectorizer")
-                            from lollmsvectordb.lollms_vectorizers.semantic_vectorizer import SemanticVectorizer
-                            v = SemanticVectorizer(self.config.rag_vectorizer_model, self.config.rag_vectorizer_execute_remote_code)
-                        elif self.config.rag_vectorizer == "tfidf":
-                            self.ShowBlockingMessage("Processing file\nPlease wait ...\nUsing tfidf vectorizer")
-                            from lollmsvectordb.lollms_vectorizers.tfidf_vectorizer import TFIDFVectorizer
-                            v = TFIDFVectorizer()
-                        elif self.config.rag_vectorizer == "openai":
-                            self.ShowBlockingMessage("Processing file\nPlease wait ...\nUsing open ai vectorizer")
-                            from lollmsvectordb.lollms_vectorizers.openai_vectorizer import OpenAIVectorizer
-                            v = OpenAIVectorizer()
-                        elif self.config.rag_vectorizer == "ollama":
-                            self.ShowBlockingMessage("Processing file\nPlease wait ...\nUsing ollama vectorizer")
-                            from lollmsvectordb.lollms_vectorizers.ollama_vectorizer import OllamaVectorizer
-                            v = OllamaVectorizer(self.config.rag_vectorizer_model, self.config.rag_service_url)
+                        self.ShowBlockingMessage(f"Processing file\nPlease wait ...\nUsing {self.config.rag_vectorizer} vectorizer")
+                        v = vectorizers_registry.get_vectorizer(self.config)
                         self.vectorizer = VectorDatabase(
                                     client.discussion.discussion_rag_folder/"db.sqli",
                                     v,
@@ -2509,6 +2451,12 @@ Don't forget encapsulate the code inside a html code tag. This is mandatory.
         Returns:
             bool: True if any antiprompt is found in the text (ignoring case), False otherwise.
         """
+        return StopSequenceMatcher(self.get_anti_prompts(), text).match
+
+    def get_anti_prompts(self) -> List[str]:
+        """
+        Gets the texts that mark the start of a new message (headers and separator). The generation is stopped when the model writes one of them.
+        """
         start_header_id_template        = self.config.start_header_id_template
         start_user_header_id_template   = self.config.start_user_header_id_template
         start_ai_header_id_template     = self.config.start_ai_header_id_template
@@ -2516,11 +2464,7 @@ Don't forget encapsulate the code inside a html code tag. This is mandatory.
         anti_prompts = [start_header_id_template, start_user_header_id_template, start_ai_header_id_template]
         if self.app.config.separator_template!="\n":
             anti_prompts.append(self.app.config.separator_template)
-
-        for prompt in anti_prompts:
-            if prompt.lower() in text.lower():
-                return prompt.lower()
-        return None
+        return anti_prompts
 
 
     # Helper functions
@@ -2591,6 +2535,7 @@ Don't forget encapsulate the code inside a html code tag. This is mandatory.
         while len(tk)>max_summary_size and (document_chunks is None or len(document_chunks)>1):
             self.step_start(f"Comprerssing {doc_name}...")
             chunk_size = int(self.config.ctx_size*0.6)
+            from lollmsvectordb.text_chunker import TextChunker
             document_chunks =TextChunker.chunk_text(text, self.model, chunk_size, 0, True)
             text = self.summarize_chunks(
                                             document_chunks,
@@ -2627,6 +2572,7 @@ Don't forget encapsulate the code inside a html code tag. This is mandatory.
         prev_len = len(tk)
         while len(tk)>max_summary_size:
             chunk_size = int(self.config.ctx_size*0.6)
+            from lollmsvectordb.text_chunker import TextChunker
             document_chunks = TextChunker.chunk_text(text, self.model, chunk_size, 0, True)
             text = self.summarize_chunks(
                                             document_chunks, 
@@ -3570,6 +3516,7 @@ class APScript(StateMachine):
         while len(tk)>max_summary_size and (document_chunks is None or len(document_chunks)>1):
             self.step_start(f"Comprerssing {doc_name}...")
             chunk_size = int(self.personality.config.ctx_size*0.6)
+            from lollmsvectordb.text_chunker import TextChunker
             document_chunks = TextChunker.chunk_text(text, self.personality.model, chunk_size, 0, True)
             text = self.summarize_chunks(
                                             document_chunks,
@@ -3607,6 +3554,7 @@ class APScript(StateMachine):
         prev_len = len(tk)
         while len(tk)>max_summary_size:
             chunk_size = int(self.personality.config.ctx_size*0.6)
+            from lollmsvectordb.text_chunker import TextChunker
             document_chunks = TextChunker.chunk_text(text, self.personality.model, chunk_size, 0, True)
             text = self.summarize_chunks(
                                             document_chunks, 
@@ -3969,19 +3917,8 @@ transition-all duration-300 ease-in-out">
     def vectorize_and_query(self, title, url, text, query, max_chunk_size=512, overlap_size=20, internet_vectorization_nb_chunks=3):
         
         from lollmsvectordb.lollms_tokenizers.tiktoken_tokenizer import TikTokenTokenizer
-        vectorizer = self.config.rag_vectorizer
-        if vectorizer == "semantic":
-            from lollmsvectordb.lollms_vectorizers.semantic_vectorizer import SemanticVectorizer
-            v = SemanticVectorizer(self.config.rag_vectorizer_model, self.config.rag_vectorizer_execute_remote_code)
-        elif vectorizer == "tfidf":
-            from lollmsvectordb.lollms_vectorizers.tfidf_vectorizer import TFIDFVectorizer
-            v = TFIDFVectorizer()
-        elif vectorizer == "openai":
-            from lollmsvectordb.lollms_vectorizers.openai_vectorizer import OpenAIVectorizer
-            v = OpenAIVectorizer()
-        elif self.config.rag_vectorizer == "ollama":
-            from lollmsvectordb.lollms_vectorizers.ollama_vectorizer import OllamaVectorizer
-            v = OllamaVectorizer(self.config.rag_vectorizer_model, self.config.rag_service_url)
+        from lollmsvectordb.vector_database import VectorDatabase
+        v = vectorizers_registry.get_vectorizer(self.config)
 
         vectorizer = VectorDatabase("", v, TikTokenTokenizer(), self.config.rag_chunk_size, self.config.rag_overlap)
         vectorizer.add_document(title, text, url)
@@ -4518,80 +4455,13 @@ transition-all duration-300 ease-in-out">
 
 
     def extract_code_blocks(self, text: str, return_remaining_text: bool = False) -> Union[List[dict], Tuple[List[dict], str]]:
-        codes = []
-        remaining_text = text
-        current_index = 0
-        
-        while True:
-            # Find next code block start
-            start_pos = remaining_text.find('```')
-            if start_pos == -1:
-                break
-                
-            # Check for file name before code block
-            file_name = ''
-            file_name_match = remaining_text[:start_pos].rfind('<file_name>')
-            if file_name_match != -1:
-                file_name_end = remaining_text[:start_pos].rfind('</file_name>')
-                if file_name_end != -1 and file_name_match < file_name_end:
-                    file_name = remaining_text[file_name_match + 11:file_name_end].strip()
-            
-            # Get code type if specified
-            code_type = ''
-            next_newline = remaining_text.find('\n', start_pos + 3)
-            if next_newline != -1:
-                potential_type = remaining_text[start_pos + 3:next_newline].strip()
-                if potential_type:
-                    code_type = potential_type
-                    start_pos = next_newline + 1
-                else:
-                    start_pos += 3
-            else:
-                start_pos += 3
-                
-            # Find matching end tag
-            tag_count = 1
-            pos = start_pos
-            content_start = start_pos
-            is_complete = False
-            
-            while pos < len(remaining_text):
-                if remaining_text[pos:pos + 3] == '```':
-                    tag_count -= 1
-                    if tag_count == 0:
-                        # Found matching end tag
-                        content = remaining_text[content_start:pos].strip()
-                        is_complete = True
-                        codes.append({
-                            'index': current_index,
-                            'file_name': file_name,
-                            'content': content,
-                            'type': code_type,
-                            'is_complete': True
-                        })
-                        remaining_text = remaining_text[pos + 3:]
-                        break
-                elif remaining_text[pos:pos + 3] == '```':
-                    tag_count += 1
-                pos += 1
-                
-            if not is_complete:
-                # Handle incomplete code block
-                content = remaining_text[content_start:].strip()
-                codes.append({
-                    'index': current_index,
-                    'file_name': file_name,
-                    'content': content,
-                    'type': code_type,
-                    'is_complete': False
-                })
-                remaining_text = ''
-                
-            current_index += 1
-        
+        """
+        Extracts the markdown code blocks of text (see AIPersonality.extract_code_blocks).
+        """
+        parser = CodeBlocksParser.parse(text)
         if return_remaining_text:
-            return codes, remaining_text
-        return codes
+            return parser.blocks, parser.remaining_text
+        return parser.blocks
 
 
 
@@ -4761,6 +4631,8 @@ transition-all duration-300 ease-in-out">
 
     def ask_user(self, question):
         try:
+            import_pyqt5()
+            from PyQt5.QtWidgets import QApplication, QLineEdit
             app = QApplication(sys.argv)
             input_field = QLineEdit(question)
             input_field.setWindowTitle("Input")
@@ -4773,6 +4645,8 @@ transition-all duration-300 ease-in-out">
 
     def ask_user_yes_no(self, question):
         try:
+            import_pyqt5()
+            from PyQt5.QtWidgets import QApplication, QMessageBox
             app = QApplication(sys.argv)
             msg = QMessageBox()
             msg.setIcon(QMessageBox.Question)
@@ -4787,7 +4661,8 @@ transition-all duration-300 ease-in-out">
 
     def ask_user_multichoice_question(self, question, choices, default=None):
         try:
-            from PyQt5.QtWidgets import QLabel, QPushButton
+            import_pyqt5()
+            from PyQt5.QtWidgets import QApplication, QButtonGroup, QRadioButton, QVBoxLayout, QWidget, QLabel, QPushButton
             app = QApplication(sys.argv)
             window = QWidget()
             layout = QVBoxLayout()
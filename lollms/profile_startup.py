@@ -0,0 +1,105 @@
+"""
+project: lollms
+file: profile_startup.py
+author: ParisNeo
+description:
+    Report of the time spent importing lollms modules and their dependencies.
+    The module is imported in a fresh interpreter with python -X importtime, so the numbers are the ones of a
+    cold start (the bytecode cache is used if it exists).
+
+    usage:
+        python -m lollms.profile_startup                        # profiles lollms.app
+        python -m lollms.profile_startup lollms.personality --top 30
+        python -m lollms.profile_startup --max-seconds 1.5      # fails if importing lollms.app takes longer
+
+"""
+from dataclasses import dataclass
+from typing import Dict, List
+import argparse
+import os
+import subprocess
+import sys
+
+
+@dataclass
+class ImportTime:
+    module: str
+    self_time: float    # seconds spent in the module itself
+    cumulative: float   # seconds including the modules it imported
+    depth: int
+
+
+def profile_imports(module:str="lollms.app", python:str=None)->List[ImportTime]:
+    """
+    Imports module in a new interpreter and returns the import time of every module it loaded, in import order.
+
+    Raises:
+        RuntimeError: if the module can't be imported.
+    """
+    env = dict(os.environ)
+    # The lollms package being profiled must be the one imported by the child interpreter
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join([package_root]+([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    process = subprocess.run(
+                                [python or sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                capture_output=True, text=True, env=env
+                            )
+    if process.returncode!=0:
+        raise RuntimeError(f"Couldn't import {module}:\n{process.stderr[-2000:]}")
+    times = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times.append(ImportTime(name.strip(), int(self_us)/1e6, int(cumulative_us)/1e6, (len(name)-len(name.lstrip()))//2))
+    return times
+
+
+def total_time(times:List[ImportTime], module:str)->float:
+    """Cumulative import time of module (the last entry with this name is the top level one)."""
+    for entry in reversed(times):
+        if entry.module==module:
+            return entry.cumulative
+    return 0
+
+
+def packages_time(times:List[ImportTime])->Dict[str, float]:
+    """Self time of the imported modules summed by top level package, slowest first."""
+    packages:Dict[str, float] = {}
+    for entry in times:
+        package = entry.module.split(".")[0]
+        packages[package] = packages.get(package, 0)+entry.self_time
+    return dict(sorted(packages.items(), key=lambda item: item[1], reverse=True))
+
+
+def print_report(module:str, times:List[ImportTime], top:int=20):
+    print(f"Import of {module}: {total_time(times, module):.3f}s, {len(times)} modules loaded")
+    print("\nSlowest modules (cumulative time, self time):")
+    for entry in sorted(times, key=lambda e: e.cumulative, reverse=True)[:top]:
+        print(f"  {entry.cumulative:8.3f}s {entry.self_time:8.3f}s  {entry.module}")
+    print("\nSlowest packages (self time of all their modules):")
+    for package, seconds in list(packages_time(times).items())[:top]:
+        print(f"  {seconds:8.3f}s  {package}")
+
+
+def main(argv=None)->int:
+    parser = argparse.ArgumentParser(description="Reports the time spent importing a lollms module and its dependencies.")
+    parser.add_argument("module", nargs="?", default="lollms.app", help="Module to import (default: lollms.app)")
+    parser.add_argument("--top", type=int, default=20, help="Number of modules and packages to list")
+    parser.add_argument("--max-seconds", type=float, default=None, help="Exit with an error if the import takes longer than this")
+    parser.add_argument("--runs", type=int, default=1, help="Number of imports, the fastest one is reported")
+    args = parser.parse_args(argv)
+
+    runs = [profile_imports(args.module) for _ in range(max(1, args.runs))]
+    times = min(runs, key=lambda times: total_time(times, args.module))
+    print_report(args.module, times, args.top)
+    if args.max_seconds is not None:
+        elapsed = total_time(times, args.module)
+        if elapsed>args.max_seconds:
+            print(f"\nImporting {args.module} took {elapsed:.3f}s, more than the allowed {args.max_seconds:.3f}s")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,7 +7,8 @@ description:
     application. These routes allow users to manipulate the discussion elements.
 
 """
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, UploadFile, File, Form
+from starlette.concurrency import run_in_threadpool
 from lollms.server.elf_server import LOLLMSElfServer
 from pydantic import BaseModel
 from starlette.responses import StreamingResponse
@@ -15,9 +16,11 @@ from lollms.types import MSG_OPERATION_TYPE
 from lollms.utilities import detect_antiprompt, remove_text_from_string, trace_exception
 from lollms.security import sanitize_path, check_access
 from ascii_colors import ASCIIColors
-from lollms.databases.discussions_database import DiscussionsDB, Discussion
-from typing import List
+from lollms.databases.discussions_database import DiscussionsDB, Discussion, Message
+from typing import List, Optional
 import shutil
+import json
+import io
 import tqdm
 from pathlib import Path
 class GenerateRequest(BaseModel):
@@ -68,6 +71,8 @@ def select_database(data:DatabaseSelectionParameters):
 
     print(f'Selecting database {data.name}')
     # Create database object
+    if getattr(lollmsElfServer, "db", None) is not None:
+        lollmsElfServer.db.close()
     lollmsElfServer.db = DiscussionsDB(lollmsElfServer, lollmsElfServer.lollms_paths, data.name)
     ASCIIColors.info("Checking discussions database... ",end="")
     lollmsElfServer.db.create_tables()
@@ -125,12 +130,37 @@ async def make_title(discussion_title: DiscussionTitle):
     
 class DatabaseExport(BaseModel):
     client_id: str
-
+    export_format: str = "json"
+
+# Media types of the streamed exports
+EXPORT_MEDIA_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "markdown": "text/markdown",
+}
+
+def stream_json_string(chunks):
+    """Streams text chunks as a single JSON string."""
+    yield '"'
+    for chunk in chunks:
+        yield json.dumps(chunk)[1:-1]
+    yield '"'
+
+def stream_export(chunks):
+    try:
+        yield from chunks
+    except Exception as ex:
+        # The response is already started, the export is truncated
+        trace_exception(ex)
+        lollmsElfServer.error(f"Export failed: {ex}")
 
 @router.post("/export")
 def export(databaseExport:DatabaseExport):
     check_access(lollmsElfServer, databaseExport.client_id)
-    return lollmsElfServer.db.export_to_json()
+    if databaseExport.export_format not in EXPORT_MEDIA_TYPES:
+        return {"status":False,"error":f"Unknown export format {databaseExport.export_format}"}
+    # The database is streamed as it is read, whatever its size
+    return StreamingResponse(stream_export(lollmsElfServer.db.stream_export(databaseExport.export_format)), media_type=EXPORT_MEDIA_TYPES[databaseExport.export_format])
 
 
 
@@ -180,13 +210,12 @@ async def export_multiple_discussions(discussion_export: DiscussionExport):
         discussion_ids = discussion_export.discussion_ids
         export_format = discussion_export.export_format
 
-        if export_format=="json":
-            discussions = lollmsElfServer.db.export_discussions_to_json(discussion_ids)
-        elif export_format=="markdown":
-            discussions = lollmsElfServer.db.export_discussions_to_markdown(discussion_ids)
-        else:
-            discussions = lollmsElfServer.db.export_discussions_to_markdown(discussion_ids)
-        return discussions
+        if export_format in ["json", "ndjson"]:
+            chunks = lollmsElfServer.db.stream_export(export_format, discussion_ids)
+            return StreamingResponse(stream_export(chunks), media_type=EXPORT_MEDIA_TYPES[export_format])
+        # The markdown export is sent as a JSON string, as it always was
+        chunks = lollmsElfServer.db.stream_export("markdown", discussion_ids)
+        return StreamingResponse(stream_export(stream_json_string(chunks)), media_type="application/json")
     except Exception as ex:
         trace_exception(ex)
         lollmsElfServer.error(ex)
@@ -214,6 +243,102 @@ async def import_multiple_discussions(discussion_import: DiscussionImport):
         lollmsElfServer.error(ex)
         return {"status":False,"error":str(ex)}
 
+@router.post("/import_discussions_file")
+async def import_discussions_file(client_id: str = Form(...), file: UploadFile = File(...)):
+    """
+    Imports an export file: a json list of discussions or an ndjson export, which is read line by line.
+    The import is done in a single transaction, nothing is imported if it fails.
+    The request is a multipart form with the client_id and the file.
+
+    Returns:
+        dict: The status and the import report (number of discussions and messages, duration, throughput).
+    """
+    check_access(lollmsElfServer, client_id)
+    def import_file():
+        # The uploaded file is spooled to disk, the ndjson lines are parsed as they are imported
+        text_file = io.TextIOWrapper(file.file, encoding="utf-8")
+        first_char = text_file.read(1)
+        while first_char.isspace():
+            first_char = text_file.read(1)
+        text_file.seek(0)
+        if first_char=="[":
+            return lollmsElfServer.db.import_from_json(json.load(text_file))
+        return lollmsElfServer.db.import_from_ndjson(text_file)
+    try:
+        report = await run_in_threadpool(import_file)
+        return {"status":True, **report}
+    except Exception as ex:
+        trace_exception(ex)
+        lollmsElfServer.error(ex)
+        return {"status":False,"error":str(ex)}
+
+
+class DiscussionMessagesPage(BaseModel):
+    client_id: str
+    discussion_id: Optional[int] = None
+    before_id: Optional[int] = None
+    limit: int = 50
+    heavy_fields: bool = True
+
+@router.post("/get_discussion_messages")
+async def get_discussion_messages(data: DiscussionMessagesPage):
+    """
+    Gets the messages of a discussion page by page, starting from the last ones.
+    The first page is requested without before_id, the next ones with the next_cursor returned by the previous page.
+    Without heavy_fields, the metadata, steps and ui of the messages are not sent.
+
+    Returns:
+        dict: The messages of the page ordered by id and the cursor of the previous page (None when the first message was sent).
+    """
+    client = check_access(lollmsElfServer, data.client_id)
+    try:
+        discussion = client.discussion
+        if data.discussion_id is not None and (discussion is None or discussion.discussion_id!=data.discussion_id):
+            # Discussion creates the folders of the discussion, it must not be built for an unknown id
+            if lollmsElfServer.db.select("SELECT 1 FROM discussion WHERE id=?", (data.discussion_id,), fetch_all=False) is None:
+                return {"status":False,"error":"Discussion not found"}
+            discussion = Discussion(lollmsElfServer, data.discussion_id, lollmsElfServer.db)
+        if discussion is None:
+            return {"status":False,"error":"No discussion selected"}
+        def get_page():
+            messages, next_cursor = discussion.get_messages_page(data.before_id, min(max(1, data.limit), 500), data.heavy_fields)
+            if data.heavy_fields:
+                return [message.to_json() for message in messages], next_cursor
+            fields = Message.get_light_fields()
+            return [{field:getattr(message, field) for field in fields} for message in messages], next_cursor
+        messages, next_cursor = await run_in_threadpool(get_page)
+        return {"status":True, "messages":messages, "next_cursor":next_cursor}
+    except Exception as ex:
+        trace_exception(ex)
+        lollmsElfServer.error(ex)
+        return {"status":False,"error":str(ex)}
+
+
+class DiscussionsSearch(BaseModel):
+    client_id: str
+    query: str
+    limit: int = 20
+    offset: int = 0
+    discussion_id: Optional[int] = None
+
+@router.post("/search_discussions")
+async def search_discussions(search: DiscussionsSearch):
+    """
+    Searches the messages of all the discussions (or of one discussion) containing all the words of the query.
+
+    Returns:
+        dict: The page of results, best matches first, with a snippet of each message and whether there are more results.
+    """
+    check_access(lollmsElfServer, search.client_id)
+    try:
+        limit = min(max(1, search.limit), 100)
+        found = await run_in_threadpool(lollmsElfServer.db.search_messages, search.query, limit, max(0, search.offset), search.discussion_id)
+        return {"status":True, **found}
+    except Exception as ex:
+        trace_exception(ex)
+        lollmsElfServer.error(ex)
+        return {"status":False,"error":str(ex)}
+
 
 
 # ------------------------------------------- Files manipulation -----------------------------------------------------
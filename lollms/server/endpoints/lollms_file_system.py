@@ -20,6 +20,9 @@ from lollms.utilities import load_config, trace_exception, gc, PackageManager, r
 from pathlib import Path
 from typing import List, Optional, Dict
 from lollms.security import check_access
+from lollms.databases.vectorizers_registry import vectorizers_registry, vector_databases_cache, open_vector_database, vectorizer_key
+from lollms.databases.documents_manifest import DocumentsManifest
+from lollms.databases.folder_vectorizer import FolderVectorizer
 from functools import partial
 import os
 import re
@@ -92,6 +95,44 @@ def open_file(file_types: List[str]) -> Optional[Path]:
     
 
 
+def vectorize_rag_folder(folder_path:Path, db_name:str):
+    """
+    Indexes the supported files of a folder into the datalake database {db_name}.sqlite stored in the folder.
+    Only the files that changed since the last run are vectorized and an interrupted run resumes where it stopped.
+    """
+    from lollmsvectordb import VectorDatabase
+    from lollmsvectordb.lollms_tokenizers.tiktoken_tokenizer import TikTokenTokenizer
+    config = lollmsElfServer.config
+    vector_db_path = Path(folder_path)/f"{db_name}.sqlite"
+    manifest = DocumentsManifest(vector_db_path.with_name(vector_db_path.name+".manifest"), [list(vectorizer_key(config)), config.rag_chunk_size, config.rag_overlap, config.rag_clean_chunks])
+    # Without a manifest we don't know what the database contains, it is rebuilt
+    reset = manifest.reset_required or not manifest.manifest_path.exists() or not vector_db_path.exists()
+    if reset:
+        manifest.clear()
+    # The database is modified, the next users must not get the old one from the cache
+    vector_databases_cache.invalidate(vector_db_path)
+    vdb = VectorDatabase(
+        vector_db_path,
+        vectorizers_registry.get_vectorizer(config),
+        lollmsElfServer.model if lollmsElfServer.model else TikTokenTokenizer(),
+        chunk_size=config.rag_chunk_size,
+        overlap=config.rag_overlap,
+        clean_chunks=config.rag_clean_chunks,
+        reset=reset
+    )
+    def show_progress(infos):
+        lollmsElfServer.ShowBlockingMessage(f"Vectorizing {db_name}\n{infos['documents']}/{infos['total']} documents\n{infos['docs_per_second']:.1f} docs/s - {infos['chunks_per_second']:.1f} chunks/s")
+    return FolderVectorizer(
+        folder_path,
+        vdb,
+        manifest,
+        follow_subfolders=config.rag_follow_subfolders,
+        parse_workers=config.rag_vectorization_parse_workers,
+        embed_workers=config.rag_vectorization_embed_workers,
+        batch_size=config.rag_vectorization_batch_size,
+        callback=show_progress
+    ).run()
+
 def select_rag_database(client) -> Optional[Dict[str, Path]]:
     """
     Opens a folder selection dialog and then a string input dialog to get the database name using PyQt5.
@@ -134,46 +175,7 @@ def select_rag_database(client) -> Optional[Dict[str, Path]]:
                     try:
                         lollmsElfServer.ShowBlockingMessage("Adding a new database.")
                         
-                        from lollmsvectordb import VectorDatabase
-                        from lollmsvectordb.text_document_loader import TextDocumentsLoader
-                        from lollmsvectordb.lollms_tokenizers.tiktoken_tokenizer import TikTokenTokenizer
-
-                        if lollmsElfServer.config.rag_vectorizer == "semantic":
-                            from lollmsvectordb.lollms_vectorizers.semantic_vectorizer import SemanticVectorizer
-                            v = SemanticVectorizer(lollmsElfServer.config.rag_vectorizer_model, lollmsElfServer.config.rag_vectorizer_execute_remote_code)
-                        elif lollmsElfServer.config.rag_vectorizer == "tfidf":
-                            from lollmsvectordb.lollms_vectorizers.tfidf_vectorizer import TFIDFVectorizer
-                            v = TFIDFVectorizer()
-                        elif lollmsElfServer.config.rag_vectorizer == "openai":
-                            from lollmsvectordb.lollms_vectorizers.openai_vectorizer import OpenAIVectorizer
-                            v = OpenAIVectorizer(lollmsElfServer.config.rag_vectorizer_openai_key)
-                        elif lollmsElfServer.config.rag_vectorizer == "ollama":
-                            from lollmsvectordb.lollms_vectorizers.ollama_vectorizer import OllamaVectorizer
-                            v = OllamaVectorizer(lollmsElfServer.config.rag_vectorizer_model, lollmsElfServer.config.rag_service_url)
-
-                        vdb = VectorDatabase(Path(folder_path)/f"{db_name}.sqlite", v, lollmsElfServer.model if lollmsElfServer.model else TikTokenTokenizer())
-                        # Get all files in the folder
-                        folder = Path(folder_path)
-                        file_types = [f"**/*{f}" if lollmsElfServer.config.rag_follow_subfolders else f"*{f}" for f in TextDocumentsLoader.get_supported_file_types()]
-                        files = []
-                        for file_type in file_types:
-                            files.extend(folder.glob(file_type))
-                        
-                        # Load and add each document to the database
-                        for fn in files:
-                            try:
-                                text = TextDocumentsLoader.read_file(fn)
-                                title = fn.stem  # Use the file name without extension as the title
-                                lollmsElfServer.ShowBlockingMessage(f"Adding a new database.\nAdding {title}")
-                                vdb.add_document(title, text, fn)
-                                print(f"Added document: {title}")
-                            except Exception as e:
-                                lollmsElfServer.error(f"Failed to add document {fn}: {e}")
-                                print(f"Failed to add document {fn}: {e}")
-                        if vdb.new_data: #New files are added, need reindexing
-                            lollmsElfServer.ShowBlockingMessage(f"Adding a new database.\nIndexing the database...")
-                            vdb.build_index()
-                            ASCIIColors.success("OK")
+                        vectorize_rag_folder(Path(folder_path), db_name)
                         lollmsElfServer.HideBlockingMessage()
                         run_async(partial(lollmsElfServer.sio.emit,'rag_db_added', {"datalake_name": db_name, "path": str(folder_path)}, to=client.client_id))
 
@@ -301,34 +303,16 @@ def toggle_mount_rag_database(database_infos: MountDatabase):
                 if db_entry['type']=="lollmsvectordb":
                     lollmsElfServer.ShowBlockingMessage(f"Mounting database {db_entry['alias']}")
                     try:
-                        from lollmsvectordb import VectorDatabase
-                        from lollmsvectordb.text_document_loader import TextDocumentsLoader
                         from lollmsvectordb.lollms_tokenizers.tiktoken_tokenizer import TikTokenTokenizer
 
-                        # Vectorizer selection logic
-                        if lollmsElfServer.config.rag_vectorizer == "semantic":
-                            from lollmsvectordb.lollms_vectorizers.semantic_vectorizer import SemanticVectorizer
-                            v = SemanticVectorizer(lollmsElfServer.config.rag_vectorizer_model, 
-                                                lollmsElfServer.config.rag_vectorizer_execute_remote_code)
-                        elif lollmsElfServer.config.rag_vectorizer == "tfidf":
-                            from lollmsvectordb.lollms_vectorizers.tfidf_vectorizer import TFIDFVectorizer
-                            v = TFIDFVectorizer()
-                        elif lollmsElfServer.config.rag_vectorizer == "openai":
-                            from lollmsvectordb.lollms_vectorizers.openai_vectorizer import OpenAIVectorizer
-                            v = OpenAIVectorizer(lollmsElfServer.config.rag_vectorizer_openai_key)
-                        elif lollmsElfServer.config.rag_vectorizer == "ollama":
-                            from lollmsvectordb.lollms_vectorizers.ollama_vectorizer import OllamaVectorizer
-                            v = OllamaVectorizer(lollmsElfServer.config.rag_vectorizer_model, 
-                                            lollmsElfServer.config.rag_service_url)
-
-                        vdb = VectorDatabase(
+                        vdb = open_vector_database(
+                            lollmsElfServer.config,
                             Path(db_entry['path'])/f"{database_infos.datalake_name}.sqlite",
-                            v,
                             lollmsElfServer.model if lollmsElfServer.model else TikTokenTokenizer(),
                             chunk_size=lollmsElfServer.config.rag_chunk_size,
                             clean_chunks=lollmsElfServer.config.rag_clean_chunks,
                             n_neighbors=lollmsElfServer.config.rag_n_chunks
-                        )       
+                        )
                         lollmsElfServer.config.datalakes[index]['mounted'] = True
                         lollmsElfServer.active_datalakes.append(lollmsElfServer.config.datalakes[index] | {
                             "binding": vdb
@@ -359,6 +343,9 @@ def toggle_mount_rag_database(database_infos: MountDatabase):
             lollmsElfServer.info(f"Datalake {database_infos.datalake_name} unmounted successfully")
         elif db_entry['type']=="lollmsvectordb":
             lollmsElfServer.config.datalakes[index]['mounted'] = False
+            for db in lollmsElfServer.active_datalakes:
+                if db["alias"] == database_infos.datalake_name:
+                    vector_databases_cache.release(db["binding"])
             lollmsElfServer.active_datalakes = [
                 db for db in lollmsElfServer.active_datalakes 
                 if db["alias"] != database_infos.datalake_name
@@ -406,49 +393,7 @@ async def vectorize_folder(database_infos: FolderInfos):
         try:
             lollmsElfServer.ShowBlockingMessage("Revectorizing the database.")
             
-            from lollmsvectordb.lollms_vectorizers.semantic_vectorizer import SemanticVectorizer
-            from lollmsvectordb import VectorDatabase
-            from lollmsvectordb.text_document_loader import TextDocumentsLoader
-            from lollmsvectordb.lollms_tokenizers.tiktoken_tokenizer import TikTokenTokenizer
-
-            if lollmsElfServer.config.rag_vectorizer == "semantic":
-                from lollmsvectordb.lollms_vectorizers.semantic_vectorizer import SemanticVectorizer
-                v = SemanticVectorizer(lollmsElfServer.config.rag_vectorizer_model, lollmsElfServer.config.rag_vectorizer_execute_remote_code)
-            elif lollmsElfServer.config.rag_vectorizer == "tfidf":
-                from lollmsvectordb.lollms_vectorizers.tfidf_vectorizer import TFIDFVectorizer
-                v = TFIDFVectorizer()
-            elif lollmsElfServer.config.rag_vectorizer == "openai":
-                from lollmsvectordb.lollms_vectorizers.openai_vectorizer import OpenAIVectorizer
-                v = OpenAIVectorizer(lollmsElfServer.config.rag_vectorizer_openai_key)
-            elif lollmsElfServer.config.rag_vectorizer == "ollama":
-                from lollmsvectordb.lollms_vectorizers.ollama_vectorizer import OllamaVectorizer
-                v = OllamaVectorizer(lollmsElfServer.config.rag_vectorizer_model, lollmsElfServer.config.rag_service_url)
-
-            vector_db_path = Path(folder_path)/f"{db_name}.sqlite"
-
-            vdb = VectorDatabase(vector_db_path, v, lollmsElfServer.model if lollmsElfServer.model else TikTokenTokenizer(), reset=True)
-            vdb.new_data = True
-            # Get all files in the folder
-            folder = Path(folder_path)
-            file_types = [f"**/*{f}" if lollmsElfServer.config.rag_follow_subfolders else f"*{f}" for f in TextDocumentsLoader.get_supported_file_types()]
-            files = []
-            for file_type in file_types:
-                files.extend(folder.glob(file_type))
-            
-            # Load and add each document to the database
-            for fn in files:
-                try:
-                    text = TextDocumentsLoader.read_file(fn)
-                    title = fn.stem  # Use the file name without extension as the title
-                    lollmsElfServer.ShowBlockingMessage(f"Adding a new database.\nAdding {title}")
-                    vdb.add_document(title, text, fn)
-                    print(f"Added document: {title}")
-                except Exception as e:
-                    lollmsElfServer.error(f"Failed to add document {fn}: {e}")
-            if vdb.new_data: #New files are added, need reindexing
-                lollmsElfServer.ShowBlockingMessage(f"Adding a new database.\nIndexing the database...")
-                vdb.build_index()
-                ASCIIColors.success("OK")
+            vectorize_rag_folder(Path(folder_path), db_name)
             lollmsElfServer.HideBlockingMessage()
             run_async(partial(lollmsElfServer.sio.emit,'rag_db_added', {"datalake_name": db_name, "path": str(folder_path)}, to=client.client_id))
 
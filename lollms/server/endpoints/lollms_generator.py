@@ -8,18 +8,17 @@ description:
 
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import PlainTextResponse
 from lollms.server.elf_server import LOLLMSElfServer
 from pydantic import BaseModel, ConfigDict
 from starlette.responses import StreamingResponse
 from lollms.types import MSG_OPERATION_TYPE
-from lollms.utilities import detect_antiprompt, remove_text_from_string, trace_exception
-from lollms.generation import RECEPTION_MANAGER, ROLE_CHANGE_DECISION, ROLE_CHANGE_OURTPUT
+from lollms.utilities import trace_exception
+from lollms.generation import RECEPTION_MANAGER, ROLE_CHANGE_DECISION, ROLE_CHANGE_OURTPUT, StreamingBridge, StopSequenceMatcher
 from ascii_colors import ASCIIColors
 import time
 import re
-import threading
 from typing import List, Optional, Union
 import random
 import string
@@ -44,10 +43,41 @@ elf_server = LOLLMSElfServer.get_instance()
 
 @router.get("/get_generation_status")
 def get_generation_status():
-    return {"status":elf_server.busy}
+    return {"status":elf_server.busy, "scheduler":elf_server.generation_scheduler.status(), "batcher":elf_server.generation_batcher.status()}
 
 
 # ----------------------------------- Generation -----------------------------------------
+def _client_id(http_request:Request)->str:
+    """Identifies the client of an http request for the generation scheduler fairness"""
+    return http_request.client.host if http_request.client else None
+
+def _anti_prompts()->List[str]:
+    """Headers that start a new message in the configured prompt format, the generated text is cut before them"""
+    config = elf_server.config
+    anti_prompts = [config.discussion_prompt_separator, config.start_header_id_template, config.start_user_header_id_template, config.start_ai_header_id_template]
+    if config.separator_template!="\n":
+        anti_prompts.append(config.separator_template)
+    return anti_prompts
+
+def _streaming_callback(reception_manager:RECEPTION_MANAGER, bridge:StreamingBridge):
+    """Builds the binding callback of a streaming endpoint: it pushes the text that can't be part of a new role header to the bridge"""
+    def callback(chunk, chunk_type:MSG_OPERATION_TYPE=MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
+        if chunk is None:
+            return
+
+        rx = reception_manager.new_chunk(chunk)
+        # Send the safe part of the text to the streaming response
+        if reception_manager.chunk and not bridge.push(reception_manager.chunk):
+            return False
+        return rx.status!=ROLE_CHANGE_DECISION.ROLE_CHANGED
+    return callback
+
+def _end_stream(reception_manager:RECEPTION_MANAGER, bridge:StreamingBridge):
+    """Sends the text held back at the end of the generation (it was not a header)"""
+    if reception_manager.flush():
+        bridge.push(reception_manager.chunk)
+    reception_manager.done = True
+
 class LollmsTokenizeRequest(BaseModel):
     prompt: str
     return_named: bool = False
@@ -99,7 +129,7 @@ class LollmsGenerateRequest(BaseModel):
     n_threads: Optional[int] = 8
 
 @router.post("/lollms_generate")
-async def lollms_generate(request: LollmsGenerateRequest):
+def lollms_generate(request: LollmsGenerateRequest, http_request: Request):
     """ Endpoint for generating text from prompts using the LoLLMs fastAPI server.
 
     Args:
@@ -127,7 +157,7 @@ async def lollms_generate(request: LollmsGenerateRequest):
 
     try:
         headers = { 'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'Connection': 'keep-alive',}
-        reception_manager=RECEPTION_MANAGER()
+        reception_manager=RECEPTION_MANAGER(_anti_prompts())
         prompt = request.prompt
         if elf_server.config.debug:
             ASCIIColors.yellow(prompt)
@@ -141,90 +171,63 @@ async def lollms_generate(request: LollmsGenerateRequest):
         stream = request.stream
         if elf_server.binding is not None:
             if stream:
-                new_output={"new_values":[]}
                 async def generate_chunks():
-                    lk = threading.Lock()
-
-                    def callback(chunk, chunk_type:MSG_OPERATION_TYPE=MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
-                        if elf_server.cancel_gen:
-                            return False
-                        
-                        if chunk is None:
-                            return
-
-                        rx = reception_manager.new_chunk(chunk)
-                        if rx.status!=ROLE_CHANGE_DECISION.MOVE_ON:
-                            if rx.status==ROLE_CHANGE_DECISION.PROGRESSING:
-                                return True
-                            elif rx.status==ROLE_CHANGE_DECISION.ROLE_CHANGED:
-                                return False
-                            else:
-                                chunk = chunk + rx.value
-
-                        # Yield each chunk of data
-                        lk.acquire()
-                        try:
-                            new_output["new_values"].append(reception_manager.chunk)
-                            lk.release()
-                            return True
-                        except Exception as ex:
-                            trace_exception(ex)
-                            lk.release()
-                            return False
-                        
+                    bridge = StreamingBridge()
+                    callback = _streaming_callback(reception_manager, bridge)
+
                     def chunks_builder():
                         if request.model_name in elf_server.binding.list_models() and elf_server.binding.model_name!=request.model_name:
                             elf_server.binding.build_model(request.model_name)    
 
-                        elf_server.binding.generate(
-                                                prompt, 
-                                                n_predict, 
-                                                callback=callback, 
-                                                temperature=request.temperature or elf_server.config.temperature
-                                            )
-                        reception_manager.done = True
-                    thread = threading.Thread(target=chunks_builder)
-                    thread.start()
+                        try:
+                            with elf_server.generation_scheduler.slot(_client_id(http_request), binding=elf_server.binding, abandoned=lambda: bridge.cancelled) as ticket:
+                                if not ticket.cancelled:
+                                    elf_server.generation_batcher.generate(
+                                                            elf_server.binding,
+                                                            prompt, 
+                                                            n_predict, 
+                                                            callback=ticket.wrap_callback(callback), 
+                                                            temperature=request.temperature or elf_server.config.temperature
+                                                        )
+                        finally:
+                            _end_stream(reception_manager, bridge)
+                    bridge.start(chunks_builder)
                     current_index = 0
-                    while (not reception_manager.done and elf_server.cancel_gen == False):
-                        while (not reception_manager.done and len(new_output["new_values"])==0):
-                            time.sleep(0.001)
-                        lk.acquire()
-                        for i in range(len(new_output["new_values"])):
-                            current_index += 1                        
-                            yield (new_output["new_values"][i])
-                        new_output["new_values"]=[]
-                        lk.release()
-                    elf_server.cancel_gen = False         
+                    async for chunk in bridge:
+                        current_index += 1                        
+                        yield (chunk)
                 return StreamingResponse(generate_chunks(), media_type="text/plain", headers=headers)
             else:
+                output = StopSequenceMatcher(_anti_prompts())
                 def callback(chunk, chunk_type:MSG_OPERATION_TYPE=MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
                     # Yield each chunk of data
                     if chunk is None:
                         return True
-                    reception_manager.reception_buffer += chunk
-                    antiprompt = elf_server.personality.detect_antiprompt(reception_manager.reception_buffer)
+                    antiprompt = output.feed(chunk)
                     if antiprompt:
                         ASCIIColors.warning(f"\n{antiprompt} detected. Stopping generation")
-                        reception_manager.reception_buffer = elf_server.remove_text_from_string(reception_manager.reception_buffer,antiprompt)
                         return False
 
 
                     return True
                 
-                elf_server.binding.generate(
-                                                prompt, 
-                                                n_predict, 
-                                                callback=callback,
-                                                temperature=request.temperature or elf_server.config.temperature
-                                            )
-                completion_tokens = len(elf_server.binding.tokenize(reception_manager.reception_buffer))
+                with elf_server.generation_scheduler.slot(_client_id(http_request), binding=elf_server.binding) as ticket:
+                    if not ticket.cancelled:
+                        elf_server.generation_batcher.generate(
+                                                        elf_server.binding,
+                                                        prompt, 
+                                                        n_predict, 
+                                                        callback=ticket.wrap_callback(callback),
+                                                        temperature=request.temperature or elf_server.config.temperature
+                                                    )
+                generated_text = output.text
+                completion_tokens = len(elf_server.binding.tokenize(generated_text))
                 ASCIIColors.yellow(f"Generated: {completion_tokens} tokens")
                 if elf_server.config.debug:
                     ASCIIColors.yellow("Output")        
-                    ASCIIColors.yellow(reception_manager.reception_buffer)        
+                    ASCIIColors.yellow(generated_text)        
 
-                return PlainTextResponse(reception_manager.reception_buffer)
+                return PlainTextResponse(generated_text)
         else:
             return None
     except Exception as ex:
@@ -240,25 +243,10 @@ async def lollms_embed(request: LollmsEmbed):
     if not pm.is_installed ("lollmsvectordb"):
         pm.install("lollmsvectordb")
     
-    from lollmsvectordb import VectorDatabase
-    from lollmsvectordb.text_document_loader import TextDocumentsLoader
-    from lollmsvectordb.lollms_tokenizers.tiktoken_tokenizer import TikTokenTokenizer
-    if elf_server.config.rag_vectorizer=="semantic":
-        from lollmsvectordb.lollms_vectorizers.semantic_vectorizer import SemanticVectorizer
-        vectorizer = SemanticVectorizer(elf_server.config.rag_vectorizer_model)
-    elif elf_server.config.rag_vectorizer=="tfidf":
-        from lollmsvectordb.lollms_vectorizers.tfidf_vectorizer import TFIDFVectorizer
-        vectorizer = TFIDFVectorizer()
-    elif elf_server.config.rag_vectorizer=="openai":
-        from lollmsvectordb.lollms_vectorizers.openai_vectorizer import OpenAIVectorizer
-        vectorizer = OpenAIVectorizer(elf_server.config.rag_vectorizer_model, elf_server.config.rag_vectorizer_openai_key)
-    elif elf_server.config.rag_vectorizer=="ollama":
-        from lollmsvectordb.lollms_vectorizers.ollama_vectorizer import OllamaVectorizer
-        vectorizer = OllamaVectorizer(elf_server.config.rag_vectorizer_model, elf_server.config.rag_service_url)
-
-    vdb = VectorDatabase("", vectorizer, None if elf_server.config.rag_vectorizer=="semantic" else elf_server.model if elf_server.model else TikTokenTokenizer(), n_neighbors=elf_server.config.rag_n_chunks)       
-
-    vector = vdb.vectorizer.vectorize([request.text])
+    from lollms.databases.vectorizers_registry import vectorizers_registry
+    vectorizer = vectorizers_registry.get_vectorizer(elf_server.config)
+
+    vector = vectorizer.vectorize([request.text])
     return {"vector":vector[0].tolist()}
 
 class LollmsGenerateRequest(BaseModel):
@@ -278,7 +266,7 @@ class LollmsGenerateRequest(BaseModel):
     n_threads: Optional[int] = 8
 
 @router.post("/lollms_generate_with_images")
-async def lollms_generate_with_images(request: LollmsGenerateRequest):
+def lollms_generate_with_images(request: LollmsGenerateRequest, http_request: Request):
     """ Endpoint for generating text from prompts using the LoLLMs fastAPI server.
 
     Args:
@@ -307,7 +295,7 @@ async def lollms_generate_with_images(request: LollmsGenerateRequest):
 
     try:
         headers = { 'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'Connection': 'keep-alive',}
-        reception_manager=RECEPTION_MANAGER()
+        reception_manager=RECEPTION_MANAGER(_anti_prompts())
         prompt = request.prompt
         encoded_images = request.images
         tokens = elf_server.model.tokenize(prompt)
@@ -341,62 +329,31 @@ async def lollms_generate_with_images(request: LollmsGenerateRequest):
                     image_file.write(base64.b64decode(padded_image))
                 image_files.append(image_path)            
             if stream:
-                new_output={"new_values":[]}
                 async def generate_chunks():
-                    lk = threading.Lock()
-
-                    def callback(chunk, chunk_type:MSG_OPERATION_TYPE=MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
-                        if elf_server.cancel_gen:
-                            return False
-                        
-                        if chunk is None:
-                            return
-
-                        rx = reception_manager.new_chunk(chunk)
-                        if rx.status!=ROLE_CHANGE_DECISION.MOVE_ON:
-                            if rx.status==ROLE_CHANGE_DECISION.PROGRESSING:
-                                return True
-                            elif rx.status==ROLE_CHANGE_DECISION.ROLE_CHANGED:
-                                return False
-                            else:
-                                chunk = chunk + rx.value
-
-                        # Yield each chunk of data
-                        lk.acquire()
-                        try:
-                            new_output["new_values"].append(reception_manager.chunk)
-                            lk.release()
-                            return True
-                        except Exception as ex:
-                            trace_exception(ex)
-                            lk.release()
-                            return False
-                        
+                    bridge = StreamingBridge()
+                    callback = _streaming_callback(reception_manager, bridge)
+
                     def chunks_builder():
                         if request.model_name in elf_server.binding.list_models() and elf_server.binding.model_name!=request.model_name:
                             elf_server.binding.build_model(request.model_name)    
 
-                        elf_server.binding.generate_with_images(
-                                                prompt,
-                                                image_files,
-                                                n_predict, 
-                                                callback=callback, 
-                                                temperature=request.temperature or elf_server.config.temperature
-                                            )
-                        reception_manager.done = True
-                    thread = threading.Thread(target=chunks_builder)
-                    thread.start()
+                        try:
+                            with elf_server.generation_scheduler.slot(_client_id(http_request), binding=elf_server.binding, abandoned=lambda: bridge.cancelled) as ticket:
+                                if not ticket.cancelled:
+                                    elf_server.binding.generate_with_images(
+                                                            prompt,
+                                                            image_files,
+                                                            n_predict, 
+                                                            callback=ticket.wrap_callback(callback), 
+                                                            temperature=request.temperature or elf_server.config.temperature
+                                                        )
+                        finally:
+                            _end_stream(reception_manager, bridge)
+                    bridge.start(chunks_builder)
                     current_index = 0
-                    while (not reception_manager.done and elf_server.cancel_gen == False):
-                        while (not reception_manager.done and len(new_output["new_values"])==0):
-                            time.sleep(0.001)
-                        lk.acquire()
-                        for i in range(len(new_output["new_values"])):
-                            current_index += 1                        
-                            yield (new_output["new_values"][i])
-                        new_output["new_values"]=[]
-                        lk.release()
-                    elf_server.cancel_gen = False         
+                    async for chunk in bridge:
+                        current_index += 1                        
+                        yield (chunk)
                 return StreamingResponse(generate_chunks(), media_type="text/plain", headers=headers)
             else:
                 def callback(chunk, chunk_type:MSG_OPERATION_TYPE=MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
@@ -405,23 +362,16 @@ async def lollms_generate_with_images(request: LollmsGenerateRequest):
                         return True
 
                     rx = reception_manager.new_chunk(chunk)
-                    if rx.status!=ROLE_CHANGE_DECISION.MOVE_ON:
-                        if rx.status==ROLE_CHANGE_DECISION.PROGRESSING:
-                            return True
-                        elif rx.status==ROLE_CHANGE_DECISION.ROLE_CHANGED:
-                            return False
-                        else:
-                            chunk = chunk + rx.value
-
-
-                    return True
-                elf_server.binding.generate_with_images(
-                                                prompt,
-                                                image_files,
-                                                n_predict, 
-                                                callback=callback,
-                                                temperature=request.temperature or elf_server.config.temperature
-                                            )
+                    return rx.status!=ROLE_CHANGE_DECISION.ROLE_CHANGED
+                with elf_server.generation_scheduler.slot(_client_id(http_request), binding=elf_server.binding) as ticket:
+                    if not ticket.cancelled:
+                        elf_server.binding.generate_with_images(
+                                                        prompt,
+                                                        image_files,
+                                                        n_predict, 
+                                                        callback=ticket.wrap_callback(callback),
+                                                        temperature=request.temperature or elf_server.config.temperature
+                                                    )
                 completion_tokens = len(elf_server.binding.tokenize(reception_manager.reception_buffer))
                 return PlainTextResponse(reception_manager.reception_buffer)
         else:
@@ -524,9 +474,9 @@ class ChatGenerationRequest(BaseModel):
 
 
 @router.post("/v1/chat/completions")
-async def v1_chat_completions(request: ChatGenerationRequest):
+def v1_chat_completions(request: ChatGenerationRequest, http_request: Request):
     try:
-        reception_manager=RECEPTION_MANAGER()
+        reception_manager=RECEPTION_MANAGER(_anti_prompts())
         messages = request.messages
         max_tokens = request.max_tokens if request.max_tokens>0 else elf_server.config.max_n_predict if elf_server.config.max_n_predict else elf_server.config.ctx_size
         temperature = request.temperature if  elf_server.config.temperature else elf_server.config.temperature
@@ -545,66 +495,36 @@ async def v1_chat_completions(request: ChatGenerationRequest):
         prompt_tokens = len(elf_server.binding.tokenize(prompt))
         if elf_server.binding is not None:
             if stream:
-                new_output={"new_values":[]}
                 async def generate_chunks():
-                    lk = threading.Lock()
-
-                    def callback(chunk, chunk_type:MSG_OPERATION_TYPE=MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
-                        if elf_server.cancel_gen:
-                            return False
-                        
-                        if chunk is None:
-                            return
-
-                        rx = reception_manager.new_chunk(chunk)
-                        if rx.status!=ROLE_CHANGE_DECISION.MOVE_ON:
-                            if rx.status==ROLE_CHANGE_DECISION.PROGRESSING:
-                                return True
-                            elif rx.status==ROLE_CHANGE_DECISION.ROLE_CHANGED:
-                                return False
-                            else:
-                                chunk = chunk + rx.value
-
-                        # Yield each chunk of data
-                        lk.acquire()
-                        try:
-                            new_output["new_values"].append(reception_manager.chunk)
-                            lk.release()
-                            return True
-                        except Exception as ex:
-                            trace_exception(ex)
-                            lk.release()
-                            return False
-                        
+                    bridge = StreamingBridge()
+                    callback = _streaming_callback(reception_manager, bridge)
+
                     def chunks_builder():
-                        elf_server.binding.generate(
-                                                prompt, 
-                                                n_predict, 
-                                                callback=callback, 
-                                                temperature=temperature
-                                            )
-                        reception_manager.done = True
-                    thread = threading.Thread(target=chunks_builder)
-                    thread.start()
+                        try:
+                            with elf_server.generation_scheduler.slot(_client_id(http_request), binding=elf_server.binding, abandoned=lambda: bridge.cancelled) as ticket:
+                                if not ticket.cancelled:
+                                    elf_server.generation_batcher.generate(
+                                                            elf_server.binding,
+                                                            prompt, 
+                                                            n_predict, 
+                                                            callback=ticket.wrap_callback(callback), 
+                                                            temperature=temperature
+                                                        )
+                        finally:
+                            _end_stream(reception_manager, bridge)
+                    bridge.start(chunks_builder)
                     current_index = 0
-                    while (not reception_manager.done and elf_server.cancel_gen == False):
-                        while (not reception_manager.done and len(new_output["new_values"])==0):
-                            time.sleep(0.001)
-                        lk.acquire()
-                        for i in range(len(new_output["new_values"])):
-                            output_val = StreamingModelResponse(
-                                id = _generate_id(), 
-                                choices = [StreamingChoices(index= current_index, delta=Delta(content=new_output["new_values"][i]))], 
-                                created=int(time.time()),
-                                model=elf_server.config.model_name,
-                                object="chat.completion.chunk",
-                                usage=Usage(prompt_tokens= prompt_tokens, completion_tokens= 1)
-                                )
-                            current_index += 1                        
-                            yield (output_val.json() + '\n')
-                        new_output["new_values"]=[]
-                        lk.release()
-                    elf_server.cancel_gen = False         
+                    async for chunk in bridge:
+                        output_val = StreamingModelResponse(
+                            id = _generate_id(), 
+                            choices = [StreamingChoices(index= current_index, delta=Delta(content=chunk))], 
+                            created=int(time.time()),
+                            model=elf_server.config.model_name,
+                            object="chat.completion.chunk",
+                            usage=Usage(prompt_tokens= prompt_tokens, completion_tokens= 1)
+                            )
+                        current_index += 1                        
+                        yield (output_val.json() + '\n')
                 return StreamingResponse(generate_chunks(), media_type="application/json")
             else:
                 def callback(chunk, chunk_type:MSG_OPERATION_TYPE=MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
@@ -613,22 +533,16 @@ async def v1_chat_completions(request: ChatGenerationRequest):
                         return True
 
                     rx = reception_manager.new_chunk(chunk)
-                    if rx.status!=ROLE_CHANGE_DECISION.MOVE_ON:
-                        if rx.status==ROLE_CHANGE_DECISION.PROGRESSING:
-                            return True
-                        elif rx.status==ROLE_CHANGE_DECISION.ROLE_CHANGED:
-                            return False
-                        else:
-                            chunk = chunk + rx.value
-
-
-                    return True
-                elf_server.binding.generate(
-                                                prompt, 
-                                                n_predict, 
-                                                callback=callback,
-                                                temperature=temperature
-                                            )
+                    return rx.status!=ROLE_CHANGE_DECISION.ROLE_CHANGED
+                with elf_server.generation_scheduler.slot(_client_id(http_request), binding=elf_server.binding) as ticket:
+                    if not ticket.cancelled:
+                        elf_server.generation_batcher.generate(
+                                                        elf_server.binding,
+                                                        prompt, 
+                                                        n_predict, 
+                                                        callback=ticket.wrap_callback(callback),
+                                                        temperature=temperature
+                                                    )
                 completion_tokens = len(elf_server.binding.tokenize(reception_manager.reception_buffer))
                 return ModelResponse(id = _generate_id(), choices = [Choices(message=Message(role="assistant", content=reception_manager.reception_buffer), finish_reason="stop", index=0)], created=int(time.time()), model=request.model,usage=Usage(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens))
         else:
@@ -666,9 +580,9 @@ class OllamaModelResponse(BaseModel):
 
 
 @router.post("/api/chat")
-async def ollama_chat_completion(request: ChatGenerationRequest):
+def ollama_chat_completion(request: ChatGenerationRequest, http_request: Request):
     try:
-        reception_manager=RECEPTION_MANAGER()
+        reception_manager=RECEPTION_MANAGER(_anti_prompts())
         messages = request.messages
         max_tokens = request.max_tokens if request.max_tokens>0 else elf_server.config.max_n_predict if elf_server.config.max_n_predict else elf_server.config.ctx_size
         temperature = request.temperature if  elf_server.config.temperature else elf_server.config.temperature
@@ -687,66 +601,36 @@ async def ollama_chat_completion(request: ChatGenerationRequest):
         prompt_tokens = len(elf_server.binding.tokenize(prompt))
         if elf_server.binding is not None:
             if stream:
-                new_output={"new_values":[]}
                 async def generate_chunks():
-                    lk = threading.Lock()
-
-                    def callback(chunk, chunk_type:MSG_OPERATION_TYPE=MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
-                        if elf_server.cancel_gen:
-                            return False
-                        
-                        if chunk is None:
-                            return
-
-                        rx = reception_manager.new_chunk(chunk)
-                        if rx.status!=ROLE_CHANGE_DECISION.MOVE_ON:
-                            if rx.status==ROLE_CHANGE_DECISION.PROGRESSING:
-                                return True
-                            elif rx.status==ROLE_CHANGE_DECISION.ROLE_CHANGED:
-                                return False
-                            else:
-                                chunk = chunk + rx.value
-
-                        # Yield each chunk of data
-                        lk.acquire()
-                        try:
-                            new_output["new_values"].append(reception_manager.chunk)
-                            lk.release()
-                            return True
-                        except Exception as ex:
-                            trace_exception(ex)
-                            lk.release()
-                            return False
-                        
+                    bridge = StreamingBridge()
+                    callback = _streaming_callback(reception_manager, bridge)
+
                     def chunks_builder():
-                        elf_server.binding.generate(
-                                                prompt, 
-                                                n_predict, 
-                                                callback=callback, 
-                                                temperature=temperature
-                                            )
-                        reception_manager.done = True
-                    thread = threading.Thread(target=chunks_builder)
-                    thread.start()
+                        try:
+                            with elf_server.generation_scheduler.slot(_client_id(http_request), binding=elf_server.binding, abandoned=lambda: bridge.cancelled) as ticket:
+                                if not ticket.cancelled:
+                                    elf_server.generation_batcher.generate(
+                                                            elf_server.binding,
+                                                            prompt, 
+                                                            n_predict, 
+                                                            callback=ticket.wrap_callback(callback), 
+                                                            temperature=temperature
+                                                        )
+                        finally:
+                            _end_stream(reception_manager, bridge)
+                    bridge.start(chunks_builder)
                     current_index = 0
-                    while (not reception_manager.done and elf_server.cancel_gen == False):
-                        while (not reception_manager.done and len(new_output["new_values"])==0):
-                            time.sleep(0.001)
-                        lk.acquire()
-                        for i in range(len(new_output["new_values"])):
-                            output_val = StreamingModelResponse(
-                                id = _generate_id(), 
-                                choices = [StreamingChoices(index= current_index, delta=Delta(content=new_output["new_values"][i]))], 
-                                created=int(time.time()),
-                                model=elf_server.config.model_name,
-                                object="chat.completion.chunk",
-                                usage=Usage(prompt_tokens= prompt_tokens, completion_tokens= 1)
-                                )
-                            current_index += 1                        
-                            yield (output_val.json() + '\n')
-                        new_output["new_values"]=[]
-                        lk.release()
-                    elf_server.cancel_gen = False         
+                    async for chunk in bridge:
+                        output_val = StreamingModelResponse(
+                            id = _generate_id(), 
+                            choices = [StreamingChoices(index= current_index, delta=Delta(content=chunk))], 
+                            created=int(time.time()),
+                            model=elf_server.config.model_name,
+                            object="chat.completion.chunk",
+                            usage=Usage(prompt_tokens= prompt_tokens, completion_tokens= 1)
+                            )
+                        current_index += 1                        
+                        yield (output_val.json() + '\n')
                 return StreamingResponse(generate_chunks(), media_type="application/json")
             else:
                 def callback(chunk, chunk_type:MSG_OPERATION_TYPE=MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
@@ -755,22 +639,16 @@ async def ollama_chat_completion(request: ChatGenerationRequest):
                         return True
 
                     rx = reception_manager.new_chunk(chunk)
-                    if rx.status!=ROLE_CHANGE_DECISION.MOVE_ON:
-                        if rx.status==ROLE_CHANGE_DECISION.PROGRESSING:
-                            return True
-                        elif rx.status==ROLE_CHANGE_DECISION.ROLE_CHANGED:
-                            return False
-                        else:
-                            chunk = chunk + rx.value
-
-
-                    return True
-                elf_server.binding.generate(
-                                                prompt, 
-                                                n_predict, 
-                                                callback=callback,
-                                                temperature=temperature
-                                            )
+                    return rx.status!=ROLE_CHANGE_DECISION.ROLE_CHANGED
+                with elf_server.generation_scheduler.slot(_client_id(http_request), binding=elf_server.binding) as ticket:
+                    if not ticket.cancelled:
+                        elf_server.generation_batcher.generate(
+                                                        elf_server.binding,
+                                                        prompt, 
+                                                        n_predict, 
+                                                        callback=ticket.wrap_callback(callback),
+                                                        temperature=temperature
+                                                    )
                 completion_tokens = len(elf_server.binding.tokenize(reception_manager.reception_buffer))
                 return OllamaModelResponse(id = _generate_id(), choices = [Choices(message=Message(role="assistant", content=reception_manager.reception_buffer), finish_reason="stop", index=0)], created=int(time.time()), model=request.model,usage=Usage(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens))
         else:
@@ -808,17 +686,13 @@ class CompletionGenerationRequest(BaseModel):
 
 @router.options("/api/generate")
 @router.post("/api/generate")
-async def ollama_generate(request: CompletionGenerationRequest):
+def ollama_generate(request: CompletionGenerationRequest, http_request: Request):
     """
     Executes Python code and returns the output.
 
     :param request: The HTTP request object.
     :return: A JSON response with the status of the operation.
     """
-    start_header_id_template    = elf_server.config.start_header_id_template
-    end_header_id_template      = elf_server.config.end_header_id_template
-    separator_template          = elf_server.config.separator_template
-
     try:
         start_time = time.perf_counter_ns()
         ASCIIColors.cyan("> Ollama Server emulator: Received request")
@@ -843,56 +717,62 @@ async def ollama_generate(request: CompletionGenerationRequest):
         ASCIIColors.cyan("> Processing ...")
         if elf_server.binding is not None:
             if stream:
-                output = {"text":""}
-                def generate_chunks():
-                    def callback(chunk, chunk_type:MSG_OPERATION_TYPE=MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
-                        # Yield each chunk of data
-                        output["text"] += chunk
-                        antiprompt = detect_antiprompt(output["text"], [start_header_id_template, end_header_id_template])
-                        if antiprompt:
-                            ASCIIColors.warning(f"\n{antiprompt} detected. Stopping generation")
-                            output["text"] = remove_text_from_string(output["text"],antiprompt)
-                            return False
-                        else:
-                            yield chunk
-                            return True
-                    return iter(elf_server.binding.generate(
-                                                text, 
-                                                n_predict, 
-                                                callback=callback, 
-                                                temperature=temperature,
-                            ))
+                reception_manager=RECEPTION_MANAGER(_anti_prompts())
+                async def generate_chunks():
+                    bridge = StreamingBridge()
+                    callback = _streaming_callback(reception_manager, bridge)
+
+                    def chunks_builder():
+                        try:
+                            with elf_server.generation_scheduler.slot(_client_id(http_request), binding=elf_server.binding, abandoned=lambda: bridge.cancelled) as ticket:
+                                if not ticket.cancelled:
+                                    elf_server.generation_batcher.generate(
+                                                            elf_server.binding,
+                                                            text, 
+                                                            n_predict, 
+                                                            callback=ticket.wrap_callback(callback), 
+                                                            temperature=temperature,
+                                                        )
+                        finally:
+                            _end_stream(reception_manager, bridge)
+                    bridge.start(chunks_builder)
+                    async for chunk in bridge:
+                        yield json.dumps(dict(response_data, response=chunk)) + "\n"
+                    response_data["total_duration"] = time.perf_counter_ns() - start_time
+                    response_data["done"] = True
+                    yield json.dumps(response_data) + "\n"
                 ASCIIColors.success("> Streaming ...")                
-                return StreamingResponse(generate_chunks())
+                return StreamingResponse(generate_chunks(), media_type="application/x-ndjson")
             else:
-                output = {"text":""}
+                output = StopSequenceMatcher(_anti_prompts())
                 def callback(chunk, chunk_type:MSG_OPERATION_TYPE=MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
                     if chunk is None:
                         return
                     # Yield each chunk of data
-                    output["text"] += chunk
-                    antiprompt = detect_antiprompt(output["text"])
+                    antiprompt = output.feed(chunk)
                     if antiprompt:
                         ASCIIColors.warning(f"\n{antiprompt} detected. Stopping generation")
-                        output["text"] = remove_text_from_string(output["text"],antiprompt)
                         ASCIIColors.success("Done")                
                         return False
                     else:
                         return True
-                elf_server.binding.generate(
-                                                text, 
-                                                n_predict, 
-                                                callback=callback,
-                                                temperature=request.temperature if request.temperature>=0 else elf_server.config.temperature
-                                            )
+                with elf_server.generation_scheduler.slot(_client_id(http_request), binding=elf_server.binding) as ticket:
+                    if not ticket.cancelled:
+                        elf_server.generation_batcher.generate(
+                                                        elf_server.binding,
+                                                        text, 
+                                                        n_predict, 
+                                                        callback=ticket.wrap_callback(callback),
+                                                        temperature=request.temperature if request.temperature>=0 else elf_server.config.temperature
+                                                    )
                 ASCIIColors.success("> Done")
                 response_data["total_duration"] = time.perf_counter_ns() - start_time
                 response_data["load_duration"] = 0
                 response_data["prompt_eval_count"] = len(request.prompt.split())
                 response_data["prompt_eval_duration"] = time.perf_counter_ns() - start_time
-                response_data["eval_count"] = len(elf_server.binding.tokenize(output["text"]))  # Simulated number of tokens in the response
+                response_data["eval_count"] = len(elf_server.binding.tokenize(output.text))  # Simulated number of tokens in the response
                 response_data["eval_duration"] = time.perf_counter_ns() - start_time
-                response_data["response"] = output["text"]
+                response_data["response"] = output.text
                 response_data["done"] = True
                 return response_data
         else:
@@ -907,7 +787,7 @@ async def ollama_generate(request: CompletionGenerationRequest):
 
 
 @router.post("/instruct/generate")
-async def ollama_completion(request: CompletionGenerationRequest):
+def ollama_completion(request: CompletionGenerationRequest, http_request: Request):
     """
     Executes Python code and returns the output.
 
@@ -915,7 +795,7 @@ async def ollama_completion(request: CompletionGenerationRequest):
     :return: A JSON response with the status of the operation.
     """
     try:
-        reception_manager=RECEPTION_MANAGER()
+        reception_manager=RECEPTION_MANAGER(_anti_prompts())
         prompt = request.prompt
         n_predict = request.max_tokens if request.max_tokens>=0 else elf_server.config.max_n_predict
         temperature = request.temperature if request.temperature>=0 else elf_server.config.temperature
@@ -927,61 +807,31 @@ async def ollama_completion(request: CompletionGenerationRequest):
         
         if elf_server.binding is not None:
             if stream:
-                new_output={"new_values":[]}
                 async def generate_chunks():
-                    lk = threading.Lock()
-
-                    def callback(chunk, chunk_type:MSG_OPERATION_TYPE=MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
-                        if elf_server.cancel_gen:
-                            return False
-                        
-                        if chunk is None:
-                            return
-
-                        rx = reception_manager.new_chunk(chunk)
-                        if rx.status!=ROLE_CHANGE_DECISION.MOVE_ON:
-                            if rx.status==ROLE_CHANGE_DECISION.PROGRESSING:
-                                return True
-                            elif rx.status==ROLE_CHANGE_DECISION.ROLE_CHANGED:
-                                return False
-                            else:
-                                chunk = chunk + rx.value
-
-                        # Yield each chunk of data
-                        lk.acquire()
-                        try:
-                            new_output["new_values"].append(reception_manager.chunk)
-                            lk.release()
-                            return True
-                        except Exception as ex:
-                            trace_exception(ex)
-                            lk.release()
-                            return False
-                        
+                    bridge = StreamingBridge()
+                    callback = _streaming_callback(reception_manager, bridge)
+
                     def chunks_builder():
                         if request.model in elf_server.binding.list_models() and elf_server.binding.model_name!=request.model:
                             elf_server.binding.build_model(request.model)    
 
-                        elf_server.binding.generate(
-                                                prompt, 
-                                                n_predict, 
-                                                callback=callback, 
-                                                temperature=temperature or elf_server.config.temperature
-                                            )
-                        reception_manager.done = True
-                    thread = threading.Thread(target=chunks_builder)
-                    thread.start()
+                        try:
+                            with elf_server.generation_scheduler.slot(_client_id(http_request), binding=elf_server.binding, abandoned=lambda: bridge.cancelled) as ticket:
+                                if not ticket.cancelled:
+                                    elf_server.generation_batcher.generate(
+                                                            elf_server.binding,
+                                                            prompt, 
+                                                            n_predict, 
+                                                            callback=ticket.wrap_callback(callback), 
+                                                            temperature=temperature or elf_server.config.temperature
+                                                        )
+                        finally:
+                            _end_stream(reception_manager, bridge)
+                    bridge.start(chunks_builder)
                     current_index = 0
-                    while (not reception_manager.done and elf_server.cancel_gen == False):
-                        while (not reception_manager.done and len(new_output["new_values"])==0):
-                            time.sleep(0.001)
-                        lk.acquire()
-                        for i in range(len(new_output["new_values"])):
-                            current_index += 1                        
-                            yield {"response":new_output["new_values"][i]}
-                        new_output["new_values"]=[]
-                        lk.release()
-                    elf_server.cancel_gen = False         
+                    async for chunk in bridge:
+                        current_index += 1                        
+                        yield json.dumps({"response":chunk}) + "\n"
                 return StreamingResponse(generate_chunks(), media_type="text/plain")
             else:
                 def callback(chunk, chunk_type:MSG_OPERATION_TYPE=MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
@@ -990,22 +840,16 @@ async def ollama_completion(request: CompletionGenerationRequest):
                         return True
 
                     rx = reception_manager.new_chunk(chunk)
-                    if rx.status!=ROLE_CHANGE_DECISION.MOVE_ON:
-                        if rx.status==ROLE_CHANGE_DECISION.PROGRESSING:
-                            return True
-                        elif rx.status==ROLE_CHANGE_DECISION.ROLE_CHANGED:
-                            return False
-                        else:
-                            chunk = chunk + rx.value
-
-
-                    return True
-                elf_server.binding.generate(
-                                                prompt, 
-                                                n_predict, 
-                                                callback=callback,
-                                                temperature=request.temperature or elf_server.config.temperature
-                                            )
+                    return rx.status!=ROLE_CHANGE_DECISION.ROLE_CHANGED
+                with elf_server.generation_scheduler.slot(_client_id(http_request), binding=elf_server.binding) as ticket:
+                    if not ticket.cancelled:
+                        elf_server.generation_batcher.generate(
+                                                        elf_server.binding,
+                                                        prompt, 
+                                                        n_predict, 
+                                                        callback=ticket.wrap_callback(callback),
+                                                        temperature=request.temperature or elf_server.config.temperature
+                                                    )
                 return {"response":reception_manager.reception_buffer}
     except Exception as ex:
         trace_exception(ex)
@@ -1014,7 +858,7 @@ async def ollama_completion(request: CompletionGenerationRequest):
 
 
 @router.post("/v1/completions")
-async def v1_completion(request: CompletionGenerationRequest):
+def v1_completion(request: CompletionGenerationRequest, http_request: Request):
     """
     Executes Python code and returns the output.
 
@@ -1033,46 +877,48 @@ async def v1_completion(request: CompletionGenerationRequest):
         
         if elf_server.binding is not None:
             if stream:
-                output = {"text":""}
-                def generate_chunks():
-                    def callback(chunk, chunk_type:MSG_OPERATION_TYPE=MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
-                        # Yield each chunk of data
-                        output["text"] += chunk
-                        antiprompt = detect_antiprompt(output["text"])
-                        if antiprompt:
-                            ASCIIColors.warning(f"\n{antiprompt} detected. Stopping generation")
-                            output["text"] = remove_text_from_string(output["text"],antiprompt)
-                            return False
-                        else:
-                            yield chunk
-                            return True
-                    return iter(elf_server.binding.generate(
-                                                text, 
-                                                n_predict, 
-                                                callback=callback, 
-                                                temperature=temperature,
-                            ))
-                
-                return StreamingResponse(generate_chunks())
+                reception_manager=RECEPTION_MANAGER(_anti_prompts())
+                async def generate_chunks():
+                    bridge = StreamingBridge()
+                    callback = _streaming_callback(reception_manager, bridge)
+
+                    def chunks_builder():
+                        try:
+                            with elf_server.generation_scheduler.slot(_client_id(http_request), binding=elf_server.binding, abandoned=lambda: bridge.cancelled) as ticket:
+                                if not ticket.cancelled:
+                                    elf_server.generation_batcher.generate(
+                                                            elf_server.binding,
+                                                            text, 
+                                                            n_predict, 
+                                                            callback=ticket.wrap_callback(callback), 
+                                                            temperature=temperature,
+                                                        )
+                        finally:
+                            _end_stream(reception_manager, bridge)
+                    bridge.start(chunks_builder)
+                    async for chunk in bridge:
+                        yield chunk
+                return StreamingResponse(generate_chunks(), media_type="text/plain")
             else:
-                output = {"text":""}
+                output = StopSequenceMatcher(_anti_prompts())
                 def callback(chunk, chunk_type:MSG_OPERATION_TYPE=MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK):
                     # Yield each chunk of data
-                    output["text"] += chunk
-                    antiprompt = detect_antiprompt(output["text"])
+                    antiprompt = output.feed(chunk)
                     if antiprompt:
                         ASCIIColors.warning(f"\n{antiprompt} detected. Stopping generation")
-                        output["text"] = remove_text_from_string(output["text"],antiprompt)
                         return False
                     else:
                         return True
-                elf_server.binding.generate(
-                                                text, 
-                                                n_predict, 
-                                                callback=callback,
-                                                temperature=request.temperature if request.temperature>=0 else elf_server.config.temperature
-                                            )
-                return output["text"]
+                with elf_server.generation_scheduler.slot(_client_id(http_request), binding=elf_server.binding) as ticket:
+                    if not ticket.cancelled:
+                        elf_server.generation_batcher.generate(
+                                                        elf_server.binding,
+                                                        text, 
+                                                        n_predict, 
+                                                        callback=ticket.wrap_callback(callback),
+                                                        temperature=request.temperature if request.temperature>=0 else elf_server.config.temperature
+                                                    )
+                return output.text
         else:
             return None
     except Exception as ex:
@@ -1083,5 +929,6 @@ async def v1_completion(request: CompletionGenerationRequest):
 
 @router.post("/stop_gen")
 def stop_gen():
-    elf_server.cancel_gen = True
+    # The http generations stop through their tickets (cancel_gen is reset only by the socket generations)
+    elf_server.generation_scheduler.cancel()
     return {"status": True} 
@@ -22,6 +22,7 @@ from typing import List, Optional
 import psutil
 import yaml
 from lollms.security import sanitize_path
+from lollms.databases.personalities_catalog import PersonalitiesCatalog, find_avatar
 
 # --------------------- Parameter Classes -------------------------------
 
@@ -36,6 +37,7 @@ class PersonalitySelectionInfos(BaseModel):
 # ----------------------- Defining router and main class ------------------------------
 router = APIRouter()
 lollmsElfServer = LOLLMSElfServer.get_instance()
+personalities_catalog = PersonalitiesCatalog(lollmsElfServer.lollms_paths.personal_data_path/"personalities_catalog.json")
 
 # --------------------- Listing -------------------------------
 
@@ -62,48 +64,12 @@ def list_personalities(category:str):
     return personalities
 
 
-@router.get("/get_personality")
-def get_personality():
-    ASCIIColors.yellow("Getting current personality")
-    personality = lollmsElfServer.personality
-
+def personality_infos(personality:AIPersonality, category:str)->dict:
+    """Listing infos of a loaded personality"""
     real_assets_path = lollmsElfServer.lollms_paths.personalities_zoo_path / personality.category / personality.personality_folder_name / 'assets'
-    assets_path = Path("personalities") / personality.category / personality.personality_folder_name / 'assets'
-    gif_logo_path = assets_path / 'logo.gif'
-    webp_logo_path = assets_path / 'logo.webp'
-    png_logo_path = assets_path / 'logo.png'
-    jpg_logo_path = assets_path / 'logo.jpg'
-    jpeg_logo_path = assets_path / 'logo.jpeg'
-    svg_logo_path = assets_path / 'logo.svg'
-    bmp_logo_path = assets_path / 'logo.bmp'
-
-    gif_logo_path_ = real_assets_path / 'logo.gif'
-    webp_logo_path_ = real_assets_path / 'logo.webp'
-    png_logo_path_ = real_assets_path / 'logo.png'
-    jpg_logo_path_ = real_assets_path / 'logo.jpg'
-    jpeg_logo_path_ = real_assets_path / 'logo.jpeg'
-    svg_logo_path_ = real_assets_path / 'logo.svg'
-    bmp_logo_path_ = real_assets_path / 'logo.bmp'
-        
-    has_logo = png_logo_path.is_file() or gif_logo_path.is_file()
-    
-    if gif_logo_path_.exists():
-        avatar = str(gif_logo_path).replace("\\","/")
-    elif webp_logo_path_.exists():
-        avatar = str(webp_logo_path).replace("\\","/")
-    elif png_logo_path_.exists():
-        avatar = str(png_logo_path).replace("\\","/")
-    elif jpg_logo_path_.exists():
-        avatar = str(jpg_logo_path).replace("\\","/")
-    elif jpeg_logo_path_.exists():
-        avatar = str(jpeg_logo_path).replace("\\","/")
-    elif svg_logo_path_.exists():
-        avatar = str(svg_logo_path).replace("\\","/")
-    elif bmp_logo_path_.exists():
-        avatar = str(bmp_logo_path).replace("\\","/")
-    else:
-        avatar = ""    
-    personality = {
+    assets_path = Path("personalities") / category / personality.personality_folder_name / 'assets'
+    avatar, has_logo = find_avatar(real_assets_path, assets_path)
+    return {
         "folder":personality.personality_folder_name,
         "has_scripts":personality.processor is not None,
         "name":personality.name,
@@ -121,166 +87,25 @@ def get_personality():
         "avatar":avatar,
         "has_logo":has_logo
     }
-    return personality
+
+@router.get("/get_personality")
+def get_personality():
+    ASCIIColors.yellow("Getting current personality")
+    personality = lollmsElfServer.personality
+    return personality_infos(personality, personality.category)
 
 @router.get("/get_all_personalities")
-def get_all_personalities():
+def get_all_personalities(refresh:bool=False):
     ASCIIColors.yellow("Listing all personalities")
-    personalities_folder = lollmsElfServer.lollms_paths.personalities_zoo_path
-    personalities = {}
-
-    for category_folder in  [lollmsElfServer.lollms_paths.custom_personalities_path] + list(personalities_folder.iterdir()):
-        cat = category_folder.stem
-        if category_folder.is_dir() and not category_folder.stem.startswith('.'):
-            personalities[cat if category_folder!=lollmsElfServer.lollms_paths.custom_personalities_path else "custom_personalities"] = []
-            for personality_folder in category_folder.iterdir():
-                pers = personality_folder.stem
-                if lollmsElfServer.personality.personality_folder_name==pers:
-                    personality = lollmsElfServer.personality
-                    lollmsElfServer.lollms_paths.custom_personalities_path
-                    real_assets_path = lollmsElfServer.lollms_paths.personalities_zoo_path / cat / personality.personality_folder_name / 'assets'
-                    category = personality.category if category_folder!=lollmsElfServer.lollms_paths.custom_personalities_path!=category_folder else "custom_personalities"
-                    assets_path = Path("personalities") / category / personality.personality_folder_name / 'assets'
-                    gif_logo_path = assets_path / 'logo.gif'
-                    webp_logo_path = assets_path / 'logo.webp'
-                    png_logo_path = assets_path / 'logo.png'
-                    jpg_logo_path = assets_path / 'logo.jpg'
-                    jpeg_logo_path = assets_path / 'logo.jpeg'
-                    svg_logo_path = assets_path / 'logo.svg'
-                    bmp_logo_path = assets_path / 'logo.bmp'
-
-                    gif_logo_path_ = real_assets_path / 'logo.gif'
-                    webp_logo_path_ = real_assets_path / 'logo.webp'
-                    png_logo_path_ = real_assets_path / 'logo.png'
-                    jpg_logo_path_ = real_assets_path / 'logo.jpg'
-                    jpeg_logo_path_ = real_assets_path / 'logo.jpeg'
-                    svg_logo_path_ = real_assets_path / 'logo.svg'
-                    bmp_logo_path_ = real_assets_path / 'logo.bmp'
-                        
-                    has_logo = png_logo_path.is_file() or gif_logo_path.is_file()
-                    
-                    if gif_logo_path_.exists():
-                        avatar = str(gif_logo_path).replace("\\","/")
-                    elif webp_logo_path_.exists():
-                        avatar = str(webp_logo_path).replace("\\","/")
-                    elif png_logo_path_.exists():
-                        avatar = str(png_logo_path).replace("\\","/")
-                    elif jpg_logo_path_.exists():
-                        avatar = str(jpg_logo_path).replace("\\","/")
-                    elif jpeg_logo_path_.exists():
-                        avatar = str(jpeg_logo_path).replace("\\","/")
-                    elif svg_logo_path_.exists():
-                        avatar = str(svg_logo_path).replace("\\","/")
-                    elif bmp_logo_path_.exists():
-                        avatar = str(bmp_logo_path).replace("\\","/")
-                    else:
-                        avatar = ""    
-                    personality = {
-                        "folder":personality.personality_folder_name,
-                        "has_scripts":personality.processor is not None,
-                        "name":personality.name,
-                        "description":personality.personality_description,
-                        "disclaimer":personality.disclaimer,
-                        "author":personality.author,
-                        "language":personality.language,
-                        "version":personality.version,
-                        "creation_date":personality.creation_date,
-                        "last_update_date":personality.last_update_date,
-                        "installed":True,
-                        "help":personality.help,
-                        "commands":personality.commands,
-                        "prompts_list":personality.prompts_list,
-                        "avatar":avatar,
-                        "has_logo":has_logo
-                    }
-                    personalities[cat if category_folder!=lollmsElfServer.lollms_paths.custom_personalities_path else "custom_personalities"].append(personality)
-                else:
-                    if personality_folder.is_dir() and not personality_folder.stem.startswith('.'):
-                        personality_info = {"folder":personality_folder.stem}
-                        config_path = personality_folder / 'config.yaml'
-                        if not config_path.exists():
-                            """
-                            try:
-                                shutil.rmtree(str(config_path.parent))
-                                ASCIIColors.warning(f"Deleted useless personality: {config_path.parent}")
-                            except Exception as ex:
-                                ASCIIColors.warning(f"Couldn't delete personality ({ex})")
-                            """
-                            continue                                    
-                        try:
-                            scripts_path = personality_folder / 'scripts'
-                            personality_info['has_scripts'] = scripts_path.exists()
-                            with open(config_path, "r", encoding="utf8") as config_file:
-                                config_data = yaml.load(config_file, Loader=yaml.FullLoader)
-                                personality_info['name'] = config_data.get('name',"No Name")
-                                personality_info['description'] = config_data.get('personality_description',"")
-                                personality_info['disclaimer'] = config_data.get('disclaimer',"")
-                                personality_info['author'] = config_data.get('author', 'ParisNeo')
-                                personality_info['language'] = config_data.get('language', 'english')
-                                personality_info['version'] = config_data.get('version', '1.0.0')
-                                personality_info['creation_date'] = config_data.get("creation_date",None)
-                                personality_info['last_update_date'] = config_data.get("last_update_date",None)
-                                personality_info['installed'] = (lollmsElfServer.lollms_paths.personal_configuration_path/f"personality_{personality_folder.stem}.yaml").exists() or personality_info['has_scripts']
-                                personality_info['help'] = config_data.get('help', '')
-                                personality_info['commands'] = config_data.get('commands', '')
-                                personality_info['prompts_list'] = config_data.get('prompts_list', [])
-
-
-                            try:
-                                help_path = personality_folder / 'README.md'
-                                if help_path.exists():
-                                    personality_info['help']=help_path.read_text()
-                            except:
-                                pass
-
-                            languages_path = personality_folder/ 'languages'
-
-                            real_assets_path = personality_folder/ 'assets'
-                            assets_path = Path("personalities") / cat / pers / 'assets'
-                            gif_logo_path = assets_path / 'logo.gif'
-                            webp_logo_path = assets_path / 'logo.webp'
-                            png_logo_path = assets_path / 'logo.png'
-                            jpg_logo_path = assets_path / 'logo.jpg'
-                            jpeg_logo_path = assets_path / 'logo.jpeg'
-                            svg_logo_path = assets_path / 'logo.svg'
-                            bmp_logo_path = assets_path / 'logo.bmp'
-
-                            gif_logo_path_ = real_assets_path / 'logo.gif'
-                            webp_logo_path_ = real_assets_path / 'logo.webp'
-                            png_logo_path_ = real_assets_path / 'logo.png'
-                            jpg_logo_path_ = real_assets_path / 'logo.jpg'
-                            jpeg_logo_path_ = real_assets_path / 'logo.jpeg'
-                            svg_logo_path_ = real_assets_path / 'logo.svg'
-                            bmp_logo_path_ = real_assets_path / 'logo.bmp'
-
-                            if languages_path.exists():
-                                personality_info['languages']= [""]+[f.stem for f in languages_path.iterdir() if f.suffix==".yaml"]
-                            else:
-                                personality_info['languages']=None
-                                
-                            personality_info['has_logo'] = png_logo_path.is_file() or gif_logo_path.is_file()
-                            
-                            if gif_logo_path_.exists():
-                                personality_info['avatar'] = str(gif_logo_path).replace("\\","/")
-                            elif webp_logo_path_.exists():
-                                personality_info['avatar'] = str(webp_logo_path).replace("\\","/")
-                            elif png_logo_path_.exists():
-                                personality_info['avatar'] = str(png_logo_path).replace("\\","/")
-                            elif jpg_logo_path_.exists():
-                                personality_info['avatar'] = str(jpg_logo_path).replace("\\","/")
-                            elif jpeg_logo_path_.exists():
-                                personality_info['avatar'] = str(jpeg_logo_path).replace("\\","/")
-                            elif svg_logo_path_.exists():
-                                personality_info['avatar'] = str(svg_logo_path).replace("\\","/")
-                            elif bmp_logo_path_.exists():
-                                personality_info['avatar'] = str(bmp_logo_path).replace("\\","/")
-                            else:
-                                personality_info['avatar'] = ""
-                            
-                            personalities[cat if category_folder!=lollmsElfServer.lollms_paths.custom_personalities_path else "custom_personalities"].append(personality_info)
-                        except Exception as ex:
-                            ASCIIColors.warning(f"Couldn't load personality from {personality_folder} [{ex}]")
-                            trace_exception(ex)
+    personalities = personalities_catalog.list_zoo(lollmsElfServer.lollms_paths.personalities_zoo_path, lollmsElfServer.lollms_paths.custom_personalities_path, refresh)
+    installed_personalities = personalities_catalog.installed_personalities(lollmsElfServer.lollms_paths.personal_configuration_path)
+    for category, category_personalities in personalities.items():
+        for i, personality_info in enumerate(category_personalities):
+            if lollmsElfServer.personality.personality_folder_name==personality_info["folder"]:
+                # The mounted personality is described by its loaded version
+                category_personalities[i] = personality_infos(lollmsElfServer.personality, category if category=="custom_personalities" else lollmsElfServer.personality.category)
+            else:
+                personality_info['installed'] = personality_info['has_scripts'] or personality_info["folder"] in installed_personalities
     ASCIIColors.green("OK")
 
     return personalities
@@ -344,6 +169,7 @@ async def reinstall_personality(personality_in: PersonalityIn):
                                         model=lollmsElfServer.model,
                                         app=lollmsElfServer,
                                         run_scripts=True,installation_option=InstallOption.FORCE_INSTALL)
+            personalities_catalog.invalidate()
             return {"status":True}
         except Exception as ex:
             ASCIIColors.error(f"Personality file not found or is corrupted ({personality_in.name}).\nReturned the following exception:{ex}\nPlease verify that the personality you have selected exists or select another personality. Some updates may lead to change in personality name or category, so check the personality selection in settings to be sure.")
@@ -549,6 +375,7 @@ def mount_personality(data:PersonalityMountingInfos):
         """
         lollmsElfServer.config["personalities"].append(package_path)
         lollmsElfServer.mounted_personalities = lollmsElfServer.rebuild_personalities()
+        personalities_catalog.invalidate()
         lollmsElfServer.config["active_personality_id"]= len(lollmsElfServer.config["personalities"])-1
         lollmsElfServer.personality = lollmsElfServer.mounted_personalities[lollmsElfServer.config["active_personality_id"]]
         ASCIIColors.success("ok")
@@ -611,6 +438,7 @@ def remount_personality(data:PersonalityMountingInfos):
         lollmsElfServer.config["personalities"].append(package_path)
         lollmsElfServer.config["active_personality_id"]= len(lollmsElfServer.config["personalities"])-1
         lollmsElfServer.mounted_personalities = lollmsElfServer.rebuild_personalities()
+        personalities_catalog.invalidate()
         lollmsElfServer.personality = lollmsElfServer.mounted_personalities[lollmsElfServer.config["active_personality_id"]]
         ASCIIColors.success("ok")
         if lollmsElfServer.config["active_personality_id"]<0:
@@ -657,6 +485,7 @@ def unmount_personality(data:PersonalityMountingInfos):
                 lollmsElfServer.personality = lollmsElfServer.mounted_personalities[lollmsElfServer.config["active_personality_id"]]
             else:
                 lollmsElfServer.config["active_personality_id"] = -1
+        personalities_catalog.invalidate()
         ASCIIColors.success("ok")
         if lollmsElfServer.config.auto_save:
             ASCIIColors.info("Saving configuration")
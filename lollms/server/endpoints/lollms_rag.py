@@ -13,6 +13,7 @@ from typing import List, Optional, Union
 from pathlib import Path
 from lollmsvectordb.database_elements.chunk import Chunk
 from lollmsvectordb.vector_database import VectorDatabase
+from lollms.databases.vectorizers_registry import vector_databases_cache, open_vector_database
 import sqlite3
 import secrets
 import time
@@ -20,7 +21,7 @@ import shutil
 import os
 from datetime import datetime, timedelta
 import asyncio
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager
 import hashlib
 
 # ----------------------- Defining router and main class ------------------------------
@@ -61,31 +62,36 @@ class RAGChunk(BaseModel):
     nb_tokens : int
     distance : float
 
-def get_user_vectorizer(user_key: str):
-    small_key = hashlib.md5(user_key.encode()).hexdigest()[:8]
-    user_folder = lollmsElfServer.lollms_paths.personal_outputs_path / str(user_key)
+def get_user_folder(user_key: str)->Path:
+    """Folder of the data of a user. The key comes from the client, so it must not escape the outputs folder."""
+    user_key = sanitize_path(str(user_key))
+    outputs_path = lollmsElfServer.lollms_paths.personal_outputs_path
+    user_folder = outputs_path / user_key
+    if not user_key or user_key.strip(" ./")=="" or outputs_path.resolve() not in user_folder.resolve().parents:
+        raise HTTPException(status_code=400, detail="Invalid Key")
+    return user_folder
+
+def get_user_database_path(user_key: str)->Path:
+    user_folder = get_user_folder(user_key)
     user_folder.mkdir(parents=True, exist_ok=True)
+    return user_folder / "rag_db.sqlite"
+
+@contextmanager
+def get_user_vectorizer(user_key: str):
+    """Opens the vector database of a user. It is shared with the other requests of the same user and kept open between requests."""
     from lollmsvectordb.lollms_tokenizers.tiktoken_tokenizer import TikTokenTokenizer
-    if lollmsElfServer.config.rag_vectorizer == "semantic":
-        from lollmsvectordb.lollms_vectorizers.semantic_vectorizer import SemanticVectorizer
-        v = SemanticVectorizer(lollmsElfServer.config.rag_vectorizer_model, lollmsElfServer.config.rag_vectorizer_execute_remote_code)
-    elif lollmsElfServer.config.rag_vectorizer == "tfidf":
-        from lollmsvectordb.lollms_vectorizers.tfidf_vectorizer import TFIDFVectorizer
-        v = TFIDFVectorizer()
-    elif lollmsElfServer.config.rag_vectorizer == "openai":
-        from lollmsvectordb.lollms_vectorizers.openai_vectorizer import OpenAIVectorizer
-        v = OpenAIVectorizer(lollmsElfServer.config.rag_vectorizer_openai_key)
-    elif lollmsElfServer.config.rag_vectorizer == "ollama":
-        from lollmsvectordb.lollms_vectorizers.ollama_vectorizer import OllamaVectorizer
-        v = OllamaVectorizer(lollmsElfServer.config.rag_vectorizer_model, lollmsElfServer.config.rag_service_url)
-
-    return VectorDatabase(
-        "",
-        v, TikTokenTokenizer(),
+    vdb = open_vector_database(
+        lollmsElfServer.config,
+        get_user_database_path(user_key),
+        TikTokenTokenizer(),
         chunk_size=lollmsElfServer.config.rag_chunk_size,
         overlap=lollmsElfServer.config.rag_overlap,
         model=lollmsElfServer.model,
     )
+    try:
+        yield vdb
+    finally:
+        vector_databases_cache.release(vdb)
 
 async def validate_key(key: str):
     if lollmsElfServer.config.lollms_access_keys and key not in lollmsElfServer.config.lollms_access_keys:
@@ -95,16 +101,16 @@ async def validate_key(key: str):
 @router.post("/add_document", response_model=DocumentResponse)
 async def add_document(doc: IndexDocument):
     await validate_key(doc.key)
-    vectorizer = get_user_vectorizer(doc.key)
-    vectorizer.add_document(title=doc.title, text=doc.content, path=doc.path)
+    with get_user_vectorizer(doc.key) as vectorizer:
+        vectorizer.add_document(title=doc.title, text=doc.content, path=doc.path)
     return DocumentResponse(success=True, message="Document added successfully.")
 
 @router.post("/remove_document/{document_id}", response_model=DocumentResponse)
 async def remove_document(document_id: int, key: str):
     await validate_key(key)
-    vectorizer = get_user_vectorizer(key)
-    doc_hash = vectorizer.get_document_hash(document_id)
-    vectorizer.remove_document(doc_hash)
+    with get_user_vectorizer(key) as vectorizer:
+        doc_hash = vectorizer.get_document_hash(document_id)
+        vectorizer.remove_document(doc_hash)
     return DocumentResponse(success=True, message="Document removed successfully.")
 
 class IndexDatabaseRequest(BaseModel):
@@ -114,15 +120,15 @@ class IndexDatabaseRequest(BaseModel):
 async def index_database(request: IndexDatabaseRequest):
     key = request.key
     await validate_key(key)
-    vectorizer = get_user_vectorizer(key)
-    vectorizer.build_index()
+    with get_user_vectorizer(key) as vectorizer:
+        vectorizer.build_index()
     return DocumentResponse(success=True, message="Database indexed successfully.")
 
 @router.post("/search", response_model=List[RAGChunk])
 async def search(query: RAGQuery):
     await validate_key(query.key)
-    vectorizer = get_user_vectorizer(query.key)
-    chunks = vectorizer.search(query.query)
+    with get_user_vectorizer(query.key) as vectorizer:
+        chunks = vectorizer.search(query.query)
     return [
     RAGChunk(
         id=c.id,
@@ -139,7 +145,7 @@ async def search(query: RAGQuery):
 @router.delete("/wipe_database", response_model=DocumentResponse)
 async def wipe_database(key: str):
     await validate_key(key)
-    key = sanitize_path(key)
-    user_folder = lollmsElfServer.lollms_paths / str(key)
+    user_folder = get_user_folder(key)
+    vector_databases_cache.invalidate(user_folder / "rag_db.sqlite")
     shutil.rmtree(user_folder, ignore_errors=True)
     return DocumentResponse(success=True, message="Database wiped successfully.")
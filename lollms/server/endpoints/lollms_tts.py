@@ -16,6 +16,7 @@ from lollms.types import MSG_OPERATION_TYPE
 from lollms.main_config import BaseConfig
 from lollms.utilities import find_next_available_filename, output_file_path_to_url, detect_antiprompt, remove_text_from_string, trace_exception, find_first_available_file_index, add_period, PackageManager
 from lollms.security import sanitize_path, validate_path, check_access
+from lollms.lazy_service import LazyService
 from pathlib import Path
 from ascii_colors import ASCIIColors
 import os
@@ -255,24 +256,34 @@ async def upload_voice_file(file: UploadFile = File(...)):
     return {"message": f"Successfully uploaded {safe_filename}"}
 
 
+def _built_service(service):
+    """Returns the service if it is built, without building a lazy service (the status endpoints must not wait for it)"""
+    if isinstance(service, LazyService):
+        return service.lazy_instance if service.lazy_loaded else None
+    return service
+
+
 @router.get("/tts_is_ready")
 def tts_is_ready():
-    if lollmsElfServer.tts:
-        if lollmsElfServer.tts.ready:
+    tts = _built_service(lollmsElfServer.tts)
+    if tts:
+        if tts.ready:
             return {"status":True}
     return {"status":False}
 
 
 @router.get("/get_snd_input_devices")
 def get_snd_input_devices():
-    if lollmsElfServer.stt:
-        return lollmsElfServer.stt.get_devices()
+    stt = _built_service(lollmsElfServer.stt)
+    if stt:
+        return stt.get_devices()
     else:
         return []
 @router.get("/get_snd_output_devices")
 def get_snd_output_devices():
-    if lollmsElfServer.tts:
-        return lollmsElfServer.tts.get_devices()
+    tts = _built_service(lollmsElfServer.tts)
+    if tts:
+        return tts.get_devices()
     else:
         return []
 
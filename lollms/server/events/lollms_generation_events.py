@@ -27,6 +27,21 @@ from datetime import datetime
 lollmsElfServer = LOLLMSElfServer.get_instance()
 
 
+def generation_target(client_id:str, target):
+    """
+    Returns a function running target on behalf of the client (see GenerationScheduler.bind_client) that writes the
+    buffered content of the discussion messages once the generation is over.
+    """
+    def run(*args, **kwargs):
+        try:
+            return target(*args, **kwargs)
+        finally:
+            discussion = lollmsElfServer.session.get_client(client_id).discussion
+            if discussion is not None:
+                discussion.discussions_db.flush_messages(finished=True)
+    return lollmsElfServer.generation_scheduler.bind_client(client_id, run)
+
+
 # ----------------------------------- events -----------------------------------------
 def add_events(sio:socketio):
     @sio.on('cancel_generation')
@@ -34,9 +49,13 @@ def add_events(sio:socketio):
         client_id = sid
         client = lollmsElfServer.session.get_client(client_id)
         lollmsElfServer.cancel_gen = True
+        lollmsElfServer.generation_scheduler.cancel(client_id)
         #kill thread
         ASCIIColors.error(f'Client {sid} requested cancelling generation')
         terminate_thread(client.generation_thread)
+        # Make sure the partial answer is saved
+        if client.discussion is not None:
+            client.discussion.discussions_db.flush_messages(finished=True)
         lollmsElfServer.busy=False
         if lollmsElfServer.tts:
             lollmsElfServer.tts.stop()
@@ -49,6 +68,7 @@ def add_events(sio:socketio):
         client_id = sid
         client = lollmsElfServer.session.get_client(client_id)
         client.requested_stop=True
+        lollmsElfServer.generation_scheduler.cancel(client_id)
         print(f"Client {client_id} requested canceling generation")
         run_async(partial(lollmsElfServer.sio.emit,"generation_canceled", {"message":"Generation is canceled."}, to=client_id))
         lollmsElfServer.busy = False
@@ -115,16 +135,17 @@ def add_events(sio:socketio):
                     try:
                         ASCIIColors.print("warming up", ASCIIColors.color_bright_cyan)
                         
-                        generated_text = model.generate(fd, 
-                                                        n_predict=n_predicts, 
-                                                        callback=callback,
-                                                        temperature = parameters["temperature"],
-                                                        top_k = parameters["top_k"],
-                                                        top_p = parameters["top_p"],
-                                                        repeat_penalty = parameters["repeat_penalty"],
-                                                        repeat_last_n = parameters["repeat_last_n"],
-                                                        seed = parameters["seed"],                                           
-                                                        )
+                        with lollmsElfServer.generation_scheduler.slot(client_id, binding=model) as ticket:
+                            generated_text = "" if ticket.cancelled else model.generate(fd, 
+                                                            n_predict=n_predicts, 
+                                                            callback=ticket.wrap_callback(callback),
+                                                            temperature = parameters["temperature"],
+                                                            top_k = parameters["top_k"],
+                                                            top_p = parameters["top_p"],
+                                                            repeat_penalty = parameters["repeat_penalty"],
+                                                            repeat_last_n = parameters["repeat_last_n"],
+                                                            seed = parameters["seed"],                                           
+                                                            )
                         ASCIIColors.success(f"\ndone")
 
                         if client_id in lollmsElfServer.session.clients.keys():
@@ -192,10 +213,11 @@ def add_events(sio:socketio):
                             generated_text = personality.processor.run_workflow(context_details, client=client, callback=callback)
                         else:
                             ASCIIColors.info("generating...")
-                            generated_text = personality.model.generate(
-                                                                        personality.personality_conditioning+fd, 
-                                                                        n_predict=n_predicts, 
-                                                                        callback=callback)
+                            with lollmsElfServer.generation_scheduler.slot(client_id, binding=personality.model) as ticket:
+                                generated_text = "" if ticket.cancelled else personality.model.generate(
+                                                                            personality.personality_conditioning+fd, 
+                                                                            n_predict=n_predicts, 
+                                                                            callback=ticket.wrap_callback(callback))
 
                         if personality.processor is not None and personality.processor_cfg["process_model_output"]: 
                             generated_text = personality.processor.process_model_output(generated_text)
@@ -210,7 +232,7 @@ def add_events(sio:socketio):
                         ASCIIColors.error(f"\ndone")
                     lollmsElfServer.busy = False
 
-            client.generation_thread = threading.Thread(target=do_generation)
+            client.generation_thread = threading.Thread(target=generation_target(client_id, do_generation))
             client.generation_thread.start()
             ASCIIColors.info("Started generation task")
             lollmsElfServer.busy=True
@@ -267,7 +289,7 @@ def add_events(sio:socketio):
             )
 
             ASCIIColors.green("Starting message generation by "+lollmsElfServer.personality.name)
-            client.generation_thread = threading.Thread(target=lollmsElfServer.start_message_generation, args=(message, message.id, client_id))
+            client.generation_thread = threading.Thread(target=generation_target(client_id, lollmsElfServer.start_message_generation), args=(message, message.id, client_id))
             client.generation_thread.start()
             ASCIIColors.info("Started generation task")
             lollmsElfServer.busy=True
@@ -296,7 +318,7 @@ def add_events(sio:socketio):
             message = lollmsElfServer.session.get_client(client_id).discussion.load_message(id_)
         if message is None:
             return            
-        client.generation_thread = threading.Thread(target=lollmsElfServer.start_message_generation, args=(message, message.id, client_id, False, generation_type))
+        client.generation_thread = threading.Thread(target=generation_target(client_id, lollmsElfServer.start_message_generation), args=(message, message.id, client_id, False, generation_type))
         client.generation_thread.start()
 
     @sio.on('continue_generate_msg_from')
@@ -318,5 +340,5 @@ def add_events(sio:socketio):
             message = lollmsElfServer.session.get_client(client_id).discussion.load_message(id_)
 
         client.generated_text=message.content
-        client.generation_thread = threading.Thread(target=lollmsElfServer.start_message_generation, args=(message, message.id, client_id, True))
+        client.generation_thread = threading.Thread(target=generation_target(client_id, lollmsElfServer.start_message_generation), args=(message, message.id, client_id, True))
         client.generation_thread.start()
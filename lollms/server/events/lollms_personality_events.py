@@ -181,6 +181,6 @@ def add_events(sio:socketio):
 
             lollmsElfServer.busy=False
 
-        client.generation_thread = threading.Thread(target=do_generation)
+        client.generation_thread = threading.Thread(target=lollmsElfServer.generation_scheduler.bind_client(client_id, do_generation))
         client.generation_thread.start()
         ASCIIColors.info("Started generation task")
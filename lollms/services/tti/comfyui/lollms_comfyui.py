@@ -22,7 +22,6 @@ import time
 import json
 import platform
 from dataclasses import dataclass
-from PIL import Image, PngImagePlugin
 from enum import Enum
 from typing import List, Dict, Any
 import uuid
@@ -32,12 +31,8 @@ from lollms.utilities import git_pull, show_yes_no_dialog, run_script_in_env, cr
 from lollms.tti import LollmsTTI
 import subprocess
 import shutil
-from tqdm import tqdm
 import threading
 
-if not PackageManager.check_package_installed("websocket"):
-    PackageManager.install_or_update("websocket-client")
-import websocket
 if not PackageManager.check_package_installed("urllib"):
     PackageManager.install_or_update("urllib")
 from urllib import request, parse
@@ -53,6 +48,7 @@ def download_file(url, folder_path, local_filename):
     # Make sure 'folder_path' exists
     folder_path.mkdir(parents=True, exist_ok=True)
 
+    from tqdm import tqdm
     with requests.get(url, stream=True) as r:
         r.raise_for_status()
         total_size = int(r.headers.get('content-length', 0))
@@ -421,6 +417,10 @@ class LollmsComfyUI(LollmsTTI):
         
         prompt["1"]["inputs"]["base_ckpt_name"] = self.app.config.comfyui_model
         
+        # websocket-client is only needed to talk to a running comfyui, it is installed on first use
+        if not PackageManager.check_package_installed("websocket"):
+            PackageManager.install_or_update("websocket-client")
+        import websocket
         ws = websocket.WebSocket()
         ws.connect("ws://{}/ws?clientId={}".format(url, client_id))
         images = get_images(ws, prompt)
@@ -8,24 +8,10 @@ Author: ParisNeo, a computer geek passionate about AI
 """
 
 from lollms.app import LollmsApplication
-from lollms.utilities import PackageManager
+from lollms.utilities import PackageManager, import_sounddevice
 from pathlib import Path
 from ascii_colors import ASCIIColors
 
-try:
-    if not PackageManager.check_package_installed("sounddevice"):
-        # os.system("sudo apt-get install portaudio19-dev")
-        PackageManager.install_package("sounddevice")
-        PackageManager.install_package("wave")
-except:
-    # os.system("sudo apt-get install portaudio19-dev -y")
-    PackageManager.install_package("sounddevice")
-    PackageManager.install_package("wave")
-try:
-    import sounddevice as sd
-    import wave
-except:
-    ASCIIColors.error("Couldn't load sound tools")
 
 class LollmsSTT:
     """
@@ -125,6 +111,7 @@ class LollmsSTT:
 
 
     def get_devices(self):
+        sd = import_sounddevice()
         devices =  sd.query_devices()
         print(devices)
         return {
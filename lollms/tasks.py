@@ -6,10 +6,9 @@ from datetime import datetime
 from ascii_colors import ASCIIColors
 from lollms.types import MSG_OPERATION_TYPE, SUMMARY_MODE
 from lollms.com import LoLLMsCom
+from lollms.generation import generation_slot, StopSequenceMatcher
+from lollms.code_parser import CodeBlocksParser
 from lollms.utilities import PromptReshaper, remove_text_from_string, process_ai_output
-from lollmsvectordb.text_chunker import TextChunker
-from lollmsvectordb.database_elements.document import Document
-from lollmsvectordb.directory_binding import DirectoryBinding
 import hashlib
 import json
 class TasksLibrary:
@@ -20,6 +19,7 @@ class TasksLibrary:
         self.anti_prompts = [lollms.config.discussion_prompt_separator]
         if lollms.config.separator_template!="\n":
             self.anti_prompts.append(lollms.config.separator_template)
+        self.bot_says = ""
 
     def print_prompt(self, title, prompt):
         ASCIIColors.red("*-*-*-*-*-*-*-* ", end="")
@@ -41,10 +41,7 @@ class TasksLibrary:
         Returns:
             bool: True if any antiprompt is found in the text (ignoring case), False otherwise.
         """
-        for prompt in self.anti_prompts:
-            if prompt.lower() in text.lower():
-                return prompt.lower()
-        return None
+        return StopSequenceMatcher(self.anti_prompts, text).match
 
     def process(self, text:str, message_type:MSG_OPERATION_TYPE, callback=None, show_progress=False):
         if callback is None:
@@ -52,9 +49,10 @@ class TasksLibrary:
         if text is None:
             return True
         if message_type==MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_ADD_CHUNK:
-            bot_says = self.bot_says + text
+            antiprompt = self.bot_says_matcher.feed(text)
         elif  message_type==MSG_OPERATION_TYPE.MSG_OPERATION_TYPE_SET_CONTENT:
-            bot_says = text
+            self.bot_says = text
+            antiprompt = self.bot_says_matcher.match
 
         if show_progress:
             if self.nb_received_tokens==0:
@@ -69,16 +67,22 @@ class TasksLibrary:
             self.nb_received_tokens+=1
 
 
-        antiprompt = self.detect_antiprompt(bot_says)
         if antiprompt:
-            self.bot_says = remove_text_from_string(bot_says,antiprompt)
             ASCIIColors.warning(f"\n{antiprompt} detected. Stopping generation")
             return False
         else:
             if callback:
                 callback(text,message_type)
-            self.bot_says = bot_says
             return True
+
+    @property
+    def bot_says(self) -> str:
+        """The text generated so far, without the antiprompt that stopped the generation."""
+        return self.bot_says_matcher.text
+
+    @bot_says.setter
+    def bot_says(self, text:str):
+        self.bot_says_matcher = StopSequenceMatcher(self.anti_prompts, text)
         
     def generate(self, prompt, max_size= None, temperature = None, top_k = None, top_p=None, repeat_penalty=None, repeat_last_n=None, callback=None, debug=False, show_progress=False ):
         ASCIIColors.info("Text generation started: Warming up")
@@ -87,16 +91,18 @@ class TasksLibrary:
         if debug:
             self.print_prompt("gen",prompt)
         ntokens = len(self.lollms.model.tokenize(prompt))
-        self.lollms.model.generate(
-                                prompt,
-                                max_size if max_size else min(self.lollms.config.ctx_size-ntokens,self.lollms.config.max_n_predict),
-                                partial(self.process, callback=callback, show_progress=show_progress),
-                                temperature= temperature if temperature is not None else self.lollms.config.temperature if self.lollms.config.override_personality_model_parameters else self.lollms.personality.model_temperature,
-                                top_k= top_k if top_k is not None else self.lollms.config.top_k if self.lollms.config.override_personality_model_parameters else self.lollms.personality.model_top_k,
-                                top_p= top_p if top_p is not None else self.lollms.config.top_p if self.lollms.config.override_personality_model_parameters else self.lollms.personality.model_top_p,
-                                repeat_penalty= repeat_penalty if repeat_penalty is not None else self.lollms.config.repeat_penalty if self.lollms.config.override_personality_model_parameters else self.lollms.personality.model_repeat_penalty,
-                                repeat_last_n= repeat_last_n if repeat_last_n is not None else self.lollms.config.repeat_last_n if self.lollms.config.override_personality_model_parameters else self.lollms.personality.model_repeat_last_n,
-                                ).strip()
+        with generation_slot(self.lollms, self.lollms.model) as ticket:
+            if not ticket.cancelled:
+                self.lollms.model.generate(
+                                        prompt,
+                                        max_size if max_size else min(self.lollms.config.ctx_size-ntokens,self.lollms.config.max_n_predict),
+                                        ticket.wrap_callback(partial(self.process, callback=callback, show_progress=show_progress)),
+                                        temperature= temperature if temperature is not None else self.lollms.config.temperature if self.lollms.config.override_personality_model_parameters else self.lollms.personality.model_temperature,
+                                        top_k= top_k if top_k is not None else self.lollms.config.top_k if self.lollms.config.override_personality_model_parameters else self.lollms.personality.model_top_k,
+                                        top_p= top_p if top_p is not None else self.lollms.config.top_p if self.lollms.config.override_personality_model_parameters else self.lollms.personality.model_top_p,
+                                        repeat_penalty= repeat_penalty if repeat_penalty is not None else self.lollms.config.repeat_penalty if self.lollms.config.override_personality_model_parameters else self.lollms.personality.model_repeat_penalty,
+                                        repeat_last_n= repeat_last_n if repeat_last_n is not None else self.lollms.config.repeat_last_n if self.lollms.config.override_personality_model_parameters else self.lollms.personality.model_repeat_last_n,
+                                        ).strip()
         return self.bot_says
 
     def generate_with_images(self, prompt, images, max_size, temperature = None, top_k = None, top_p=None, repeat_penalty=None, repeat_last_n=None, callback=None, debug=False, show_progress=False ):
@@ -106,17 +112,19 @@ class TasksLibrary:
         if debug:
             self.print_prompt("gen",prompt)
 
-        self.lollms.model.generate_with_images(
-                                prompt,
-                                images,
-                                max_size,
-                                partial(self.process, callback=callback, show_progress=show_progress),
-                                temperature=self.lollms.config.model_temperature if temperature is None else temperature,
-                                top_k=self.lollms.config.model_top_k if top_k is None else top_k,
-                                top_p=self.lollms.config.model_top_p if top_p is None else top_p,
-                                repeat_penalty=self.lollms.config.model_repeat_penalty if repeat_penalty is None else repeat_penalty,
-                                repeat_last_n = self.lollms.config.model_repeat_last_n if repeat_last_n is None else repeat_last_n
-                                ).strip()
+        with generation_slot(self.lollms, self.lollms.model) as ticket:
+            if not ticket.cancelled:
+                self.lollms.model.generate_with_images(
+                                        prompt,
+                                        images,
+                                        max_size,
+                                        ticket.wrap_callback(partial(self.process, callback=callback, show_progress=show_progress)),
+                                        temperature=self.lollms.config.model_temperature if temperature is None else temperature,
+                                        top_k=self.lollms.config.model_top_k if top_k is None else top_k,
+                                        top_p=self.lollms.config.model_top_p if top_p is None else top_p,
+                                        repeat_penalty=self.lollms.config.model_repeat_penalty if repeat_penalty is None else repeat_penalty,
+                                        repeat_last_n = self.lollms.config.model_repeat_last_n if repeat_last_n is None else repeat_last_n
+                                        ).strip()
         return self.bot_says
 
     def fast_gen(
@@ -445,72 +453,16 @@ class TasksLibrary:
         Returns:
         List[dict]: A list of dictionaries where each dictionary represents a code block and contains the following keys:
             - 'index' (int): The index of the code block in the text.
-            - 'file_name' (str): An empty string. This field is not used in the current implementation.
+            - 'file_name' (str): The file name given on the line before the block, if any.
+            - 'section' (str): The section given on the line before the block, if any.
             - 'content' (str): The content of the code block.
             - 'type' (str): The type of the code block. If the code block starts with a language specifier (like 'python' or 'java'), this field will contain that specifier. Otherwise, it will be set to 'language-specific'.
+            - 'is_complete' (bool): True if the block has a closing tag, False otherwise.
 
         Note:
-        The function assumes that the number of triple backticks in the text is even.
-        If the number of triple backticks is odd, it will consider the rest of the text as the last code block.
+        If the number of triple backticks is odd, the rest of the text is considered as the last (incomplete) code block.
         """        
-        remaining = text
-        bloc_index = 0
-        first_index=0
-        indices = []
-        while len(remaining)>0:
-            try:
-                index = remaining.index("```")
-                indices.append(index+first_index)
-                remaining = remaining[index+3:]
-                first_index += index+3
-                bloc_index +=1
-            except Exception as ex:
-                if bloc_index%2==1:
-                    index=len(remaining)
-                    indices.append(index)
-                remaining = ""
-
-        code_blocks = []
-        is_start = True
-        for index, code_delimiter_position in enumerate(indices):
-            block_infos = {
-                'index':index,
-                'file_name': "",
-                'content': "",
-                'type':""
-            }
-            if is_start:
-
-                sub_text = text[code_delimiter_position+3:]
-                if len(sub_text)>0:
-                    try:
-                        find_space = sub_text.index(" ")
-                    except:
-                        find_space = int(1e10)
-                    try:
-                        find_return = sub_text.index("\n")
-                    except:
-                        find_return = int(1e10)
-                    next_index = min(find_return, find_space)
-                    start_pos = next_index
-                    if code_delimiter_position+3<len(text) and text[code_delimiter_position+3] in ["\n"," ","\t"] :
-                        # No
-                        block_infos["type"]='language-specific'
-                    else:
-                        block_infos["type"]=sub_text[:next_index]
-
-                    next_pos = indices[index+1]-code_delimiter_position
-                    if sub_text[next_pos-3]=="`":
-                        block_infos["content"]=sub_text[start_pos:next_pos-3].strip()
-                    else:
-                        block_infos["content"]=sub_text[start_pos:next_pos].strip()
-                    code_blocks.append(block_infos)
-                is_start = False
-            else:
-                is_start = True
-                continue
-
-        return code_blocks
+        return CodeBlocksParser.parse(text).blocks
 
     def translate_conditionning(self, prompt, original_language, language):
         conditionning_translation_text = f"{self.lollms.system_full_header}Translate the following prompt to {language}.\n{self.lollms.separator_template}{self.lollms.ai_custom_header('prompt')}\n```{original_language}\n{prompt}\n```\nPut the answer inside a {language} markdown tag like this:\n```{language}\nTranslated text\n```\n{self.lollms.ai_custom_header('translation')}"
@@ -558,6 +510,8 @@ class TasksLibrary:
         while len(tk)>max_summary_size and (document_chunks is None or len(document_chunks)>1):
             self.step_start(f"Comprerssing {doc_name}... [depth {depth+1}]")
             chunk_size = int(self.lollms.config.ctx_size*0.6)
+            from lollmsvectordb.text_chunker import TextChunker
+            from lollmsvectordb.database_elements.document import Document
             tc = TextChunker(chunk_size, 0, model= self.lollms.model)
             hasher = hashlib.md5()
             hasher.update(text.encode("utf8"))
@@ -599,6 +553,8 @@ class TasksLibrary:
         prev_len = len(tk)
         while len(tk)>max_summary_size:
             chunk_size = int(self.lollms.config.ctx_size*0.6)
+            from lollmsvectordb.text_chunker import TextChunker
+            from lollmsvectordb.database_elements.document import Document
             tc = TextChunker(chunk_size, 0, None, self.lollms.model)
             document_chunks = tc.get_text_chunks(text,Document("","","",0),True)
             text = self.summarize_chunks(
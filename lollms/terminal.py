@@ -10,9 +10,8 @@ from lollms.config import InstallOption
 from lollms.personality import PersonalityBuilder
 from lollms.helpers import trace_exception
 
-from tqdm import tqdm
-import pkg_resources
 from pathlib import Path
+import importlib.metadata
 import yaml
 import sys
 class Menu:
@@ -187,7 +186,7 @@ class MainMenu(Menu):
 
 
         print(f"{ASCIIColors.color_reset}")
-        print(f"{ASCIIColors.color_red}Version: {ASCIIColors.color_green}{pkg_resources.get_distribution('lollms').version}")
+        print(f"{ASCIIColors.color_red}Version: {ASCIIColors.color_green}{importlib.metadata.version('lollms')}")
         print(f"{ASCIIColors.color_red}By : {ASCIIColors.color_green}ParisNeo")
         print(f"{ASCIIColors.color_reset}")
 
@@ -295,6 +294,7 @@ class MainMenu(Menu):
                 tqdm_bar.update(block_size)
 
             # Usage example
+            from tqdm import tqdm
             with tqdm(total=100, unit="%", desc="Download Progress", ncols=80) as tqdm_bar:
                 self.lollms_app.config.download_model(url,self.lollms_app.binding, progress_callback)
             self.select_model()
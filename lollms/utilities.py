@@ -9,7 +9,6 @@
 # module.
 ######
 from ascii_colors import ASCIIColors, trace_exception
-import numpy as np
 from pathlib import Path
 import json
 import re
@@ -32,25 +31,15 @@ import io
 import urllib
 import os
 import sys
-import git
 
 import mimetypes
 import sys
 import platform
 import subprocess
-import pkg_resources
 from functools import partial
 
-import pipmaster as pm
-if not pm.is_installed("Pillow"):
-    pm.install("Pillow")
-from PIL import Image
-
-if not pm.is_installed("PyQt5"):
-    pm.install("PyQt5")
-import sys
-from PyQt5.QtWidgets import QApplication, QButtonGroup, QRadioButton, QVBoxLayout, QWidget, QPushButton, QMessageBox
-from PyQt5.QtCore import Qt
+# numpy, Pillow, PyQt5, git and pkg_resources are slow to import (and Pillow and PyQt5 may have to be installed):
+# they are imported by the functions that use them, not when lollms is imported
 
 import os
 import subprocess
@@ -294,6 +283,7 @@ def process_ai_output(output, images, output_folder):
     if not PackageManager.check_package_installed("cv2"):
         PackageManager.install_package("opencv-python")
     import cv2
+    import numpy as np
     images = [cv2.imread(str(img)) for img in images]
     # Find all bounding box entries in the output
     bounding_boxes = re.findall(r'boundingbox\((\d+), ([^,]+), ([^,]+), ([^,]+), ([^,]+), ([^,]+)\)', output)
@@ -402,8 +392,17 @@ def show_console_custom_dialog(title, text, options):
         except ValueError:
             print("Invalid input. Please enter a number.")
 
+def import_pyqt5():
+    """Installs PyQt5 if needed, the first time a dialog is shown."""
+    import pipmaster as pm
+    if not pm.is_installed("PyQt5"):
+        pm.install("PyQt5")
+
+
 def show_custom_dialog(title, text, options):
     try:
+        import_pyqt5()
+        from PyQt5.QtWidgets import QApplication, QButtonGroup, QRadioButton, QVBoxLayout, QWidget, QPushButton, QLabel
         app = QApplication(sys.argv)
         window = QWidget()
         layout = QVBoxLayout()
@@ -438,6 +437,9 @@ def show_custom_dialog(title, text, options):
 
 def show_yes_no_dialog(title, text):
     try:
+        import_pyqt5()
+        from PyQt5.QtWidgets import QApplication, QMessageBox
+        from PyQt5.QtCore import Qt
         app = QApplication.instance() or QApplication(sys.argv)
         
         # Create a message box with Yes/No buttons
@@ -469,6 +471,9 @@ def console_dialog(title, text):
         
 def show_message_dialog(title, text):
     try:
+        import_pyqt5()
+        from PyQt5.QtWidgets import QApplication, QMessageBox
+        from PyQt5.QtCore import Qt
         app = QApplication(sys.argv)
         msg = QMessageBox()
         msg.setOption(QMessageBox.DontUseNativeDialog, True)
@@ -639,8 +644,31 @@ def convert_language_name(language_name):
     return language_codes.get(language_name,"en")
 
 
+def import_pillow():
+    """Installs Pillow if needed and returns its Image module."""
+    import pipmaster as pm
+    if not pm.is_installed("Pillow"):
+        pm.install("Pillow")
+    from PIL import Image
+    return Image
+
+def import_sounddevice():
+    """Installs sounddevice if needed and returns it, the first time the audio devices are used."""
+    try:
+        if not PackageManager.check_package_installed("sounddevice"):
+            # os.system("sudo apt-get install portaudio19-dev")
+            PackageManager.install_package("sounddevice")
+            PackageManager.install_package("wave")
+    except:
+        # os.system("sudo apt-get install portaudio19-dev -y")
+        PackageManager.install_package("sounddevice")
+        PackageManager.install_package("wave")
+    import sounddevice as sd
+    return sd
+
 # Function to encode the image
 def encode_image(image_path, max_image_width=-1):
+    Image = import_pillow()
     image = Image.open(image_path)
     width, height = image.size
 
@@ -678,6 +706,7 @@ def save_config(config, filepath):
 
 
 def load_image(image_file):
+    Image = import_pillow()
     s_image_file = str(image_file)
     if s_image_file.startswith('http://') or s_image_file.startswith('https://'):
         response = requests.get(s_image_file)
@@ -687,10 +716,12 @@ def load_image(image_file):
     return image
 
 def load_image_from_base64(image):
+    Image = import_pillow()
     return Image.open(BytesIO(base64.b64decode(image)))
 
 
 def expand2square(pil_img, background_color):
+    Image = import_pillow()
     width, height = pil_img.size
     if width == height:
         return pil_img
@@ -817,6 +848,7 @@ import subprocess
 
 def check_torch_version(min_version="2.0.0", min_cuda_version=12):
     try:
+        import pkg_resources
         import torch
         current_version = torch.__version__
         
@@ -903,6 +935,7 @@ def check_and_install_torch(enable_gpu: bool, version: float = 2.2):
         version (float): Minimum required PyTorch version
     """
     try:
+        import pkg_resources
         import torch
         current_version = torch.__version__
         system = platform.system().lower()
@@ -954,6 +987,7 @@ def check_and_install_torch(enable_gpu: bool, version: float = 2.2):
 
 class NumpyEncoderDecoder(json.JSONEncoder):
     def default(self, obj):
+        import numpy as np
         if isinstance(obj, np.ndarray):
             return {'__numpy_array__': True, 'data': obj.tolist()}
         return super(NumpyEncoderDecoder, self).default(obj)
@@ -961,6 +995,7 @@ class NumpyEncoderDecoder(json.JSONEncoder):
     @staticmethod
     def as_numpy_array(dct):
         if '__numpy_array__' in dct:
+            import numpy as np
             return np.array(dct['data'])
         return dct
     
@@ -974,6 +1009,7 @@ def clone_repository(repository_url, local_folder:Path|str, exist_ok=False):
             return False
 
     try:
+        import git
         # Create a new repository object
         repo = git.Repo.clone_from(repository_url, str(local_folder))
         ASCIIColors.success("Repository was cloned successfully")
@@ -0,0 +1,64 @@
+"""
+project: lollms
+file: benchmark_code_parser.py
+author: ParisNeo
+description:
+    Code blocks extraction time on multi megabyte outputs made of fenced python blocks with file names.
+    Compares CodeBlocksParser (whole text, and streamed by small chunks) with the reference parser used before it,
+    and checks that both return the same blocks.
+
+    usage:
+        python tests/benchmarks/benchmark_code_parser.py
+        python tests/benchmarks/benchmark_code_parser.py --sizes 1 4 8 --no-reference
+
+"""
+from pathlib import Path
+import argparse
+import sys
+import time
+
+root = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(root))
+sys.path.insert(0, str(root/"tests"/"unit_tests"))
+
+from lollms.code_parser import CodeBlocksParser
+from test_code_parser import reference_extract_code_blocks
+
+UNIT = "Some explanation text here.\n<file_name>main.py</file_name>\n```python\n"+"def f(x):\n    return x*2\n"*20+"```\n"
+
+
+def main(argv=None)->int:
+    parser = argparse.ArgumentParser(description="Code blocks extraction benchmark")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[0.5, 1, 2], help="Sizes of the outputs in MB")
+    parser.add_argument("--chunk-size", type=int, default=8, help="Characters per chunk of the streamed parsing")
+    parser.add_argument("--no-reference", action="store_true", help="Don't run the reference parser (quadratic, slow above 2MB)")
+    args = parser.parse_args(argv)
+
+    for size in args.sizes:
+        text = UNIT*int(size*1e6/len(UNIT))
+
+        start = time.perf_counter()
+        parsed = CodeBlocksParser.parse(text)
+        whole = time.perf_counter()-start
+
+        start = time.perf_counter()
+        streamed = CodeBlocksParser()
+        for i in range(0, len(text), args.chunk_size):
+            streamed.feed(text[i:i+args.chunk_size])
+        streamed.finish()
+        chunked = time.perf_counter()-start
+        assert streamed.blocks==parsed.blocks
+
+        line = f"{len(text)/1e6:5.1f}MB {len(parsed.blocks):6} blocks: parser {whole:.3f}s, streamed by {args.chunk_size} chars {chunked:.2f}s"
+        if not args.no_reference:
+            start = time.perf_counter()
+            blocks, remaining_text = reference_extract_code_blocks(text, True)
+            reference = time.perf_counter()-start
+            assert blocks==parsed.blocks and remaining_text==parsed.remaining_text
+            line += f", reference {reference:.2f}s"
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
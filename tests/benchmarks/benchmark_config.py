@@ -0,0 +1,95 @@
+"""
+project: lollms
+file: benchmark_config.py
+author: ParisNeo
+description:
+    Cost of the configuration reads and writes done on every request: reading keys of the main configuration as
+    attributes (the keys read while building a prompt) and reading and writing TypedConfig entries.
+    With --baseline, the same measures are done with lollms/config.py as it was at a git revision, to compare.
+
+    usage:
+        python tests/benchmarks/benchmark_config.py
+        python tests/benchmarks/benchmark_config.py --baseline e8da1f8~1
+
+"""
+from pathlib import Path
+import argparse
+import subprocess
+import sys
+import time
+import types
+import yaml
+
+root = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(root))
+
+# Keys read as attributes while a prompt is built
+REQUEST_KEYS = [
+    "ctx_size", "max_n_predict", "temperature", "start_header_id_template", "end_header_id_template",
+    "separator_template", "system_message_template", "debug", "rag_vectorizer", "activate_skills_lib"
+]
+
+
+def load_config_module(revision:str=None):
+    if revision is None:
+        import lollms.config
+        return lollms.config
+    source = subprocess.run(["git", "show", f"{revision}:lollms/config.py"], cwd=root, capture_output=True, text=True, check=True).stdout
+    module = types.ModuleType(f"config_{revision}")
+    exec(compile(source, f"config.py@{revision}", "exec"), module.__dict__)
+    return module
+
+
+def measure(module, n:int)->dict:
+    with open(root/"lollms"/"configs"/"config.yaml", "r", encoding="utf8") as f:
+        values = yaml.safe_load(f)
+    config = module.BaseConfig(["file_path", "config", "lollms_paths"], values)
+    results = {}
+
+    start = time.perf_counter()
+    for _ in range(n):
+        for key in REQUEST_KEYS:
+            getattr(config, key)
+    results["BaseConfig key read (ns)"] = (time.perf_counter()-start)*1e9/(n*len(REQUEST_KEYS))
+
+    start = time.perf_counter()
+    for _ in range(n):
+        c = config
+        c.ctx_size; c.max_n_predict; c.temperature; c.start_header_id_template; c.end_header_id_template
+        c.separator_template; c.system_message_template; c.debug; c.rag_vectorizer; c.activate_skills_lib
+    results["request path, 10 reads (us)"] = (time.perf_counter()-start)*1e6/n
+
+    template = module.ConfigTemplate([{"name":f"k{i}", "value":i, "type":"int", "min":0, "max":1000} for i in range(60)]+[{"name":"s", "value":"x", "type":"str"}])
+    typed_config = module.TypedConfig(template, module.BaseConfig(config={}))
+    start = time.perf_counter()
+    for _ in range(n):
+        typed_config.k10; typed_config.s; typed_config.k59
+    results["TypedConfig read (ns)"] = (time.perf_counter()-start)*1e9/(3*n)
+
+    writes = max(1, n//10)
+    start = time.perf_counter()
+    for i in range(writes):
+        typed_config.k10 = i%500
+        typed_config["k20"] = i%500
+    results["TypedConfig write (us)"] = (time.perf_counter()-start)*1e6/(2*writes)
+    return results
+
+
+def main(argv=None)->int:
+    parser = argparse.ArgumentParser(description="Configuration access benchmark")
+    parser.add_argument("-n", type=int, default=200000, help="Number of iterations")
+    parser.add_argument("--baseline", help="git revision of lollms/config.py to compare with")
+    args = parser.parse_args(argv)
+
+    current = measure(load_config_module(), args.n)
+    baseline = measure(load_config_module(args.baseline), args.n) if args.baseline else None
+    for name, value in current.items():
+        line = f"{name:<30} {value:10.2f}"
+        if baseline:
+            line += f"   baseline {baseline[name]:10.2f}"
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
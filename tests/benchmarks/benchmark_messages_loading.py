@@ -0,0 +1,108 @@
+"""
+project: lollms
+file: benchmark_messages_loading.py
+author: ParisNeo
+description:
+    Construction time and memory of the Message objects of a big discussion.
+    The fixture is a temporary discussions database with one discussion of 100k messages (--messages to change it).
+    The messages are loaded with all their columns and with the light columns only, and the time per message
+    (best of 3), the memory retained per message and the size of one instance are reported.
+    With --baseline, the same discussion is also loaded with lollms/databases/discussions_database.py as it was at
+    a git revision, through its select then Message.from_dict path.
+
+    usage:
+        python tests/benchmarks/benchmark_messages_loading.py
+        python tests/benchmarks/benchmark_messages_loading.py --baseline 18f3f46~1
+
+"""
+from pathlib import Path
+from types import ModuleType, SimpleNamespace
+import argparse
+import gc
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+root = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(root))
+
+from lollms.databases.discussions_database import DiscussionsDB, Message
+
+
+def create_fixture(folder:Path, nb_messages:int)->int:
+    """Creates a discussions database in folder with one discussion of nb_messages messages, returns its id"""
+    db = DiscussionsDB(SimpleNamespace(), SimpleNamespace(personal_discussions_path=folder))
+    db.create_tables()
+    discussion_id = db.create_discussion("benchmark").discussion_id
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO message (sender, content, message_type, discussion_id, metadata, steps, ui, created_at, nb_tokens, rank, parent_message_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [("user" if i%2 else "lollms", f"message number {i}", 0, discussion_id, None, "[]", None, "2024-01-01 00:00:00", 12, 0, i) for i in range(nb_messages)]
+        )
+    db.close()
+    return discussion_id
+
+
+def load_baseline_module(revision:str)->ModuleType:
+    source = subprocess.run(["git", "show", f"{revision}:lollms/databases/discussions_database.py"], cwd=root, capture_output=True, text=True, check=True).stdout
+    module = ModuleType(f"discussions_database_{revision}")
+    exec(compile(source, f"discussions_database.py@{revision}", "exec"), module.__dict__)
+    return module
+
+
+def instance_size(message)->int:
+    return sys.getsizeof(message)+(sys.getsizeof(message.__dict__) if hasattr(message, "__dict__") else 0)
+
+
+def measure(label:str, load, nb_messages:int):
+    load()
+    best = None
+    for _ in range(3):
+        gc.collect()
+        start = time.perf_counter()
+        messages = load()
+        elapsed = time.perf_counter()-start
+        best = elapsed if best is None else min(best, elapsed)
+        del messages
+    gc.collect()
+    tracemalloc.start()
+    messages = load()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(messages)==nb_messages
+    print(f"{label:<32} {best:7.3f}s {best/nb_messages*1e6:7.2f} us/msg  retained {retained/nb_messages:6.0f} B/msg  instance {instance_size(messages[0])} B")
+
+
+def main(argv=None)->int:
+    parser = argparse.ArgumentParser(description="Messages loading benchmark")
+    parser.add_argument("--messages", type=int, default=100_000, help="Number of messages of the discussion")
+    parser.add_argument("--baseline", help="git revision of discussions_database.py to compare with")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        discussion_id = create_fixture(folder, args.messages)
+        db = DiscussionsDB(SimpleNamespace(), SimpleNamespace(personal_discussions_path=folder))
+        baseline_db = None
+        if args.baseline:
+            baseline = load_baseline_module(args.baseline)
+            baseline_db = baseline.DiscussionsDB(SimpleNamespace(), SimpleNamespace(personal_discussions_path=folder))
+
+        for columns_label, columns in [("all columns", Message.get_fields()), ("light columns", Message.get_light_fields())]:
+            if baseline_db is not None:
+                def load_baseline():
+                    rows = baseline_db.select(f"SELECT {','.join(columns)} FROM message WHERE discussion_id=? ORDER BY id", (discussion_id,))
+                    return [baseline.Message.from_dict(baseline_db, {column:row[i] for i, column in enumerate(columns)}) for row in rows]
+                measure(f"baseline ({columns_label})", load_baseline, args.messages)
+            heavy_fields = columns==Message.get_fields()
+            measure(f"current ({columns_label})", lambda: db.select_messages("WHERE discussion_id=? ORDER BY id", (discussion_id,), heavy_fields=heavy_fields), args.messages)
+        db.close()
+        if baseline_db is not None and hasattr(baseline_db, "close"):
+            baseline_db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+project: lollms
+file: benchmark_stop_sequences.py
+author: ParisNeo
+description:
+    Cost per streamed token of the stop sequences (antiprompts) detection, for generations of growing length.
+    The reference searches the whole text received so far at each token with detect_antiprompt, as the callbacks
+    did before StopSequenceMatcher. The cost per token of the matcher must stay flat up to 32k tokens.
+
+    usage:
+        python tests/benchmarks/benchmark_stop_sequences.py
+        python tests/benchmarks/benchmark_stop_sequences.py --tokens 4000 32000 --check
+
+"""
+from pathlib import Path
+from typing import List
+import argparse
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from lollms.generation import StopSequenceMatcher
+from lollms.utilities import detect_antiprompt
+
+STOP_SEQUENCES = ["!@>", "<|im_start|>", "\n!@>user:", "\n!@>lollms:"]
+
+
+def make_tokens(n:int)->List[str]:
+    return [f"word{i%97} " for i in range(n)]
+
+
+def reference_cost(tokens:List[str])->float:
+    """Seconds per token when the whole text is searched at each token"""
+    start = time.perf_counter()
+    text = ""
+    for token in tokens:
+        text += token
+        detect_antiprompt(text, STOP_SEQUENCES)
+    return (time.perf_counter()-start)/len(tokens)
+
+
+def matcher_cost(tokens:List[str])->float:
+    """Seconds per token with the incremental matcher"""
+    start = time.perf_counter()
+    matcher = StopSequenceMatcher(STOP_SEQUENCES)
+    for token in tokens:
+        matcher.feed(token)
+    return (time.perf_counter()-start)/len(tokens)
+
+
+def main(argv=None)->int:
+    parser = argparse.ArgumentParser(description="Stop sequences detection cost per token")
+    parser.add_argument("--tokens", type=int, nargs="+", default=[4000, 16000, 32000], help="Generation lengths to measure")
+    parser.add_argument("--check", action="store_true", help="Fail if the matcher cost per token at the longest length is more than twice the one at the shortest")
+    args = parser.parse_args(argv)
+
+    costs = []
+    for n in args.tokens:
+        tokens = make_tokens(n)
+        reference = reference_cost(tokens)
+        # Best of 3, the matcher runs are short enough to be noisy
+        cost = min(matcher_cost(tokens) for _ in range(3))
+        costs.append(cost)
+        print(f"{n:>7} tokens: reference {reference*1e6:8.2f} us/token  matcher {cost*1e6:6.2f} us/token")
+
+    if args.check and costs[-1]>2*costs[0]:
+        print(f"The matcher cost per token grows with the text length ({costs[0]*1e6:.2f} -> {costs[-1]*1e6:.2f} us/token)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+import random
+from typing import List, Tuple, Union
+
+import pytest
+
+from lollms.code_parser import CodeBlocksParser
+
+
+# Parser used by AIPersonality.extract_code_blocks before CodeBlocksParser, kept as the reference of the
+# differential test (also used by tests/benchmarks/benchmark_code_parser.py)
+def reference_extract_code_blocks(text: str, return_remaining_text: bool = False) -> Union[List[dict], Tuple[List[dict], str]]:
+    """
+    This function extracts code blocks from a given text and optionally returns the text without code blocks.
+
+    Parameters:
+    text (str): The text from which to extract code blocks. Code blocks are identified by triple backticks (```).
+    return_remaining_text (bool): If True, also returns the text with code blocks removed.
+
+    Returns:
+    Union[List[dict], Tuple[List[dict], str]]: 
+        - If return_remaining_text is False: Returns only the list of code block dictionaries
+        - If return_remaining_text is True: Returns a tuple containing:
+            * List of code block dictionaries
+            * String containing the text with all code blocks removed
+        
+    Each code block dictionary contains:
+        - 'index' (int): The index of the code block in the text
+        - 'file_name' (str): The name of the file extracted from the preceding line, if available
+        - 'content' (str): The content of the code block
+        - 'type' (str): The type of the code block
+        - 'is_complete' (bool): True if the block has a closing tag, False otherwise
+    """        
+    remaining = text
+    bloc_index = 0
+    first_index = 0
+    indices = []
+    text_without_blocks = text
+    
+    # Find all code block delimiters
+    while len(remaining) > 0:
+        try:
+            index = remaining.index("```")
+            indices.append(index + first_index)
+            remaining = remaining[index + 3:]
+            first_index += index + 3
+            bloc_index += 1
+        except Exception as ex:
+            if bloc_index % 2 == 1:
+                index = len(remaining)
+                indices.append(index)
+            remaining = ""
+
+    code_blocks = []
+    is_start = True
+    
+    # Process code blocks and build text without blocks if requested
+    if return_remaining_text:
+        text_parts = []
+        last_end = 0
+        
+    for index, code_delimiter_position in enumerate(indices):
+        if is_start:
+            block_infos = {
+                'index': len(code_blocks),
+                'file_name': "",
+                'section': "",
+                'content': "",
+                'type': "",
+                'is_complete': False
+            }
+            
+            # Store text before code block if returning remaining text
+            if return_remaining_text:
+                text_parts.append(text[last_end:code_delimiter_position].strip())
+            
+            # Check the preceding line for file name
+            preceding_text = text[:code_delimiter_position].strip().splitlines()
+            if preceding_text:
+                last_line = preceding_text[-1].strip()
+                if last_line.startswith("<file_name>") and last_line.endswith("</file_name>"):
+                    file_name = last_line[len("<file_name>"):-len("</file_name>")].strip()
+                    block_infos['file_name'] = file_name
+                elif last_line.startswith("## filename:"):
+                    file_name = last_line[len("## filename:"):].strip()
+                    block_infos['file_name'] = file_name
+                if last_line.startswith("<section>") and last_line.endswith("</section>"):
+                    section = last_line[len("<section>"):-len("</section>")].strip()
+                    block_infos['section'] = section
+
+            sub_text = text[code_delimiter_position + 3:]
+            if len(sub_text) > 0:
+                try:
+                    find_space = sub_text.index(" ")
+                except:
+                    find_space = int(1e10)
+                try:
+                    find_return = sub_text.index("\n")
+                except:
+                    find_return = int(1e10)
+                next_index = min(find_return, find_space)
+                if '{' in sub_text[:next_index]:
+                    next_index = 0
+                start_pos = next_index
+                
+                if code_delimiter_position + 3 < len(text) and text[code_delimiter_position + 3] in ["\n", " ", "\t"]:
+                    block_infos["type"] = 'language-specific'
+                else:
+                    block_infos["type"] = sub_text[:next_index]
+
+                if index + 1 < len(indices):
+                    next_pos = indices[index + 1] - code_delimiter_position
+                    if next_pos - 3 < len(sub_text) and sub_text[next_pos - 3] == "`":
+                        block_infos["content"] = sub_text[start_pos:next_pos - 3].strip()
+                        block_infos["is_complete"] = True
+                    else:
+                        block_infos["content"] = sub_text[start_pos:next_pos].strip()
+                        block_infos["is_complete"] = False
+                    
+                    if return_remaining_text:
+                        last_end = indices[index + 1] + 3
+                else:
+                    block_infos["content"] = sub_text[start_pos:].strip()
+                    block_infos["is_complete"] = False
+                    
+                    if return_remaining_text:
+                        last_end = len(text)
+                
+                code_blocks.append(block_infos)
+            is_start = False
+        else:
+            is_start = True
+            
+    if return_remaining_text:
+        # Add any remaining text after the last code block
+        if last_end < len(text):
+            text_parts.append(text[last_end:].strip())
+        # Join all non-code parts with newlines
+        text_without_blocks = '\n'.join(filter(None, text_parts))
+        return code_blocks, text_without_blocks
+        
+    return code_blocks
+
+
+LINES = [
+    "hello world", "print(1)", "<file_name>a.py</file_name>", "## filename: b.js", "<section>s1</section>", "text {x}",
+    "```python", "```json", "```", "``` ", "```{\"k\":2}```", " more", "x", "", "  indented", '{"a":1}', "`inline` code"
+]
+
+
+def feed_by_random_chunks(text:str, rng:random.Random)->CodeBlocksParser:
+    parser = CodeBlocksParser()
+    cuts = sorted(rng.sample(range(1, len(text)), min(len(text)-1, rng.randint(0, 8)))) if len(text)>1 else []
+    for start, end in zip([0]+cuts, cuts+[len(text)]):
+        parser.feed(text[start:end])
+    parser.finish()
+    return parser
+
+
+@pytest.mark.parametrize("seed", [1, 2])
+def test_same_blocks_as_the_reference_parser(seed):
+    """
+    Random texts whose fences start their line, fed by random chunks.
+    Texts with an unclosed block are skipped: the reference truncates their content (see below).
+    """
+    rng = random.Random(seed)
+    checked = 0
+    for _ in range(4000):
+        text = "\n".join(rng.choice(LINES) for _ in range(rng.randint(0, 14)))
+        if text.count("```")%2:
+            continue
+        expected_blocks, expected_text = reference_extract_code_blocks(text, True)
+        parser = feed_by_random_chunks(text, rng)
+        assert parser.blocks==expected_blocks, text
+        assert parser.remaining_text==expected_text, text
+        checked += 1
+    assert checked>2000
+
+
+def test_unclosed_block_keeps_its_whole_content():
+    text = "intro\n```python\ndef f():\n    return 1\n"
+    blocks = CodeBlocksParser.parse(text).blocks
+    assert blocks==[{"index":0, "file_name":"", "section":"", "content":"def f():\n    return 1", "type":"python", "is_complete":False}]
+    # The reference adds a relative position to an absolute one and cuts the content
+    assert reference_extract_code_blocks(text)[0]["content"]!=blocks[0]["content"]
+
+
+def test_file_name_right_after_a_closing_fence():
+    text = "```python\nx = 1\n```<file_name>b.py</file_name>\n```python\ny = 2\n```"
+    blocks = CodeBlocksParser.parse(text).blocks
+    assert [b["file_name"] for b in blocks]==["", "b.py"]
+    assert [b["file_name"] for b in reference_extract_code_blocks(text)]==["", ""]
+
+
+def test_blocks_are_returned_when_their_closing_fence_arrives():
+    parser = CodeBlocksParser()
+    assert parser.feed("<file_name>main.py</file_name>\n``")==[]
+    assert parser.feed("`python\nprint(1)\n`")==[]
+    assert [b["content"] for b in parser.feed("``\nafter")]==["print(1)"]
+    assert parser.finish()==[]
+    assert parser.blocks[0]["file_name"]=="main.py" and parser.remaining_text=="<file_name>main.py</file_name>\nafter"
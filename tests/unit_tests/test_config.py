@@ -0,0 +1,104 @@
+import pytest
+import yaml
+
+from lollms.config import BaseConfig, ConfigKeyAccessor, ConfigTemplate, TypedConfig
+
+
+# ----------------------------------- BaseConfig attribute reads -----------------------------------
+def test_key_reads_install_an_accessor_and_stay_per_instance():
+    first = BaseConfig(config={"accessor_test_key":1})
+    second = BaseConfig(config={"accessor_test_key":2})
+    assert first.accessor_test_key==1
+    assert isinstance(BaseConfig.__dict__["accessor_test_key"], ConfigKeyAccessor)
+    assert second.accessor_test_key==2
+    first.accessor_test_key = 3
+    assert first.config["accessor_test_key"]==3 and first.accessor_test_key==3
+    assert second.accessor_test_key==2
+
+
+def test_errors_of_key_reads():
+    config = BaseConfig(config={"present":1})
+    # Twice: the first read goes through __getattr__, the second one through the accessor
+    for _ in range(2):
+        with pytest.raises(KeyError):
+            config.missing_key_for_test
+        config.present
+    unloaded = BaseConfig()
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            unloaded.present
+
+
+def test_exceptional_keys_are_real_attributes():
+    config = BaseConfig(["lollms_paths"], {"x":1})
+    for _ in range(2):
+        with pytest.raises(AttributeError):
+            config.lollms_paths
+    config.lollms_paths = "paths"
+    assert config.lollms_paths=="paths" and "lollms_paths" not in config.config
+    # For an instance without this exceptional key, it is a configuration key
+    other = BaseConfig([], {"lollms_paths":7})
+    assert other.lollms_paths==7
+    other.lollms_paths = 8
+    assert other.config["lollms_paths"]==8
+
+
+# ----------------------------------- TypedConfig lazy sync -----------------------------------
+def make_typed_config(values:dict=None)->TypedConfig:
+    template = ConfigTemplate([
+        {"name":"n", "value":1, "type":"int", "min":0, "max":10},
+        {"name":"ratio", "value":0.5, "type":"float"},
+        {"name":"name", "value":"x", "type":"str"},
+    ])
+    return TypedConfig(template, BaseConfig(config=dict(values or {})))
+
+
+def test_template_is_synced_when_it_is_used():
+    config = make_typed_config({"n":"4"})
+    # The initial sync converts the values
+    assert config.config_template["n"]["value"]==4
+    config.n = 50
+    # The raw value is kept in the config until the template is used
+    assert config.n==50 and config._config_template["n"]["value"]==4
+    assert config.config_template["n"]["value"]==10
+    config["ratio"] = "0.25"
+    assert config.to_dict(True)["ratio"]["value"]==0.25
+    assert config.to_dict()["ratio"]=="0.25"
+
+
+def test_invalid_value_is_reported_at_sync_not_at_assignment(tmp_path):
+    config = make_typed_config()
+    config.config.file_path = tmp_path/"config.yaml"
+    config.n = "not a number"
+    with pytest.raises(ValueError):
+        config.config_template
+    # Still reported until the value is fixed
+    with pytest.raises(ValueError):
+        config.save()
+    assert not (tmp_path/"config.yaml").exists()
+
+    config.n = 3
+    config.save()
+    assert config.config_template["n"]["value"]==3
+    assert yaml.safe_load((tmp_path/"config.yaml").read_text())["n"]==3
+
+
+def test_failed_sync_keeps_the_other_modified_keys():
+    config = make_typed_config()
+    config.name = 12
+    config.ratio = "bad"
+    with pytest.raises(ValueError):
+        config.sync_modified()
+    config.ratio = 0.75
+    template = config.config_template
+    assert template["ratio"]["value"]==0.75 and template["name"]["value"]=="12"
+
+
+def test_full_sync():
+    config = make_typed_config({"n":-5})
+    assert config.config_template["n"]["value"]==0
+    config.config.config["ratio"] = "2"
+    config.sync()
+    assert config.config_template["ratio"]["value"]==2.0
+    # Keys of the template missing from the config are added to it
+    assert config.name=="x"
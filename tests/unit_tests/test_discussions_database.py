@@ -0,0 +1,190 @@
+import json
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from lollms.databases import discussions_database
+from lollms.databases.discussions_database import DiscussionsDB
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DiscussionsDB(SimpleNamespace(), SimpleNamespace(personal_discussions_path=tmp_path))
+    db.create_tables()
+    yield db
+    db.close()
+
+
+def test_close_keeps_the_connections_other_threads_are_using(db):
+    got_connection = threading.Event()
+    closed = threading.Event()
+    result = []
+
+    def worker():
+        conn = db.get_connection()
+        got_connection.set()
+        closed.wait(5)
+        result.append(conn.execute("SELECT COUNT(*) FROM discussion").fetchone()[0])
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    got_connection.wait(5)
+    own = db.get_connection()
+    db.close()
+    closed.set()
+    thread.join(5)
+
+    assert result==[0]
+    with pytest.raises(sqlite3.ProgrammingError):
+        own.execute("SELECT 1")
+    # The database can still be used after close, with a new connection
+    assert db.select("SELECT COUNT(*) FROM discussion")[0][0]==0
+
+
+def test_reused_thread_id_closes_the_previous_connection(db):
+    stale = sqlite3.connect(db.discussion_db_file_path, check_same_thread=False)
+    # Connection registered by a thread that had the same id as the current one
+    db._connections[threading.get_ident()] = stale
+    db._local = threading.local()
+    conn = db.get_connection()
+
+    assert conn is not stale
+    assert db._connections[threading.get_ident()] is conn
+    with pytest.raises(sqlite3.ProgrammingError):
+        stale.execute("SELECT 1")
+
+
+def test_streamed_content_is_written_by_a_single_writer_thread(db):
+    db.messages_flush_interval = 0.01
+    discussion = db.create_discussion("streaming")
+    message = discussion.add_message(0, 0, "lollms", "", [])
+    for i in range(30):
+        message.update_content(message.content+f"chunk {i} ")
+        time.sleep(0.005)
+    deadline = time.time()+5
+    while db._pending_messages and time.time()<deadline:
+        time.sleep(0.01)
+    # The buffer is emptied before being written
+    with db._flush_lock:
+        pass
+    # Read from another thread, so that the read doesn't flush the buffer itself
+    read = []
+    reader = threading.Thread(target=lambda: read.append(sqlite3.connect(db.discussion_db_file_path).execute("SELECT content FROM message WHERE id=?", (message.id,)).fetchone()[0]))
+    reader.start()
+    reader.join(5)
+
+    assert read==[message.content]
+    writer = db._writer_thread
+    assert writer is not None and writer.daemon
+    # One connection for this thread and one reused by the writer for all its flushes
+    assert set(db._connections)=={threading.get_ident(), writer.ident}
+
+    db.close()
+    writer.join(5)
+    assert not writer.is_alive()
+
+
+def test_streaming_past_the_flush_size_writes_once_per_flush_size(db):
+    # The periodic writes never happen during the test, only the ones due to the size
+    db.messages_flush_interval = 60
+    discussion = db.create_discussion("streaming")
+    message = discussion.add_message(0, 0, "lollms", "", [])
+    writes = []
+    write_message_content = db.write_message_content
+    db.write_message_content = lambda m: (writes.append(len(m.content)), write_message_content(m))
+    chunk = "x"*2000
+    for _ in range(200):
+        message.update_content(message.content+chunk)
+
+    assert len(message.content)==400000
+    assert 0<len(writes)<=len(message.content)//DiscussionsDB.MESSAGES_FLUSH_SIZE
+    assert all(b-a>=DiscussionsDB.MESSAGES_FLUSH_SIZE for a, b in zip([0]+writes, writes))
+    # A finished message doesn't keep its size at last write
+    message.update(message.content)
+    assert message.id not in db._written_sizes and not db._pending_messages
+
+
+def test_import_remaps_parents_and_drops_the_ones_outside_the_import(db):
+    existing = db.create_discussion("existing")
+    for i in range(5):
+        existing.add_message(0, 0, "user", f"existing {i}", [])
+    exported = [
+        {"title":"with ids", "messages":[
+            {"id":1, "sender":"user", "content":"question", "parent_message_id":0},
+            {"id":2, "sender":"lollms", "content":"answer", "parent_message_id":1},
+        ]},
+        # Exported from another database, the message ids overlap those of the previous discussion
+        {"title":"same ids", "messages":[
+            {"id":2, "sender":"lollms", "content":"other answer", "parent_message_id":1},
+            {"id":1, "sender":"user", "content":"other question", "parent_message_id":0},
+        ]},
+        # Exports made before the message ids were exported
+        {"title":"without ids", "messages":[
+            {"sender":"user", "content":"old question", "parent_message_id":3},
+            {"sender":"lollms", "content":"old answer", "parent_message_id":4},
+        ]},
+    ]
+    report = db.import_from_json(exported)
+    assert report["discussions"]==3 and report["messages"]==6
+
+    rows = {content:(message_id, parent) for message_id, content, parent in db.select("SELECT id, content, parent_message_id FROM message WHERE discussion_id<>?", (existing.discussion_id,))}
+    assert rows["question"][1]==0
+    assert rows["answer"][1]==rows["question"][0]
+    # The parent is looked up in its own discussion only
+    assert rows["other answer"][1]==0 and rows["other question"][1]==0
+    assert rows["old question"][1]==0 and rows["old answer"][1]==0
+
+
+def test_search_index_of_an_existing_database_is_built_by_batches_and_resumed(db, monkeypatch):
+    discussion = db.create_discussion("old")
+    for i in range(25):
+        discussion.add_message(0, 0, "user", f"word{i} common", [])
+    # A database from before the search index
+    with db.transaction() as conn:
+        for name in ["message_fts_insert", "message_fts_delete", "message_fts_update"]:
+            conn.execute(f"DROP TRIGGER {name}")
+        conn.execute("DROP TABLE message_fts")
+        conn.execute("UPDATE schema_version SET version = 15")
+    db.close()
+
+    class Interrupted(Exception):
+        pass
+    def interrupt(*args, **kwargs):
+        raise Interrupted()
+    monkeypatch.setattr(discussions_database, "MESSAGES_FTS_BACKFILL_BATCH_SIZE", 10)
+    monkeypatch.setattr(discussions_database.ASCIIColors, "info", interrupt)
+    with pytest.raises(Interrupted):
+        db.create_tables()
+    monkeypatch.undo()
+
+    def indexed():
+        return db.select("SELECT COUNT(*) FROM message_fts WHERE message_fts MATCH 'common'", fetch_all=False)[0]
+    # The migration and the first batch are committed
+    assert db.select("SELECT version FROM schema_version", fetch_all=False)[0]==16
+    assert indexed()==10
+    # Messages added meanwhile are indexed by the triggers
+    discussion.add_message(0, 0, "user", "new common", [])
+    assert indexed()==11
+
+    db.backfill_messages_fts(batch_size=10)
+    assert indexed()==26
+    assert db.select("SELECT 1 FROM sqlite_master WHERE name='message_fts_backfill'", fetch_all=False) is None
+
+
+def test_messages_of_a_discussion_are_serialized_with_batched_queries(db, monkeypatch):
+    discussion = db.create_discussion("long")
+    for i in range(120):
+        discussion.add_message(0, 0, "user", f"message {i}", [], metadata=json.dumps({"i":i}))
+    monkeypatch.setattr(discussions_database.Discussion, "HEAVY_FIELDS_BATCH_SIZE", 50)
+    discussion = discussions_database.Discussion(SimpleNamespace(), discussion.discussion_id, db)
+    queries = []
+    db.get_connection().set_trace_callback(lambda statement: statement.lstrip().upper().startswith("SELECT") and queries.append(statement))
+    messages = [message.to_json() for message in discussion.get_messages()]
+    db.get_connection().set_trace_callback(None)
+
+    assert len(messages)==120 and messages[7]["metadata"]=={"i":7}
+    # The messages, then their heavy fields by batches of 50
+    assert len(queries)<=1+3, queries
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from lollms import download
+from lollms.download import DownloadError, RangeDownloader
+
+DATA = os.urandom(300_000)
+PART_SIZE = 64*1024
+
+
+class FileServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, data:bytes, ranges:bool=True, content_length:bool=True):
+        super().__init__(("127.0.0.1", 0), FileHandler)
+        self.data = data
+        self.ranges = ranges
+        self.content_length = content_length
+        # Number of GET requests to answer with an error before serving the file
+        self.failures = 0
+        self.requests = []
+        self.served_bytes = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/model.gguf"
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    # HTTP/1.0 closes the connection after each response, which ends the body when there is no Content-Length
+    protocol_version = "HTTP/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_file_headers(self, status:int, length:int, content_range:str=None):
+        self.send_response(status)
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if content_range:
+            self.send_header("Content-Range", content_range)
+        if self.server.content_length:
+            self.send_header("Content-Length", str(length))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.send_file_headers(200, len(self.server.data))
+
+    def do_GET(self):
+        data = self.server.data
+        range_header = self.headers.get("Range")
+        with self.server.lock:
+            self.server.requests.append(range_header)
+            if self.server.failures>0:
+                self.server.failures -= 1
+                self.send_error(503)
+                return
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", range_header or "")
+        if self.server.ranges and match:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(data)-1
+            body = data[start:end+1]
+            self.send_file_headers(206, len(body), f"bytes {start}-{end}/{len(data)}")
+        else:
+            body = data
+            self.send_file_headers(200, len(body))
+        with self.server.lock:
+            self.server.served_bytes += len(body)
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def serve():
+    servers = []
+    def serve(data:bytes=DATA, **kwargs)->FileServer:
+        server = FileServer(data, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(download, "time", SimpleNamespace(perf_counter=time.perf_counter, sleep=lambda seconds: None))
+
+
+def make_downloader(server:FileServer, destination, **kwargs)->RangeDownloader:
+    kwargs.setdefault("part_size", PART_SIZE)
+    kwargs.setdefault("buffer_size", 16*1024)
+    return RangeDownloader(server.url, destination, timeout=5, progress_interval=0, **kwargs)
+
+
+def test_parallel_range_download(serve, tmp_path):
+    server = serve()
+    progress = []
+    destination = make_downloader(server, tmp_path/"model.gguf", callback=lambda downloaded, total: progress.append((downloaded, total))).download()
+
+    assert destination.read_bytes()==DATA
+    assert len([r for r in server.requests if r])==-(-len(DATA)//PART_SIZE)
+    assert progress[-1]==(len(DATA), len(DATA))
+    assert not (tmp_path/"model.gguf.part").exists() and not (tmp_path/"model.gguf.part.json").exists()
+
+
+def test_server_without_range_support(serve, tmp_path):
+    server = serve(ranges=False)
+    destination = make_downloader(server, tmp_path/"model.gguf").download()
+
+    assert destination.read_bytes()==DATA
+    assert server.requests==[None]
+
+
+def test_server_without_content_length(serve, tmp_path):
+    server = serve(ranges=False, content_length=False)
+    totals = []
+    destination = make_downloader(server, tmp_path/"model.gguf", callback=lambda downloaded, total: totals.append(total)).download()
+
+    assert destination.read_bytes()==DATA
+    assert set(totals)=={None}
+
+
+def test_interrupted_download_resumes_the_missing_parts(serve, tmp_path):
+    server = serve()
+    def interrupt(downloaded, total):
+        if downloaded>=2*PART_SIZE:
+            raise KeyboardInterrupt()
+    with pytest.raises(KeyboardInterrupt):
+        make_downloader(server, tmp_path/"model.gguf", n_connections=1, callback=interrupt).download()
+    assert (tmp_path/"model.gguf.part.json").exists()
+    assert not (tmp_path/"model.gguf").exists()
+
+    done = json.loads((tmp_path/"model.gguf.part.json").read_text())["done"]
+    assert len(done)>=1
+    served = server.served_bytes
+    progress = []
+    destination = make_downloader(server, tmp_path/"model.gguf", callback=lambda downloaded, total: progress.append(downloaded)).download()
+
+    assert destination.read_bytes()==DATA
+    # The parts finished before the interruption are not downloaded again
+    assert server.served_bytes-served==len(DATA)-sum(min(PART_SIZE, len(DATA)-i*PART_SIZE) for i in done)
+    assert progress[0]==len(done)*PART_SIZE
+
+
+def test_failed_requests_are_retried(serve, tmp_path):
+    server = serve()
+    server.failures = 3
+    destination = make_downloader(server, tmp_path/"model.gguf", n_connections=1, max_retries=5).download()
+
+    assert destination.read_bytes()==DATA
+    assert len([r for r in server.requests if r])==-(-len(DATA)//PART_SIZE)+3
+
+
+def test_gives_up_after_max_retries(serve, tmp_path):
+    server = serve()
+    server.failures = 100
+    with pytest.raises(DownloadError):
+        make_downloader(server, tmp_path/"model.gguf", n_connections=1, max_retries=3).download()
+    assert server.requests.count(f"bytes=0-{PART_SIZE-1}")==3
+    assert not (tmp_path/"model.gguf").exists()
+
+
+def test_hash_mismatch(serve, tmp_path):
+    server = serve()
+    with pytest.raises(DownloadError, match="hash mismatch"):
+        make_downloader(server, tmp_path/"model.gguf", expected_sha256="0"*64).download()
+    assert not (tmp_path/"model.gguf").exists()
+    assert not (tmp_path/"model.gguf.part").exists() and not (tmp_path/"model.gguf.part.json").exists()
+
+    destination = make_downloader(server, tmp_path/"model.gguf", expected_sha256=hashlib.sha256(DATA).hexdigest()).download()
+    assert destination.read_bytes()==DATA
@@ -0,0 +1,107 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+pytest.importorskip("lollmsvectordb")
+
+from lollmsvectordb import text_chunker
+from lollmsvectordb.tokenizer import Tokenizer
+from lollmsvectordb.vector_database import VectorDatabase
+from lollmsvectordb.vectorizer import Vectorizer
+
+from lollms.databases import folder_vectorizer
+from lollms.databases.documents_manifest import DocumentsManifest
+from lollms.databases.folder_vectorizer import FolderVectorizer, supports_direct_write
+
+
+class WordsTokenizer(Tokenizer):
+    def __init__(self):
+        super().__init__("words")
+
+    def tokenize(self, text):
+        return text.split()
+
+    def detokenize(self, tokens):
+        return " ".join(tokens)
+
+
+class LengthVectorizer(Vectorizer):
+    def __init__(self):
+        super().__init__("length")
+        self.parameters = {"model_name":"length"}
+
+    def vectorize(self, data):
+        return [np.array([len(text), text.count("e"), text.count(" ")], dtype="float32") for text in data]
+
+
+@pytest.fixture(autouse=True)
+def offline_tokenizer(monkeypatch):
+    # The default chunker tokenizer downloads its vocabulary
+    monkeypatch.setattr(text_chunker, "TikTokenTokenizer", WordsTokenizer)
+
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path/"docs"
+    folder.mkdir()
+    for i in range(3):
+        (folder/f"doc{i}.txt").write_text("\n\n".join(f"Paragraph {j} of document {i}. "+"Some text here. "*(5+i) for j in range(4)))
+    return folder
+
+
+def open_database(path):
+    return VectorDatabase(str(path), LengthVectorizer(), WordsTokenizer(), chunk_size=20)
+
+
+def database_rows(path):
+    with sqlite3.connect(path) as conn:
+        documents = conn.execute("SELECT id, hash, title, path, category_id, subcategory_id FROM documents ORDER BY path").fetchall()
+        chunks = conn.execute("SELECT d.path, c.vector, c.text, c.nb_tokens, c.chunk_id FROM chunks c JOIN documents d ON d.id=c.document_id ORDER BY d.path, c.id").fetchall()
+    return [d[1:] for d in documents], chunks
+
+
+def vectorize_folder(folder, db_path):
+    vdb = open_database(db_path)
+    manifest = DocumentsManifest(db_path.with_suffix(".json"))
+    infos = FolderVectorizer(folder, vdb, manifest, parse_workers=1, embed_workers=2).run()
+    return vdb, infos
+
+
+def test_direct_writes_match_add_document(folder, tmp_path):
+    vdb, infos = vectorize_folder(folder, tmp_path/"direct.sqlite")
+    assert supports_direct_write(vdb)
+    assert infos["documents"]==3 and infos["failed"]==0
+
+    reference = open_database(tmp_path/"reference.sqlite")
+    for path in sorted(folder.iterdir()):
+        reference.add_document(path.stem, path.read_text(), path)
+
+    documents, chunks = database_rows(tmp_path/"direct.sqlite")
+    assert len(documents)==3 and len(chunks)>3 and all(chunk[1] is not None for chunk in chunks)
+    assert (documents, chunks)==database_rows(tmp_path/"reference.sqlite")
+
+
+def test_unsupported_schema_goes_through_add_document(folder, tmp_path, monkeypatch):
+    monkeypatch.setattr(folder_vectorizer, "SUPPORTED_SCHEMA_VERSION", folder_vectorizer.SUPPORTED_SCHEMA_VERSION+1)
+    added = []
+    add_document = VectorDatabase.add_document
+    def counting_add_document(self, title, text, path="unknown", *args, **kwargs):
+        added.append(title)
+        return add_document(self, title, text, path, *args, **kwargs)
+    monkeypatch.setattr(VectorDatabase, "add_document", counting_add_document)
+
+    vdb, infos = vectorize_folder(folder, tmp_path/"fallback.sqlite")
+    assert not supports_direct_write(vdb)
+    assert sorted(added)==["doc0", "doc1", "doc2"]
+    assert infos["documents"]==3
+    documents, chunks = database_rows(tmp_path/"fallback.sqlite")
+    assert len(documents)==3 and len(chunks)>3
+
+
+def test_changed_columns_disable_direct_writes(tmp_path):
+    vdb = open_database(tmp_path/"db.sqlite")
+    assert supports_direct_write(vdb)
+    with sqlite3.connect(tmp_path/"db.sqlite") as conn:
+        conn.execute("ALTER TABLE chunks ADD COLUMN metadata TEXT")
+    assert not supports_direct_write(vdb)
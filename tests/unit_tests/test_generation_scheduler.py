@@ -0,0 +1,39 @@
+import threading
+import time
+
+from lollms.generation import GenerationScheduler
+
+
+def test_abandoned_request_leaves_the_queue():
+    scheduler = GenerationScheduler(max_concurrency=1)
+    running = scheduler.acquire("first")
+    disconnected = threading.Event()
+    tickets = []
+    waiter = threading.Thread(target=lambda: tickets.append(scheduler.acquire("second", abandoned=disconnected.is_set)))
+    waiter.start()
+    time.sleep(0.1)
+    assert scheduler.status()["queue_depth"]==1
+
+    disconnected.set()
+    waiter.join(2)
+
+    assert not waiter.is_alive()
+    assert tickets[0].cancelled
+    assert scheduler.status()["queue_depth"]==0
+    # The running request is not affected
+    assert not running.cancelled
+    scheduler.release(running)
+
+
+def test_cancel_stops_waiting_and_running_requests():
+    scheduler = GenerationScheduler(max_concurrency=1)
+    with scheduler.slot("first") as running:
+        tickets = []
+        waiter = threading.Thread(target=lambda: tickets.append(scheduler.acquire("second")))
+        waiter.start()
+        time.sleep(0.1)
+        assert scheduler.cancel()==2
+        waiter.join(2)
+        assert running.cancelled and tickets[0].cancelled
+        assert running.wrap_callback(lambda chunk: True)("chunk") is False
+    assert scheduler.status()["running"]==0
@@ -0,0 +1,30 @@
+import pytest
+
+from lollms.lazy_service import LazyService, warmup_services
+
+
+class Service:
+    ready = True
+
+
+def test_service_is_built_once_on_first_use():
+    builds = []
+    service = LazyService("service", lambda: builds.append(1) or Service())
+    assert service and not service.lazy_loaded and builds==[]
+    assert service.ready and service.ready
+    assert service.lazy_loaded and builds==[1]
+
+
+def test_failed_build_is_cached_until_reload():
+    builds = []
+    def factory():
+        builds.append(1)
+        raise ImportError("missing package")
+    service = LazyService("service", factory)
+    for _ in range(3):
+        with pytest.raises(ImportError):
+            service.ready
+    assert builds==[1]
+    assert not service and not service.lazy_loaded
+    assert service.lazy_status()["error"]=="missing package"
+    assert warmup_services([service])["service"]["error"]=="missing package" and builds==[1]
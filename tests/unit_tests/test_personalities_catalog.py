@@ -0,0 +1,126 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from lollms.databases import personalities_catalog
+from lollms.databases.personalities_catalog import PersonalitiesCatalog
+
+
+def add_personality(zoo:Path, category:str, folder:str, name:str):
+    personality_folder = zoo/category/folder
+    personality_folder.mkdir(parents=True, exist_ok=True)
+    (personality_folder/"config.yaml").write_text(f"name: {name}\n")
+    return personality_folder
+
+
+def touch_folder(folder:Path):
+    """Moves the folder mtime forward, filesystems with a coarse mtime resolution may not see a change otherwise"""
+    st = folder.stat()
+    os.utime(folder, ns=(st.st_atime_ns, st.st_mtime_ns+1_000_000_000))
+
+
+@pytest.fixture
+def zoo(tmp_path):
+    zoo = tmp_path/"zoo"
+    add_personality(zoo, "fun", "joker", "Joker")
+    add_personality(zoo, "fun", "poet", "Poet")
+    add_personality(zoo, "tools", "coder", "Coder")
+    (tmp_path/"custom").mkdir()
+    return zoo
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    reads = []
+    read_personality_infos = personalities_catalog.read_personality_infos
+    def counting_read(personality_folder, category):
+        reads.append(personality_folder.name)
+        return read_personality_infos(personality_folder, category)
+    monkeypatch.setattr(personalities_catalog, "read_personality_infos", counting_read)
+    return reads
+
+
+def names(listing):
+    return {category:sorted(p["name"] for p in personalities) for category, personalities in listing.items()}
+
+
+def test_listing_is_served_from_the_persisted_index(tmp_path, zoo, reads):
+    index_path = tmp_path/"catalog.json"
+    first = PersonalitiesCatalog(index_path).list_zoo(zoo, tmp_path/"custom")
+    assert names(first)=={"custom_personalities":[], "fun":["Joker", "Poet"], "tools":["Coder"]}
+    assert sorted(reads)==["coder", "joker", "poet"]
+
+    # A new catalog, as after a restart, serves the listing without reading the personality folders again
+    catalog = PersonalitiesCatalog(index_path)
+    assert catalog.list_zoo(zoo, tmp_path/"custom")==first
+    assert len(reads)==3
+
+
+def test_category_folder_change_rescans_only_that_category(tmp_path, zoo, reads):
+    catalog = PersonalitiesCatalog(tmp_path/"catalog.json")
+    catalog.list_zoo(zoo, tmp_path/"custom")
+    reads.clear()
+
+    add_personality(zoo, "tools", "translator", "Translator")
+    touch_folder(zoo/"tools")
+    listing = catalog.list_zoo(zoo, tmp_path/"custom")
+    assert names(listing)["tools"]==["Coder", "Translator"]
+    assert reads==["translator"]
+
+    (zoo/"fun"/"poet"/"config.yaml").unlink()
+    (zoo/"fun"/"poet").rmdir()
+    touch_folder(zoo/"fun")
+    assert names(catalog.list_zoo(zoo, tmp_path/"custom"))["fun"]==["Joker"]
+
+
+def test_files_edited_in_place_are_seen(tmp_path, zoo, reads):
+    index_path = tmp_path/"catalog.json"
+    PersonalitiesCatalog(index_path).list_zoo(zoo, tmp_path/"custom")
+    # Edited in place, as by a git pull of the zoo: the category folder doesn't change
+    config = zoo/"tools"/"coder"/"config.yaml"
+    category_mtime = (zoo/"tools").stat().st_mtime_ns
+    config.write_text("name: Coder 2\n")
+    st = config.stat()
+    os.utime(config, ns=(st.st_atime_ns, st.st_mtime_ns+1_000_000_000))
+    assert (zoo/"tools").stat().st_mtime_ns==category_mtime
+
+    # Seen by a catalog loaded from disk, as after a restart
+    catalog = PersonalitiesCatalog(index_path)
+    assert names(catalog.list_zoo(zoo, tmp_path/"custom"))["tools"]==["Coder 2"]
+
+    config.write_text("name: Coder 3\n")
+    os.utime(config, ns=(st.st_atime_ns, st.st_mtime_ns+2_000_000_000))
+    assert names(catalog.list_zoo(zoo, tmp_path/"custom"))["tools"]==["Coder 3"]
+    # Only the edited personality was read again
+    assert sorted(reads)==["coder", "coder", "coder", "joker", "poet"]
+
+
+def test_refresh_and_invalidation_read_only_the_changed_personalities(tmp_path, zoo, reads):
+    catalog = PersonalitiesCatalog(tmp_path/"catalog.json")
+    catalog.list_zoo(zoo, tmp_path/"custom")
+    reads.clear()
+    assert names(catalog.list_zoo(zoo, tmp_path/"custom", refresh=True))==names(catalog.list_zoo(zoo, tmp_path/"custom"))
+    catalog.invalidate()
+    catalog.list_zoo(zoo, tmp_path/"custom")
+    assert reads==[]
+
+
+def test_new_category_is_listed(tmp_path, zoo):
+    catalog = PersonalitiesCatalog(tmp_path/"catalog.json")
+    catalog.list_zoo(zoo, tmp_path/"custom")
+    add_personality(zoo, "art", "painter", "Painter")
+    touch_folder(zoo)
+    assert names(catalog.list_zoo(zoo, tmp_path/"custom"))["art"]==["Painter"]
+
+
+def test_installed_personalities(tmp_path):
+    configuration_path = tmp_path/"configs"
+    configuration_path.mkdir()
+    (configuration_path/"personality_joker.yaml").write_text("")
+    (configuration_path/"config.yaml").write_text("")
+    catalog = PersonalitiesCatalog(tmp_path/"catalog.json")
+    assert catalog.installed_personalities(configuration_path)=={"joker"}
+    (configuration_path/"personality_poet.yaml").write_text("")
+    touch_folder(configuration_path)
+    assert catalog.installed_personalities(configuration_path)=={"joker", "poet"}
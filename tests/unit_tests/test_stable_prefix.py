@@ -0,0 +1,87 @@
+import os
+
+from lollms.personality import AIPersonality
+
+
+class FakePrefixCacheBinding:
+    """
+    Binding keeping the tokens of the last prompt it received, like a KV cache.
+    Its tokenizer merges "a" followed by "b" into a single token, so text appended after a context can change
+    the last token of the context.
+    """
+    supports_prefix_reuse = True
+
+    def __init__(self) -> None:
+        self.calls = []
+
+    def tokenize(self, text:str)->list:
+        tokens = []
+        i = 0
+        while i<len(text):
+            if text[i:i+2]=="ab":
+                tokens.append("ab")
+                i += 2
+            else:
+                tokens.append(text[i])
+                i += 1
+        return tokens
+
+    def generate(self, prompt, n_predict=128, callback=None, stable_prefix_tokens=None, **gpt_params):
+        self.calls.append((self.tokenize(prompt), stable_prefix_tokens))
+        return ""
+
+
+def make_personality(binding):
+    personality = AIPersonality.__new__(AIPersonality)
+    personality.model = binding
+    personality.context_tokens_cache = {}
+    personality.last_context = None
+    return personality
+
+
+def send(personality, discussion_id, context, suffix=""):
+    """Builds a context for the discussion and generates from it, like build_context followed by generate"""
+    details = {"client_id":"client", "discussion_id":discussion_id}
+    personality.update_stable_prefix(details, context, personality.model.tokenize(context))
+    prompt = context+suffix
+    personality.model.generate(prompt, 16, **personality.get_generation_hints(prompt))
+
+
+def test_hinted_prefix_is_the_common_prefix_with_the_previous_prompt_of_the_discussion():
+    binding = FakePrefixCacheBinding()
+    personality = make_personality(binding)
+    turns = [
+        (1, "system: hello\nuser: a", "b"),     # the suffix merges with the end of the context
+        (1, "system: hello\nuser: a\nai: ok\nuser: xyz", ""),
+        (2, "system: other\nuser: cab", ""),
+        (1, "system: hello\nuser: a\nai: ok\nuser: xyz\nai: sure\nuser: a", "b"),
+        (2, "system: other\nuser: cab\nai: abab", "b"),
+        (1, "system: hello\nuser: a\nai: ok\nuser: xyz\nai: sure\nuser: abc", ""),
+        (1, "system: changed\nuser: a", ""),
+    ]
+    previous = {}
+    for discussion_id, context, suffix in turns:
+        send(personality, discussion_id, context, suffix)
+        tokens, hint = binding.calls[-1]
+        expected = len(os.path.commonprefix([previous[discussion_id], tokens])) if discussion_id in previous else 0
+        assert hint==expected
+        assert tokens[:hint]==previous.get(discussion_id, [])[:hint]
+        previous[discussion_id] = tokens
+    assert any(hint>0 for _, hint in binding.calls)
+
+
+def test_no_hint_for_prompts_that_are_not_the_built_context():
+    binding = FakePrefixCacheBinding()
+    personality = make_personality(binding)
+    send(personality, 1, "system: hello\nuser: hi")
+    binding.generate("summarize this", 16, **personality.get_generation_hints("summarize this"))
+    assert binding.calls[-1][1] is None
+
+
+def test_no_hint_for_bindings_without_prefix_reuse():
+    binding = FakePrefixCacheBinding()
+    binding.supports_prefix_reuse = False
+    personality = make_personality(binding)
+    send(personality, 1, "system: hello")
+    send(personality, 1, "system: hello\nuser: hi")
+    assert [hint for _, hint in binding.calls]==[None, None]
@@ -0,0 +1,22 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from lollms import profile_startup
+
+# Importing lollms.app took about 1s when it loaded these packages, and about 0.3s without them
+MAX_IMPORT_SECONDS = 1.0
+DEFERRED_PACKAGES = ["numpy", "PIL", "PyQt5", "lollmsvectordb", "cv2", "scipy", "matplotlib", "sounddevice", "bs4", "git"]
+
+
+def test_heavy_packages_are_not_imported_by_lollms_app():
+    # A new interpreter, the modules imported by the other tests must not count
+    code = f"import sys, json, lollms.app; print(json.dumps([m for m in {DEFERRED_PACKAGES!r} if m in sys.modules]))"
+    process = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=Path(profile_startup.__file__).parents[1])
+    assert process.returncode==0, process.stderr[-2000:]
+    assert json.loads(process.stdout.strip().splitlines()[-1])==[]
+
+
+def test_import_time_of_lollms_app_is_bounded(capsys):
+    assert profile_startup.main(["lollms.app", "--runs", "3", "--top", "5", "--max-seconds", str(MAX_IMPORT_SECONDS)])==0, capsys.readouterr().out